@@ -0,0 +1,84 @@
+"""Measure the size and CPU cost of precompressed output at each level.
+
+    python benchmarks/compress.py [--manifests N] [--canvases C] [--threads T]
+
+Compresses the serialization of a Manifest of C Canvases with gzip, and
+brotli if it is installed, at several levels, then times writing N such
+Manifests with toFile() plainly, with gzip and brotli as they are
+written, and with a pool of T threads compressing.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.compress import _Compressor, available_formats
+from iiif_prezi.factory import ManifestFactory
+
+LEVELS = {'gz': [1, 6, 9], 'br': [4, 9, 11]}
+
+
+def manifest(fac, n, canvases):
+    """Manifest n of the corpus."""
+    mf = fac.manifest(ident="m%d/manifest" % n, label="Manifest %d" % n)
+    mf.set_metadata({"Author": "Author %d" % (n % 100), "Date": "18%02d" % (n % 100)})
+    seq = mf.sequence()
+    for i in range(canvases):
+        cvs = seq.canvas(ident="m%d/p%d" % (n, i), label="p. %d" % i)
+        cvs.set_hw(3000, 2000)
+        cvs.annotation(ident="m%d/a%d" % (n, i)).image("m%d-%d" % (n, i), iiif=True)
+    return mf
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--manifests', '-n', type=int, default=100)
+    p.add_argument('--canvases', '-c', type=int, default=500)
+    p.add_argument('--threads', '-t', type=int, default=4)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/iiif/")
+        fac.set_base_prezi_dir(tmp)
+        fac.set_base_image_uri("http://example.org/images/")
+        fac.set_iiif_image_info("2.0", "1")
+        formats = available_formats()
+
+        data = manifest(fac, 0, args.canvases).toString().encode('utf-8')
+        print("Manifest of %d Canvases: %.2f MB" % (args.canvases, len(data) / 1e6))
+        for f in formats:
+            for level in LEVELS[f]:
+                comp = _Compressor(f, level)
+                out = len(comp.process(data)) + len(comp.finish())
+                print("  %s level %2d: %8d bytes (%5.1f%%), %.3fs CPU, %.1f MB/s" % (
+                    f, level, out, 100.0 * out / len(data), comp.seconds,
+                    len(data) / 1e6 / max(comp.seconds, 1e-6)))
+
+        mfs = [manifest(fac, n, args.canvases) for n in range(args.manifests)]
+        for (what, config) in [("plain", None),
+                               ("compressed as written", {'formats': formats}),
+                               ("compressed in %d threads" % args.threads,
+                                {'formats': formats, 'threads': args.threads})]:
+            if config is None:
+                fac.set_precompress([])
+            else:
+                fac.set_precompress(**config)
+            (start, cpu) = (time.time(), time.process_time())
+            for mf in mfs:
+                mf.toFile()
+            print("toFile() of %d Manifests, %s: %.2fs, %.2fs CPU" % (
+                len(mfs), what, time.time() - start, time.process_time() - cpu))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Measure diffing Manifests and republishing only those that changed.
+
+    python benchmarks/diff.py [--manifests N] [--canvases C] [--changed F]
+
+Publishes N Manifests of C Canvases with Publisher, then republishes them
+with the labels of a fraction F changed, and compares that to writing
+them all with toFile(). Also times diff() of one Manifest with a Canvas
+moved and one relabelled.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.diff import Publisher, diff
+from iiif_prezi.factory import ManifestFactory
+
+
+def manifest(fac, n, canvases, label):
+    """Manifest n of the corpus."""
+    mf = fac.manifest(ident="m%d/manifest" % n, label=label)
+    seq = mf.sequence(ident="m%d/normal" % n)
+    for i in range(canvases):
+        cvs = seq.canvas(ident="m%d/p%d" % (n, i), label="p. %d" % i)
+        cvs.set_hw(3000, 2000)
+        cvs.annotation(ident="m%d/a%d" % (n, i)).image("m%d-%d" % (n, i), iiif=True)
+    return mf
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--manifests', '-n', type=int, default=500)
+    p.add_argument('--canvases', '-c', type=int, default=100)
+    p.add_argument('--changed', '-f', type=float, default=0.02)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/iiif/")
+        fac.set_base_prezi_dir(tmp)
+        fac.set_base_image_uri("http://example.org/images/")
+        fac.set_iiif_image_info("2.0", "1")
+        every = max(1, int(1 / args.changed)) if args.changed else args.manifests + 1
+        mfs = [manifest(fac, n, args.canvases, "Manifest %d" % n) for n in range(args.manifests)]
+        for mf in mfs:
+            mf.toFile()
+        mfs = [manifest(fac, n, args.canvases, "Manifest %d%s" % (n, " (revised)" if n % every == 0 else ""))
+               for n in range(args.manifests)]
+
+        start = time.time()
+        pub = Publisher()
+        for mf in mfs:
+            pub.publish(mf)
+        took = time.time() - start
+        print("Publisher: %s in %.2fs" % (pub, took))
+        start = time.time()
+        for mf in mfs:
+            mf.toFile()
+        print("toFile() of all: %d files written in %.2fs" % (len(mfs), time.time() - start))
+
+        old = mfs[0].toJSON(top=True)
+        new = manifest(fac, 0, args.canvases, "Manifest 0").toJSON(top=True)
+        canvases = new['sequences'][0]['canvases']
+        canvases.insert(0, canvases.pop())
+        canvases[1]['label'] = "Frontispiece"
+        start = time.time()
+        changes = diff(old, new)
+        print("diff() of %d Canvases: %s in %.1fms" % (args.canvases, changes, (time.time() - start) * 1000))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Measure editing a large Manifest file in place against reading and writing it.
+
+    python benchmarks/edit.py [--canvases C]
+
+Writes a Manifest of C Canvases with toFile(), then appends Canvases and
+updates the label with ManifestEditor, the first edit including the scan
+of the file, and compares that to ManifestReader.read() and toFile().
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.edit import ManifestEditor
+from iiif_prezi.factory import ManifestFactory
+from iiif_prezi.loader import ManifestReader
+
+
+def canvas(fac, i):
+    """Canvas i with an image."""
+    cvs = fac.canvas(ident="p%d" % i, label="p. %d" % i)
+    cvs.set_hw(3000, 2000)
+    cvs.annotation(ident="a%d" % i).image("page%d" % i, iiif=True)
+    return cvs
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--canvases', '-c', type=int, default=50000)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/iiif/book/")
+        fac.set_base_prezi_dir(tmp)
+        fac.set_base_image_uri("http://example.org/images/")
+        fac.set_iiif_image_info("2.0", "1")
+        mf = fac.manifest(label="Big book")
+        seq = mf.sequence()
+        for i in range(args.canvases):
+            seq.add_canvas(canvas(fac, i))
+        mf.toFile()
+        path = mf.file_path()
+        print("%d Canvases, %.1f MB" % (args.canvases, os.path.getsize(path) / 1e6))
+
+        editor = ManifestEditor(path)
+        for (what, edit) in [
+                ("append 10 Canvases", lambda: editor.append_canvases(
+                    [canvas(fac, args.canvases + i) for i in range(10)])),
+                ("update the label", lambda: editor.update({"label": "Big book, revised"})),
+                ("replace a Canvas", lambda: editor.replace_canvas(canvas(fac, args.canvases // 2)))]:
+            start = time.time()
+            edit()
+            print("ManifestEditor, %s: %.2fs" % (what, time.time() - start))
+
+        start = time.time()
+        with io.open(path, encoding='utf-8') as fh:
+            mf = ManifestReader(fh.read()).read()
+        mf.label = "Big book, revised again"
+        mf._factory.set_base_prezi_dir(tmp)
+        mf.toFile()
+        print("ManifestReader.read() and toFile(): %.2fs" % (time.time() - start))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
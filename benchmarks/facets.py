@@ -0,0 +1,94 @@
+"""Measure FacetIndex build time and facet query latency over many Manifests.
+
+    python benchmarks/facets.py [--manifests N] [--canvases C]
+
+Writes N Manifests of C Canvases with metadata, navDate and viewingHint,
+and reports the time to index them with read_fields() compared to
+json.load() of each file, then the latency of facet counts, filtered
+counts, navDate ranges and sub-collections.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.factory import ManifestFactory, RawResource
+from iiif_prezi.facets import FacetIndex
+
+
+def timed(label, fn, repeat=10):
+    start = time.time()
+    for i in range(repeat):
+        result = fn()
+    print("%-28s %.2fms" % (label, (time.time() - start) * 1000 / repeat))
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--manifests', '-n', type=int, default=5000)
+    p.add_argument('--canvases', '-c', type=int, default=100)
+    p.add_argument('--processes', '-p', type=int, default=0)
+    args = p.parse_args()
+
+    rnd = random.Random(1)
+    tmp = tempfile.mkdtemp()
+    try:
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_prezi_dir(tmp)
+        fac.set_base_image_uri("http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "1")
+        fns = []
+        # One Sequence, added to each Manifest as is
+        mf = fac.manifest(ident="template", label="template")
+        seq = mf.sequence(ident="normal")
+        for i in range(args.canvases):
+            cvs = seq.canvas(ident="c%d" % i, label="p%d" % i)
+            cvs.set_hw(3000, 2000)
+            cvs.annotation().image("img%d" % i, iiif=True).set_hw(3000, 2000)
+        seq = RawResource(json.dumps(mf.toJSON(top=True)['sequences'][0]))
+        for n in range(args.manifests):
+            mf = fac.manifest(ident="m%d" % n, label={rnd.choice(["en", "fr", "de"]): "Book %d" % n})
+            mf.set_metadata({"Author": "Author %d" % rnd.randint(1, 500),
+                             "Subject": "Subject %d" % rnd.randint(1, 50),
+                             "Place": "Place %d" % rnd.randint(1, 20)})
+            mf.navDate = "%d-01-01T00:00:00Z" % rnd.randint(1500, 2000)
+            mf.viewingHint = rnd.choice(["paged", "individuals", "continuous"])
+            mf.add_sequence(seq)
+            mf.toFile(compact=True)
+            fns.append(os.path.join(tmp, "m%d.json" % n))
+        print("%d Manifests, %.0f KB each" % (len(fns), os.path.getsize(fns[0]) / 1024.0))
+
+        start = time.time()
+        for fn in fns:
+            with io.open(fn, encoding='utf-8') as fh:
+                json.load(fh)
+        print("json.load of each file      %.2fs" % (time.time() - start))
+        start = time.time()
+        idx = FacetIndex()
+        idx.add_files(fns, processes=args.processes)
+        print("FacetIndex.add_files        %.2fs" % (time.time() - start))
+
+        timed("counts(Author)", lambda: idx.counts("metadata:Author", limit=10))
+        french = timed("select(language=fr)", lambda: idx.select({"language": "fr"}))
+        timed("counts(Subject) of fr", lambda: idx.counts("metadata:Subject", french, limit=10))
+        timed("nav_range(1800-1850)", lambda: idx.nav_range("1800-01-01", "1850-12-31"))
+        docs = timed("select(fr, paged, 1800s)", lambda: idx.select(
+            {"language": "fr", "viewingHint": "paged"}, "1800-01-01", "1899-12-31"))
+        timed("collection() of %d" % len(docs), lambda: idx.collection(fac, docs, ident="sub", label="Sub"))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
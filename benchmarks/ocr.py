@@ -0,0 +1,100 @@
+"""Measure OCR import throughput in words per second.
+
+    python benchmarks/ocr.py [--pages N] [--words N]
+
+Generates hOCR and ALTO with the given number of pages and words per
+page, and times parsing them, writing the Annotation Lists with
+OcrWriter, and building the same lists from Annotation objects.
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.factory import ManifestFactory
+from iiif_prezi.ocr import OcrWriter, iter_alto, iter_hocr
+
+
+def make_hocr(pages, words):
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><body>']
+    for p in range(pages):
+        out.append('<div class="ocr_page" title="bbox 0 0 4000 6000; ppageno %d">' % p)
+        for w in range(words):
+            x = (w % 20) * 190
+            y = (w // 20) * 11 % 5900
+            out.append('<span class="ocrx_word" title="bbox %d %d %d %d; x_wconf 90">word%d</span>' % (
+                x, y, x + 180, y + 10, w))
+        out.append('</div>')
+    out.append('</body></html>')
+    return "\n".join(out).encode('utf-8')
+
+
+def make_alto(pages, words):
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#"><Layout>']
+    for p in range(pages):
+        out.append('<Page ID="p%d" WIDTH="4000" HEIGHT="6000"><PrintSpace><TextBlock><TextLine>' % p)
+        for w in range(words):
+            out.append('<String CONTENT="word%d" HPOS="%d" VPOS="%d" WIDTH="180" HEIGHT="10"/>' % (
+                w, (w % 20) * 190, (w // 20) * 11 % 5900))
+        out.append('</TextLine></TextBlock></PrintSpace></Page>')
+    out.append('</Layout></alto>')
+    return "\n".join(out).encode('utf-8')
+
+
+def objects(fac, page, canvas, ident):
+    """Write the list by building Annotations, as before OcrWriter."""
+    al = fac.annotationList(ident=ident)
+    (xs, ys, ws, hs) = page.scaled(canvas.width, canvas.height)
+    for (i, text) in enumerate(page.text):
+        anno = al.annotation(ident="%s#w%d" % (al.id, i))
+        anno.text(text)
+        anno.on = canvas.make_fragment("xywh=%d,%d,%d,%d" % (xs[i], ys[i], ws[i], hs[i]))
+    al.toFile()
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--pages', type=int, default=5)
+    p.add_argument('--words', type=int, default=10000)
+    args = p.parse_args()
+    total = args.pages * args.words
+
+    tmp = tempfile.mkdtemp()
+    try:
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_prezi_dir(tmp)
+        cvs = fac.canvas(ident="c1", label="p1")
+        cvs.set_hw(3000, 2000)
+
+        print("%d pages of %d words" % (args.pages, args.words))
+        for (name, data, parse) in (("hOCR", make_hocr(args.pages, args.words), iter_hocr),
+                                    ("ALTO", make_alto(args.pages, args.words), iter_alto)):
+            start = time.time()
+            pages = list(parse(io.BytesIO(data)))
+            took = time.time() - start
+            print("parse %-14s %10.0f words/s" % (name, total / took))
+        writer = OcrWriter(fac)
+        start = time.time()
+        for page in pages:
+            writer.write_page(page, cvs, "ocr-%d.json" % page.number, add=False)
+        took = time.time() - start
+        print("write %-14s %10.0f words/s" % ("OcrWriter", total / took))
+        start = time.time()
+        for page in pages:
+            objects(fac, page, cvs, "obj-%d.json" % page.number)
+        took = time.time() - start
+        print("write %-14s %10.0f words/s" % ("Annotations", total / took))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Measure search index build time, size and query latency for OCR text.
+
+    python benchmarks/search.py [--pages N] [--words W] [--queries Q]
+
+Makes a Manifest of N Canvases, each with an Annotation List of W word
+Annotations drawn from a Zipf-like vocabulary, indexes it, and reports
+the build time, index size, open time, and the mean and worst latency of
+single word, phrase and prefix queries.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.factory import ManifestFactory
+from iiif_prezi.search import SearchIndex, SearchIndexBuilder
+
+
+def vocabulary(n, rnd):
+    """n random words."""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rnd.choice(letters) for i in range(rnd.randint(2, 10))) for j in range(n)]
+
+
+def timed(fn, queries):
+    """(mean, worst) milliseconds of fn on each of queries."""
+    times = []
+    for q in queries:
+        start = time.time()
+        fn(q)
+        times.append((time.time() - start) * 1000)
+    return (sum(times) / len(times), max(times))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--pages', '-n', type=int, default=500)
+    p.add_argument('--words', '-w', type=int, default=300)
+    p.add_argument('--vocabulary', type=int, default=20000)
+    p.add_argument('--queries', '-q', type=int, default=200)
+    args = p.parse_args()
+
+    rnd = random.Random(1)
+    vocab = vocabulary(args.vocabulary, rnd)
+    weights = [1.0 / (i + 1) for i in range(len(vocab))]
+    fac = ManifestFactory()
+    fac.set_debug("error")
+    fac.set_base_prezi_uri("http://example.org/prezi/")
+    mf = fac.manifest(label="Benchmark")
+    seq = mf.sequence()
+    text = []
+    for n in range(args.pages):
+        cvs = seq.canvas(ident="c%d" % n, label="p%d" % n)
+        lst = cvs.annotationList(ident="l%d" % n)
+        words = rnd.choices(vocab, weights, k=args.words)
+        text.extend(words)
+        for (i, word) in enumerate(words):
+            anno = lst.annotation(ident="l%d-w%d" % (n, i))
+            anno.text(word)
+            anno.on = "%s#xywh=%d,%d,40,20" % (cvs.id, (i % 20) * 50, (i // 20) * 30)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "bench.idx")
+        start = time.time()
+        builder = SearchIndexBuilder()
+        builder.add_manifest(mf)
+        builder.write(path)
+        took = time.time() - start
+        words = len(text)
+        print("%d words, %d terms: built in %.2fs (%.0f words/s), %.1f MB" % (
+            words, len(builder.terms), took, words / took, os.path.getsize(path) / 1e6))
+        builder = None
+
+        start = time.time()
+        idx = SearchIndex(path)
+        print("opened in %.2fms" % ((time.time() - start) * 1000))
+        singles = [rnd.choice(text) for i in range(args.queries)]
+        phrases = []
+        for i in range(args.queries):
+            at = rnd.randrange(words - 3)
+            phrases.append(" ".join(text[at:at + 3]))
+        prefixes = [w[:2] for w in singles]
+        for (name, fn, queries) in [
+                ("word", idx.search, singles),
+                ("3 word phrase", idx.search, phrases),
+                ("2 letter prefix", lambda q: idx.search(q, prefix=True), prefixes),
+                ("content search", lambda q: idx.content_search(q, "http://example.org/search", per_page=20),
+                 phrases)]:
+            (mean, worst) = timed(fn, queries)
+            print("%-16s mean %.3fms, worst %.3fms" % (name, mean, worst))
+        idx.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compare memory and time of the ways of targeting a region of a Canvas.
+
+    python benchmarks/selection.py [--annotations N]
+
+Makes N Annotations on xywh regions of a Canvas, targeted with
+make_fragment() (a URI string), make_selection() (a SpecificResource)
+and make_selection(compact=True) (a FragmentSelection), and reports the
+memory allocated and the time to make and to serialize them.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.factory import ManifestFactory
+
+
+def build(fac, cvs, n, target):
+    """Annotation List of n Annotations on cvs, targeted with target(cvs, xywh)."""
+    al = fac.annotationList(ident="bench.json")
+    for i in range(n):
+        anno = al.annotation()
+        anno.text("word")
+        anno.on = target(cvs, "xywh=%d,%d,10,10" % (i % 1000, i // 1000))
+    return al
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--annotations', '-n', type=int, default=20000)
+    args = p.parse_args()
+
+    fac = ManifestFactory()
+    fac.set_debug("error")
+    fac.set_base_prezi_uri("http://example.org/prezi/")
+    cvs = fac.canvas(ident="c1", label="p1")
+    cvs.set_hw(3000, 2000)
+    targets = [
+        ('make_fragment', lambda c, v: c.make_fragment(v)),
+        ('make_selection', lambda c, v: c.make_selection(v)),
+        ('compact', lambda c, v: c.make_selection(v, compact=True)),
+        ('make_selection summ', lambda c, v: c.make_selection(v, summarize=True)),
+        ('compact summ', lambda c, v: c.make_selection(v, summarize=True, compact=True)),
+    ]
+    print("%d annotations" % args.annotations)
+    print("%-20s %12s %10s %10s" % ("target", "bytes", "build s", "write s"))
+    for (name, target) in targets:
+        tracemalloc.start()
+        start = time.time()
+        al = build(fac, cvs, args.annotations, target)
+        took = time.time() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.time()
+        for chunk in al.iterString():
+            pass
+        wrote = time.time() - start
+        print("%-20s %12d %10.3f %10.3f" % (name, size, took, wrote))
+        al = None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compare pickle, snapshot and JSON for passing resource trees between processes.
+
+    python benchmarks/snapshot.py [--canvases N]
+
+For each format, reports the size and the time to write and read back a
+Manifest of N canvases with an image each.
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi import snapshot
+from iiif_prezi.factory import ManifestFactory
+from iiif_prezi.loader import ManifestReader
+from iiif_prezi.util import optional_import
+
+
+def build(n):
+    """Manifest with n Canvases."""
+    fac = ManifestFactory()
+    fac.set_debug("error")
+    fac.set_base_prezi_uri("http://example.org/prezi/")
+    fac.set_base_image_uri("http://example.org/iiif/")
+    fac.set_iiif_image_info("2.0", "1")
+    mfst = fac.manifest(label="Benchmark")
+    mfst.set_metadata({"Date": "1900", "Pages": str(n)})
+    seq = mfst.sequence()
+    seq.bulk_canvases(["c%d" % i for i in range(n)], ["p. %d" % (i + 1) for i in range(n)],
+                      [3000 + i % 7 for i in range(n)], [2000 + i % 5 for i in range(n)],
+                      ["img%d" % i for i in range(n)])
+    return mfst
+
+
+def timed(fn, repeat):
+    """Best time of repeat calls of fn, and its result."""
+    best = None
+    for x in range(repeat):
+        start = time.time()
+        result = fn()
+        took = time.time() - start
+        best = took if best is None else min(best, took)
+    return (best, result)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--canvases', '-n', type=int, default=10000)
+    p.add_argument('--repeat', '-r', type=int, default=3)
+    args = p.parse_args()
+
+    mfst = build(args.canvases)
+    formats = [
+        ('pickle', lambda: pickle.dumps(mfst, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ('snapshot (marshal)', lambda: snapshot.dumps(mfst, 'marshal'), snapshot.loads),
+        ('json', lambda: mfst.toString().encode('utf-8'),
+         lambda d: ManifestReader(d.decode('utf-8')).read()),
+    ]
+    if optional_import('msgpack') is not None:
+        formats.insert(2, ('snapshot (msgpack)', lambda: snapshot.dumps(mfst, 'msgpack'), snapshot.loads))
+    expected = mfst.toString()
+    print("%d canvases" % args.canvases)
+    print("%-20s %12s %10s %10s" % ("format", "bytes", "write s", "read s"))
+    for (name, dump, load) in formats:
+        (wt, data) = timed(dump, args.repeat)
+        (rt, copy) = timed(lambda: load(data), args.repeat)
+        if copy.toString() != expected:
+            print("%s: round trip differs!" % name)
+        print("%-20s %12d %10.3f %10.3f" % (name, len(data), wt, rt))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Measure level 0 tile generation throughput and memory for large TIFFs.
+
+    python benchmarks/tiles.py [--images N] [--width W] [--height H] [--processes P]
+
+Writes N TIFFs of W by H pixels, makes their tiles with TileGenerator,
+and reports the time, megapixels and tiles per second, and the peak
+memory of a worker process. Needs Pillow.
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.factory import ManifestFactory, get_pil_image
+from iiif_prezi.tiles import TileGenerator, tile_layout
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--images', '-n', type=int, default=4)
+    p.add_argument('--width', type=int, default=12000)
+    p.add_argument('--height', type=int, default=9000)
+    p.add_argument('--tile-size', type=int, default=512)
+    p.add_argument('--processes', '-p', type=int, default=None)
+    args = p.parse_args()
+    pil_image = get_pil_image()
+    if pil_image is None:
+        print("Pillow is not installed")
+        return
+
+    tmp = tempfile.mkdtemp()
+    try:
+        src = pil_image.linear_gradient('L').resize((args.width, args.height)).convert('RGB')
+        for i in range(args.images):
+            src.save(os.path.join(tmp, "img%d.tif" % i))
+        src = None
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_image_uri("http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "0")
+        fac.set_base_image_dir(tmp)
+        fac.set_image_api_dir(os.path.join(tmp, "iiif"))
+        tiler = TileGenerator(fac, tile_size=args.tile_size, processes=args.processes)
+        for i in range(args.images):
+            tiler.add(fac.image("img%d.tif" % i, iiif=True))
+        start = time.time()
+        done = tiler.run()
+        took = time.time() - start
+        tiles = len(list(tile_layout(args.width, args.height, args.tile_size))) * done
+        mpix = args.width * args.height * done / 1e6
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if args.processes != 0 else resource.RUSAGE_SELF)
+        print("%d images of %dx%d, %d tiles of %d" % (done, args.width, args.height, tiles, args.tile_size))
+        print("%.1fs, %.1f MPixel/s, %.0f tiles/s" % (took, mpix / took, tiles / took))
+        # ru_maxrss is kilobytes on Linux
+        print("peak memory of a worker %.0f MB, image is %.0f MB decoded" % (
+            usage.ru_maxrss / 1024.0, args.width * args.height * 3 / 1e6))
+        for error in tiler.failed:
+            print(error)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Measure JSON level upgrade throughput against reading and serializing with the factory.
+
+    python benchmarks/upgrade.py [--manifests N] [--canvases C] [--processes P]
+
+Writes N 1.0 Manifests of C Canvases, upgrades them to 2.1 and to 3.0
+with UpgradePipeline, and times ManifestReader.read() and toJSON() of
+a few of them for comparison.
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.loader import ManifestReader
+from iiif_prezi.upgrade import UpgradePipeline
+
+
+def manifest(n, canvases):
+    """JSON of a 1.0 Manifest."""
+    base = "http://example.org/iiif/m%d/" % n
+    return {
+        "@context": "http://www.shared-canvas.org/ns/context.json",
+        "@id": base + "manifest.json",
+        "@type": "sc:Manifest",
+        "label": "Manifest %d" % n,
+        "metadata": [{"label": "Author", "value": "Author %d" % (n % 100)}],
+        "sequences": [{
+            "@type": "sc:Sequence",
+            "canvases": [{
+                "@id": base + "canvas/%d.json" % i,
+                "@type": "sc:Canvas",
+                "label": "p. %d" % i,
+                "height": 3000,
+                "width": 2000,
+                "images": [{
+                    "@type": "oa:Annotation",
+                    "motivation": "sc:painting",
+                    "resource": {
+                        "@id": "http://example.org/images/m%d-%d/full/full/0/native.jpg" % (n, i),
+                        "@type": "dctypes:Image",
+                        "format": "image/jpeg",
+                        "height": 3000,
+                        "width": 2000
+                    },
+                    "on": base + "canvas/%d.json" % i
+                }]
+            } for i in range(canvases)]
+        }]
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--manifests', '-n', type=int, default=2000)
+    p.add_argument('--canvases', '-c', type=int, default=50)
+    p.add_argument('--processes', '-p', type=int, default=None)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp, "src")
+        for n in range(args.manifests):
+            dr = os.path.join(src, "%03d" % (n % 100))
+            if not os.path.isdir(dr):
+                os.makedirs(dr)
+            with io.open(os.path.join(dr, "m%d.json" % n), 'w') as fh:
+                fh.write(json.dumps(manifest(n, args.canvases)))
+        for target in ("2.1", "3.0"):
+            stats = UpgradePipeline(target, processes=args.processes, compact=True).run(
+                src, os.path.join(tmp, target))
+            print("to %s: %s\n" % (target, stats))
+
+        count = min(20, args.manifests)
+        start = time.time()
+        for n in range(count):
+            js = manifest(n, args.canvases)
+            js['@context'] = "http://iiif.io/api/presentation/2/context.json"
+            ManifestReader(json.dumps(js)).read().toJSON(top=True)
+        took = time.time() - start
+        print("ManifestReader.read() and toJSON() in one process: %.0f files/s" % (count / took))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Load test the validation service.
+
+    iiif-prezi-validate --port 8080 --quiet &
+    python benchmarks/validator_load.py --url http://127.0.0.1:8080/validate
+
+or, to start a service in this process first:
+
+    python benchmarks/validator_load.py --start --processes 4
+
+POSTs the test fixture manifests (or the files given) from --concurrency
+threads, and reports throughput, latency percentiles and response codes.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+
+try:
+    # python3
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    # fall back to python2
+    from urllib2 import Request, urlopen, HTTPError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iiif_prezi.validator import ValidatorApp, ThreadingWSGIServer, QuietHandler
+from wsgiref.simple_server import make_server
+
+
+def post(url, data):
+    """POST data to url, return the status code."""
+    req = Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        fh = urlopen(req, timeout=60)
+        fh.read()
+        fh.close()
+        return fh.getcode()
+    except HTTPError as e:
+        return e.code
+
+
+def percentile(values, p):
+    """p'th percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('files', nargs='*', help="JSON files to validate (default: test fixtures)")
+    p.add_argument('--url', default="http://127.0.0.1:8080/validate")
+    p.add_argument('--start', action='store_true', help="start a validation service on a free port")
+    p.add_argument('--processes', '-p', type=int, default=None, help="with --start, worker processes")
+    p.add_argument('--concurrency', '-c', type=int, default=8)
+    p.add_argument('--requests', '-n', type=int, default=500)
+    args = p.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'tests', '*.json')))
+    bodies = []
+    for fn in files:
+        with open(fn, 'rb') as fh:
+            bodies.append(fh.read())
+
+    server = app = None
+    url = args.url
+    if args.start:
+        app = ValidatorApp(processes=args.processes)
+        server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer,
+                             handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = "http://127.0.0.1:%d/validate" % server.server_port
+
+    latencies = []
+    codes = {}
+    lock = threading.Lock()
+    counter = [0]
+
+    def worker():
+        while True:
+            with lock:
+                n = counter[0]
+                counter[0] += 1
+            if n >= args.requests:
+                return
+            start = time.time()
+            code = post(url, bodies[n % len(bodies)])
+            took = time.time() - start
+            with lock:
+                latencies.append(took)
+                codes[code] = codes.get(code, 0) + 1
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for x in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    if server is not None:
+        server.shutdown()
+        app.close()
+
+    latencies.sort()
+    print("%d requests, %d concurrent, %d files: %.1f requests/s" % (
+        len(latencies), args.concurrency, len(bodies), len(latencies) / elapsed))
+    print("latency ms: p50 %.1f  p90 %.1f  p99 %.1f  max %.1f" % tuple(
+        [1000 * percentile(latencies, q) for q in (50, 90, 99)] + [1000 * latencies[-1]]))
+    print("status: " + ", ".join(["%s: %d" % (c, n) for (c, n) in sorted(codes.items())]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,674 @@
+"""Build Manifests and Collections from directory trees of images.
+
+Each directory containing images becomes a Manifest with one Canvas per
+image, and each directory containing such directories becomes a
+Collection of them. Image dimensions are probed in a process pool.
+With a BuildCache, rebuilds only probe new or changed images and only
+rewrite the Manifests and Collections whose inputs have changed.
+"""
+
+from __future__ import unicode_literals
+import argparse
+import heapq
+import json
+import mimetypes
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import time
+
+from .factory import ManifestFactory, ConfigurationError, OrderedDict, image_file_dimensions
+from .cache import BuildCache, fingerprint
+from ._version import __version__
+
+try:
+    # python3
+    from urllib.parse import quote
+except ImportError:
+    # fall back to python2
+    from urllib import quote
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.jp2', '.bmp', '.webp']
+
+
+def natural_sort_key(name):
+    """Sort key that orders 'page2' before 'page10'."""
+    return [int(x) if x.isdigit() else x.lower() for x in re.split(r'(\d+)', name)]
+
+
+def image_header_dimensions(fn):
+    """Return (height, width) from the header of a JPEG, PNG or GIF file.
+
+    Returns None for other formats or if the header can't be understood.
+    Much cheaper than starting ImageMagick or decoding with PIL.
+    """
+    with open(fn, 'rb') as fh:
+        head = fh.read(26)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            (w, h) = struct.unpack('>II', head[16:24])
+            return (h, w)
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            (w, h) = struct.unpack('<HH', head[6:10])
+            return (h, w)
+        elif head[:2] == b'\xff\xd8':
+            fh.seek(2)
+            while True:
+                byte = fh.read(1)
+                while byte and byte != b'\xff':
+                    byte = fh.read(1)
+                while byte == b'\xff':
+                    byte = fh.read(1)
+                if not byte:
+                    return None
+                marker = ord(byte)
+                if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7:
+                    # no length
+                    continue
+                seglen = fh.read(2)
+                if len(seglen) != 2:
+                    return None
+                length = struct.unpack('>H', seglen)[0]
+                if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                    sof = fh.read(5)
+                    if len(sof) != 5:
+                        return None
+                    (h, w) = struct.unpack('>HH', sof[1:5])
+                    return (h, w)
+                fh.seek(length - 2, 1)
+    return None
+
+
+def probe_image(fn, whichid=""):
+    """Return (height, width) of image file fn.
+
+    Reads the header where possible, otherwise falls back to ImageMagick
+    or PIL as Image.set_hw_from_file() does.
+    """
+    try:
+        hw = image_header_dimensions(fn)
+    except (IOError, OSError, struct.error):
+        hw = None
+    if hw and hw[0] and hw[1]:
+        return hw
+    return image_file_dimensions(fn, whichid)
+
+
+def _probe_task(args):
+    """Pool task: return (fn, (height, width)) or (fn, error message)."""
+    (fn, whichid) = args
+    try:
+        return (fn, probe_image(fn, whichid))
+    except Exception as e:
+        return (fn, "%s: %s" % (e.__class__.__name__, e))
+
+
+def title_from_name(name):
+    """Turn a file or directory name like 'page_001' into 'Page 001'."""
+    return name.replace("_", " ").title()
+
+
+class BuildStats(object):
+    """Counts and timings from a DirectoryBuilder run."""
+
+    def __init__(self):
+        """Initialize BuildStats."""
+        self.images = 0
+        self.cached = 0
+        self.failed = []
+        self.manifests = 0
+        self.collections = 0
+        self.unchanged = 0
+        self.probe_seconds = 0.0
+        self.write_seconds = 0.0
+        self.total_seconds = 0.0
+
+    @property
+    def images_per_second(self):
+        """Overall throughput in images per second."""
+        if not self.total_seconds:
+            return 0.0
+        return self.images / self.total_seconds
+
+    def __str__(self):
+        """Summary of the run."""
+        return ("%d images (%d failed, %d cached) in %d manifests and %d collections "
+                "(%d unchanged); probe %.2fs, write %.2fs, total %.2fs, %.1f images/s" % (
+                    self.images, len(self.failed), self.cached, self.manifests,
+                    self.collections, self.unchanged, self.probe_seconds,
+                    self.write_seconds, self.total_seconds, self.images_per_second))
+
+
+class DirectoryBuilder(object):
+    """Build and publish Manifests and Collections from a directory tree.
+
+    factory must have its base URIs and prezi_dir set; the Manifests and
+    Collections are written with toFile().
+
+    Templates are str.format() strings. label_template and
+    manifest_label_template get name (file or directory name), stem (name
+    without extension), title (stem made into a title), index (1 based
+    position) and dir (relative directory). image_ident_template gets the
+    same, plus path (relative path without extension) and relpath.
+    """
+
+    def __init__(self, factory, image_dir, processes=None, iiif=True,
+                 label_template="{title}", manifest_label_template="{title}",
+                 image_ident_template="{path}", quote_idents=True,
+                 extensions=IMAGE_EXTENSIONS, compact=True, progress=None, cache=None):
+        """Initialize DirectoryBuilder.
+
+        processes: number of probe processes, default os.cpu_count(); 1 to probe in-process
+        iiif: images are served through the IIIF Image API at the factory's base image URI
+        quote_idents: %-encode image identifiers, including any slashes
+        progress: callable(done, total) called as images are probed
+        cache: BuildCache, or the path of one, to reuse results of previous builds
+        """
+        if not factory.prezi_dir:
+            raise ConfigurationError(
+                "Metadata Directory on Factory must be set to write to file")
+        self.factory = factory
+        self.image_dir = image_dir.rstrip(os.sep) or os.sep
+        self.processes = processes
+        self.iiif = iiif
+        self.label_template = label_template
+        self.manifest_label_template = manifest_label_template
+        self.image_ident_template = image_ident_template
+        self.quote_idents = quote_idents
+        self.extensions = set([e.lower() for e in extensions])
+        self.compact = compact
+        self.progress = progress
+        if cache is not None and not isinstance(cache, BuildCache):
+            cache = BuildCache(cache)
+        self.cache = cache
+        self.stats = BuildStats()
+        # State of the last build(), for update()
+        self.tree = {}
+        self.manifests = {}
+        self.collections = {}
+        self._outputs = {}
+
+    def scan(self, top=""):
+        """Return {reldir: (image filenames, subdirectories)}, naturally sorted.
+
+        reldir is relative to image_dir, '' for image_dir itself. Only
+        the tree below top, another reldir, is scanned if it is given.
+        """
+        tree = {}
+        for (dirpath, dirnames, filenames) in os.walk(os.path.join(self.image_dir, top)):
+            dirnames.sort(key=natural_sort_key)
+            reldir = os.path.relpath(dirpath, self.image_dir)
+            if reldir == os.curdir:
+                reldir = ""
+            tree[reldir.replace(os.sep, '/')] = (self._images(filenames), dirnames)
+        return tree
+
+    def _images(self, filenames):
+        """Image files of filenames, naturally sorted."""
+        images = [f for f in filenames
+                  if os.path.splitext(f)[1].lower() in self.extensions and not f.startswith('.')]
+        images.sort(key=natural_sort_key)
+        return images
+
+    def probe(self, paths):
+        """Return {path: (height, width)} for the image files in paths.
+
+        Files that could not be probed are recorded in stats.failed.
+        """
+        start = time.time()
+        whichid = self.factory.whichid
+        tasks = [(p, whichid) for p in paths]
+        total = len(tasks)
+        dims = {}
+        if self.processes == 1 or total < 2:
+            results = (_probe_task(t) for t in tasks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            chunksize = max(1, min(64, total // (4 * (self.processes or multiprocessing.cpu_count()))))
+            results = pool.imap(_probe_task, tasks, chunksize)
+        try:
+            for (done, (fn, hw)) in enumerate(results, 1):
+                if isinstance(hw, tuple):
+                    dims[fn] = hw
+                else:
+                    self.stats.failed.append((fn, hw))
+                if self.progress:
+                    self.progress(done, total)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stats.probe_seconds += time.time() - start
+        return dims
+
+    def _fields(self, reldir, name, index):
+        """Template fields for file or directory name."""
+        stem = os.path.splitext(name)[0]
+        prefix = reldir + '/' if reldir else ''
+        return {'name': name, 'stem': stem, 'title': title_from_name(stem),
+                'index': index, 'dir': reldir, 'path': prefix + stem,
+                'relpath': prefix + name}
+
+    def image_ident(self, reldir, name, index=1):
+        """Image API identifier, or path for static images, of image name."""
+        ident = self.image_ident_template.format(**self._fields(reldir, name, index))
+        if self.quote_idents:
+            ident = quote(ident.encode('utf-8'), safe='' if self.iiif else '/')
+        if not self.iiif:
+            # static image URIs are base + ident, and the base has no trailing /
+            ident = '/' + ident
+        return ident
+
+    def manifest_ident(self, reldir):
+        """Return the identifier of the Manifest for reldir, relative to prezi_base."""
+        return reldir + '/manifest' if reldir else 'manifest'
+
+    def collection_ident(self, reldir):
+        """Return the identifier of the Collection for reldir, relative to prezi_base."""
+        return reldir + '/collection' if reldir else 'collection'
+
+    def _dir_label(self, reldir):
+        name = reldir.rsplit('/', 1)[-1] if reldir else os.path.basename(self.image_dir)
+        return self.manifest_label_template.format(**self._fields(
+            reldir.rsplit('/', 1)[0] if '/' in reldir else '', name, 1))
+
+    def _config(self):
+        """Return the settings, other than per image values, that the output depends on."""
+        fac = self.factory
+        return [__version__, fac.presentation_api_version, fac.context_uri,
+                fac.default_lang, fac.prezi_base, fac.default_base_image_uri, self.iiif,
+                fac.default_image_api_version, fac.default_image_api_level,
+                fac.default_image_api_context, fac.default_image_api_profile]
+
+    def _canvas_rows(self, reldir, images, dims):
+        """Return (path, ident, label, height, width, image, format) per probed image."""
+        rows = []
+        prefix = reldir + '/' if reldir else ''
+        for (index, name) in enumerate(images, 1):
+            fn = os.path.join(self.image_dir, prefix + name)
+            if fn not in dims:
+                continue
+            (h, w) = dims[fn]
+            fields = self._fields(reldir, name, index)
+            rows.append((prefix + name, prefix + fields['stem'],
+                         self.label_template.format(**fields), h, w,
+                         self.image_ident(reldir, name, index),
+                         mimetypes.guess_type(name)[0] or ""))
+        return rows
+
+    def build_manifest(self, reldir, images, dims):
+        """Build and return the Manifest for images in reldir.
+
+        Returns None if none of the images could be probed.
+        """
+        rows = self._canvas_rows(reldir, images, dims)
+        if not rows:
+            return None
+        return self._manifest(self.manifest_ident(reldir), self._dir_label(reldir), rows)
+
+    def _manifest(self, ident, label, rows):
+        """Build Manifest from _canvas_rows(), reusing cached Canvases."""
+        fac = self.factory
+        mfst = fac.manifest(ident=ident, label=label)
+        seq = mfst.sequence()
+        if self.cache is None:
+            self._add_canvases(seq, rows)
+            return mfst
+        config = self._config()
+        todo = []
+        for row in rows:
+            text = self.cache.canvas(row[0], fingerprint(config, row[1:]))
+            if text is None:
+                todo.append(row)
+                continue
+            self._add_canvases(seq, todo)
+            todo = []
+            if not self.compact:
+                # indent it along with everything else
+                text = json.loads(text, object_pairs_hook=OrderedDict)
+            seq.add_canvas(fac.rawResource(text))
+        self._add_canvases(seq, todo)
+        return mfst
+
+    def _add_canvases(self, seq, rows):
+        """Add Canvases for rows to seq, recording them in the cache."""
+        if not rows:
+            return
+        cols = list(zip(*rows))
+        new = seq.bulk_canvases(cols[1], cols[2], cols[3], cols[4], cols[5],
+                                None if self.iiif else cols[6], iiif=self.iiif)
+        if self.cache is not None:
+            config = self._config()
+            for (row, cvs) in zip(rows, new):
+                self.cache.set_canvas(row[0], fingerprint(config, row[1:]),
+                                      json.dumps(cvs.toJSON(), separators=(',', ':')))
+
+    def _output_exists(self, minimal):
+        """Check whether the file for the resource described by minimal exists."""
+        myid = minimal['@id']
+        base = self.factory.prezi_base
+        if not myid.startswith(base):
+            return False
+        return os.path.exists(os.path.join(self.factory.prezi_dir, myid[len(base):]))
+
+    def _cached_output(self, ident, fp):
+        """Return the minimal JSON of ident if it was built from fp, else None."""
+        if self.cache is None:
+            (old, minimal) = self._outputs.get(ident, (None, None))
+        else:
+            (old, minimal) = self.cache.output(ident)
+        if old == fp and self._output_exists(minimal):
+            self.stats.unchanged += 1
+            return minimal
+        return None
+
+    def _record_output(self, ident, fp, minimal):
+        """Record that ident was built from fp."""
+        self._outputs[ident] = (fp, minimal)
+        if self.cache is not None:
+            self.cache.set_output(ident, fp, minimal)
+            self.cache.commit()
+
+    def publish(self, resource):
+        """Write resource with toFile(), return the minimal JSON for it."""
+        start = time.time()
+        resource.toFile(compact=self.compact)
+        self.stats.write_seconds += time.time() - start
+        return {'@id': resource.id, '@type': resource._type, 'label': resource.label}
+
+    def build(self):
+        """Build and write everything under image_dir, return the BuildStats.
+
+        The top level resource is the Collection of image_dir if it has
+        subdirectories with images, otherwise its Manifest.
+        """
+        self.stats = BuildStats()
+        start = time.time()
+        self.tree = self.scan()
+        self.manifests = {}
+        self.collections = {}
+        keys = {}
+        for (reldir, (images, subdirs)) in self.tree.items():
+            keys.update(self._image_keys(reldir, images))
+        self.stats.images += len(keys)
+        dims = self._probe_keys(keys)
+        self._build_dir("", dims)
+        if self.cache is not None:
+            self.cache.prune(keys.values())
+            self.cache.commit()
+        self.stats.total_seconds += time.time() - start
+        return self.stats
+
+    def update(self, reldirs):
+        """Bring the output up to date after changes to the directories reldirs.
+
+        Each directory in reldirs is rescanned and its Manifest rebuilt;
+        a Collection is only rebuilt when its membership changes, which
+        may then change its parent, and so on up. New directories are
+        scanned and built. The Manifests of directories that no longer
+        have images are left on disk, but are no longer in any Collection.
+        Runs a full build() if there hasn't been one. Returns a new
+        BuildStats for the update.
+        """
+        if not self.tree:
+            return self.build()
+        self.stats = BuildStats()
+        start = time.time()
+        rescan = set(reldirs)
+        heap = []
+        queued = set()
+
+        def push(reldir):
+            if reldir not in queued:
+                queued.add(reldir)
+                # deepest first, so Collections are built after their members
+                heapq.heappush(heap, (-(reldir.count('/') + 1 if reldir else 0), reldir))
+
+        for reldir in rescan:
+            push(reldir)
+        while heap:
+            reldir = heapq.heappop(heap)[1]
+            queued.discard(reldir)
+            before = self.members(reldir)
+            if reldir in rescan:
+                rescan.discard(reldir)
+                new = self._rescan(reldir)
+                if new:
+                    rescan.update(new)
+                    for sub in new:
+                        push(sub)
+                    push(reldir)
+                    continue
+                if reldir in self.tree:
+                    self._update_manifest(reldir)
+            if reldir in self.tree:
+                self._update_collection(reldir)
+            if reldir and self.members(reldir) != before:
+                push(reldir.rsplit('/', 1)[0] if '/' in reldir else '')
+        if self.cache is not None:
+            self.cache.commit()
+        self.stats.total_seconds += time.time() - start
+        return self.stats
+
+    def members(self, reldir):
+        """Minimal JSON of the Manifest and/or Collection built for reldir."""
+        return [m for m in (self.manifests.get(reldir), self.collections.get(reldir)) if m]
+
+    def _rescan(self, reldir):
+        """Rescan reldir after a change, return the reldirs of new subdirectories."""
+        path = os.path.join(self.image_dir, reldir)
+        if not os.path.isdir(path):
+            for d in [d for d in self.tree if d == reldir or d.startswith(reldir + '/')]:
+                del self.tree[d]
+                self.manifests.pop(d, None)
+                self.collections.pop(d, None)
+            return []
+        (dirpath, dirnames, filenames) = next(os.walk(path))
+        dirnames.sort(key=natural_sort_key)
+        prefix = reldir + '/' if reldir else ''
+        old = self.tree.get(reldir, ([], []))[1]
+        for sub in set(old) - set(dirnames):
+            self._rescan(prefix + sub)
+        new = []
+        for sub in dirnames:
+            if prefix + sub not in self.tree:
+                subtree = self.scan(prefix + sub)
+                self.tree.update(subtree)
+                new.extend(subtree)
+        if reldir not in self.tree and reldir:
+            # link a new directory into its parent
+            (parent, name) = reldir.rsplit('/', 1) if '/' in reldir else ('', reldir)
+            if parent in self.tree and name not in self.tree[parent][1]:
+                self.tree[parent][1].append(name)
+                self.tree[parent][1].sort(key=natural_sort_key)
+        self.tree[reldir] = (self._images(filenames), dirnames)
+        return new
+
+    def _image_keys(self, reldir, images):
+        """Return {path: cache key} for images in reldir."""
+        prefix = reldir + '/' if reldir else ''
+        return dict((os.path.join(self.image_dir, prefix + i), prefix + i) for i in images)
+
+    def _probe_keys(self, keys):
+        """Probe the files in keys (path: cache key), using the cache if there is one."""
+        if self.cache is None:
+            return self.probe(sorted(keys))
+        start = time.time()
+        dims = {}
+        infos = {}
+        for fn in sorted(keys):
+            try:
+                (hw, info) = self.cache.lookup(keys[fn], fn)
+            except (IOError, OSError) as e:
+                self.stats.failed.append((fn, "%s: %s" % (e.__class__.__name__, e)))
+                continue
+            if hw is None:
+                infos[fn] = info
+            else:
+                dims[fn] = hw
+        self.stats.cached += len(dims)
+        self.stats.probe_seconds += time.time() - start
+        probed = self.probe(sorted(infos))
+        for (fn, hw) in probed.items():
+            self.cache.store(keys[fn], infos[fn], hw)
+        self.cache.commit()
+        dims.update(probed)
+        return dims
+
+    def _build_dir(self, reldir, dims):
+        """Build reldir and below from self.tree, return list of minimal JSON for the results."""
+        self._build_manifest(reldir, dims)
+        for sub in self.tree.get(reldir, ([], []))[1]:
+            self._build_dir(reldir + '/' + sub if reldir else sub, dims)
+        self._update_collection(reldir)
+        return self.members(reldir)
+
+    def _update_manifest(self, reldir):
+        """Probe the images in reldir and rebuild its Manifest."""
+        images = self.tree[reldir][0]
+        keys = self._image_keys(reldir, images)
+        self.stats.images += len(keys)
+        self._build_manifest(reldir, self._probe_keys(keys))
+
+    def _build_manifest(self, reldir, dims):
+        """Build and publish the Manifest for reldir, unless it is unchanged."""
+        images = self.tree.get(reldir, ([], []))[0]
+        rows = self._canvas_rows(reldir, images, dims) if images else None
+        if not rows:
+            self.manifests.pop(reldir, None)
+            return
+        ident = self.manifest_ident(reldir)
+        label = self._dir_label(reldir)
+        fp = fingerprint(self._config(), self.compact, ident, label, [r[1:] for r in rows])
+        minimal = self._cached_output(ident, fp)
+        if minimal is None:
+            minimal = self.publish(self._manifest(ident, label, rows))
+            self._record_output(ident, fp, minimal)
+        self.manifests[reldir] = minimal
+        self.stats.manifests += 1
+
+    def _update_collection(self, reldir):
+        """Build and publish the Collection of reldir's subdirectories, unless it is unchanged."""
+        prefix = reldir + '/' if reldir else ''
+        children = []
+        for sub in self.tree.get(reldir, ([], []))[1]:
+            children.extend(self.members(prefix + sub))
+        if not children:
+            self.collections.pop(reldir, None)
+            return
+        ident = self.collection_ident(reldir)
+        label = self._dir_label(reldir)
+        fp = fingerprint(self._config(), self.compact, ident, label, children)
+        minimal = self._cached_output(ident, fp)
+        if minimal is None:
+            fac = self.factory
+            coll = fac.collection(ident=ident, label=label)
+            for child in children:
+                raw = fac.rawResource(child)
+                if child['@type'] == 'sc:Collection':
+                    coll.add_collection(raw)
+                else:
+                    coll.add_manifest(raw)
+            minimal = self.publish(coll)
+            self._record_output(ident, fp, minimal)
+        self.collections[reldir] = minimal
+        self.stats.collections += 1
+
+
+def _stream_progress(stream):
+    """Progress callback writing a counter to stream."""
+    def progress(done, total):
+        if done == total or not done % 100:
+            stream.write("\rprobed %d/%d images" % (done, total))
+            if done == total:
+                stream.write("\n")
+            stream.flush()
+    return progress
+
+
+def main(argv=None):
+    """Command line entry point for iiif-prezi-build."""
+    p = argparse.ArgumentParser(
+        description="Build IIIF Manifests and Collections from directories of images")
+    p.add_argument('image_dir', help="directory of images (or of directories of images)")
+    p.add_argument('--prezi-dir', required=True, help="directory to write JSON to")
+    p.add_argument('--prezi-base', required=True, help="base URI of the JSON in prezi-dir")
+    p.add_argument('--image-base', required=True, help="base URI of the images or Image API service")
+    p.add_argument('--image-api', default="2.0", help="Image API version (default 2.0)")
+    p.add_argument('--image-level', default="1", help="Image API compliance level (default 1)")
+    p.add_argument('--static', action='store_true', help="images are static files, not through the Image API")
+    p.add_argument('--processes', '-p', type=int, default=None, help="probe processes (default: CPUs)")
+    p.add_argument('--label-template', default="{title}", help="Canvas label template")
+    p.add_argument('--manifest-label-template', default="{title}", help="Manifest/Collection label template")
+    p.add_argument('--image-ident-template', default="{path}", help="image identifier template")
+    p.add_argument('--no-quote', action='store_true', help="don't %%-encode image identifiers")
+    p.add_argument('--pretty', action='store_true', help="indent the JSON")
+    p.add_argument('--cache', help="build cache file, to only rebuild what has changed")
+    p.add_argument('--hash', action='store_true', help="check contents of cached images with changed times")
+    p.add_argument('--watch', action='store_true', help="keep watching image_dir and rebuild as it changes")
+    p.add_argument('--debounce', type=float, default=1.0,
+                   help="with --watch, seconds to wait for changes to settle (default 1)")
+    p.add_argument('--poll', type=float, default=None, metavar='SECONDS',
+                   help="with --watch, poll for changes every SECONDS instead of using inotify")
+    p.add_argument('--quiet', '-q', action='store_true', help="no progress or statistics")
+    args = p.parse_args(argv)
+
+    if not os.path.isdir(args.image_dir):
+        p.error("image_dir %s is not a directory" % args.image_dir)
+    if not os.path.isdir(args.prezi_dir):
+        try:
+            os.makedirs(args.prezi_dir)
+        except OSError as e:
+            p.error("can't make --prezi-dir %s: %s" % (args.prezi_dir, e))
+    fac = ManifestFactory()
+    fac.set_debug("error")
+    fac.set_base_prezi_uri(args.prezi_base)
+    fac.set_base_prezi_dir(args.prezi_dir)
+    fac.set_base_image_uri(args.image_base)
+    fac.set_base_image_dir(args.image_dir)
+    if not args.static:
+        fac.set_iiif_image_info(args.image_api, args.image_level)
+    builder = DirectoryBuilder(
+        fac, args.image_dir, processes=args.processes, iiif=not args.static,
+        label_template=args.label_template,
+        manifest_label_template=args.manifest_label_template,
+        image_ident_template=args.image_ident_template,
+        quote_idents=not args.no_quote, compact=not args.pretty,
+        progress=None if args.quiet else _stream_progress(sys.stderr),
+        cache=BuildCache(args.cache, args.hash) if args.cache else None)
+    try:
+        if args.watch:
+            return _watch(builder, args)
+        stats = builder.build()
+    finally:
+        if builder.cache is not None:
+            builder.cache.close()
+    if not args.quiet:
+        for (fn, err) in stats.failed:
+            sys.stderr.write("failed: %s (%s)\n" % (fn, err))
+        sys.stderr.write("%s\n" % stats)
+    return 1 if stats.failed else 0
+
+
+def _watch(builder, args):
+    """Build, then rebuild as image_dir changes, until interrupted."""
+    from .watch import Watcher
+
+    def report(stats, reldirs):
+        if not args.quiet:
+            changed = "everything" if reldirs is None else ", ".join(sorted(d or '.' for d in reldirs))
+            sys.stderr.write("%s: %s\n" % (changed, stats))
+
+    watcher = Watcher(builder, debounce=args.debounce, interval=args.poll or 5.0,
+                      use_inotify=args.poll is None, callback=report)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
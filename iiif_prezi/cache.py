@@ -0,0 +1,175 @@
+"""Persistent build cache for incremental rebuilds.
+
+A sqlite database that records, for each image file, its size and
+modification time (and optionally a content hash) with the dimensions
+probed from it and the serialized Canvas built for it, and for each
+published Manifest or Collection the fingerprint of the inputs it was
+built from. DirectoryBuilder uses it to probe only new or changed files
+and to rewrite only the resources whose inputs have changed.
+"""
+
+from __future__ import unicode_literals
+import hashlib
+import json
+import os
+import sqlite3
+
+SCHEMA_VERSION = "1"
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, size INTEGER, "
+    "mtime INTEGER, hash TEXT, height INTEGER, width INTEGER, "
+    "canvas_key TEXT, canvas TEXT)",
+    "CREATE TABLE IF NOT EXISTS outputs (ident TEXT PRIMARY KEY, "
+    "fingerprint TEXT, minimal TEXT)",
+]
+
+
+def file_digest(fn, blocksize=1 << 20):
+    """Return the hex SHA-1 of the contents of file fn."""
+    h = hashlib.sha1()
+    with open(fn, 'rb') as fh:
+        block = fh.read(blocksize)
+        while block:
+            h.update(block)
+            block = fh.read(blocksize)
+    return h.hexdigest()
+
+
+def fingerprint(*parts):
+    """Return a hex digest of the JSON serializable parts."""
+    js = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(js.encode('utf-8')).hexdigest()
+
+
+class BuildCache(object):
+    """sqlite backed cache of image dimensions, Canvases and output fingerprints.
+
+    Image rows are keyed by a path (DirectoryBuilder uses the path
+    relative to the image directory) and are valid while the file's size
+    and modification time are unchanged. With hash_contents, a file whose
+    size or time has changed but whose contents have not (for example
+    after a copy or touch) is also treated as unchanged, at the cost of
+    reading the file.
+
+    Not thread-safe: the sqlite connection belongs to the thread that
+    opened the cache.
+    """
+
+    def __init__(self, path, hash_contents=False):
+        """Open or create the cache database at path."""
+        self.path = path
+        self.hash_contents = hash_contents
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for stmt in SCHEMA:
+            self.db.execute(stmt)
+        row = self.db.execute("SELECT value FROM meta WHERE key='schema'").fetchone()
+        if row is None:
+            self.db.execute("INSERT INTO meta VALUES ('schema', ?)", (SCHEMA_VERSION,))
+        elif row[0] != SCHEMA_VERSION:
+            # Written by an incompatible version, start again
+            self.clear()
+            self.db.execute("UPDATE meta SET value=? WHERE key='schema'", (SCHEMA_VERSION,))
+        self.db.commit()
+
+    def __enter__(self):
+        """Use as a context manager."""
+        return self
+
+    def __exit__(self, *exc):
+        """Commit and close."""
+        self.close()
+
+    def close(self):
+        """Commit and close the database."""
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def commit(self):
+        """Commit pending changes."""
+        self.db.commit()
+
+    def clear(self):
+        """Forget everything."""
+        self.db.execute("DELETE FROM images")
+        self.db.execute("DELETE FROM outputs")
+
+    def stat(self, fn):
+        """Return (size, mtime in ns) of file fn."""
+        st = os.stat(fn)
+        mtime = getattr(st, 'st_mtime_ns', None)
+        if mtime is None:
+            mtime = int(st.st_mtime * 1000000000)
+        return (st.st_size, mtime)
+
+    def lookup(self, key, fn):
+        """Return ((height, width) or None, info) for image file fn.
+
+        The dimensions are None if the file is not in the cache or has
+        changed. info is to be passed to store() with the new dimensions.
+        """
+        (size, mtime) = self.stat(fn)
+        row = self.db.execute(
+            "SELECT size, mtime, hash, height, width FROM images WHERE path=?",
+            (key,)).fetchone()
+        if row is not None and row[0] == size and row[1] == mtime:
+            return ((row[3], row[4]), (size, mtime, row[2]))
+        digest = file_digest(fn) if self.hash_contents else None
+        if row is not None and digest is not None and row[2] == digest:
+            self.db.execute("UPDATE images SET size=?, mtime=? WHERE path=?",
+                            (size, mtime, key))
+            return ((row[3], row[4]), (size, mtime, digest))
+        return (None, (size, mtime, digest))
+
+    def store(self, key, info, hw):
+        """Record the dimensions hw of the image at key, with info from lookup()."""
+        (size, mtime, digest) = info
+        self.db.execute(
+            "INSERT OR REPLACE INTO images (path, size, mtime, hash, height, width) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (key, size, mtime, digest, hw[0], hw[1]))
+
+    def canvas(self, key, canvas_key):
+        """Return the serialized Canvas for the image at key, or None.
+
+        canvas_key is a fingerprint of everything the Canvas was built
+        from; the Canvas is only returned if it matches.
+        """
+        row = self.db.execute(
+            "SELECT canvas FROM images WHERE path=? AND canvas_key=?",
+            (key, canvas_key)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_canvas(self, key, canvas_key, text):
+        """Record the serialized Canvas text for the image at key."""
+        self.db.execute("UPDATE images SET canvas_key=?, canvas=? WHERE path=?",
+                        (canvas_key, text, key))
+
+    def output(self, ident):
+        """Return (fingerprint, minimal JSON) recorded for output ident, or (None, None)."""
+        row = self.db.execute(
+            "SELECT fingerprint, minimal FROM outputs WHERE ident=?", (ident,)).fetchone()
+        if row is None:
+            return (None, None)
+        return (row[0], json.loads(row[1]))
+
+    def set_output(self, ident, fingerprint, minimal):
+        """Record the input fingerprint and minimal JSON of output ident."""
+        self.db.execute("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?)",
+                        (ident, fingerprint, json.dumps(minimal)))
+
+    def prune(self, keys):
+        """Remove images that are not in keys, return the number removed."""
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM seen")
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((k,) for k in keys))
+        cur = self.db.execute("DELETE FROM images WHERE path NOT IN (SELECT path FROM seen)")
+        self.db.execute("DELETE FROM seen")
+        return cur.rowcount
+
+    def __len__(self):
+        """Number of images in the cache."""
+        return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
@@ -0,0 +1,398 @@
+r"""Precompressed copies of output files, with ETag sidecars.
+
+For a web server or CDN to send files as they are rather than compress
+them for each response. Writing manifest.json also writes
+manifest.json.gz, and manifest.json.br if brotli is installed, as
+nginx's gzip_static and brotli_static expect, and manifest.json.etag,
+JSON with a strong ETag for each from the SHA-256 of the content:
+
+    {"etag": "\"9f86d081884c7d65...\"", "length": 5120, "sha256": "9f86d0...",
+     "encodings": {"gzip": {"etag": "\"9f86d081884c7d65...-gz9\"", "length": 1017}, ...}}
+
+The bytes are hashed and compressed as they are written, in one pass
+over the serialization, or compressed in a pool of threads, where zlib
+and brotli run alongside the serialization of the next file.
+
+    factory.set_precompress(levels={"gz": 9, "br": 11})
+    manifest.toFile()
+    precompress_tree("published/", threads=8)
+"""
+
+from __future__ import unicode_literals
+import hashlib
+import io
+import json
+import multiprocessing.pool
+import os
+import time
+import uuid
+import zlib
+
+from .factory import ConfigurationError, _replace_file
+from .util import optional_import
+
+FORMATS = ['gz', 'br']
+DEFAULT_LEVELS = {'gz': 9, 'br': 11}
+ENCODINGS = {'gz': 'gzip', 'br': 'br'}
+SIDECAR = '.etag'
+
+# Bytes written, hashed and compressed at a time
+BLOCK = 1 << 16
+
+try:
+    _cpu_time = time.thread_time
+except AttributeError:  # before python 3.7
+    _cpu_time = time.time
+
+
+def _brotli():
+    """The brotli module, or None if it isn't installed."""
+    return optional_import('brotli', 'brotlicffi')
+
+
+def available_formats():
+    """List of the formats that can be written here."""
+    return [f for f in FORMATS if f != 'br' or _brotli() is not None]
+
+
+class _Compressor(object):
+    """Streaming compressor for format fmt at level, timing itself."""
+
+    def __init__(self, fmt, level):
+        """Initialize _Compressor."""
+        if fmt == 'gz':
+            # gzip wrapper, with no file name or time so the output is the same every time
+            self._comp = zlib.compressobj(level, zlib.DEFLATED, 31)
+            (self._process, self._finish) = (self._comp.compress, self._comp.flush)
+        else:
+            self._comp = _brotli().Compressor(quality=level)
+            (self._process, self._finish) = (self._comp.process, self._comp.finish)
+        self.length = 0
+        self.seconds = 0.0
+
+    def process(self, data):
+        """Compressed bytes for some more data."""
+        start = _cpu_time()
+        out = self._process(data)
+        self.seconds += _cpu_time() - start
+        self.length += len(out)
+        return out
+
+    def finish(self):
+        """The last of the compressed bytes."""
+        start = _cpu_time()
+        out = self._finish()
+        self.seconds += _cpu_time() - start
+        self.length += len(out)
+        return out
+
+
+class PrecompressedFile(object):
+    """A file written with precompressed copies.
+
+    length and sha256 are of the file itself, and encodings has
+    (length, CPU seconds) of each compressed copy by format.
+    """
+
+    def __init__(self, path, length, sha256, levels):
+        """Initialize PrecompressedFile."""
+        self.path = path
+        self.length = length
+        self.sha256 = sha256
+        self.levels = levels
+        self.encodings = {}
+
+    @property
+    def etag(self):
+        """Strong ETag of the file."""
+        return '"%s"' % self.sha256[:32]
+
+    def encoding_etag(self, fmt):
+        """Strong ETag of the copy in format fmt, which differs with the level."""
+        return '"%s-%s%d"' % (self.sha256[:32], fmt, self.levels[fmt])
+
+    def toJSON(self):
+        """JSON for the sidecar."""
+        return {'etag': self.etag, 'length': self.length, 'sha256': self.sha256,
+                'encodings': dict([(ENCODINGS[f], {'etag': self.encoding_etag(f), 'length': n})
+                                   for (f, (n, secs)) in self.encodings.items()])}
+
+
+def read_sidecar(path):
+    """JSON of the ETag sidecar of the file at path, or None if there isn't one."""
+    try:
+        with io.open(path + SIDECAR, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def remove_copies(path):
+    """Remove the compressed copies and sidecar of path, as out of date."""
+    for ext in ['.' + f for f in FORMATS] + [SIDECAR]:
+        if os.path.exists(path + ext):
+            os.remove(path + ext)
+
+
+def _compress_job(args):
+    """Compress data to a temporary file, returning (format, temporary file, length, CPU seconds)."""
+    (path, fmt, level, data) = args
+    comp = _Compressor(fmt, level)
+    tmp = "%s.%s.%s.tmp" % (path, fmt, uuid.uuid4().hex)
+    try:
+        with io.open(tmp, 'wb') as fh:
+            for i in range(0, len(data), BLOCK * 16):
+                fh.write(comp.process(data[i:i + BLOCK * 16]))
+            fh.write(comp.finish())
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return (fmt, tmp, comp.length, comp.seconds)
+
+
+class Precompressor(object):
+    """Writes files with precompressed copies and an ETag sidecar.
+
+    formats is a list of 'gz' and 'br', by default those available, and
+    levels a dict of compression level by format, for those not the
+    default (gzip 9, brotli 11). With threads 0 the file is compressed
+    as it is written, otherwise compression is done in a pool of that
+    many threads.
+    """
+
+    def __init__(self, formats=None, levels=None, threads=0):
+        """Initialize Precompressor."""
+        if formats is None:
+            formats = available_formats()
+        for f in formats:
+            if f not in FORMATS:
+                raise ConfigurationError("Unknown compression format %s, not one of %s" % (
+                    f, ", ".join(FORMATS)))
+            elif f == 'br' and _brotli() is None:
+                raise ConfigurationError("Writing .br files needs brotli, which is not installed")
+        self.formats = list(formats)
+        self.levels = dict(DEFAULT_LEVELS)
+        self.levels.update(levels or {})
+        self.threads = threads
+        self._pool = None
+        self._pending = []
+
+    def _get_pool(self):
+        """The thread pool, started when first needed."""
+        if self._pool is None:
+            self._pool = multiprocessing.pool.ThreadPool(self.threads)
+        return self._pool
+
+    def write(self, path, chunks, wait=True):
+        """Write the strings from iterable chunks to file path, with compressed copies.
+
+        With threads and wait False, the copies and sidecar may still be
+        being made when this returns; join() waits for them. Returns the
+        PrecompressedFile, which is complete once they are.
+        """
+        tmp = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        sha = hashlib.sha256()
+        (length, blocks) = (0, [])
+        inline = [] if self.threads else [
+            (f, _Compressor(f, self.levels[f]), "%s.%s.%s.tmp" % (path, f, uuid.uuid4().hex))
+            for f in self.formats]
+        handles = []
+        try:
+            fh = io.open(tmp, 'wb')
+            handles.append(fh)
+            for (f, comp, ctmp) in inline:
+                handles.append(io.open(ctmp, 'wb'))
+            for block in _blocks(chunks):
+                fh.write(block)
+                sha.update(block)
+                length += len(block)
+                if self.threads:
+                    blocks.append(block)
+                for (n, (f, comp, ctmp)) in enumerate(inline):
+                    handles[n + 1].write(comp.process(block))
+            for (n, (f, comp, ctmp)) in enumerate(inline):
+                handles[n + 1].write(comp.finish())
+        except:
+            _close(handles)
+            _remove([tmp] + [ctmp for (f, comp, ctmp) in inline])
+            raise
+        _close(handles)
+        info = PrecompressedFile(path, length, sha.hexdigest(), self.levels)
+        if not self.threads:
+            self._finalize(info, tmp, [(f, ctmp, comp.length, comp.seconds) for (f, comp, ctmp) in inline])
+            return info
+        data = b''.join(blocks)
+        jobs = [self._get_pool().apply_async(_compress_job, ((path, f, self.levels[f], data),))
+                for f in self.formats]
+        self._pending.append((info, tmp, jobs))
+        if wait:
+            self.join()
+        else:
+            # keep a bounded number of files in memory
+            while len(self._pending) > self.threads:
+                self._finish(self._pending.pop(0))
+        return info
+
+    def compress_file(self, path):
+        """Make the compressed copies and sidecar of the existing file path."""
+        with io.open(path, 'rb') as fh:
+            data = fh.read()
+        info = PrecompressedFile(path, len(data), hashlib.sha256(data).hexdigest(), self.levels)
+        self._finalize(info, None, [_compress_job((path, f, self.levels[f], data)) for f in self.formats])
+        return info
+
+    def _finish(self, pending):
+        """Wait for the compression of a file, then put it in place."""
+        (info, tmp, jobs) = pending
+        results = []
+        error = None
+        for job in jobs:
+            try:
+                results.append(job.get())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            _remove([tmp] + [r[1] for r in results])
+            raise error
+        self._finalize(info, tmp, results)
+
+    def _finalize(self, info, tmp, results):
+        """Move the file and its copies into place and write the sidecar."""
+        path = info.path
+        for (f, ctmp, length, seconds) in results:
+            _replace_file(ctmp, path + '.' + f)
+            info.encodings[f] = (length, seconds)
+        for f in FORMATS:
+            if f not in info.encodings and os.path.exists(path + '.' + f):
+                # no longer made, so would be out of date
+                os.remove(path + '.' + f)
+        if tmp is not None:
+            _replace_file(tmp, path)
+        stmp = "%s%s.%s.tmp" % (path, SIDECAR, uuid.uuid4().hex)
+        with io.open(stmp, 'w', encoding='utf-8') as fh:
+            fh.write(json.dumps(info.toJSON(), sort_keys=True))
+        _replace_file(stmp, path + SIDECAR)
+
+    def is_current(self, path):
+        """True if path has compressed copies in all the formats and a sidecar of its content."""
+        side = read_sidecar(path)
+        if side is None or side.get('length') != os.path.getsize(path):
+            return False
+        for f in self.formats:
+            enc = side.get('encodings', {}).get(ENCODINGS[f])
+            if not enc or not enc.get('etag', '').endswith('-%s%d"' % (f, self.levels[f])):
+                return False
+            if not os.path.exists(path + '.' + f):
+                return False
+        with io.open(path, 'rb') as fh:
+            sha = hashlib.sha256()
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                sha.update(block)
+        return side.get('sha256') == sha.hexdigest()
+
+    def join(self):
+        """Wait for the files still being compressed."""
+        while self._pending:
+            self._finish(self._pending.pop(0))
+
+    def close(self):
+        """Wait for the files still being compressed and stop the pool."""
+        try:
+            self.join()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+def _blocks(chunks):
+    """Generate the UTF-8 of the strings from chunks in blocks of about BLOCK bytes."""
+    (buf, size) = ([], 0)
+    for chunk in chunks:
+        b = chunk.encode('utf-8')
+        buf.append(b)
+        size += len(b)
+        if size >= BLOCK:
+            yield b''.join(buf)
+            (buf, size) = ([], 0)
+    if buf:
+        yield b''.join(buf)
+
+
+def _close(handles):
+    """Close the open files in handles."""
+    for fh in handles:
+        fh.close()
+
+
+def _remove(paths):
+    """Remove the files in paths that exist."""
+    for p in paths:
+        if os.path.exists(p):
+            os.remove(p)
+
+
+class PrecompressStats(object):
+    """Counts of a precompress_tree() run."""
+
+    def __init__(self):
+        """Initialize PrecompressStats."""
+        self.files = 0
+        self.current = 0
+        self.bytes = 0
+        self.compressed = {}
+        self.cpu = {}
+        self.failed = []
+        self.seconds = 0.0
+
+    def __str__(self):
+        """Summary line."""
+        parts = ["%s %.1f%% in %.1fs CPU" % (f, 100.0 * self.compressed[f] / max(self.bytes, 1), self.cpu[f])
+                 for f in sorted(self.compressed)]
+        return "%d files compressed (%s), %.1f MB in %.1fs, %d already current, %d failed" % (
+            self.files, ", ".join(parts) or "none", self.bytes / 1e6, self.seconds,
+            self.current, len(self.failed))
+
+
+def precompress_tree(directory, formats=None, levels=None, threads=None, force=False):
+    """Make compressed copies and sidecars of every .json file in directory.
+
+    Files whose sidecar is of their current content, with copies at the
+    same levels, are skipped unless force is True. Files are compressed in
+    a pool of threads, by default one per CPU. Returns PrecompressStats.
+    """
+    pre = Precompressor(formats, levels)
+    stats = PrecompressStats()
+    start = time.time()
+    paths = []
+    for (dr, dirs, files) in os.walk(directory):
+        dirs.sort()
+        paths.extend([os.path.join(dr, fn) for fn in sorted(files) if fn.endswith('.json')])
+
+    def job(path):
+        try:
+            if not force and pre.is_current(path):
+                return (path, None, None)
+            return (path, pre.compress_file(path), None)
+        except (IOError, OSError, zlib.error) as e:
+            return (path, None, "%s: %s" % (type(e).__name__, e))
+    pool = multiprocessing.pool.ThreadPool(threads)
+    try:
+        for (path, info, error) in pool.imap_unordered(job, paths):
+            if error:
+                stats.failed.append((path, error))
+            elif info is None:
+                stats.current += 1
+            else:
+                stats.files += 1
+                stats.bytes += info.length
+                for (f, (length, seconds)) in info.encodings.items():
+                    stats.compressed[f] = stats.compressed.get(f, 0) + length
+                    stats.cpu[f] = stats.cpu.get(f, 0.0) + seconds
+    finally:
+        pool.close()
+        pool.join()
+    stats.seconds = time.time() - start
+    return stats
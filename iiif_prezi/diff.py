@@ -0,0 +1,448 @@
+"""Structural differences between versions of a resource, as JSON Patch.
+
+    changes = diff(old_manifest, new_manifest)
+    changes.patch()      # RFC 6902 operations turning old into new
+    changes.resources()  # @ids of the resources added, removed or changed
+    changes.kinds()      # number of changes by kind: descriptive, ...
+
+Resources in lists are matched by their @id (or 3.0 id) rather than by
+position, so adding, removing or moving a Canvas is one operation and the
+others are unaffected. Publisher writes top level resources to their
+files only where their JSON has changed, so caches of the rest stay
+valid, and records what changed in those it writes.
+
+    iiif-prezi-diff old/manifest.json new/manifest.json
+"""
+
+from __future__ import unicode_literals
+import argparse
+import copy
+import io
+import json
+import os
+import sys
+from collections import OrderedDict
+
+from .factory import BaseMetadataObject, DataError, RawResource, _write_chunks
+from .util import STR_TYPES
+
+# Kind of change by the property of the resource changed
+KINDS = {}
+for (kind, props) in [
+        ('descriptive', ['label', 'metadata', 'description', 'thumbnail', 'navDate',
+                         'attribution', 'license', 'logo', 'related', 'rendering',
+                         'seeAlso', 'within', 'summary', 'requiredStatement', 'rights']),
+        ('structural', ['sequences', 'canvases', 'structures', 'ranges', 'members',
+                        'manifests', 'collections', 'items', 'startCanvas', 'first',
+                        'last', 'next', 'prev', 'viewingHint', 'viewingDirection',
+                        'contentLayer']),
+        ('content', ['images', 'otherContent', 'resources', 'resource', 'on', 'motivation',
+                     'chars', 'full', 'selector', 'style', 'body', 'target', 'annotations']),
+        ('technical', ['@context', '@type', 'type', 'height', 'width', 'duration', 'format',
+                       'service', 'profile', 'language', 'total', 'startIndex'])]:
+    for p in props:
+        KINDS[p] = kind
+
+
+def _pointer(path):
+    """JSON Pointer of the list of keys and indexes path."""
+    return "".join(["/" + ("%s" % p).replace('~', '~0').replace('/', '~1') for p in path])
+
+
+def _unpointer(pointer):
+    """List of the (unescaped) tokens of JSON Pointer pointer."""
+    if not pointer:
+        return []
+    if not pointer.startswith('/'):
+        raise DataError("Not a JSON Pointer: %s" % pointer)
+    return [p.replace('~1', '/').replace('~0', '~') for p in pointer[1:].split('/')]
+
+
+def _ident(value):
+    """@id (or id) of value if it's a resource with one, else None."""
+    if isinstance(value, dict):
+        ident = value.get('@id', value.get('id'))
+        if type(ident) in STR_TYPES:
+            return ident
+    return None
+
+
+def _idents(value, found):
+    """Add the @ids of value and the resources within it to set found."""
+    if isinstance(value, dict):
+        ident = _ident(value)
+        if ident is not None:
+            found.add(ident)
+        for v in value.values():
+            _idents(v, found)
+    elif isinstance(value, list):
+        for v in value:
+            _idents(v, found)
+    return found
+
+
+def as_json(resource):
+    """JSON of resource, given as a resource, RawResource, dict or JSON text."""
+    if isinstance(resource, BaseMetadataObject):
+        return resource.toJSON(top=True)
+    elif isinstance(resource, RawResource):
+        return resource.toJSON()
+    elif type(resource) in STR_TYPES:
+        if isinstance(resource, bytes):
+            resource = resource.decode('utf-8')
+        try:
+            return json.loads(resource.lstrip('\ufeff'), object_pairs_hook=OrderedDict)
+        except ValueError as e:
+            raise DataError("Could not parse JSON to compare: %s" % e)
+    elif isinstance(resource, (dict, list)) or resource is None:
+        return resource
+    raise DataError("Expected a resource, dict or JSON to compare, got %r" % type(resource))
+
+
+class Change(object):
+    """One operation of a ChangeSet.
+
+    op, path, value and from_ are as in JSON Patch, with path and from_
+    as lists of keys and indexes. resource is the @id of the resource
+    changed, and kind the kind of change, from KINDS.
+    """
+
+    __slots__ = ('op', 'path', 'value', 'from_', 'resource', 'kind')
+
+    def __init__(self, op, path, value=None, from_=None, resource=None, kind='other'):
+        """Initialize Change."""
+        self.op = op
+        self.path = path
+        self.value = value
+        self.from_ = from_
+        self.resource = resource
+        self.kind = kind
+
+    def toJSON(self):
+        """JSON Patch operation."""
+        js = OrderedDict([('op', self.op), ('path', _pointer(self.path))])
+        if self.op == 'move':
+            js['from'] = _pointer(self.from_)
+        elif self.op != 'remove':
+            js['value'] = self.value
+        return js
+
+    def __repr__(self):
+        """Readable representation."""
+        return "<Change %s %s (%s of %s)>" % (self.op, _pointer(self.path), self.kind, self.resource)
+
+
+class ChangeSet(object):
+    """Changes from one version of a resource to another, see diff()."""
+
+    def __init__(self):
+        """Initialize ChangeSet."""
+        self.changes = []
+        self.added = set()
+        self.removed = set()
+        self.changed = set()
+
+    def __len__(self):
+        """Number of changes."""
+        return len(self.changes)
+
+    def __bool__(self):
+        """True if there are any changes."""
+        return bool(self.changes)
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        """Iterate over the Changes."""
+        return iter(self.changes)
+
+    def patch(self):
+        """List of JSON Patch operations, to apply in order."""
+        return [c.toJSON() for c in self.changes]
+
+    def resources(self):
+        """Set of @ids of the resources added, removed or changed."""
+        return self.added | self.removed | self.changed
+
+    def kinds(self):
+        """Dict of the number of changes of each kind."""
+        counts = {}
+        for c in self.changes:
+            counts[c.kind] = counts.get(c.kind, 0) + 1
+        return counts
+
+    def __str__(self):
+        """Summary line."""
+        kinds = self.kinds()
+        return "%d changes (%s): %d resources added, %d removed, %d changed" % (
+            len(self.changes), ", ".join(["%d %s" % (kinds[k], k) for k in sorted(kinds)]) or "none",
+            len(self.added), len(self.removed), len(self.changed))
+
+    def _add(self, op, path, value=None, from_=None, owner=None, prop=None):
+        """Record a change, within resource owner's property prop."""
+        kind = KINDS.get(prop, 'other')
+        if owner is not None:
+            self.changed.add(owner)
+        self.changes.append(Change(op, list(path), value, from_, owner, kind))
+
+    def _diff(self, old, new, path, owner, prop):
+        """Add the changes from old to new at path."""
+        if isinstance(old, dict) and isinstance(new, dict):
+            ident = _ident(new)
+            if ident is not None and ident == _ident(old):
+                (owner, prop) = (ident, None)
+            for k in old:
+                if k not in new:
+                    self._add('remove', path + [k], old[k], None, owner, prop or k)
+            for (k, v) in new.items():
+                if k not in old:
+                    self._add('add', path + [k], v, None, owner, prop or k)
+                elif old[k] != v:
+                    self._diff(old[k], v, path + [k], owner, prop or k)
+        elif isinstance(old, list) and isinstance(new, list):
+            self._diff_list(old, new, path, owner, prop)
+        elif old != new or type(old) != type(new):
+            self._add('replace', path, new, None, owner, prop)
+
+    def _diff_list(self, old, new, path, owner, prop):
+        """Add the changes from list old to list new at path."""
+        old_keys = [_ident(v) for v in old]
+        new_keys = [_ident(v) for v in new]
+        keyed = (None not in old_keys and None not in new_keys and
+                 len(set(old_keys)) == len(old_keys) and len(set(new_keys)) == len(new_keys))
+        if not keyed:
+            # by position
+            for i in range(min(len(old), len(new))):
+                if old[i] != new[i]:
+                    self._diff(old[i], new[i], path + [i], owner, prop)
+            for i in range(len(old) - 1, len(new) - 1, -1):
+                self._add('remove', path + [i], old[i], None, owner, prop)
+            for i in range(len(old), len(new)):
+                self._add('add', path + [i], new[i], None, owner, prop)
+            return
+        # Remove those that have gone, from the end so the indexes hold
+        wanted = set(new_keys)
+        by_key = {}
+        for i in range(len(old) - 1, -1, -1):
+            if old_keys[i] in wanted:
+                by_key[old_keys[i]] = old[i]
+            else:
+                self._add('remove', path + [i], old[i], None, owner, prop)
+        current = [k for k in old_keys if k in by_key]
+        # Then fill in each position in order, which only moves later items
+        for (i, key) in enumerate(new_keys):
+            if key not in by_key:
+                self._add('add', path + [i], new[i], None, owner, prop)
+                current.insert(i, key)
+                continue
+            if current[i] != key:
+                j = current.index(key, i)
+                self._add('move', path + [i], None, path + [j], owner, prop)
+                current.insert(i, current.pop(j))
+            if by_key[key] != new[i]:
+                self._diff(by_key[key], new[i], path + [i], owner, prop)
+
+
+def diff(old, new):
+    """Return the ChangeSet from resource old to resource new.
+
+    Each may be a resource, a RawResource, a dict of its JSON or the JSON
+    text. If old is None, new is one change, added as a whole.
+    """
+    (old, new) = (as_json(old), as_json(new))
+    changes = ChangeSet()
+    if old is None:
+        if new is not None:
+            changes._add('add', [], new)
+    else:
+        changes._diff(old, new, [], _ident(old), None)
+    if changes:
+        (before, after) = (_idents(old, set()), _idents(new, set()))
+        changes.added = after - before
+        changes.removed = before - after
+        changes.changed -= changes.added | changes.removed
+    return changes
+
+
+def apply_patch(doc, patch):
+    """Return a copy of JSON doc with the JSON Patch operations patch applied.
+
+    Supports the add, remove, replace and move operations that diff()
+    makes, and test. Raises DataError if an operation does not apply.
+    """
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        try:
+            path = _unpointer(op['path'])
+            if op['op'] == 'move':
+                (parent, key) = _locate(doc, _unpointer(op['from']))
+                value = parent.pop(key)
+                doc = _insert(doc, path, value)
+            elif op['op'] == 'add':
+                doc = _insert(doc, path, copy.deepcopy(op['value']))
+            elif op['op'] == 'remove':
+                (parent, key) = _locate(doc, path)
+                del parent[key]
+            elif op['op'] == 'replace':
+                if not path:
+                    doc = copy.deepcopy(op['value'])
+                else:
+                    (parent, key) = _locate(doc, path)
+                    parent[key] = copy.deepcopy(op['value'])
+            elif op['op'] == 'test':
+                (parent, key) = _locate(doc, path)
+                if parent[key] != op['value']:
+                    raise DataError("JSON Patch test failed at %s" % op['path'])
+            else:
+                raise DataError("Unsupported JSON Patch operation %s" % op['op'])
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            raise DataError("Could not apply %r: %s" % (op, e))
+    return doc
+
+
+def _locate(doc, path):
+    """Return (container, key or index) of the existing value at path in doc."""
+    if not path:
+        raise DataError("Can't take the whole document")
+    parent = doc
+    for p in path[:-1]:
+        parent = parent[int(p) if isinstance(parent, list) else p]
+    key = path[-1]
+    if isinstance(parent, list):
+        key = int(key)
+        parent[key]
+    elif key not in parent:
+        raise KeyError(key)
+    return (parent, key)
+
+
+def _insert(doc, path, value):
+    """Add value at path in doc, returning the document."""
+    if not path:
+        return value
+    parent = doc
+    for p in path[:-1]:
+        parent = parent[int(p) if isinstance(parent, list) else p]
+    key = path[-1]
+    if isinstance(parent, list):
+        if key == '-':
+            parent.append(value)
+        else:
+            key = int(key)
+            if key > len(parent):
+                raise IndexError(key)
+            parent.insert(key, value)
+    else:
+        parent[key] = value
+    return doc
+
+
+class Publisher(object):
+    """Write top level resources to their files only where they have changed.
+
+    Files whose contents would be the same are not touched, so their
+    modification times, and any caches keyed on them, stay as they were.
+    The ChangeSet of each file written is kept in changes by path, and
+    unchanged counts the files skipped. Files are written with compressed
+    copies by precompressor, if given, or that of the resource's factory,
+    with close() to wait for any still being compressed.
+    """
+
+    def __init__(self, compact=True, precompressor=None):
+        """Initialize Publisher."""
+        self.compact = compact
+        self.precompressor = precompressor
+        self.changes = OrderedDict()
+        self.unchanged = 0
+        self._used = []
+
+    def publish(self, resource):
+        """Write resource to its file_path() if changed, returning the ChangeSet."""
+        pre = self.precompressor or resource._factory.get_precompressor()
+        return self.publish_text(resource.file_path(), "".join(resource.iterString(self.compact)), pre)
+
+    def publish_text(self, path, text, precompressor=None):
+        """Write JSON text to path if changed, returning the ChangeSet."""
+        pre = precompressor or self.precompressor
+        old = None
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        if size is not None:
+            # as written in text mode
+            expected = len(text.encode('utf-8')) + text.count('\n') * (len(os.linesep) - 1)
+            with io.open(path, encoding='utf-8') as fh:
+                old = fh.read() if size == expected else None
+            if old == text:
+                if pre is not None and not pre.is_current(path):
+                    pre.compress_file(path)
+                self.unchanged += 1
+                return ChangeSet()
+            if old is None:
+                with io.open(path, encoding='utf-8') as fh:
+                    old = fh.read()
+            try:
+                old = as_json(old)
+            except DataError:
+                # replace a broken file
+                old = None
+        changes = diff(old, as_json(text))
+        if pre is not None:
+            if pre not in self._used:
+                self._used.append(pre)
+            pre.write(path, [text], wait=False)
+        else:
+            _write_chunks(path, [text])
+        self.changes[path] = changes
+        return changes
+
+    def close(self):
+        """Wait for files still being compressed."""
+        for pre in self._used:
+            pre.join()
+
+    def written(self):
+        """List of the paths of the files written."""
+        return list(self.changes)
+
+    def resources(self):
+        """Set of @ids of the resources added, removed or changed in all the files written."""
+        found = set()
+        for c in self.changes.values():
+            found |= c.resources()
+        return found
+
+    def __str__(self):
+        """Summary line."""
+        return "%d files written (%d changes, %d resources), %d unchanged" % (
+            len(self.changes), sum([len(c) for c in self.changes.values()]),
+            len(self.resources()), self.unchanged)
+
+
+def main(argv=None):
+    """Command line entry point for iiif-prezi-diff."""
+    p = argparse.ArgumentParser(description="Show the changes between two JSON resources as JSON Patch")
+    p.add_argument('old', help="JSON file of the old version")
+    p.add_argument('new', help="JSON file of the new version")
+    p.add_argument('--summary', '-s', action='store_true',
+                   help="list the kinds of change and the resources changed instead")
+    args = p.parse_args(argv)
+    docs = []
+    for fn in (args.old, args.new):
+        with io.open(fn, encoding='utf-8') as fh:
+            docs.append(fh.read())
+    changes = diff(docs[0], docs[1])
+    if args.summary:
+        print(changes)
+        for (label, ids) in [("added", changes.added), ("removed", changes.removed),
+                             ("changed", changes.changed)]:
+            for ident in sorted(ids):
+                print("%s %s" % (label, ident))
+    else:
+        print(json.dumps(changes.patch(), indent=2))
+    return 1 if changes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
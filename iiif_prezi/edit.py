@@ -0,0 +1,491 @@
+"""Edit Manifest files written by toFile() in place, without reading them in.
+
+    editor = ManifestEditor("manifest.json")
+    editor.append_canvases([cvs1, cvs2])
+    editor.replace_canvas(cvs)
+    editor.update({"label": "New label", "navDate": None})
+
+toFile() writes the top level properties in a fixed order with fixed
+separators, either compact or indented by two spaces. The editor scans a
+file once for the byte offsets of its top level properties and of each
+Canvas in the first Sequence, keeping them up to date as it edits. An
+edit serializes only the new Canvases or values, and makes the new file
+from them and byte ranges of the old one, replacing it in one step. A
+file not laid out as toFile() writes it is read and written out in full
+instead, as is a Manifest without a Sequence to add Canvases to.
+"""
+
+from __future__ import unicode_literals
+import io
+import json
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+
+from .compress import remove_copies
+from .factory import (BaseMetadataObject, Canvas, DataError, KEY_ORDER_HASH, RawResource,
+                      _iter_json, _key_ordered, _replace_file, _write_chunks)
+
+# Top level properties that are not for update()
+NOT_UPDATABLE = set(['@context', '@id', '@type', 'sequences', 'structures'])
+
+_decoder = json.JSONDecoder()
+
+
+class _LayoutError(Exception):
+    """The file is not laid out as toFile() writes it."""
+
+
+class _Layout(object):
+    """Byte offsets in a Manifest file.
+
+    keys is a list of [key, key start, value start, value end] for the
+    top level properties in order; canvases a list of [start, end] for the
+    Canvases of the first Sequence, with their @ids in canvas_ids; and
+    close the offset after the last Canvas, or the '[' if there are none.
+    """
+
+    def __init__(self, compact, newline):
+        """Initialize _Layout."""
+        self.compact = compact
+        self.newline = newline
+        self.keys = []
+        self.canvases = []
+        self.canvas_ids = []
+        self.close = None
+        self.stat = None
+
+    def ws(self, level):
+        """Whitespace before a member at level."""
+        return '' if self.compact else self.newline + '  ' * level
+
+    def shift(self, a, b, delta):
+        """Move the offsets after bytes a to b, replaced by delta more bytes."""
+        for entry in self.keys:
+            for i in (1, 2, 3):
+                if entry[i] >= b and entry[i] != a:
+                    entry[i] += delta
+        for entry in self.canvases:
+            for i in (0, 1):
+                if entry[i] >= b and entry[i] != a:
+                    entry[i] += delta
+        if self.close is not None and self.close >= b and self.close != a:
+            self.close += delta
+
+
+class _Scanner(object):
+    """Reads a file's layout, checking the whitespace between values."""
+
+    def __init__(self, text, layout):
+        """Initialize _Scanner with the file's text decoded as latin-1."""
+        self.s = text
+        self.pos = 0
+        self.layout = layout
+
+    def expect(self, token):
+        """Move past token, which must be next."""
+        if not self.s.startswith(token, self.pos):
+            raise _LayoutError("Expected %r at %d" % (token, self.pos))
+        self.pos += len(token)
+
+    def peek(self, token):
+        """Move past token and return True if it's next."""
+        if self.s.startswith(token, self.pos):
+            self.pos += len(token)
+            return True
+        return False
+
+    def value(self):
+        """Parse the value at pos and move past it."""
+        try:
+            (value, self.pos) = _decoder.raw_decode(self.s, self.pos)
+        except ValueError as e:
+            raise _LayoutError(str(e))
+        return value
+
+    def key(self, level):
+        """Read the key of a member at level, and the separator after it."""
+        self.expect(self.layout.ws(level))
+        key = self.value()
+        if not isinstance(key, type('')):
+            raise _LayoutError("Expected a key at %d" % self.pos)
+        self.expect(':' if self.layout.compact else ': ')
+        return key
+
+    def more(self, level, end):
+        """True if another member follows, else move past the end of the container."""
+        if self.peek(','):
+            return True
+        self.expect(self.layout.ws(level) + end)
+        return False
+
+    def manifest(self):
+        """Scan the whole file."""
+        self.expect('{')
+        more = True
+        while more:
+            start = self.pos
+            key = self.key(1)
+            value_start = self.pos
+            if key == 'sequences' and self.layout.close is None:
+                self.sequences()
+            else:
+                self.value()
+            self.layout.keys.append([key, start, value_start, self.pos])
+            more = self.more(0, '}')
+        if self.s[self.pos:].strip():
+            raise _LayoutError("Data after the Manifest")
+        if self.layout.close is None:
+            raise _LayoutError("No Canvases in a first Sequence")
+
+    def sequences(self):
+        """Scan the sequences property, recording the first Sequence's Canvases."""
+        self.expect('[')
+        self.expect(self.layout.ws(2) + '{')
+        more = not self.peek('}')
+        while more:
+            key = self.key(3)
+            if key == 'canvases' and self.layout.close is None:
+                self.canvases()
+            else:
+                self.value()
+            more = self.more(2, '}')
+        while self.more(1, ']'):
+            self.expect(self.layout.ws(2))
+            self.value()
+
+    def canvases(self):
+        """Scan the Canvases of the first Sequence."""
+        self.expect('[')
+        self.layout.close = self.pos
+        if self.peek(']'):
+            return
+        more = True
+        while more:
+            self.expect(self.layout.ws(4))
+            start = self.pos
+            cvs = self.value()
+            ident = cvs.get('@id') if isinstance(cvs, dict) else None
+            if not isinstance(ident, type('')):
+                raise _LayoutError("Canvas without an @id at %d" % start)
+            self.layout.canvases.append([start, self.pos])
+            # decoded as latin-1 for the offsets
+            self.layout.canvas_ids.append(ident.encode('latin-1').decode('utf-8'))
+            self.layout.close = self.pos
+            more = self.more(3, ']')
+
+
+def _ident(value):
+    """@id of a resource, RawResource or dict, as it is written."""
+    if isinstance(value, BaseMetadataObject):
+        bmap = value._factory.get_base_map()
+        return value.id if bmap is None else bmap.uri(value.id)
+    elif isinstance(value, RawResource):
+        return value.id
+    elif isinstance(value, dict):
+        return value.get('@id')
+    raise DataError("Expected a resource, RawResource or dict, got %r" % type(value))
+
+
+def _check_canvas(value):
+    """Raise DataError unless value is a Canvas."""
+    ident = _ident(value)
+    if isinstance(value, BaseMetadataObject):
+        typ = value._type
+    elif isinstance(value, RawResource):
+        typ = value.type
+    else:
+        typ = value.get('@type')
+    if typ != Canvas._type or not ident:
+        raise DataError("Expected a Canvas with an @id, got %s" % typ)
+
+
+class ManifestEditor(object):
+    """Edit the Manifest file at path in place, see the module documentation.
+
+    full_rewrites counts the edits that had to read and write the whole
+    file because it wasn't laid out as expected. After each edit the
+    compressed copies and sidecar are made again by precompressor, if
+    given, or else removed as out of date.
+    """
+
+    def __init__(self, path, precompressor=None):
+        """Initialize ManifestEditor."""
+        self.path = path
+        self.precompressor = precompressor
+        self.full_rewrites = 0
+        self._layout = None
+
+    def _stat(self):
+        """Size and modification time of the file."""
+        st = os.stat(self.path)
+        return (st.st_size, st.st_mtime)
+
+    def layout(self):
+        """_Layout of the file, or None if it isn't laid out as toFile() writes it."""
+        stat = self._stat()
+        if self._layout is not None and self._layout.stat == stat:
+            return self._layout
+        with io.open(self.path, 'rb') as fh:
+            data = fh.read()
+        if data.startswith(b'{"'):
+            layout = _Layout(True, '')
+        elif data.startswith(b'{\r\n'):
+            layout = _Layout(False, '\r\n')
+        else:
+            layout = _Layout(False, '\n')
+        try:
+            _Scanner(data.decode('latin-1'), layout).manifest()
+        except _LayoutError:
+            self._layout = None
+            return None
+        layout.stat = stat
+        self._layout = layout
+        return layout
+
+    def canvas_ids(self):
+        """List of the @ids of the Canvases of the first Sequence."""
+        layout = self.layout()
+        if layout is not None:
+            return list(layout.canvas_ids)
+        seqs = self._read().get('sequences') or [{}]
+        return [c.get('@id') for c in seqs[0].get('canvases', [])]
+
+    def canvas(self, ident):
+        """JSON of the Canvas with @id ident in the first Sequence."""
+        layout = self.layout()
+        if layout is None:
+            for c in (self._read().get('sequences') or [{}])[0].get('canvases', []):
+                if c.get('@id') == ident:
+                    return c
+            raise DataError("No Canvas %s in %s" % (ident, self.path))
+        try:
+            (start, end) = layout.canvases[layout.canvas_ids.index(ident)]
+        except ValueError:
+            raise DataError("No Canvas %s in %s" % (ident, self.path))
+        with io.open(self.path, 'rb') as fh:
+            fh.seek(start)
+            return json.loads(fh.read(end - start).decode('utf-8'))
+
+    def _text(self, value, level, layout):
+        """Serialization of value at level, as in the file."""
+        chunks = _iter_json(value, layout.compact, level)
+        if isinstance(value, BaseMetadataObject):
+            bmap = value._factory.get_base_map()
+            if bmap is not None:
+                chunks = [bmap.text(c) for c in chunks]
+        text = "".join(chunks)
+        if layout.newline == '\r\n':
+            text = text.replace('\n', '\r\n')
+        return text
+
+    def append_canvases(self, canvases):
+        """Add canvases (resources, RawResources or dicts) to the end of the first Sequence."""
+        canvases = list(canvases)
+        for c in canvases:
+            _check_canvas(c)
+        existing = set(self.canvas_ids())
+        for c in canvases:
+            ident = _ident(c)
+            if ident in existing:
+                raise DataError("Cannot have two Canvases with the same identity: %s" % ident)
+            existing.add(ident)
+        if not canvases:
+            return
+        layout = self.layout()
+        if layout is None:
+            return self._rewrite(lambda doc: self._first_sequence(doc).setdefault('canvases', []).extend(
+                [json.loads(self._text(c, 0, _Layout(True, ''))) for c in canvases]))
+        sep = ',' + layout.ws(4)
+        parts = []
+        spans = []
+        offset = 0
+        for (n, c) in enumerate(canvases):
+            text = (sep if n or layout.canvases else layout.ws(4)).encode('utf-8')
+            body = self._text(c, 4, layout).encode('utf-8')
+            spans.append([offset + len(text), offset + len(text) + len(body)])
+            parts.append(text + body)
+            offset += len(text) + len(body)
+        if not layout.canvases:
+            # into []
+            parts.append(layout.ws(3).encode('utf-8'))
+        data = b''.join(parts)
+
+        def fix(a):
+            layout.canvases.extend([[a + s, a + e] for (s, e) in spans])
+            layout.canvas_ids.extend([_ident(c) for c in canvases])
+            layout.close = a + offset
+        self._splice(layout, [(layout.close, layout.close, data, fix)])
+
+    def replace_canvas(self, canvas, ident=None):
+        """Replace the Canvas with @id ident, by default canvas's own, with canvas."""
+        _check_canvas(canvas)
+        if ident is None:
+            ident = _ident(canvas)
+        ids = self.canvas_ids()
+        if ident not in ids:
+            raise DataError("No Canvas %s in %s" % (ident, self.path))
+        new_id = _ident(canvas)
+        if new_id != ident and new_id in ids:
+            raise DataError("Cannot have two Canvases with the same identity: %s" % new_id)
+        layout = self.layout()
+        if layout is None:
+            def apply(doc):
+                cvses = self._first_sequence(doc)['canvases']
+                i = [c.get('@id') for c in cvses].index(ident)
+                cvses[i] = json.loads(self._text(canvas, 0, _Layout(True, '')))
+            return self._rewrite(apply)
+        i = layout.canvas_ids.index(ident)
+        (start, end) = layout.canvases[i]
+        data = self._text(canvas, 4, layout).encode('utf-8')
+
+        def fix(a):
+            layout.canvases[i] = [a, a + len(data)]
+            layout.canvas_ids[i] = new_id
+        self._splice(layout, [(start, end, data, fix)])
+
+    def update(self, props):
+        """Set top level properties from dict props, removing those set to None."""
+        for key in props:
+            if key in NOT_UPDATABLE:
+                raise DataError("Cannot update %s in place" % key)
+        layout = self.layout()
+        if layout is None:
+            def apply(doc):
+                for (key, value) in props.items():
+                    if value is None:
+                        doc.pop(key, None)
+                    else:
+                        doc[key] = json.loads(self._text(value, 0, _Layout(True, '')))
+            return self._rewrite(apply)
+        colon = ':' if layout.compact else ': '
+        sep = ',' + layout.ws(1)
+        edits = []
+        inserts = {}
+        by_key = dict([(entry[0], (n, entry)) for (n, entry) in enumerate(layout.keys)])
+        for (key, value) in props.items():
+            if key in by_key:
+                (n, entry) = by_key[key]
+                if value is None:
+                    if n == 0:
+                        raise DataError("Cannot remove the first property, %s" % key)
+                    edits.append((layout.keys[n - 1][3], entry[3], b'', self._remover(layout, entry)))
+                else:
+                    data = self._text(value, 1, layout).encode('utf-8')
+                    edits.append((entry[2], entry[3], data, self._replacer(entry, len(data))))
+            elif value is not None:
+                # after the last property that comes before it
+                rank = KEY_ORDER_HASH.get(key, 1000)
+                before = [e for e in layout.keys if KEY_ORDER_HASH.get(e[0], 1000) <= rank]
+                if not before:
+                    raise DataError("Cannot find where %s goes in %s" % (key, self.path))
+                inserts.setdefault(before[-1][3], []).append((rank, key, value))
+        for (p, items) in inserts.items():
+            (data, entries) = (b'', [])
+            for (rank, key, value) in sorted(items, key=lambda x: x[0]):
+                head = (sep + json.dumps(key) + colon).encode('utf-8')
+                body = self._text(value, 1, layout).encode('utf-8')
+                entries.append([key, len(data) + 1, len(data) + len(head),
+                                len(data) + len(head) + len(body)])
+                data += head + body
+            edits.append((p, p, data, self._inserter(layout, p, entries)))
+        if edits:
+            self._splice(layout, edits)
+
+    def _remover(self, layout, entry):
+        """Return the fix for an edit removing top level property entry."""
+        def fix(a):
+            layout.keys.remove(entry)
+        return fix
+
+    def _replacer(self, entry, size):
+        """Return the fix for an edit replacing the value of top level property entry."""
+        def fix(a):
+            (entry[2], entry[3]) = (a, a + size)
+        return fix
+
+    def _inserter(self, layout, p, entries):
+        """Return the fix for an edit adding top level properties entries at offset p."""
+        def fix(a):
+            # after the property ending at p, where shift() left it
+            n = [e[3] for e in layout.keys].index(a) + 1
+            layout.keys[n:n] = [[k, a + s, a + v, a + e] for (k, s, v, e) in entries]
+        return fix
+
+    def _splice(self, layout, edits):
+        """Write the file with byte ranges replaced, and update the layout.
+
+        edits is a list of (start, end, bytes, fix), which must not
+        overlap; fix(a) records the new offsets of the bytes, now at a.
+        """
+        edits.sort(key=lambda x: (x[0], x[1]))
+        tmp = "%s.%s.tmp" % (self.path, uuid.uuid4().hex)
+        try:
+            with io.open(self.path, 'rb') as src:
+                with io.open(tmp, 'wb') as dst:
+                    pos = 0
+                    for (a, b, data, fix) in edits:
+                        _copy_range(src, dst, pos, a)
+                        dst.write(data)
+                        pos = b
+                    src.seek(pos)
+                    shutil.copyfileobj(src, dst, 1 << 20)
+            _replace_file(tmp, self.path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self._layout = None
+            raise
+        # From the end, so each edit's offsets are as in the file it's applied to
+        for (a, b, data, fix) in reversed(edits):
+            layout.shift(a, b, len(data) - (b - a))
+            fix(a)
+        layout.stat = self._stat()
+        self._edited()
+
+    def _read(self):
+        """JSON of the whole file."""
+        with io.open(self.path, encoding='utf-8') as fh:
+            text = fh.read()
+        try:
+            return json.loads(text.lstrip('\ufeff'), object_pairs_hook=OrderedDict)
+        except ValueError as e:
+            raise DataError("Could not parse %s: %s" % (self.path, e))
+
+    def _first_sequence(self, doc):
+        """First Sequence of Manifest JSON doc, added if there isn't one."""
+        if not doc.get('sequences'):
+            doc['sequences'] = [{"@type": "sc:Sequence"}]
+        return doc['sequences'][0]
+
+    def _rewrite(self, apply):
+        """Read the file, apply(json) and write it in full, as toFile() would."""
+        with io.open(self.path, 'rb') as fh:
+            head = fh.read(3)
+        compact = not (head.startswith(b'{\n') or head == b'{\r\n')
+        doc = self._read()
+        apply(doc)
+        _write_chunks(self.path, _iter_json(_key_ordered(doc), compact, 0))
+        self.full_rewrites += 1
+        self._layout = None
+        self._edited()
+
+    def _edited(self):
+        """Update or remove the compressed copies of the file."""
+        if self.precompressor is not None:
+            self.precompressor.compress_file(self.path)
+        else:
+            remove_copies(self.path)
+
+
+def _copy_range(src, dst, start, end):
+    """Copy bytes start to end of file src to file dst."""
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = src.read(min(remaining, 1 << 20))
+        if not block:
+            raise DataError("File changed while being edited")
+        dst.write(block)
+        remaining -= len(block)
@@ -0,0 +1,454 @@
+"""Facet counts and filtering over the metadata of many Manifests.
+
+    index = FacetIndex()
+    index.add_files(glob.glob("manifests/*.json"), processes=4)
+    index.counts("metadata:Author", limit=10)
+    docs = index.select({"language": "fr"}, nav_from="1900-01-01", nav_to="1949-12-31")
+    coll = index.collection(factory, docs, ident="french-1900s", label="French, 1900-1949")
+
+Only the top level fields that are indexed are read from each Manifest,
+as JSON values, in one pass over the start of the file: nothing is read
+past its sequences, which this library writes after all of the
+descriptive properties (see KEY_ORDER), and no resource objects are
+made. The metadata label/value pairs, viewingHint and the languages of
+the label, metadata and description are kept as facets: for each, a
+table of the distinct values, the Manifests with each value, and each
+Manifest's values. navDate is kept as a column of seconds, sorted on
+demand for range queries.
+"""
+
+from __future__ import unicode_literals
+import calendar
+import codecs
+import io
+import json
+import multiprocessing
+import os
+import re
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+try:
+    # python2
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .factory import DataError, Manifest, RawResource, _replace_file
+from .util import STR_TYPES
+
+# The top level properties read
+FIELDS = ('@id', '@type', 'label', 'metadata', 'description', 'navDate', 'viewingHint')
+# Reading stops at these, as everything wanted comes before them in KEY_ORDER
+STOP_AT = ('sequences', 'structures', 'collections', 'manifests', 'members')
+CHUNK_SIZE = 1 << 16
+METADATA_PREFIX = "metadata:"
+
+NAV_DATE_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.\d+)?)?)?'
+                         r'\s*(Z|[+-]\d\d:?\d\d)?$')
+_WS_RE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class _Reader(object):
+    """Buffer over a file, read as more of it is needed."""
+
+    def __init__(self, fh, chunk_size):
+        """Initialize _Reader."""
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """Read more, at least doubling what's held; False at the end of the file."""
+        if self.eof:
+            return False
+        data = self.fh.read(max(self.chunk_size, len(self.buf) - self.pos))
+        # at the end when nothing is read, not when part of a character is
+        self.eof = not data
+        if isinstance(data, bytes):
+            try:
+                data = self.decode(data, self.eof)
+            except UnicodeDecodeError as e:
+                raise DataError("Invalid UTF-8: %s" % e)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def char(self):
+        """Next character other than whitespace, or '' at the end."""
+        while True:
+            self.pos = _WS_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.more():
+                return self.buf[self.pos:self.pos + 1]
+
+    def value(self):
+        """Parse the next JSON value."""
+        self.char()
+        while True:
+            try:
+                (value, end) = _decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer might go on
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError as e:
+                if self.eof:
+                    raise DataError("Invalid JSON: %s" % e)
+            self.more()
+
+
+def read_fields(source, fields=FIELDS, stop_at=STOP_AT, chunk_size=CHUNK_SIZE):
+    """Return dict of the top level fields of the JSON object in source.
+
+    source is a file name or a file object. Values are parsed only for
+    fields, others are skipped, and reading stops at any of stop_at, or
+    once all of fields have been found. Pass stop_at=() for documents
+    that may have the fields after their sequences, such as JSON written
+    with sorted keys.
+    """
+    if type(source) in STR_TYPES:
+        with io.open(source, 'rb') as fh:
+            return read_fields(fh, fields, stop_at, chunk_size)
+    reader = _Reader(source, chunk_size)
+    if reader.char() == '\ufeff':
+        reader.pos += 1
+    if reader.char() != '{':
+        raise DataError("Expected a JSON object")
+    reader.pos += 1
+    found = {}
+    if reader.char() == '}':
+        return found
+    while True:
+        key = reader.value()
+        if type(key) not in STR_TYPES or reader.char() != ':':
+            raise DataError("Invalid JSON object at character %d" % reader.pos)
+        reader.pos += 1
+        if key in stop_at:
+            break
+        value = reader.value()
+        if key in fields:
+            found[key] = value
+            if len(found) == len(fields):
+                break
+        c = reader.char()
+        reader.pos += 1
+        if c == '}':
+            break
+        elif c != ',':
+            raise DataError("Invalid JSON object at character %d" % reader.pos)
+    return found
+
+
+def nav_date_seconds(value):
+    """Seconds since 1970 (UTC) of a navDate string, datetime or date; None if invalid."""
+    if hasattr(value, 'utctimetuple'):
+        return float(calendar.timegm(value.utctimetuple()))
+    elif hasattr(value, 'timetuple'):
+        return float(calendar.timegm(value.timetuple()))
+    elif type(value) not in STR_TYPES:
+        return None
+    m = NAV_DATE_RE.match(value.strip())
+    if not m:
+        return None
+    (y, mo, d, h, mi, s, tz) = m.groups()
+    try:
+        secs = calendar.timegm((int(y), int(mo), int(d), int(h or 0), int(mi or 0), int(s or 0), 0, 0, 0))
+    except ValueError:
+        return None
+    if tz and tz != 'Z':
+        offset = int(tz[1:3]) * 3600 + int(tz[-2:]) * 60
+        secs -= offset if tz[0] == '+' else -offset
+    return float(secs)
+
+
+def _strings(value, languages):
+    """List of the strings of JSON-LD value, adding its languages to the set languages."""
+    if type(value) == list:
+        found = []
+        for v in value:
+            found.extend(_strings(v, languages))
+        return found
+    elif isinstance(value, dict):
+        if value.get('@language'):
+            languages.add(value['@language'])
+        value = value.get('@value')
+    if type(value) in STR_TYPES:
+        value = value.strip()
+        return [value] if value else []
+    elif value is not None and not isinstance(value, (dict, list)):
+        return ["%s" % value]
+    return []
+
+
+def manifest_facets(fields):
+    """Return (@id, label, navDate seconds or None, dict of facet to values).
+
+    fields is a dict from read_fields() or the JSON of a Manifest.
+    Metadata facets are named METADATA_PREFIX and the pair's label.
+    """
+    if fields.get('@type', Manifest._type) != Manifest._type:
+        raise DataError("Expected a Manifest, got %s" % fields.get('@type'))
+    ident = fields.get('@id')
+    if type(ident) not in STR_TYPES:
+        raise DataError("Manifest has no @id")
+    languages = set()
+    facets = OrderedDict()
+    _strings(fields.get('label'), languages)
+    _strings(fields.get('description'), languages)
+    metadata = fields.get('metadata') or []
+    if isinstance(metadata, dict):
+        metadata = [metadata]
+    for pair in metadata:
+        if not isinstance(pair, dict):
+            continue
+        labels = _strings(pair.get('label'), languages)
+        values = _strings(pair.get('value'), languages)
+        if labels and values:
+            facets.setdefault(METADATA_PREFIX + labels[0], []).extend(values)
+    hints = fields.get('viewingHint')
+    if hints:
+        facets['viewingHint'] = [hints] if type(hints) in STR_TYPES else list(hints)
+    if languages:
+        facets['language'] = sorted(languages)
+    return (ident, fields.get('label', ''), nav_date_seconds(fields.get('navDate')), facets)
+
+
+def _read_file(args):
+    """(fn, fields, error) for read_fields() in a pool worker."""
+    (fn, stop_at) = args
+    try:
+        return (fn, read_fields(fn, stop_at=stop_at), None)
+    except (DataError, IOError, OSError) as e:
+        return (fn, None, "%s: %s" % (fn, e))
+
+
+class _Facet(object):
+    """Values of one facet, with the Manifests having each, and each Manifest's values.
+
+    The values of the Manifests in docs (ascending) are, as codes into
+    values, doc_codes[offsets[i]:offsets[i + 1]] for docs[i].
+    """
+
+    def __init__(self):
+        """Initialize _Facet."""
+        self.values = []
+        self.codes = {}
+        self.postings = []
+        self.docs = array('I')
+        self.offsets = array('I', [0])
+        self.doc_codes = array('I')
+
+    def add(self, doc, values):
+        """Add the values of Manifest number doc."""
+        added = set()
+        for value in values:
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+                self.postings.append(array('I'))
+            if code not in added:
+                added.add(code)
+                self.postings[code].append(doc)
+                self.doc_codes.append(code)
+        self.docs.append(doc)
+        self.offsets.append(len(self.doc_codes))
+
+    def count(self, docs=None):
+        """Dict of value code to number of Manifests, of docs (sorted) if given."""
+        if docs is None:
+            return dict((code, len(p)) for (code, p) in enumerate(self.postings))
+        counts = {}
+        if len(docs) < len(self.doc_codes):
+            # look up each Manifest's values
+            for doc in docs:
+                i = bisect_left(self.docs, doc)
+                if i < len(self.docs) and self.docs[i] == doc:
+                    for code in self.doc_codes[self.offsets[i]:self.offsets[i + 1]]:
+                        counts[code] = counts.get(code, 0) + 1
+        else:
+            wanted = set(docs)
+            for (code, p) in enumerate(self.postings):
+                n = sum(1 for doc in p if doc in wanted)
+                if n:
+                    counts[code] = n
+        return counts
+
+
+class FacetIndex(object):
+    """Columns of the ids, labels, facets and navDates of Manifests.
+
+    Manifests are numbered in the order they are added, and sets of them
+    are given as sorted lists of those numbers.
+    """
+
+    def __init__(self):
+        """Initialize FacetIndex."""
+        self.ids = []
+        self.labels = []
+        self.nav = array('d')
+        self.facets = {}
+        self.failed = []
+        self._nav_order = None
+
+    def __len__(self):
+        """Number of Manifests."""
+        return len(self.ids)
+
+    def add(self, fields):
+        """Add the Manifest with fields (see manifest_facets()), returning its number."""
+        (ident, label, nav, facets) = manifest_facets(fields)
+        doc = len(self.ids)
+        self.ids.append(ident)
+        self.labels.append(label)
+        self.nav.append(float('nan') if nav is None else nav)
+        for (name, values) in facets.items():
+            facet = self.facets.get(name)
+            if facet is None:
+                facet = self.facets[name] = _Facet()
+            facet.add(doc, values)
+        self._nav_order = None
+        return doc
+
+    def add_file(self, fn, stop_at=STOP_AT):
+        """Add the Manifest in file fn, returning its number."""
+        return self.add(read_fields(fn, stop_at=stop_at))
+
+    def add_files(self, fns, processes=0, stop_at=STOP_AT):
+        """Add the Manifests in files fns, in order, reading them in processes processes.
+
+        processes is None for one per CPU, or 0 to read them in this
+        process. Files that can't be read, or aren't Manifests, are listed
+        in failed with the reason. Returns the number added.
+        """
+        jobs = [(fn, stop_at) for fn in fns]
+        before = len(self)
+        if processes == 0:
+            results = (_read_file(job) for job in jobs)
+            self._add_results(results)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                self._add_results(pool.imap(_read_file, jobs, 64))
+            finally:
+                pool.close()
+                pool.join()
+        return len(self) - before
+
+    def _add_results(self, results):
+        """Add the fields read by _read_file()."""
+        for (fn, fields, error) in results:
+            if error is None:
+                try:
+                    self.add(fields)
+                    continue
+                except DataError as e:
+                    error = "%s: %s" % (fn, e)
+            self.failed.append(error)
+
+    def fields(self):
+        """Sorted names of the facets."""
+        return sorted(self.facets)
+
+    def counts(self, field, docs=None, limit=None):
+        """List of (value, number of Manifests) of facet field, most first.
+
+        Only the Manifests in docs are counted, if given.
+        """
+        facet = self.facets.get(field)
+        if facet is None:
+            return []
+        counts = facet.count(docs)
+        found = sorted([(facet.values[code], n) for (code, n) in counts.items() if n],
+                       key=lambda x: (-x[1], x[0]))
+        return found[:limit] if limit is not None else found
+
+    def nav_range(self, start=None, end=None):
+        """Sorted numbers of the Manifests with a navDate from start to end, inclusive.
+
+        start and end are navDate strings, datetimes or dates, or None
+        for no limit.
+        """
+        if self._nav_order is None:
+            pairs = sorted([(t, doc) for (doc, t) in enumerate(self.nav) if t == t])
+            self._nav_order = ([t for (t, doc) in pairs], [doc for (t, doc) in pairs])
+        (times, docs) = self._nav_order
+        lo = 0
+        hi = len(times)
+        for (value, which) in [(start, 'start'), (end, 'end')]:
+            if value is None:
+                continue
+            secs = nav_date_seconds(value)
+            if secs is None:
+                raise DataError("Invalid navDate %s: %r" % (which, value))
+            if which == 'start':
+                lo = bisect_left(times, secs)
+            else:
+                hi = bisect_right(times, secs)
+        return sorted(docs[lo:hi])
+
+    def select(self, filters=None, nav_from=None, nav_to=None):
+        """Sorted numbers of the Manifests matching filters and in the navDate range.
+
+        filters is a dict of facet name to a value, or a list of values
+        any of which may match; all of the facets must match.
+        """
+        found = None
+        for (field, values) in (filters or {}).items():
+            if type(values) in STR_TYPES:
+                values = [values]
+            facet = self.facets.get(field)
+            docs = set()
+            if facet is not None:
+                for value in values:
+                    code = facet.codes.get(value)
+                    if code is not None:
+                        docs.update(facet.postings[code])
+            found = docs if found is None else found & docs
+        if nav_from is not None or nav_to is not None:
+            docs = self.nav_range(nav_from, nav_to)
+            found = set(docs) if found is None else found.intersection(docs)
+        if found is None:
+            return list(range(len(self)))
+        return sorted(found)
+
+    def collection(self, factory, docs, ident="", label=""):
+        """Make a Collection of references to the Manifests numbered docs."""
+        coll = factory.collection(ident=ident, label=label)
+        for doc in docs:
+            ref = OrderedDict([('@id', self.ids[doc]), ('@type', Manifest._type)])
+            if self.labels[doc]:
+                ref['label'] = self.labels[doc]
+            coll.add_manifest(RawResource(ref))
+        return coll
+
+    def save(self, path):
+        """Write the index to file path."""
+        tmp = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        state = (self.ids, self.labels, self.nav, self.facets)
+        try:
+            with io.open(tmp, 'wb') as fh:
+                pickle.dump(state, fh, 2)
+            _replace_file(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()."""
+        with io.open(path, 'rb') as fh:
+            try:
+                (ids, labels, nav, facets) = pickle.load(fh)
+            except Exception as e:
+                raise DataError("Not a facet index: %s (%s)" % (path, e))
+        index = cls()
+        (index.ids, index.labels, index.nav, index.facets) = (ids, labels, nav, facets)
+        return index
@@ -1,35 +1,54 @@
 """IIIF Presentation API Manifest Factory."""
 
 from __future__ import unicode_literals
+import contextlib
+import io
 import json
 import os
+import re
 import sys
 import subprocess
+import threading
+import uuid
 from collections import OrderedDict
 
-from .util import is_http_uri, STR_TYPES
+from .util import is_http_uri, STR_TYPES, optional_import
 
-try:
-    # python3
-    from urllib.request import urlopen
-    from urllib.request import Request
-except ImportError:
-    # fall back to python2
-    from urllib2 import urlopen
-    from urllib2 import Request
 
-try:
-    from PIL import Image as pil_image
-except:
-    try:
-        import Image as pil_image
-    except:
-        pil_image = None
+# Optional and slow to import dependencies are only loaded on first use
+
+
+def get_pil_image():
+    """Return the PIL Image module, or None if PIL is not available."""
+    return optional_import('PIL.Image', 'Image')
+
+
+def get_etree():
+    """Return lxml.etree, or None if lxml is not available."""
+    return optional_import('lxml.etree')
+
+
+def get_urllib():
+    """Return module with urlopen and Request (urllib.request or urllib2)."""
+    return optional_import('urllib.request', 'urllib2')
 
-try:
-    from lxml import etree
-except:
-    etree = None
+
+_identify = []
+
+
+def find_identify():
+    """Return the path of ImageMagick's identify, or "" if not found.
+
+    Only looked for once per process.
+    """
+    if not _identify:
+        try:
+            path = subprocess.check_output('which identify', shell=True).strip()
+        except:
+            # No ImageMagick or not unix
+            path = ""
+        _identify.append(path)
+    return _identify[0]
 
 
 class PresentationError(Exception):
@@ -73,6 +92,133 @@ class DataError(MetadataError):
     pass
 
 
+class PresentationWarning(object):
+    """Structured warning about a resource.
+
+    The message is kept as a template plus arguments and is only
+    formatted when it is asked for.
+    """
+
+    __slots__ = ('code', 'resource_type', 'ident', 'template', 'args')
+
+    def __init__(self, code, resource_type, ident, template, args=()):
+        """Initialize PresentationWarning."""
+        self.code = code
+        self.resource_type = resource_type
+        self.ident = ident
+        self.template = template
+        self.args = args
+
+    @property
+    def message(self):
+        """Formatted warning message."""
+        if self.args:
+            return self.template % self.args
+        return self.template
+
+    def key(self):
+        """Key used to detect duplicate warnings."""
+        args = self.args
+        try:
+            hash(args)
+        except TypeError:
+            args = repr(args)
+        return (self.code, self.resource_type, self.ident, self.template, args)
+
+    def __str__(self):
+        """Log line form of the warning."""
+        return "WARNING: " + self.message
+
+    def __repr__(self):
+        """Representation of the warning."""
+        return "PresentationWarning(%r, %r, %r, %r)" % (
+            self.code, self.resource_type, self.ident, self.message)
+
+
+class WarningCollector(object):
+    """Bounded in-memory collection of PresentationWarnings.
+
+    Identical warnings are only kept once, at most max_per_code pending
+    warnings are kept for each code and at most max_records pending in
+    total. Anything beyond that is counted in suppressed rather than
+    stored. The limits, and which warnings count as identical, start
+    again when the pending warnings are drained, so serializing the same
+    resource twice reports its warnings twice.
+    """
+
+    def __init__(self, max_records=1000, max_per_code=100):
+        """Initialize WarningCollector."""
+        self._lock = threading.Lock()
+        self.max_records = max_records
+        self.max_per_code = max_per_code
+        self.suppressed = 0
+        self._pending = []
+        self._kept = 0
+        self._seen = set()
+        self._per_code = {}
+
+    def add(self, warning):
+        """Add warning, return True if it was kept."""
+        key = warning.key()
+        with self._lock:
+            if key in self._seen:
+                return False
+            count = self._per_code.get(warning.code, 0)
+            if count >= self.max_per_code or self._kept >= self.max_records:
+                self.suppressed += 1
+                return False
+            self._per_code[warning.code] = count + 1
+            if len(self._seen) >= self.max_records * 10:
+                # only remember so many, so may repeat an old one
+                self._seen = set()
+            self._seen.add(key)
+            self._kept += 1
+            self._pending.append(warning)
+            return True
+
+    def records(self, code=None):
+        """List of pending warnings, optionally only those with code."""
+        if code is None:
+            return list(self._pending)
+        return [w for w in self._pending if w.code == code]
+
+    def messages(self):
+        """List of formatted log lines for the pending warnings."""
+        return [str(w) for w in self._pending]
+
+    def drain(self):
+        """Return and forget the pending warnings.
+
+        The limits then apply to the warnings added afterwards, and
+        warnings identical to those drained are kept again; clear() also
+        resets suppressed.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._kept = 0
+            self._seen = set()
+            self._per_code = {}
+        return pending
+
+    def clear(self):
+        """Forget all warnings, counts and limits."""
+        with self._lock:
+            self.suppressed = 0
+            self._pending = []
+            self._kept = 0
+            self._seen = set()
+            self._per_code = {}
+
+    def __len__(self):
+        """Number of pending warnings."""
+        return len(self._pending)
+
+    def __iter__(self):
+        """Iterate over pending warnings."""
+        return iter(list(self._pending))
+
+
 COLL_VIEWINGHINTS = ['individuals', 'multi-part']
 MAN_VIEWINGHINTS = ['individuals', 'paged', 'continuous']
 SEQ_VIEWINGHINTS = ['individuals', 'paged', 'continuous']
@@ -82,6 +228,12 @@ RNG_VIEWINGHINTS = ['top', 'individuals', 'paged', 'continuous']
 VIEWINGDIRS = ['left-to-right', 'right-to-left',
                'top-to-bottom', 'bottom-to-top']
 
+# Image API version in a service's context, and level in its profile
+IMAGE_CONTEXT_RE = re.compile(r'(?:iiif\.io/api/image/|image-api/)(\d)')
+LEVEL_RE = re.compile(r'level(\d)')
+# Longest side of a thumbnail, if no size is asked for
+THUMBNAIL_SIZE = 100
+
 BAD_HTML_TAGS = ['script', 'style', 'object', 'form', 'input']
 GOOD_HTML_TAGS = ['a', 'b', 'br', 'i', 'img', 'p', 'span']
 
@@ -91,21 +243,57 @@ KEY_ORDER = ["@context", "@id", "@type", "@value", "@language", "label", "value"
              "viewingDirection", "viewingHint", "navDate",
              "profile", "seeAlso", "search", "formats", "qualities", "supports",
                          "scale_factors", "scaleFactors", "tile_width", "tile_height", "tiles", "sizes",
-             "within", "motivation", "stylesheet", "resource", "contentLayer",
+             "within", "total", "first", "last", "startIndex", "prev", "next", "motivation", "stylesheet", "resource", "contentLayer",
              "on", "default", "item", "style", "full", "selector", "chars", "language",
              "sequences", "structures", "canvases", "resources", "images", "otherContent"]
 
 KEY_ORDER_HASH = dict([(KEY_ORDER[x], x) for x in range(len(KEY_ORDER))])
 
-PROPS_21 = ["rendering", "navDate", "members", "contentLayer"]
+PROPS_21 = ["rendering", "navDate", "members", "contentLayer",
+            "total", "first", "last", "startIndex", "prev", "next"]
 HINTS_21 = ["multi-part", "facing-pages"]
 
 
+# Factory attributes that are not configuration
+FACTORY_STATE = ['log_stream', '_warnings', '_local', 'store', '_whichid']
+LOG_STREAMS = {'stdout': sys.stdout, 'stderr': sys.stderr}
+
+# Factories made by factory_from_config(), by configuration
+_factories = {}
+
+
+def factory_from_config(config):
+    """Return a ManifestFactory with config, from ManifestFactory.get_config().
+
+    The same factory is returned for the same config within a process,
+    so resources unpickled from a pool worker share one factory.
+    """
+    key = json.dumps(config, sort_keys=True)
+    fac = _factories.get(key)
+    if fac is None or fac.get_config() != config:
+        fac = ManifestFactory()
+        for (k, v) in config.items():
+            if k == 'log_stream':
+                v = LOG_STREAMS.get(v)
+            setattr(fac, k, v)
+        _factories[key] = fac
+    return fac
+
+
 class ManifestFactory(object):
-    """Factory class for IIIF Presentation API resources."""
+    """Factory class for IIIF Presentation API resources.
+
+    A configured factory can be shared between threads which each build
+    and serialize their own resources; use collect_warnings() to keep
+    each thread's warnings apart. Don't change the configuration (bases,
+    debug level, log_stream) while it is shared. A factory with a
+    ResourceStore should only be used from one thread.
+    """
 
     prezi_base = ""
     prezi_dir = ""
+    base_map = {}
+    precompress = None
 
     def __init__(self, version="2.1", mdbase="", imgbase="", mddir="", lang="en"):
         """Initialize ManifestFactory.
@@ -151,25 +339,70 @@ class ManifestFactory(object):
 
         self.debug_level = "warn"
         self.log_stream = sys.stdout
-
-        # Try to find ImageMagick's identify
-        try:
-            self.whichid = subprocess.check_output(
-                'which identify', shell=True).strip()
-        except:
-            # No ImageMagick or not unix
-            self.whichid = ""
+        self._local = threading.local()
+        self.warnings = WarningCollector()
+        self.store = None
+        # Path of ImageMagick's identify, looked up when first needed
+        self._whichid = None
+
+    @property
+    def whichid(self):
+        """Path of ImageMagick's identify, or "" if it isn't available."""
+        if self._whichid is None:
+            self._whichid = find_identify()
+        return self._whichid
+
+    @whichid.setter
+    def whichid(self, path):
+        self._whichid = path
 
     def set_debug_stream(self, strm):
         """Set debug level."""
         self.log_stream = strm
 
+    def get_config(self):
+        """Return the configuration of this factory as a dict of strings and booleans.
+
+        Can be passed to another process to make an equivalent factory
+        with factory_from_config(). Warnings, the resource store and any
+        log stream other than stdout or stderr are not part of it.
+        """
+        config = dict([(k, v) for (k, v) in self.__dict__.items() if k not in FACTORY_STATE])
+        config['log_stream'] = None
+        for (name, strm) in LOG_STREAMS.items():
+            if self.log_stream is strm:
+                config['log_stream'] = name
+        return config
+
+    def __reduce__(self):
+        """Pickle as configuration, unpickled with factory_from_config()."""
+        return (factory_from_config, (self.get_config(),))
+
+    def set_resource_store(self, store):
+        """Keep Manifests and Canvases in store, a store.ResourceStore, rather than all in memory."""
+        if store is not None:
+            if store.factory is not None and store.factory is not self:
+                raise ConfigurationError("ResourceStore is already used by another factory")
+            store.factory = self
+        self.store = store
+
+    def _stored(self, resource):
+        """Return resource, or its proxy if there is a resource store."""
+        if self.store is None:
+            return resource
+        return self.store.add(resource)
+
     def set_debug(self, typ):
         """Set behavior on errors and warnings.
 
         error = squash warnings
         warn = display warnings
         error_on_warning = raise exception for a warning rather than continuing
+
+        With warn, warnings are collected in self.warnings and written to
+        log_stream when a top level toJSON(), toString(), iterString() or
+        toFile() finishes, including any from building the resources
+        since the last one.
         """
         if typ in ['error', 'warn', 'error_on_warning']:
             self.debug_level = typ
@@ -177,17 +410,75 @@ class ManifestFactory(object):
             raise ConfigurationError(
                 "Only levels are 'error', 'warn' and 'error_on_warning'")
 
-    def maybe_warn(self, msg):
-        """warn method that respects debug_level property."""
+    @property
+    def warnings(self):
+        """WarningCollector for warnings on this thread, see collect_warnings()."""
+        collector = getattr(self._local, 'collector', None)
+        if collector is not None:
+            return collector
+        return self._warnings
+
+    @warnings.setter
+    def warnings(self, collector):
+        self._warnings = collector
+
+    @contextlib.contextmanager
+    def collect_warnings(self, collector=None):
+        """Collect the warnings from this thread in a separate WarningCollector.
+
+        For use where several threads share a factory:
+
+            with fac.collect_warnings() as warnings:
+                mfst.toJSON(top=True)
+            records = warnings.records()
+
+        Warnings collected this way are not written to log_stream.
+        """
+        if collector is None:
+            collector = WarningCollector()
+        previous = getattr(self._local, 'collector', None)
+        self._local.collector = collector
+        try:
+            yield collector
+        finally:
+            self._local.collector = previous
+
+    def maybe_warn(self, msg, args=(), code="warning", resource=None):
+        """warn method that respects debug_level property.
+
+        Warnings are collected in self.warnings and only written to
+        log_stream by flush_warnings(). msg may be a template for args,
+        in which case it is only formatted if the warning is used.
+        """
         if self.debug_level == "warn":
-            self.log_stream.write(msg + "\n")
+            if resource is not None:
+                rtype = resource._type
+                ident = getattr(resource, 'id', '')
+            else:
+                rtype = ident = ""
+            self.warnings.add(PresentationWarning(code, rtype, ident, msg, args))
+        elif self.debug_level == "error_on_warning":
+            # We don't know the type, just raise a MetadataError
+            raise MetadataError(
+                str(PresentationWarning(code, "", "", msg, args)))
+
+    def flush_warnings(self):
+        """Write pending warnings to log_stream in one go.
+
+        Returns the list of warnings written. Nothing is written, and the
+        warnings stay pending, if log_stream is None.
+        """
+        if self.log_stream is None or getattr(self._local, 'collector', None) is not None:
+            return []
+        pending = self.warnings.drain()
+        if pending:
+            self.log_stream.write(
+                "".join([str(w) + "\n" for w in pending]))
             try:
                 self.log_stream.flush()
             except:
                 pass
-        elif self.debug_level == "error_on_warning":
-            # We don't know the type, just raise a MetadataError
-            raise MetadataError(msg)
+        return pending
 
     def assert_base_prezi_uri(self):
         """Check base metadata URI is set."""
@@ -239,6 +530,77 @@ class ManifestFactory(object):
         """Set image auth token."""
         self.image_auth_token = token
 
+    def set_base_map(self, mapping):
+        """Set base URIs to write in place of others when serializing.
+
+        mapping is a dict of base URI, such as prezi_base, to the base URI
+        to write instead. Identifiers are kept under the factory's bases,
+        and every URI under a base in mapping is rewritten as the top level
+        resource is serialized by toJSON(top=True), toString(),
+        iterString() or toFile().
+        """
+        for (old, new) in mapping.items():
+            if not old or type(new) not in STR_TYPES:
+                raise ValueError("Must map base URIs to base URIs, got %r: %r" % (old, new))
+        self.base_map = dict(mapping)
+
+    @contextlib.contextmanager
+    def rebased(self, mapping):
+        """Serialize with base URI mapping, on this thread, in place of base_map.
+
+        For writing the same resources for several hosts:
+
+            for (dr, base) in hosts:
+                fac.set_base_prezi_dir(dr)
+                with fac.rebased({fac.prezi_base: base}):
+                    mfst.toFile()
+        """
+        previous = getattr(self._local, 'base_map', None)
+        self._local.base_map = mapping
+        try:
+            yield
+        finally:
+            self._local.base_map = previous
+
+    def get_base_map(self):
+        """Return the BaseMap to serialize with on this thread, or None."""
+        mapping = getattr(self._local, 'base_map', None)
+        if mapping is None:
+            mapping = self.base_map
+        if not mapping:
+            return None
+        key = tuple(sorted(mapping.items()))
+        bmap = _base_maps.get(key)
+        if bmap is None:
+            bmap = _base_maps[key] = BaseMap(mapping)
+        return bmap
+
+    def set_precompress(self, formats=None, levels=None, threads=0):
+        r"""Write compressed copies and an ETag sidecar with each file.
+
+        formats is a list of 'gz' and 'br', by default those available, or
+        empty to stop. levels and threads are as for Precompressor in
+        iiif_prezi.compress. Files are then written exactly as UTF-8, with
+        newlines as \n on every platform.
+        """
+        if formats is not None and not formats:
+            self.precompress = None
+            return
+        from .compress import Precompressor
+        pre = Precompressor(formats, levels, threads)
+        self.precompress = {'formats': pre.formats, 'levels': pre.levels, 'threads': threads}
+
+    def get_precompressor(self):
+        """Return the Precompressor for writing files, or None."""
+        if not self.precompress:
+            return None
+        key = json.dumps(self.precompress, sort_keys=True)
+        pre = _precompressors.get(key)
+        if pre is None:
+            from .compress import Precompressor
+            pre = _precompressors[key] = Precompressor(**self.precompress)
+        return pre
+
     def set_base_image_uri(self, uri):
         """Set base URI for images.
 
@@ -251,6 +613,13 @@ class ManifestFactory(object):
             uri = uri[:-1]
         self.default_base_image_uri = uri
 
+    def set_image_api_dir(self, dr):
+        """Set directory to write static Image API files (tiles) to."""
+        if not dr:
+            raise ValueError(
+                "Must provide a directory name to set the Image API directory to")
+        self.default_image_api_dir = dr
+
     def set_iiif_image_info(self, version="2.0", lvl="1"):
         """Set IIIF Image API profile and compliance."""
         version = str(version)
@@ -285,7 +654,7 @@ class ManifestFactory(object):
         """Create a Manifest."""
         if not is_http_uri(ident):
             self.assert_base_prezi_uri()
-        return Manifest(self, ident, label, mdhash)
+        return self._stored(Manifest(self, ident, label, mdhash))
 
     def sequence(self, ident="", label="", mdhash={}):
         """Create a Sequence."""
@@ -300,7 +669,7 @@ class ManifestFactory(object):
                 "Canvases must have a real identity (Canvas['@id'] cannot be empty)")
         elif not is_http_uri(ident):
             self.assert_base_prezi_uri()
-        return Canvas(self, ident, label, mdhash)
+        return self._stored(Canvas(self, ident, label, mdhash))
 
     def annotation(self, ident="", label="", mdhash={}):
         """Create an Annotation."""
@@ -339,6 +708,10 @@ class ManifestFactory(object):
         """Create a SpecificResource."""
         return SpecificResource(self, full)
 
+    def rawResource(self, data):
+        """Create a RawResource for pre-serialized JSON (dict or bytes)."""
+        return RawResource(data)
+
     def text(self, txt="", ident="", language="", format=""):
         """Create either a local Text or an ExternalText."""
         if ident:
@@ -363,6 +736,10 @@ class ManifestFactory(object):
 # Cannot have type --> dc:type, for example
 
 
+# Shared tuples of attribute names for BaseMetadataObject.__getstate__
+_state_names = {}
+
+
 class BaseMetadataObject(object):
     """Base class for metadata resources."""
 
@@ -378,15 +755,7 @@ class BaseMetadataObject(object):
     def __init__(self, factory, ident="", label="", mdhash={}, **kw):
         """Initialize BaseMetadataObject."""
         self._factory = factory
-        if ident:
-            if is_http_uri(ident):
-                self.id = ident
-            else:
-                self.id = factory.prezi_base + self.__class__._uri_segment + ident
-                if not self.id.endswith('.json'):
-                    self.id += '.json'
-        else:
-            self.id = ""
+        self.id = self._make_id(factory, ident)
         self.type = self.__class__._type
         self.label = ""
         if label:
@@ -405,6 +774,51 @@ class BaseMetadataObject(object):
         self.within = ""
         self.related = ""
 
+    def __getstate__(self):
+        """Compact state for pickling.
+
+        The factory (which pickles as its configuration), the values that
+        are set, and the names of the empty string and list attributes.
+        """
+        values = {}
+        strings = []
+        lists = []
+        for (k, v) in self.__dict__.items():
+            if type(v) in STR_TYPES and not v:
+                strings.append(k)
+            elif type(v) is list and not v:
+                lists.append(k)
+            elif k != '_factory':
+                values[k] = v
+        # Share the tuples, so pickle only writes each combination once
+        strings = _state_names.setdefault(tuple(strings), tuple(strings))
+        lists = _state_names.setdefault(tuple(lists), tuple(lists))
+        return (self.__dict__.get('_factory'), values, strings, lists)
+
+    def __setstate__(self, state):
+        """Restore from __getstate__()."""
+        (factory, values, strings, lists) = state
+        d = self.__dict__
+        if factory is not None:
+            d['_factory'] = factory
+        d.update(values)
+        for k in strings:
+            d[k] = ""
+        for k in lists:
+            d[k] = []
+
+    @classmethod
+    def _make_id(cls, factory, ident):
+        """Full URI for ident, relative to the factory's base URI."""
+        if not ident:
+            return ""
+        elif is_http_uri(ident):
+            return ident
+        myid = factory.prezi_base + cls._uri_segment + ident
+        if not myid.endswith('.json'):
+            myid += '.json'
+        return myid
+
     def __setattr__(self, which, value):
         """Attribute setting magic for error checking and resource/literal handling."""
         try:
@@ -419,7 +833,8 @@ class BaseMetadataObject(object):
               which not in self._extra_properties and
               which not in self._structure_properties.keys()):
             self.maybe_warn(
-                "Setting non-standard field '%s' on resource of type '%s'" % (which, self._type))
+                "Setting non-standard field '%s' on resource of type '%s'", (which, self._type),
+                code="non-standard-field")
         elif (which[0] != '_' and
               type(value) not in types and
               which not in self._integer_properties and
@@ -446,10 +861,9 @@ class BaseMetadataObject(object):
         else:
             object.__setattr__(self, which, value)
 
-    def maybe_warn(self, msg):
+    def maybe_warn(self, msg, args=(), code="warning"):
         """warn that respects debug settings."""
-        msg = "WARNING: " + msg
-        self._factory.maybe_warn(msg)
+        self._factory.maybe_warn(msg, args, code, self)
 
     def test_object(self, data):
         """True if data is an object (resource or URI)."""
@@ -475,6 +889,7 @@ class BaseMetadataObject(object):
 
     def test_html(self, data):
         """Raise DataError unless data is good IIIF subset HTML."""
+        etree = get_etree()
         if etree:
             try:
                 dom = etree.HTML(data)
@@ -503,7 +918,8 @@ class BaseMetadataObject(object):
                             "Attributes not allowed on %s tag" % (elm.tag), self)
                     if elm.tag not in GOOD_HTML_TAGS:
                         self.maybe_warn(
-                            "Risky HTML tag '%s' in '%s'" % (elm.tag, data))
+                            "Risky HTML tag '%s' in '%s'", (elm.tag, data),
+                            code="risky-html")
                 # Cannot keep CDATA sections separate from text when parsing in
                 # LXML :(
 
@@ -633,8 +1049,7 @@ class BaseMetadataObject(object):
         if not current:
             object.__setattr__(self, which, value)
         elif type(current) == list:
-            new = current.append(value)
-            object.__setattr__(self, which, new)
+            object.__setattr__(self, which, current + [value])
         else:
             new = [current, value]
             object.__setattr__(self, which, new)
@@ -646,18 +1061,48 @@ class BaseMetadataObject(object):
         return svc
 
     def get_thumbnail(self, width=0, height=0, square=False):
-        """Check self for thumbnail."""
-        if this.thumbnail:
-            # Check if we have a IIIF Service and want width/height/square
-            # XXX Finish Me
-            if type(this.thumbnail) == list:
-                pass
-            return this.thumbnail
-        else:
+        """Return thumbnail for this resource, or None if there isn't one.
+
+        Without width, height or square, the thumbnail that is set is
+        returned as is. Otherwise, or if none is set, an Image is made
+        from the IIIF Image service of the thumbnail, or of this
+        resource's first image, for that size: one of the service's sizes
+        if it lists any, else a size and region made for the request.
+        No requests are made to the service.
+        """
+        thumb = self.thumbnail
+        if type(thumb) == list:
+            thumb = thumb[0] if thumb else ""
+        wanted = width or height or square
+        if thumb and (not wanted or not isinstance(thumb, Image)):
+            return thumb
+        image = thumb or _thumbnail_source(self)
+        if image is None:
             return None
+        info = _service_info(image.service, self._factory)
+        if info is None:
+            return image if thumb or isinstance(self, Image) else None
+        (url, w, h) = _image_request(info, width, height, square, image.width, image.height)
+        return _thumbnail_image(self._factory, url, w, h, image.service)
 
     def toJSON(self, top=False):
         """Serialize as JSON."""
+        d = self._flatten(top)
+        self._serialize_structures(d)
+        d = _key_ordered(d)
+        if top:
+            self._factory.flush_warnings()
+            bmap = self._factory.get_base_map()
+            if bmap is not None:
+                d = bmap.json(d)
+        return d
+
+    def _flatten(self, top=False):
+        """Check this resource and return dict of its set properties.
+
+        Structure properties still hold the resources themselves and are
+        serialized by _serialize_structures().
+        """
         d = self.__dict__.copy()
         if 'id' in d and d['id']:
             d['@id'] = d['id']
@@ -682,9 +1127,9 @@ class BaseMetadataObject(object):
         if debug.find("warn") > -1:
             for e in self._warn:
                 if e not in d:
-                    msg = "Resource type '%s' should have '%s' set" % (
-                        self._type, e)
-                    self.maybe_warn(msg)
+                    self.maybe_warn(
+                        "Resource type '%s' should have '%s' set",
+                        (self._type, e), code="missing-recommended")
         if top:
             d['@context'] = self._factory.context_uri
 
@@ -692,13 +1137,14 @@ class BaseMetadataObject(object):
         if 'viewingHint' in d:
             if hasattr(self, '_viewing_hints'):
                 if not d['viewingHint'] in self._viewing_hints:
-                    msg = "'%s' not a known viewing hint for type '%s': %s" % (
-                        d['viewingHint'], self._type, ' '.join(self._viewing_hints))
-                    self.maybe_warn(msg)
+                    self.maybe_warn(
+                        "'%s' not a known viewing hint for type '%s': %s",
+                        (d['viewingHint'], self._type, ' '.join(self._viewing_hints)),
+                        code="unknown-viewing-hint")
             else:
-                msg = "Resource type '%s' does not have any known viewingHints; '%s' given" % (
-                    self._type, d['viewingHint'])
-                self.maybe_warn(msg)
+                self.maybe_warn(
+                    "Resource type '%s' does not have any known viewingHints; '%s' given",
+                    (self._type, d['viewingHint']), code="no-viewing-hints")
 
         if 'viewingDirection' in d:
             if hasattr(self, '_viewing_directions'):
@@ -707,33 +1153,38 @@ class BaseMetadataObject(object):
                         d['viewingDirection'], self._type, ' '.join(self._viewing_directions))
                     raise DataError(msg, self)
             else:
-                msg = "Resource type '%s' does not have any known viewingDirections; '%s' given" % (
-                    self._type, d['viewingDirection'])
-                self.maybe_warn(msg)
+                self.maybe_warn(
+                    "Resource type '%s' does not have any known viewingDirections; '%s' given",
+                    (self._type, d['viewingDirection']), code="no-viewing-directions")
+
+        return d
+
+    def _serialize_structures(self, d, stream=False):
+        """Recurse into structures in d, maybe minimally.
 
-        # Recurse into structures, maybe minimally
+        If stream is set then resources that are to be embedded in full are
+        left in place, for _iter_json() to write out.
+        """
         for (p, sinfo) in self._structure_properties.items():
             if p in d:
                 if type(d[p]) == list:
                     newl = []
                     for s in d[p]:
                         minimalOveride = self._should_be_minimal(s)
-                        done = self._single_toJSON(s, sinfo, p, minimalOveride)
+                        done = self._single_toJSON(s, sinfo, p, minimalOveride, stream)
                         newl.append(done)
                     d[p] = newl
                 else:
                     if sinfo.get('list', False):
                         raise StructuralError(
                             "%s['%s'] must be a list, got %r" % (self._type, p, d[p]), self)
-                    d[p] = self._single_toJSON(d[p], sinfo, p)
-
-        return OrderedDict(sorted(d.items(), key=lambda x: KEY_ORDER_HASH.get(x[0], 1000)))
+                    d[p] = self._single_toJSON(d[p], sinfo, p, stream=stream)
 
     def _should_be_minimal(self, what):
         """Return False."""
         return False
 
-    def _single_toJSON(self, instance, sinfo, prop, minimalOveride=False):
+    def _single_toJSON(self, instance, sinfo, prop, minimalOveride=False, stream=False):
         # duck typing. Bite me.
         typ = sinfo.get('subclass', None)
         minimal = sinfo.get('minimal', False)
@@ -742,19 +1193,30 @@ class BaseMetadataObject(object):
         if type(instance) in STR_TYPES:
             # Just a URI
             return instance
+        elif isinstance(instance, RawResource):
+            if typ is not None:
+                instance.check_type(typ._type, self)
+            if minimal:
+                return instance.minimal()
+            elif stream:
+                return instance
+            else:
+                return instance.toJSON(False)
         elif ((isinstance(instance, BaseMetadataObject) and typ is None) or
               (typ is not None and isinstance(instance, typ))):
             if minimal:
                 return {'@id': instance.id, '@type': instance._type, 'label': instance.label}
+            elif stream:
+                return instance
             else:
                 return instance.toJSON(False)
-        elif (type(instance) == dict and
-              (('@type' in instance and instance['@type'] == typ._type) or typ is None)):
+        elif (isinstance(instance, dict) and
+              (typ is None or ('@type' in instance and instance['@type'] == typ._type))):
             if minimal:
                 return {'@id': instance['@id'], '@type': instance['@type'], 'label': instance['label']}
             else:
                 return instance
-        elif type(instance) == dict:
+        elif isinstance(instance, dict):
             raise StructuralError("%s['%s'] objects must be of type %s, got %s" % (
                 self._type, prop, typ._type, instance.get('@type', None)), self)
         else:
@@ -767,14 +1229,33 @@ class BaseMetadataObject(object):
             if compact:
                 out = json.dumps(js, sort_keys=True, separators=(',', ':'))
             else:
-                out = json.dumps(js, sort_keys=True, indent=2)
+                out = json.dumps(js, sort_keys=True, indent=2, separators=(',', ': '))
         else:
             if compact:
                 out = json.dumps(js, separators=(',', ':'))
             else:
-                out = json.dumps(js, indent=2)
+                out = json.dumps(js, indent=2, separators=(',', ': '))
         return out
 
+    def iterString(self, compact=True):
+        """Generate the JSON serialization as a series of strings.
+
+        Produces the same output as toString(), but each embedded resource
+        is only serialized when it is reached, so the whole JSON tree is
+        never held in memory, and RawResources are written out verbatim.
+        """
+        bmap = self._factory.get_base_map()
+        for chunk in self._iter_chunks(compact, 0, True):
+            # Strings are never split between chunks
+            yield chunk if bmap is None else bmap.text(chunk)
+        self._factory.flush_warnings()
+
+    def _iter_chunks(self, compact, level, top=False):
+        """Generate serialization of this resource at indent level."""
+        d = self._flatten(top)
+        self._serialize_structures(d, stream=True)
+        return _iter_json(_key_ordered(d), compact, level)
+
     def toString(self, compact=True):
         """Return JSON setialization as string."""
         js = self.toJSON(top=True)
@@ -783,6 +1264,24 @@ class BaseMetadataObject(object):
     def toFile(self, compact=True):
         """Write to local file.
 
+        Creates directories as necessary
+        """
+        out = []
+
+        def chunks():
+            for chunk in self.iterString(compact):
+                out.append(chunk)
+                yield chunk
+        pre = self._factory.get_precompressor()
+        if pre is not None:
+            pre.write(self.file_path(), chunks())
+        else:
+            _write_chunks(self.file_path(), chunks())
+        return "".join(out)
+
+    def file_path(self):
+        """Return the path of the file in prezi_dir for this resource.
+
         Creates directories as necessary
         """
         mdd = self._factory.prezi_dir
@@ -790,10 +1289,9 @@ class BaseMetadataObject(object):
             raise ConfigurationError(
                 "Metadata Directory on Factory must be set to write to file")
 
-        js = self.toJSON(top=True)
         # Now calculate file path based on URI of top object
         # ... which is self for those of you following at home
-        myid = js['@id']
+        myid = self.id
         mdb = self._factory.prezi_base
         if not myid.startswith(mdb):
             raise ConfigurationError(
@@ -806,18 +1304,20 @@ class BaseMetadataObject(object):
                 os.makedirs(mydir)
             except OSError:
                 pass
-        fh = open(os.path.join(mdd, fp), 'w')
-        out = self._buildString(js, compact)
-        fh.write(out)
-        fh.close()
-        return out
+        return os.path.join(mdd, fp)
 
 
 class ContentResource(BaseMetadataObject):
     """Content resource referred to in prezi API."""
 
-    def make_selection(self, selector, summarize=False):
-        """Create SpecificResource for selector."""
+    def make_selection(self, selector, summarize=False, compact=False):
+        """Create SpecificResource for selector.
+
+        With compact, a string selector such as "xywh=0,0,100,100" gives
+        a FragmentSelection, which is far smaller but can't be changed.
+        """
+        if compact and type(selector) in STR_TYPES:
+            return FragmentSelection(self, selector, summarize)
         if summarize:
             full = OrderedDict([("@id", self.id), ("@type", self.type)])
             if self.label:
@@ -860,14 +1360,20 @@ class Collection(BaseMetadataObject):
         super(Collection, self).__init__(*args, **kw)
         self.collections = []
         self.manifests = []
+        # Not through __setattr__, which would warn that it's non-standard
+        object.__setattr__(self, 'members', [])
         self._embed = False
 
     def add_collection(self, coll):
         """Add add_collection to this Collection."""
+        if isinstance(coll, RawResource):
+            coll.check_type(Collection._type, self)
         self.collections.append(coll)
 
     def add_manifest(self, manifest):
         """Add Manifest to this Collection."""
+        if isinstance(manifest, RawResource):
+            manifest.check_type(Manifest._type, self)
         self.manifests.append(manifest)
 
     def collection(self, *args, **kw):
@@ -925,9 +1431,13 @@ class Manifest(BaseMetadataObject):
                 if s.id == seq.id:
                     raise DataError(
                         "Cannot have two Sequences with the same identity", self)
+        if isinstance(seq, RawResource):
+            seq.check_type(Sequence._type, self)
+            self.sequences.append(seq)
+            return
 
         # Label and @id are only required if there is more than one sequence
-        if self.sequences:
+        if self.sequences and not isinstance(self.sequences[0], RawResource):
             seq._required = ['@id', '@type', 'label']
             if len(self.sequences) == 1:
                 # Also add to existing sequence
@@ -946,9 +1456,27 @@ class Manifest(BaseMetadataObject):
                 if r.id == rng.id:
                     raise DataError(
                         "Cannot have two Ranges with the same identity", self)
-        rng._parent = self
+        if isinstance(rng, RawResource):
+            rng.check_type(Range._type, self)
+        else:
+            rng._parent = self
         self.structures.append(rng)
 
+    def has_canvas(self, cvsid):
+        """True if the first Sequence has a Canvas with @id cvsid.
+
+        The @ids are looked up in a dict of them, which is made again
+        when cvsid isn't in it or the number of Canvases has changed.
+        """
+        if not self.sequences:
+            return False
+        canvases = self.sequences[0].canvases
+        ids = self.__dict__.get('_canvas_ids')
+        if ids is None or cvsid not in ids or len(ids) != len(canvases):
+            ids = dict([(c.id, True) for c in canvases])
+            object.__setattr__(self, '_canvas_ids', ids)
+        return cvsid in ids
+
     def sequence(self, *args, **kw):
         """Create Sequance and add to this Manifest."""
         seq = self._factory.sequence(*args, **kw)
@@ -987,6 +1515,8 @@ class Sequence(BaseMetadataObject):
                 if c.id == cvs.id:
                     raise DataError(
                         "Cannot have two Canvases with the same identity", self)
+        if isinstance(cvs, RawResource):
+            cvs.check_type(Canvas._type, self)
         self.canvases.append(cvs)
         if start:
             self.set_start_canvas(cvs)
@@ -997,11 +1527,107 @@ class Sequence(BaseMetadataObject):
         self.add_canvas(cvs)
         return cvs
 
+    def bulk_canvases(self, idents, labels, heights, widths, images=None, formats=None, iiif=True):
+        """Create Canvases with image Annotations from parallel columns.
+
+        Each column is a list, iterable or NumPy array with one entry per
+        Canvas; images defaults to idents and formats to the Image default.
+        The result is the same as, for each row:
+
+            cvs = seq.canvas(ident, label)
+            cvs.set_hw(height, width)
+            img = cvs.annotation().image(image, iiif=iiif)
+            img.set_hw(height, width)
+            img.format = format  # only if formats is given
+
+        but columns are validated once up front and each row is built by
+        copying the attributes of the first, rather than through __setattr__.
+        Returns the list of new Canvases.
+        """
+        fac = self._factory
+        idents = _column_strings(idents)
+        labels = _column_strings(labels)
+        heights = _column_values(heights)
+        widths = _column_values(widths)
+        images = idents if images is None else _column_strings(images)
+        if formats is not None:
+            formats = _column_strings(formats)
+        n = len(idents)
+        for (name, col) in [('labels', labels), ('heights', heights), ('widths', widths),
+                            ('images', images), ('formats', formats)]:
+            if col is not None and len(col) != n:
+                raise DataError("Column '%s' has %d values, expected %d" % (
+                    name, len(col), n), self)
+        if not n:
+            return []
+        _check_integers(heights, 'height', self)
+        _check_integers(widths, 'width', self)
+
+        seen = set([c.id for c in self.canvases])
+        for (ident, image) in zip(idents, images):
+            if not ident:
+                raise RequirementError(
+                    "Canvases must have a real identity (Canvas['@id'] cannot be empty)")
+            elif not is_http_uri(ident):
+                fac.assert_base_prezi_uri()
+            if not image:
+                raise RequirementError(
+                    "Images must have a real identity (Image['@id'] cannot be empty)")
+            elif not iiif and not is_http_uri(image):
+                fac.assert_base_image_uri()
+        cvsids = [Canvas._make_id(fac, i) for i in idents]
+        for cvsid in cvsids:
+            if cvsid in seen:
+                raise DataError(
+                    "Cannot have two Canvases with the same identity", self)
+            seen.add(cvsid)
+
+        # First row the normal way, then use it as the template for the rest
+        cvs = self.canvas(ident=idents[0], label=labels[0])
+        cvs.set_hw(heights[0], widths[0])
+        anno = cvs.annotation()
+        img = anno.image(ident=images[0], iiif=iiif)
+        img.set_hw(heights[0], widths[0])
+        if formats is not None:
+            img.format = formats[0]
+        new = [cvs]
+        tmpl_cvs = cvs.__dict__
+        tmpl_anno = anno.__dict__
+        tmpl_img = img.__dict__
+        tmpl_svc = img.service.__dict__ if iiif else None
+        for x in range(1, n):
+            cvs = _clone_resource(Canvas, tmpl_cvs)
+            cvs.__dict__['id'] = cvsids[x]
+            if labels[x]:
+                cvs.set_label(labels[x])
+            else:
+                cvs.__dict__['label'] = ""
+            cvs.__dict__['height'] = heights[x]
+            cvs.__dict__['width'] = widths[x]
+            anno = _clone_resource(Annotation, tmpl_anno)
+            anno.__dict__['on'] = cvsids[x]
+            img = _clone_resource(Image, tmpl_img)
+            img.__dict__['id'] = Image._make_image_id(fac, images[x], iiif)
+            img.__dict__['height'] = heights[x]
+            img.__dict__['width'] = widths[x]
+            if formats is not None:
+                img.__dict__['format'] = formats[x]
+            if iiif:
+                svc = _clone_resource(ImageService, tmpl_svc)
+                svc.__dict__['id'] = ImageService._make_service_id(fac, images[x])
+                img.__dict__['service'] = svc
+                img.__dict__['_identifier'] = images[x]
+            anno.__dict__['resource'] = img
+            cvs.__dict__['images'] = [anno]
+            new.append(fac._stored(cvs))
+        self.canvases.extend(new[1:])
+        return new
+
     def set_start_canvas(self, cvs):
         """Find and return the start canvas."""
         if type(cvs) in STR_TYPES:
             cvsid = cvs
-        elif isinstance(cvs, Canvas):
+        elif isinstance(cvs, (Canvas, RawResource)):
             cvsid = cvs.id
         elif isinstance(cvs, OrderedDict):
             cvsid = cvs['@id']
@@ -1053,7 +1679,8 @@ class Canvas(ContentResource):
     def add_image_annotation(self, imgid, iiif=True):
         """Add image Annotation to this Canvas."""
         self.maybe_warn(
-            "add_image_annotation is deprecated; use set_image_annotation() please")
+            "add_image_annotation is deprecated; use set_image_annotation() please",
+            code="deprecated")
         return self.set_image_annotation(imgid, iiif)
 
     def set_image_annotation(self, imgid, iiif=True):
@@ -1072,10 +1699,14 @@ class Canvas(ContentResource):
 
     def add_annotation(self, imgAnno):
         """Add Annotation to this Canvas."""
+        if isinstance(imgAnno, RawResource):
+            imgAnno.check_type(Annotation._type, self)
         self.images.append(imgAnno)
 
     def add_annotationList(self, annoList):
         """Add AnnotationList to this Canvas."""
+        if isinstance(annoList, RawResource):
+            annoList.check_type(AnnotationList._type, self)
         self.otherContent.append(annoList)
 
     def annotation(self, *args, **kw):
@@ -1092,10 +1723,12 @@ class Canvas(ContentResource):
         self.add_annotationList(annol)
         return annol
 
-    def toJSON(self, top=False):
-        """Serialize as JSON."""
+    def _flatten(self, top=False):
+        """Check this Canvas and return dict of its set properties."""
         # first verify that images are all for Image resources
         for anno in self.images:
+            if isinstance(anno, RawResource):
+                continue
             res = anno.resource
             # if res is neither an Image, nor part of an Image, nor a Choice of
             # those then break
@@ -1103,8 +1736,7 @@ class Canvas(ContentResource):
                 raise StructuralError(
                     "Annotations in Canvas['images'] must have Images for their resources, got: %r" % res, self)
 
-        d = super(Canvas, self).toJSON(top)
-        return d
+        return super(Canvas, self)._flatten(top)
 
 
 class Annotation(BaseMetadataObject):
@@ -1135,6 +1767,12 @@ class Annotation(BaseMetadataObject):
         self.resource = txt
         return txt
 
+    def _single_toJSON(self, instance, sinfo, prop, minimalOveride=False, stream=False):
+        """Also allow a Specific Resource of a Canvas as the target."""
+        if prop == 'on' and isinstance(instance, SpecificResource):
+            sinfo = {}
+        return super(Annotation, self)._single_toJSON(instance, sinfo, prop, minimalOveride, stream)
+
     def audio(self, ident="", label=""):
         """Create Audio body."""
         aud = self._factory.audio(ident, label)
@@ -1187,6 +1825,70 @@ class SpecificResource(BaseMetadataObject):
         self.full = full
 
 
+class FragmentSelection(SpecificResource):
+    """Immutable Specific Resource of a resource with a FragmentSelector.
+
+    Serializes the same as the SpecificResource from make_selection(),
+    but only holds the resource, the selector value and whether to
+    summarize the resource; the selector and summary are made on output,
+    so a summary has the resource's label at that time.
+    """
+
+    __slots__ = ('_full', '_value', '_summarize')
+
+    def __init__(self, full, value, summarize=False):
+        """Initialize FragmentSelection of resource full with selector value."""
+        object.__setattr__(self, '_full', full)
+        object.__setattr__(self, '_value', value)
+        object.__setattr__(self, '_summarize', summarize)
+
+    def __setattr__(self, which, value):
+        """FragmentSelections can't be changed."""
+        raise DataError("Cannot set '%s' on a FragmentSelection, use make_selection() "
+                        "without compact for a SpecificResource that can be changed" % which, self)
+
+    def __reduce__(self):
+        """Pickle as the resource, value and summarize flag."""
+        return (FragmentSelection, (self._full, self._value, self._summarize))
+
+    @property
+    def _factory(self):
+        """Factory of the selected resource."""
+        return self._full._factory
+
+    @property
+    def type(self):
+        """Type of resource."""
+        return self._type
+
+    @property
+    def full(self):
+        """The selected resource, or its summary if summarized."""
+        if self._summarize:
+            full = OrderedDict([("@id", self._full.id), ("@type", self._full.type)])
+            if self._full.label:
+                full['label'] = self._full.label
+            return full
+        return self._full
+
+    @property
+    def selector(self):
+        """FragmentSelector with the value."""
+        return OrderedDict([("@type", "oa:FragmentSelector"), ("value", self._value)])
+
+    def toJSON(self, top=False):
+        """Return JSON as dict."""
+        full = self.full
+        if not self._summarize:
+            full = full.toJSON(False)
+        return OrderedDict([("@type", self._type), ("full", full), ("selector", self.selector)])
+
+    def _iter_chunks(self, compact, level, top=False):
+        """Generate serialization of this resource at indent level."""
+        return _iter_json(OrderedDict([("@type", self._type), ("full", self.full),
+                                       ("selector", self.selector)]), compact, level)
+
+
 class ExternalText(ContentResource):
     """External text object in Presentation API."""
 
@@ -1270,24 +1972,31 @@ class Image(ContentResource):
             # add IIIF service -- iiif is version or bool
             # ident is identifier
             self.service = ImageService(factory, ident)
-
-            if factory.default_image_api_version[0] == '1':
-                self.id = factory.default_base_image_uri + '/' + \
-                    ident + '/%s/%s/0/native.jpg' % (region, size)
-            else:
-                self.id = factory.default_base_image_uri + '/' + \
-                    ident + '/%s/%s/0/default.jpg' % (region, size)
+            self.id = self._make_image_id(factory, ident, True, region, size)
             self._identifier = ident
             self.format = "image/jpeg"
 
         else:
             # Static image
             # ident is either full URL or filename
-            if is_http_uri(ident):
-                self.id = ident
-            else:
+            if not is_http_uri(ident):
                 factory.assert_base_image_uri()
-                self.id = factory.default_base_image_uri + ident
+            self.id = self._make_image_id(factory, ident)
+
+    @staticmethod
+    def _make_image_id(factory, ident, iiif=False, region='full', size='full'):
+        """URI of the image ident, through the Image API if iiif is set."""
+        if iiif:
+            if factory.default_image_api_version[0] == '1':
+                return factory.default_base_image_uri + '/' + \
+                    ident + '/%s/%s/0/native.jpg' % (region, size)
+            else:
+                return factory.default_base_image_uri + '/' + \
+                    ident + '/%s/%s/0/default.jpg' % (region, size)
+        elif is_http_uri(ident):
+            return ident
+        else:
+            return factory.default_base_image_uri + ident
 
     def set_hw(self, h, w):
         """Set height and width to specified values."""
@@ -1302,25 +2011,11 @@ class Image(ContentResource):
 
         requrl = self._factory.default_base_image_uri + \
             "/" + self._identifier + '/info.json'
+        js = fetch_image_info(self._factory, requrl)
         try:
-            if self._factory.image_auth_token:
-                req = Request(requrl, headers={
-                              'Authorization': self._factory.image_auth_token})
-            else:
-                req = Request(requrl)
-            fh = urlopen(req)
-            data = fh.read().decode('utf-8')
-            fh.close()
-        except:
-            raise ConfigurationError(
-                "Could not get IIIF Info from %s" % requrl)
-
-        try:
-            js = json.loads(data)
             self.height = int(js['height'])
             self.width = int(js['width'])
         except:
-            print(data)
             raise ConfigurationError(
                 "Response from IIIF server did not have mandatory height/width")
 
@@ -1334,34 +2029,41 @@ class Image(ContentResource):
                 raise ValueError("Could not find image file: %s" % fn)
             else:
                 fn = fn2
-        cmd = self._factory.whichid
-        if cmd:
-            # Try ImageMagick
-            try:
-                info = subprocess.check_output(
-                    cmd + ' -ping -format "%h %w" ' + fn, shell=True).strip()
-                (h, w) = info.split(" ")
-                self.height = int(h)
-                self.width = int(w)
-                return
-            except:
-                pass
-        if pil_image:
-            # Try PIL
+        (self.height, self.width) = image_file_dimensions(fn, self._factory.whichid)
+
+
+def image_file_dimensions(fn, whichid=""):
+    """Return (height, width) of image file fn.
+
+    Uses ImageMagick's identify if whichid is its path, else PIL.
+    """
+    cmd = whichid
+    if cmd:
+        # Try ImageMagick
+        try:
+            if isinstance(cmd, bytes):
+                cmd = cmd.decode('utf-8')
+            info = subprocess.check_output(
+                [cmd, '-ping', '-format', '%h %w', fn + '[0]']).decode('utf-8').strip()
+            (h, w) = info.split(" ")
+            return (int(h), int(w))
+        except:
+            pass
+    pil_image = get_pil_image()
+    if pil_image:
+        # Try PIL
+        try:
+            img = pil_image.open(fn)
+            (w, h) = img.size
             try:
-                img = pil_image.open(fn)
-                (w, h) = img.size
-                self.height = h
-                self.width = w
-                try:
-                    img.close()
-                except:
-                    pass
-                return
+                img.close()
             except:
                 pass
-        raise ConfigurationError(
-            "No identify from ImageMagick and no PIL, you have to set manually")
+            return (h, w)
+        except:
+            pass
+    raise ConfigurationError(
+        "No identify from ImageMagick and no PIL, you have to set manually")
 
 
 class Choice(BaseMetadataObject):
@@ -1391,6 +2093,8 @@ class AnnotationList(BaseMetadataObject):
     _uri_segment = "list/"
     _required = ["@id"]
     _warn = []
+    _extra_properties = ['startIndex', 'prev', 'next']
+    _integer_properties = ['startIndex']
     _canvas = None
 
     resources = []
@@ -1398,13 +2102,15 @@ class AnnotationList(BaseMetadataObject):
 
     def __init__(self, *args, **kw):
         """Initialize Annotation List."""
-        return super(AnnotationList, self).__init__(*args, **kw)
+        super(AnnotationList, self).__init__(*args, **kw)
         self.resources = []
         self.within = []
         self._canvas = None
 
     def add_annotation(self, imgAnno):
         """Add Annotation to this Annotation List."""
+        if isinstance(imgAnno, RawResource):
+            imgAnno.check_type(Annotation._type, self)
         self.resources.append(imgAnno)
 
     def annotation(self, *args, **kw):
@@ -1427,6 +2133,17 @@ class AnnotationList(BaseMetadataObject):
         self.within = lyr
         return lyr
 
+    def _flatten(self, top=False):
+        """Check this Annotation List and return dict of its set properties.
+
+        A Layer it is within is referred to by @id, @type and label.
+        """
+        d = super(AnnotationList, self)._flatten(top)
+        within = d.get('within')
+        if isinstance(within, Layer):
+            d['within'] = {'@id': within.id, '@type': within._type, 'label': within.label}
+        return d
+
 
 class Range(BaseMetadataObject):
     """Range object in Presentation API."""
@@ -1453,14 +2170,12 @@ class Range(BaseMetadataObject):
     def __setattr__(self, which, value):
         """Use superclass attribute setting magic for all but viewingHint."""
         if which == 'viewingHint':
+            # Top ranges needn't have canvases. Replace rather than change
+            # _warn, which is shared with every other Range
             if value == 'top':
-                # unset canvases from _warn
-                try:
-                    self._warn.remove('canvases')
-                except:
-                    pass
+                object.__setattr__(self, '_warn', [w for w in self._warn if w != 'canvases'])
             elif 'canvases' not in self._warn:
-                self._warn.append('canvases')
+                object.__setattr__(self, '_warn', self._warn + ['canvases'])
         super(Range, self).__setattr__(which, value)
 
     def add_canvas(self, cvs, frag="", start=False):
@@ -1471,16 +2186,7 @@ class Range(BaseMetadataObject):
             cvsid = cvs
             # Make sure we actually identify a canvas
             mf = self._parent
-            okay = False
-            testcvsid = cvsid
-            hashidx = testcvsid.find('#')
-            if hashidx > -1:
-                testcvsid == testcvsid[:hashidx]
-            for c in mf.sequences[0].canvases:
-                if testcvsid == c.id:
-                    okay = True
-                    break
-            if not okay:
+            if mf is not None and not mf.has_canvas(cvsid.split('#', 1)[0]):
                 raise StructuralError(
                     "Can't add a canvas to a range that is not in the sequence: (%s)" % cvsid)
 
@@ -1531,6 +2237,8 @@ class Layer(BaseMetadataObject):
     _uri_segment = "layer/"
     _required = ["@id", "label"]
     _warn = []
+    _extra_properties = ['total', 'first', 'last']
+    _integer_properties = ['total']
 
 
 class Service(BaseMetadataObject):
@@ -1566,14 +2274,13 @@ class ImageService(Service):
     _uri_segment = ""
     _required = ["@id", "@context"]
     _warn = ["profile"]
+    _extra_properties = ['context', 'profile', 'width', 'height', 'sizes', 'tiles']
+    _integer_properties = ['width', 'height']
     context = ""
 
     def __init__(self, factory, ident, label="", context="", profile=""):
         """Initialize Image Service."""
-        if not is_http_uri(ident):
-            # prepend factory.base before passing up
-            ident = factory.default_base_image_uri + '/' + ident
-
+        ident = self._make_service_id(factory, ident)
         BaseMetadataObject.__init__(self, factory, ident, label)
 
         if not context:
@@ -1585,6 +2292,460 @@ class ImageService(Service):
         elif profile:
             self.profile = profile
 
+    @staticmethod
+    def _make_service_id(factory, ident):
+        """URI of the Image API service for image ident."""
+        if not is_http_uri(ident):
+            # prepend factory.base before passing up
+            ident = factory.default_base_image_uri + '/' + ident
+        return ident
+
+    def info_url(self):
+        """URL of the service's info.json."""
+        return self.id.rstrip('/') + '/info.json'
+
+    def set_info(self, info):
+        """Embed width, height, sizes and tiles from info.json dict info.
+
+        Clients can then choose a size or tiles without requesting the
+        info.json first.
+        """
+        try:
+            self.width = int(info['width'])
+            self.height = int(info['height'])
+        except (KeyError, TypeError, ValueError):
+            raise DataError("Image information must have height and width", self)
+        self.sizes = [_key_ordered(s) for s in info.get('sizes', [])]
+        self.tiles = [_key_ordered(t) for t in info.get('tiles', [])]
+
+
+def fetch_image_info(factory, url, timeout=None):
+    """Return the IIIF Image Information (info.json) at url as a dict.
+
+    The factory's image_auth_token is sent if set.
+    """
+    try:
+        urllib = get_urllib()
+        if factory.image_auth_token:
+            req = urllib.Request(url, headers={'Authorization': factory.image_auth_token})
+        else:
+            req = urllib.Request(url)
+        if timeout is None:
+            fh = urllib.urlopen(req)
+        else:
+            fh = urllib.urlopen(req, timeout=timeout)
+        try:
+            data = fh.read().decode('utf-8')
+        finally:
+            fh.close()
+    except Exception:
+        raise ConfigurationError("Could not get IIIF Info from %s" % url)
+    try:
+        js = json.loads(data)
+    except ValueError:
+        raise ConfigurationError("Response from IIIF server was not JSON: %s" % url)
+    if not isinstance(js, dict):
+        raise ConfigurationError("Response from IIIF server was not a JSON object: %s" % url)
+    return js
+
+
+def _service_info(service, factory):
+    """(@id, version, level, sizes, width, height) of IIIF Image service, or None.
+
+    service is a Service, a dict, or a list of them; the version (1, 2
+    or 3) and compliance level are from its context and profile, or the
+    factory's defaults, and level 1 if those aren't known either.
+    """
+    if type(service) == list:
+        for svc in service:
+            info = _service_info(svc, factory)
+            if info is not None:
+                return info
+        return None
+    if isinstance(service, dict):
+        get = service.get
+        ident = get('@id', '') or get('id', '')
+    elif isinstance(service, Service):
+        def get(k, default=None):
+            return getattr(service, k, default)
+        ident = service.id
+    else:
+        return None
+    context = get('context', '') or get('@context', '')
+    if type(context) == list:
+        context = " ".join([c for c in context if type(c) in STR_TYPES])
+    if not ident or (context and 'image' not in context):
+        return None
+    m = IMAGE_CONTEXT_RE.search(context)
+    if m:
+        version = int(m.group(1))
+    elif 'image-api' in context:
+        version = 1
+    elif factory.default_image_api_version[0] in '123':
+        version = int(factory.default_image_api_version[0])
+    else:
+        version = 2
+    profile = get('profile', '')
+    if type(profile) == list:
+        profile = profile[0] if profile and type(profile[0]) in STR_TYPES else ""
+    m = LEVEL_RE.search(profile or '')
+    if m:
+        level = int(m.group(1))
+    elif int(factory.default_image_api_level) >= 0:
+        level = int(factory.default_image_api_level)
+    else:
+        level = 1
+    sizes = []
+    for size in get('sizes', None) or []:
+        try:
+            sizes.append((int(size['width']), int(size['height'])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    sizes.sort()
+    try:
+        (width, height) = (int(get('width', 0) or 0), int(get('height', 0) or 0))
+    except (TypeError, ValueError):
+        (width, height) = (0, 0)
+    return (ident.rstrip('/'), version, level, tuple(sizes), width, height)
+
+
+def _image_request(info, width=0, height=0, square=False, image_width=0, image_height=0):
+    """Return (URL, width, height) of an image of about width by height from service info.
+
+    A listed size is used if there are any and the request is for the
+    whole image, or if the service is level 0; the smallest that is at
+    least width or height, or the largest. Otherwise the size, and for
+    square the centred square region, are worked out from the image's
+    size if known. width and height are 0 in the result if not known.
+    """
+    (ident, version, level, sizes, w, h) = info
+    (iw, ih) = (w or image_width, h or image_height)
+    if not (width or height):
+        width = height = THUMBNAIL_SIZE
+    full = 'max' if version >= 3 else 'full'
+    quality = 'native' if version == 1 else 'default'
+    if sizes and (not square or level == 0 or not (iw and ih)):
+        for (sw, sh) in sizes:
+            if (width and sw >= width) or (height and sh >= height):
+                break
+        size = "%d,%d" % (sw, sh) if version >= 3 else "%d," % sw
+        return ("%s/full/%s/0/%s.jpg" % (ident, size, quality), sw, sh)
+    elif level == 0:
+        return ("%s/full/%s/0/%s.jpg" % (ident, full, quality), iw, ih)
+    region = 'full'
+    if square:
+        side = min(width or height, height or width)
+        if iw and ih:
+            edge = min(iw, ih)
+            if iw != ih:
+                region = "%d,%d,%d,%d" % ((iw - edge) // 2, (ih - edge) // 2, edge, edge)
+            (iw, ih) = (edge, edge)
+        elif version >= 2:
+            region = 'square'
+        (width, height) = (side, side)
+    if iw and ih:
+        scale = min([float(t) / d for (t, d) in ((width, iw), (height, ih)) if t])
+        if scale >= 1:
+            return ("%s/%s/%s/0/%s.jpg" % (ident, region, full, quality), iw, ih)
+        (w, h) = (max(1, int(iw * scale + 0.5)), max(1, int(ih * scale + 0.5)))
+        size = "%d,%d" % (w, h) if version >= 3 else "%d," % w
+    elif width and height:
+        (w, h) = (0, 0)
+        size = "!%d,%d" % (width, height)
+    else:
+        (w, h) = (width, height)
+        size = "%d," % width if width else ",%d" % height
+    return ("%s/%s/%s/0/%s.jpg" % (ident, region, size, quality), w, h)
+
+
+def _thumbnail_source(resource):
+    """Image of resource to make a thumbnail from, or None."""
+    while resource is not None and not isinstance(resource, Image):
+        if isinstance(resource, Collection):
+            items = resource.manifests
+        elif isinstance(resource, Manifest):
+            items = resource.sequences
+        elif isinstance(resource, Sequence):
+            items = resource.canvases
+        elif isinstance(resource, Canvas):
+            items = resource.images
+        elif isinstance(resource, Annotation):
+            items = [resource.resource]
+        elif isinstance(resource, SpecificResource):
+            items = [resource.full]
+        elif isinstance(resource, Choice):
+            items = [resource.default]
+        else:
+            return None
+        if type(items) != list:
+            items = [items]
+        resource = items[0] if items and isinstance(items[0], BaseMetadataObject) else None
+    return resource
+
+
+def _thumbnail_image(factory, url, width, height, service):
+    """Image for a thumbnail at url, with its size if known and service."""
+    img = Image(factory, url, "")
+    img.format = "image/jpeg"
+    if width and height:
+        img.set_hw(height, width)
+    img.service = service
+    return img
+
+
+class RawResource(object):
+    """Pre-serialized JSON of a resource, passed through to the output as is.
+
+    Allows finished JSON, such as a Canvas from a cache, to be added to a
+    resource without building objects for it. data is either a dict or the
+    JSON serialization as bytes or a string. Only a lightweight check that
+    @id and @type are present is made; the rest is trusted.
+    """
+
+    def __init__(self, data):
+        """Initialize RawResource."""
+        if isinstance(data, dict):
+            self._data = data
+            self._text = None
+            try:
+                self.id = data['@id']
+                self.type = data['@type']
+            except KeyError:
+                raise StructuralError(
+                    "Pre-serialized resources must have @id and @type", data)
+        elif type(data) in STR_TYPES:
+            if isinstance(data, bytes):
+                data = data.decode('utf-8')
+            data = data.strip().lstrip('\ufeff')
+            self._data = None
+            self._text = data
+            m = RAW_HEAD_RE.match(data)
+            if m and data.endswith('}'):
+                (self.id, self.type) = [json.loads('"%s"' % x) if '\\' in x else x
+                                        for x in m.groups()]
+            else:
+                # Not in the usual key order, so have to look properly
+                try:
+                    js = json.loads(data)
+                    self.id = js['@id']
+                    self.type = js['@type']
+                except (ValueError, KeyError, TypeError):
+                    raise StructuralError(
+                        "Pre-serialized resources must be JSON objects with @id and @type", data)
+        else:
+            raise DataError("Expected dict or JSON bytes, got %r" % type(data))
+        self._type = self.type
+
+    @property
+    def label(self):
+        """Label of the resource, if any."""
+        return self.toJSON().get('label', '')
+
+    def check_type(self, typ, parent=None):
+        """Raise StructuralError unless this resource has @type typ."""
+        if self.type != typ:
+            raise StructuralError("Expected pre-serialized %s, got %s" % (
+                typ, self.type), parent)
+
+    def minimal(self):
+        """Minimal JSON (@id, @type and label) for the resource."""
+        return {'@id': self.id, '@type': self.type, 'label': self.label}
+
+    def toJSON(self, top=False):
+        """Return the JSON as a dict, parsing it if necessary."""
+        if self._data is not None:
+            return self._data
+        return json.loads(self._text, object_pairs_hook=OrderedDict)
+
+    def _iter_chunks(self, compact, level, top=False):
+        """Generate serialization, verbatim if given as bytes or string."""
+        if self._data is not None:
+            return _iter_json(self._data, compact, level)
+        return iter([self._text])
+
+
+RAW_STR = r'"((?:[^"\\]|\\.)*)"'
+RAW_HEAD_RE = re.compile(
+    r'\{\s*(?:"@context"\s*:\s*(?:"(?:[^"\\]|\\.)*"|\[[^\]]*\])\s*,\s*)?' +
+    r'"@id"\s*:\s*' + RAW_STR + r'\s*,\s*"@type"\s*:\s*' + RAW_STR)
+
+
+class BaseMap(object):
+    """Rewrite URIs under some base URIs to be under others.
+
+    mapping is a dict of base URI to the base URI to write instead; where
+    several match, the longest is used. URIs are rewritten in JSON, as
+    dicts or as text, in any string that starts with a base.
+    """
+
+    def __init__(self, mapping):
+        """Initialize BaseMap."""
+        self.mapping = sorted(mapping.items(), key=lambda x: -len(x[0]))
+        # As the bases can appear in JSON text, with and without escapes
+        self._escaped = {}
+        for (old, new) in self.mapping:
+            for ascii in (True, False):
+                (o, n) = (json.dumps(old, ensure_ascii=ascii)[1:-1], json.dumps(new, ensure_ascii=ascii)[1:-1])
+                self._escaped.setdefault(o, n)
+                self._escaped.setdefault(o.replace('/', '\\/'), n.replace('/', '\\/'))
+        alternatives = sorted(self._escaped, key=len, reverse=True)
+        self._re = re.compile('"(' + '|'.join([re.escape(a) for a in alternatives]) + ')')
+
+    def uri(self, uri):
+        """uri under its new base, if it's under one of the bases."""
+        for (old, new) in self.mapping:
+            if uri.startswith(old):
+                return new + uri[len(old):]
+        return uri
+
+    def json(self, value):
+        """Copy of JSON value (dicts, lists and scalars) with its URIs rewritten."""
+        if type(value) in STR_TYPES:
+            return self.uri(value)
+        elif isinstance(value, dict):
+            return OrderedDict([(k, self.json(v)) for (k, v) in value.items()])
+        elif isinstance(value, list):
+            return [self.json(v) for v in value]
+        return value
+
+    def text_count(self, text):
+        """Return (JSON text with its URIs rewritten, number rewritten)."""
+        if not self.mapping:
+            return (text, 0)
+        return self._re.subn(lambda m: '"' + self._escaped[m.group(1)], text)
+
+    def text(self, text):
+        """JSON text with its URIs rewritten."""
+        return self.text_count(text)[0]
+
+
+# BaseMaps by their mappings, see ManifestFactory.get_base_map()
+_base_maps = {}
+
+# Precompressors by their configuration, see ManifestFactory.get_precompressor()
+_precompressors = {}
+
+
+def _key_ordered(d):
+    """OrderedDict of d with keys in KEY_ORDER."""
+    return OrderedDict(sorted(d.items(), key=lambda x: KEY_ORDER_HASH.get(x[0], 1000)))
+
+
+def _iter_json(value, compact=True, level=0):
+    """Generate JSON serialization of value as a series of strings.
+
+    Output is the same as json.dumps() with either compact separators or
+    an indent of 2, as used by toString(). Resources in value are
+    serialized as they are reached.
+    """
+    if isinstance(value, (BaseMetadataObject, RawResource)):
+        for chunk in value._iter_chunks(compact, level):
+            yield chunk
+    elif isinstance(value, dict):
+        if not value:
+            yield '{}'
+            return
+        if compact:
+            (start, sep, end) = ('{', ',', '}')
+        else:
+            indent = '\n' + '  ' * (level + 1)
+            (start, sep, end) = ('{' + indent, ',' + indent, '\n' + '  ' * level + '}')
+        yield start
+        first = True
+        for k in value:
+            if first:
+                first = False
+            else:
+                yield sep
+            yield json.dumps(k) + (':' if compact else ': ')
+            for chunk in _iter_json(value[k], compact, level + 1):
+                yield chunk
+        yield end
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            yield '[]'
+            return
+        if compact:
+            (start, sep, end) = ('[', ',', ']')
+        else:
+            indent = '\n' + '  ' * (level + 1)
+            (start, sep, end) = ('[' + indent, ',' + indent, '\n' + '  ' * level + ']')
+        yield start
+        first = True
+        for v in value:
+            if first:
+                first = False
+            else:
+                yield sep
+            for chunk in _iter_json(v, compact, level + 1):
+                yield chunk
+        yield end
+    else:
+        yield json.dumps(value)
+
+
+def _write_chunks(path, chunks):
+    """Write the strings from iterable chunks to file path.
+
+    Streams into a temporary file so a failure part way through
+    doesn't leave a broken file behind.
+    """
+    tmp = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    try:
+        fh = io.open(tmp, 'w', encoding='utf-8')
+        try:
+            for chunk in chunks:
+                fh.write(chunk)
+        finally:
+            fh.close()
+        _replace_file(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _replace_file(src, dst):
+    """Move file src to dst, replacing dst if it exists."""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # python2, where rename replaces on POSIX
+        os.rename(src, dst)
+
+
+def _column_values(col):
+    """List of native python values from a list, iterable or NumPy array."""
+    tolist = getattr(col, 'tolist', None)
+    if tolist is not None:
+        return tolist()
+    return list(col)
+
+
+def _column_strings(col):
+    """Column of values with string subclasses (eg numpy.str_) made plain."""
+    vals = _column_values(col)
+    stypes = tuple(STR_TYPES)
+    return [v if type(v) in STR_TYPES or not isinstance(v, stypes) else "%s" % v
+            for v in vals]
+
+
+def _check_integers(vals, which, resource):
+    """Raise DataError unless every value is an int."""
+    for v in vals:
+        if type(v) != int:
+            raise DataError("%s['%s'] does not accept a %s, only an integer" % (
+                Canvas._type, which, type(v).__name__), resource)
+
+
+def _clone_resource(cls, attrs):
+    """New instance of cls with a copy of attrs, bypassing __setattr__."""
+    obj = cls.__new__(cls)
+    d = obj.__dict__
+    for (k, v) in attrs.items():
+        d[k] = list(v) if type(v) == list else v
+    return obj
+
 # Need to set these at the end, after the classes have been defined
 Collection._structure_properties = {
     'collections': {'subclass': Collection, 'minimal': True, 'list': True},
@@ -6,15 +6,7 @@ import os
 import subprocess
 import urllib
 
-from .util import is_http_uri, STR_TYPES
-
-try:
-    from PIL import Image as pil_image
-except:
-    try:
-        import Image as pil_image
-    except:
-        pil_image = None
+from .util import is_http_uri, STR_TYPES, optional_import
 
 # TODO: New Python image library
 # TODO: ImageMagick module
@@ -838,6 +830,7 @@ class Image(ContentResource):
             except:
                 pass
 
+        pil_image = optional_import('PIL.Image', 'Image')
         if pil_image:
             # Try PIL
             try:
@@ -0,0 +1,191 @@
+"""Embed the size, sizes and tiles from info.json in a resource's Image services.
+
+    enricher = InfoEnricher(fac, cache_dir="info-cache", workers=8)
+    enricher.enrich(manifest)
+    manifest.toFile()
+
+Viewers can then show the images without first requesting each one's
+info.json. The Image API information for each service comes from the
+infos given (such as from a harvest), then from cache_dir, where each
+info.json fetched is also saved, and is otherwise fetched, several at a
+time in a pool of threads. Each service is looked up once, however many
+Images share it.
+"""
+
+from __future__ import unicode_literals
+import hashlib
+import io
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+from .factory import (Annotation, Canvas, Choice, Collection, ConfigurationError, DataError,
+                      Image, ImageService, Manifest, Sequence, SpecificResource,
+                      fetch_image_info, _write_chunks)
+
+
+def image_services(resource):
+    """Generate the (Image, ImageService) pairs in resource.
+
+    Canvases' images, including those in Choices and Specific
+    Resources, and the thumbnails of resources are looked in.
+    """
+    stack = [resource]
+    while stack:
+        res = stack.pop()
+        thumbs = getattr(res, 'thumbnail', '')
+        if type(thumbs) != list:
+            thumbs = [thumbs]
+        stack.extend([t for t in reversed(thumbs) if isinstance(t, Image)])
+        if isinstance(res, Collection):
+            items = res.collections + res.manifests
+        elif isinstance(res, Manifest):
+            items = res.sequences
+        elif isinstance(res, Sequence):
+            items = res.canvases
+        elif isinstance(res, Canvas):
+            items = res.images
+        elif isinstance(res, Annotation):
+            items = [res.resource]
+        elif isinstance(res, SpecificResource):
+            items = [res.full]
+        elif isinstance(res, Choice):
+            items = [res.default] + (res.item if type(res.item) == list else [res.item])
+        else:
+            items = []
+        if isinstance(res, Image):
+            services = res.service if type(res.service) == list else [res.service]
+            for svc in services:
+                if isinstance(svc, ImageService):
+                    yield (res, svc)
+        stack.extend([i for i in reversed(items) if isinstance(i, (Collection, Manifest, Sequence, Canvas,
+                                                                   Annotation, SpecificResource, Choice,
+                                                                   Image))])
+
+
+class EnrichStats(object):
+    """Counts of what an InfoEnricher did."""
+
+    def __init__(self):
+        """Initialize EnrichStats."""
+        self.services = 0
+        self.cached = 0
+        self.fetched = 0
+        self.failed = []
+
+    def __str__(self):
+        """Summary line."""
+        return "%d services, %d from cache, %d fetched, %d failed" % (
+            self.services, self.cached, self.fetched, len(self.failed))
+
+
+class InfoEnricher(object):
+    """Embed Image API information in Image services.
+
+    infos: dict of service @id to info.json dict, already harvested
+    cache_dir: directory to keep fetched info.json files in, or None
+    workers: number of info.json requests at once
+    fetch: request info.json that isn't in infos or cache_dir; if not
+        set, services without information are left as they are
+    timeout: seconds to wait for each request
+    set_hw: also set the height and width of Images that have none
+    """
+
+    def __init__(self, factory, infos=None, cache_dir=None, workers=8, fetch=True,
+                 timeout=30, set_hw=True):
+        """Initialize InfoEnricher."""
+        self.factory = factory
+        self.infos = dict(infos or {})
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.fetch = fetch
+        self.timeout = timeout
+        self.set_hw = set_hw
+        self.stats = EnrichStats()
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _cache_path(self, ident):
+        """File in cache_dir for the info.json of service ident."""
+        return os.path.join(self.cache_dir, hashlib.sha1(ident.encode('utf-8')).hexdigest() + '.json')
+
+    def _cached(self, ident):
+        """info.json dict of service ident from cache_dir, or None."""
+        if not self.cache_dir:
+            return None
+        try:
+            with io.open(self._cache_path(ident), encoding='utf-8') as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _fetch(self, args):
+        """(ident, info, error) for (ident, url), in a worker thread."""
+        (ident, url) = args
+        try:
+            return (ident, fetch_image_info(self.factory, url, self.timeout), None)
+        except ConfigurationError as e:
+            return (ident, None, str(e))
+
+    def lookup(self, services):
+        """Find the information for ImageServices services, fetching what's missing.
+
+        Returns dict of service @id to info.json dict.
+        """
+        wanted = {}
+        for svc in services:
+            wanted.setdefault(svc.id.rstrip('/'), svc.info_url())
+        found = {}
+        missing = []
+        for (ident, url) in wanted.items():
+            info = self.infos.get(ident)
+            if info is None:
+                info = self._cached(ident)
+                if info is not None:
+                    self.stats.cached += 1
+            if info is None:
+                missing.append((ident, url))
+            else:
+                found[ident] = info
+        if missing and self.fetch:
+            pool = ThreadPool(max(1, min(self.workers, len(missing))))
+            try:
+                results = pool.map(self._fetch, missing)
+            finally:
+                pool.close()
+                pool.join()
+            for (ident, info, error) in results:
+                if info is None:
+                    self.stats.failed.append((ident, error))
+                    continue
+                self.stats.fetched += 1
+                found[ident] = info
+                self.infos[ident] = info
+                if self.cache_dir:
+                    _write_chunks(self._cache_path(ident), [json.dumps(info, ensure_ascii=False)])
+        return found
+
+    def enrich(self, resource):
+        """Embed the information in every Image service in resource.
+
+        Returns the EnrichStats. Services that couldn't be looked up are
+        in its failed list, with the reason, and are left as they were.
+        """
+        pairs = list(image_services(resource))
+        found = self.lookup([svc for (img, svc) in pairs])
+        done = set()
+        for (img, svc) in pairs:
+            info = found.get(svc.id.rstrip('/'))
+            if info is None:
+                continue
+            if id(svc) not in done:
+                try:
+                    svc.set_info(info)
+                except DataError as e:
+                    self.stats.failed.append((svc.id, str(e)))
+                    continue
+                done.add(id(svc))
+                self.stats.services += 1
+            if self.set_hw and not (img.width and img.height):
+                img.set_hw(svc.height, svc.width)
+        return self.stats
@@ -7,19 +7,7 @@ from collections import OrderedDict
 
 from .factory import ManifestFactory, Service
 from .factory import PresentationError, ConfigurationError, StructuralError, RequirementError, DataError
-from .util import is_http_uri, STR_TYPES
-
-try:  # python2
-    # Must try this first as io also exists in python2
-    # but in the wrong one!
-    import StringIO as io
-except ImportError:  # python3
-    import io
-
-try:
-    from pyld import jsonld
-except:
-    jsonld = None
+from .util import is_http_uri, STR_TYPES, optional_import
 
 
 class SerializationError(PresentationError):
@@ -28,11 +16,15 @@ class SerializationError(PresentationError):
     pass
 
 
+_context_documents = {}
+
+
 def load_document_local(url, **options):
     """Load local copy of context document with given url.
 
     Returns dict with three elements 'contextUrl'=None,
-    'documentUrl'=None and 'document' set to data read
+    'documentUrl'=None and 'document' set to data read. Each file is
+    only read once per process.
     """
     doc = {'contentType': 'application/json',
            'contextUrl': None,
@@ -43,15 +35,27 @@ def load_document_local(url, **options):
         fn = os.path.join(contexts_dir, 'context_21.json')
     else:
         fn = os.path.join(contexts_dir, 'context_10.json')
-    fh = open(fn)
-    data = fh.read()
-    fh.close()
+    data = _context_documents.get(fn)
+    if data is None:
+        fh = open(fn)
+        data = fh.read()
+        fh.close()
+        _context_documents[fn] = data
     doc['document'] = data
     return doc
 
 
-if jsonld:
-    jsonld.set_document_loader(load_document_local)
+def get_jsonld():
+    """Return pyld's jsonld module, or None if pyld is not available.
+
+    pyld is only imported on first use. Pass JSONLD_OPTIONS to its calls
+    to use load_document_local; pyld's global document loader is left
+    alone, so other users of pyld in the process are not affected.
+    """
+    return optional_import('pyld.jsonld')
+
+
+JSONLD_OPTIONS = {'documentLoader': load_document_local}
 
 
 class ManifestReader(object):
@@ -70,7 +74,7 @@ class ManifestReader(object):
         data may be either a string or parsed data
         """
         self.data = data
-        self.debug_stream = None
+        self.factory = None
         self.require_version = version
 
     def buildFactory(self, version):
@@ -79,9 +83,9 @@ class ManifestReader(object):
             fac = ManifestFactory(version=self.require_version)
         else:
             fac = ManifestFactory(version=version)
-        self.debug_stream = io.StringIO()
         fac.set_debug("warn")
-        fac.set_debug_stream(self.debug_stream)
+        # Keep warnings in fac.warnings for get_warnings()
+        fac.set_debug_stream(None)
         return fac
 
     def getVersion(self, js):
@@ -112,10 +116,13 @@ class ManifestReader(object):
         return versions
 
     def get_warnings(self):
-        """Get list of warning from debug stream."""
-        if self.debug_stream:
-            self.debug_stream.seek(0)
-            return self.debug_stream.readlines()
+        """Get list of warning lines, each ending with a newline."""
+        return [str(w) + "\n" for w in self.get_warning_records()]
+
+    def get_warning_records(self):
+        """Get list of PresentationWarning objects from the last read."""
+        if self.factory:
+            return self.factory.warnings.records()
         else:
             return []
 
@@ -152,9 +159,10 @@ class ManifestReader(object):
             factory = self.buildFactory(versions[-1])
         self.factory = factory
         top = self.readObject(js)
+        jsonld = get_jsonld()
         if jsonld:
             try:
-                jsonld.expand(js)
+                jsonld.expand(js, dict(JSONLD_OPTIONS))
             except Exception as e:
                 raise
                 raise SerializationError(
@@ -0,0 +1,318 @@
+"""Import OCR (hOCR and ALTO) as word level text Annotation Lists.
+
+Pages are read from the OCR file with iterparse, one at a time, into an
+OcrPage: the words' text and boxes as columns rather than as objects.
+The boxes are scaled from the OCR's coordinates to the Canvas's in one
+go per page (with NumPy if it is installed), and each Annotation List
+is written straight to its file from the columns, without building an
+Annotation, Text and OrderedDicts for each word.
+
+    writer = OcrWriter(fac)
+    for (page, canvas) in zip(iter_pages("book.hocr"), canvases):
+        writer.write_page(page, canvas, "ocr/%s.json" % page.number)
+
+The output is the same as for Annotations made with
+AnnotationList.annotation() and Annotation.text(), on the Canvas with an
+xywh fragment. lxml is used if available, which also allows hOCR that is
+HTML rather than XHTML.
+"""
+
+from __future__ import unicode_literals
+import json
+import math
+import re
+from array import array
+from collections import OrderedDict
+
+from .factory import (Annotation, RawResource, DataError, get_etree, _iter_json,
+                      _key_ordered, _write_chunks)
+from .util import optional_import, STR_TYPES
+
+# hOCR title properties
+BBOX_RE = re.compile(r'\bbbox\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)')
+IMAGE_RE = re.compile(r'\bimage\s+"([^"]*)"')
+PAGENO_RE = re.compile(r'\bppageno\s+(\d+)')
+
+
+class OcrPage(object):
+    """Words of a page of OCR, in columns.
+
+    width and height are the size of the page in the OCR's coordinates,
+    if known, and image is the page image's file name if given.
+    """
+
+    def __init__(self, number, width=None, height=None, image=""):
+        """Initialize OcrPage."""
+        self.number = number
+        self.width = width
+        self.height = height
+        self.image = image
+        self.text = []
+        self.x = array('d')
+        self.y = array('d')
+        self.w = array('d')
+        self.h = array('d')
+
+    def add(self, text, x, y, w, h):
+        """Add a word with its box."""
+        self.text.append(text)
+        self.x.append(x)
+        self.y.append(y)
+        self.w.append(w)
+        self.h.append(h)
+
+    def __len__(self):
+        """Number of words."""
+        return len(self.text)
+
+    def scaled(self, width, height):
+        """Return (x, y, w, h) lists of integer boxes scaled to width and height.
+
+        The boxes are not scaled if the page's size isn't known.
+        """
+        sx = float(width) / self.width if width and self.width else 1.0
+        sy = float(height) / self.height if height and self.height else 1.0
+        return _scale_columns(((self.x, sx), (self.y, sy), (self.w, sx), (self.h, sy)),
+                              optional_import('numpy'))
+
+
+def _scale_columns(columns, np=None):
+    """Return the (array, scale) columns scaled, as lists of integers rounded half up.
+
+    If the numpy module is given as np the columns are scaled as arrays,
+    rounding in the same way.
+    """
+    if np is not None:
+        return [np.floor(np.frombuffer(col, dtype='d') * s + 0.5).astype(int).tolist()
+                for (col, s) in columns]
+    return [[int(math.floor(v * s + 0.5)) for v in col] for (col, s) in columns]
+
+
+def _local(tag):
+    """Tag name without namespace."""
+    if type(tag) not in STR_TYPES:
+        # Comments and processing instructions
+        return ""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _iterparse(source, html=False):
+    """iterparse source for start and end events, with lxml if available."""
+    etree = get_etree()
+    if etree is not None:
+        if html:
+            return etree.iterparse(source, events=('start', 'end'), html=True)
+        return etree.iterparse(source, events=('start', 'end'), huge_tree=True)
+    import xml.etree.ElementTree as ElementTree
+    return ElementTree.iterparse(source, events=('start', 'end'))
+
+
+def _release(elem):
+    """Free elem, and with lxml the elements before it, once handled."""
+    elem.clear()
+    getprevious = getattr(elem, 'getprevious', None)
+    if getprevious is not None:
+        while getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def iter_hocr(source, html=False):
+    """Generate the OcrPages of hOCR file (name or file object) source.
+
+    Set html for hOCR that isn't well formed XHTML (needs lxml).
+    """
+    page = None
+    number = 0
+    for (event, elem) in _iterparse(source, html):
+        classes = elem.get('class')
+        if not classes:
+            continue
+        classes = classes.split()
+        if event == 'start':
+            if 'ocr_page' in classes:
+                number += 1
+                title = elem.get('title', '')
+                m = PAGENO_RE.search(title)
+                page = OcrPage(int(m.group(1)) if m else number)
+                m = BBOX_RE.search(title)
+                if m:
+                    (x0, y0, x1, y1) = [int(v) for v in m.groups()]
+                    page.width = x1 - x0
+                    page.height = y1 - y0
+                m = IMAGE_RE.search(title)
+                if m:
+                    page.image = m.group(1)
+        elif 'ocrx_word' in classes:
+            m = BBOX_RE.search(elem.get('title', ''))
+            text = "".join(elem.itertext()).strip()
+            if m and text and page is not None:
+                (x0, y0, x1, y1) = [int(v) for v in m.groups()]
+                page.add(text, x0, y0, x1 - x0, y1 - y0)
+            _release(elem)
+        elif 'ocr_page' in classes and page is not None:
+            yield page
+            page = None
+            _release(elem)
+
+
+def iter_alto(source):
+    """Generate the OcrPages of ALTO file (name or file object) source."""
+    page = None
+    number = 0
+    image = ""
+    for (event, elem) in _iterparse(source):
+        tag = _local(elem.tag)
+        if event == 'start':
+            if tag == 'Page':
+                number += 1
+                try:
+                    width = float(elem.get('WIDTH'))
+                    height = float(elem.get('HEIGHT'))
+                except (TypeError, ValueError):
+                    width = height = None
+                nr = elem.get('PHYSICAL_IMG_NR')
+                page = OcrPage(int(nr) if nr and nr.isdigit() else number, width, height, image)
+        elif tag == 'String':
+            text = elem.get('CONTENT')
+            if text and page is not None:
+                try:
+                    page.add(text, float(elem.get('HPOS')), float(elem.get('VPOS')),
+                             float(elem.get('WIDTH')), float(elem.get('HEIGHT')))
+                except (TypeError, ValueError):
+                    raise DataError("ALTO String without a position: %s" % text)
+            _release(elem)
+        elif tag == 'fileName' and page is None:
+            # sourceImageInformation in the Description, before the pages
+            image = (elem.text or "").strip()
+        elif tag == 'Page' and page is not None:
+            yield page
+            page = None
+            _release(elem)
+
+
+def iter_pages(source):
+    """Generate the OcrPages of an hOCR or ALTO file, by looking at its start."""
+    if hasattr(source, 'read'):
+        raise DataError("iter_pages needs a file name, use iter_hocr or iter_alto for file objects")
+    with open(source, 'rb') as fh:
+        head = fh.read(4096)
+    if b'<alto' in head or b':alto' in head:
+        return iter_alto(source)
+    elif b'ocr_' in head or b'<html' in head.lower():
+        return iter_hocr(source, html=b'<?xml' not in head)
+    raise DataError("Not hOCR or ALTO: %s" % source)
+
+
+class OcrWriter(object):
+    """Write the words of OcrPages as Annotation Lists in prezi_dir.
+
+    compact: write compact rather than indented JSON
+    language: language of the text, if known
+    motivation: of the Annotations
+    word_ids: give each Annotation an @id, the list's @id with #w and
+        the word number as the fragment
+    """
+
+    def __init__(self, factory, compact=True, language="", motivation="sc:painting", word_ids=True):
+        """Initialize OcrWriter."""
+        self.factory = factory
+        self.compact = compact
+        self.language = language
+        self.motivation = motivation
+        self.word_ids = word_ids
+        self.words = 0
+
+    def write_page(self, page, canvas, ident, label="", add=True):
+        """Write the words of page as Annotation List ident on canvas.
+
+        Returns a reference to the list, which is also added to the
+        Canvas's otherContent if add is set.
+        """
+        lst = self.factory.annotationList(ident=ident, label=label)
+        pre = self.factory.get_precompressor()
+        if pre is not None:
+            pre.write(lst.file_path(), self.iter_list(lst, page, canvas))
+        else:
+            _write_chunks(lst.file_path(), self.iter_list(lst, page, canvas))
+        ref = RawResource({'@id': lst.id, '@type': lst._type, 'label': lst.label})
+        if add:
+            canvas.add_annotationList(ref)
+        return ref
+
+    def iter_list(self, lst, page, canvas):
+        """Generate the serialization of AnnotationList lst, holding the words of page."""
+        d = lst.toJSON(top=True)
+        d['resources'] = None
+        d = _key_ordered(d)
+        if self.compact:
+            (start, sep, end) = ('{', ',', '}')
+        else:
+            (start, sep, end) = ('{\n  ', ',\n  ', '\n}')
+        yield start
+        first = True
+        for (k, v) in d.items():
+            if first:
+                first = False
+            else:
+                yield sep
+            yield json.dumps(k) + (':' if self.compact else ': ')
+            if k == 'resources':
+                for chunk in self.iter_annotations(lst.id, page, canvas):
+                    yield chunk
+            else:
+                for chunk in _iter_json(v, self.compact, 1):
+                    yield chunk
+        yield end
+        self.factory.flush_warnings()
+
+    def iter_annotations(self, list_id, page, canvas):
+        """Generate the serialization of the list of Annotations for the words of page."""
+        if not len(page):
+            yield '[]'
+            return
+        (xs, ys, ws, hs) = page.scaled(canvas.width, canvas.height)
+        canvas_id = canvas.id
+        bmap = self.factory.get_base_map()
+        if bmap is not None:
+            # as iterString() would rewrite them
+            canvas_id = bmap.uri(canvas_id)
+            list_id = bmap.uri(list_id)
+        # JSON strings without the closing quote, escaped for % formatting
+        on = json.dumps(canvas_id + "#xywh=")[:-1].replace('%', '%%')
+        if self.word_ids:
+            ident = json.dumps(list_id + "#w")[:-1].replace('%', '%%')
+        if self.compact:
+            # As BaseMetadataObject would write it, in KEY_ORDER
+            template = (('{"@id":' + ident + '%d",' if self.word_ids else '{') +
+                        '"@type":"' + Annotation._type + '","motivation":' +
+                        json.dumps(self.motivation).replace('%', '%%') +
+                        ',"resource":{"@type":"cnt:ContentAsText","format":"text/plain","chars":%s' +
+                        (',"language":' + json.dumps(self.language).replace('%', '%%') if self.language else '') +
+                        '},"on":' + on + '%d,%d,%d,%d"}')
+            yield '['
+            for (i, text) in enumerate(page.text):
+                if i:
+                    yield ','
+                if self.word_ids:
+                    yield template % (i, json.dumps(text), xs[i], ys[i], ws[i], hs[i])
+                else:
+                    yield template % (json.dumps(text), xs[i], ys[i], ws[i], hs[i])
+            yield ']'
+        else:
+            words = []
+            for (i, text) in enumerate(page.text):
+                anno = OrderedDict()
+                if self.word_ids:
+                    anno['@id'] = "%s#w%d" % (list_id, i)
+                anno['@type'] = Annotation._type
+                anno['motivation'] = self.motivation
+                body = OrderedDict([('@type', 'cnt:ContentAsText'), ('format', 'text/plain'),
+                                    ('chars', text)])
+                if self.language:
+                    body['language'] = self.language
+                anno['resource'] = body
+                anno['on'] = "%s#xywh=%d,%d,%d,%d" % (canvas_id, xs[i], ys[i], ws[i], hs[i])
+                words.append(anno)
+            for chunk in _iter_json(words, False, 1):
+                yield chunk
+        self.words += len(page)
@@ -0,0 +1,203 @@
+"""Write Canvases' Annotation Lists to their own files, in pages if they are large.
+
+    writer = AnnotationListWriter(fac, max_annotations=500, max_bytes=1000000)
+    writer.write_manifest(manifest)
+    manifest.toFile()
+
+Each AnnotationList in a Canvas's otherContent is written to its file in
+the factory's prezi_dir. A list with more annotations, or more bytes of
+annotations, than allowed is split into pages linked with next and prev,
+each within a Layer that has the total and the first and last pages. The
+first page keeps the list's @id, so the Canvas still refers to it.
+
+Annotations are serialized one at a time and only one page is held at
+once, and by default each list is replaced in its Canvas by a reference
+once written, so memory use doesn't grow with the number of annotations.
+"""
+
+from __future__ import unicode_literals
+import copy
+
+from .factory import (Annotation, AnnotationList, Layer, RawResource, ConfigurationError,
+                      _iter_json, _write_chunks)
+
+
+class _AnnotationText(RawResource):
+    """Annotation serialized for a page, written out as is."""
+
+    def __init__(self, text):
+        """Initialize _AnnotationText with serialization text."""
+        self._data = None
+        self._text = text
+        self.id = None
+        self.type = self._type = Annotation._type
+
+
+class PagingStats(object):
+    """Counts of what an AnnotationListWriter wrote."""
+
+    def __init__(self):
+        """Initialize PagingStats."""
+        self.lists = 0
+        self.pages = 0
+        self.layers = 0
+        self.annotations = 0
+        self.bytes = 0
+
+    def __str__(self):
+        """Summary line."""
+        return "%d lists (%d paged into %d pages), %d annotations, %d bytes" % (
+            self.lists, self.layers, self.pages, self.annotations, self.bytes)
+
+
+def page_ident(ident, n):
+    """@id of page n (from 1) of the list with @id ident."""
+    if n == 1:
+        return ident
+    elif ident.endswith('.json'):
+        return "%s-%d.json" % (ident[:-5], n)
+    return "%s-%d" % (ident, n)
+
+
+def layer_ident(ident):
+    """@id of the Layer made for paging the list with @id ident."""
+    if ident.endswith('.json'):
+        return ident[:-5] + "-layer.json"
+    return ident + "-layer"
+
+
+class AnnotationListWriter(object):
+    """Write Annotation Lists to files in prezi_dir, split into pages.
+
+    max_annotations: most annotations in a page, None for no limit
+    max_bytes: most bytes of serialized annotations in a page, None for
+        no limit; a single larger annotation gets a page to itself
+    compact: write compact rather than indented JSON
+    release: replace each list in its Canvas with a reference once written
+    """
+
+    def __init__(self, factory, max_annotations=1000, max_bytes=None, compact=True, release=True):
+        """Initialize AnnotationListWriter."""
+        if not factory.prezi_dir:
+            raise ConfigurationError(
+                "Metadata Directory on Factory must be set to write to file")
+        self.factory = factory
+        self.max_annotations = max_annotations
+        self.max_bytes = max_bytes
+        self.compact = compact
+        self.release = release
+        self.stats = PagingStats()
+
+    def write_manifest(self, manifest):
+        """Write the Annotation Lists of every Canvas in manifest."""
+        for seq in manifest.sequences:
+            if isinstance(seq, RawResource):
+                continue
+            for cvs in seq.canvases:
+                if not isinstance(cvs, RawResource):
+                    self.write_canvas(cvs)
+        return self.stats
+
+    def write_canvas(self, canvas):
+        """Write the Annotation Lists in canvas's otherContent."""
+        for (i, lst) in enumerate(canvas.otherContent):
+            if isinstance(lst, AnnotationList):
+                self.write_list(lst)
+                if self.release:
+                    canvas.otherContent[i] = RawResource(
+                        {'@id': lst.id, '@type': lst._type, 'label': lst.label})
+        return self.stats
+
+    def _annotations(self, lst):
+        """Generate (text, bytes) of each annotation in lst, as it is in a page."""
+        for anno in lst.resources:
+            if isinstance(anno, RawResource):
+                anno.check_type(Annotation._type, lst)
+            # as an item of the resources list in a page
+            text = "".join(_iter_json(anno, self.compact, 2))
+            yield (text, len(text.encode('utf-8')))
+
+    def _full(self, count, size, nbytes):
+        """True if a page with count annotations of size bytes can't take one of nbytes."""
+        return ((self.max_annotations is not None and count >= self.max_annotations) or
+                (self.max_bytes is not None and size + nbytes > self.max_bytes))
+
+    def write_list(self, lst):
+        """Write lst to its file, or to a series of pages and a Layer.
+
+        Returns the number of pages written, 1 if lst wasn't split.
+        """
+        page = []
+        size = 0
+        pages = 0
+        start = 0
+        layer = None
+        for (text, nbytes) in self._annotations(lst):
+            if page and self._full(len(page), size, nbytes):
+                # there is a next page, so this one is in a Layer
+                if layer is None:
+                    layer = self._layer(lst)
+                pages += 1
+                self._write_page(lst, page, pages, start, layer, last=False)
+                start += len(page)
+                page = []
+                size = 0
+            page.append(_AnnotationText(text))
+            size += nbytes
+        pages += 1
+        if layer is None:
+            self._write_page(lst, page, pages, start, None, last=True)
+        else:
+            self._write_page(lst, page, pages, start, layer, last=True)
+            layer.total = start + len(page)
+            layer.first = page_ident(lst.id, 1)
+            layer.last = page_ident(lst.id, pages)
+            self._write(layer)
+            self.stats.layers += 1
+        self.stats.lists += 1
+        self.stats.pages += pages
+        self.stats.annotations += start + len(page)
+        return pages
+
+    def _layer(self, lst):
+        """Layer for the pages of lst, the one it is within if there is one."""
+        if isinstance(lst.within, Layer):
+            return lst.within
+        return self.factory.layer(ident=layer_ident(lst.id), label=lst.label or "Annotations")
+
+    def _write_page(self, lst, annotations, n, start, layer, last):
+        """Write page n of lst, holding annotations from start."""
+        if layer is None:
+            page = lst
+            saved = lst.resources
+        else:
+            page = copy.copy(lst)
+            page.id = page_ident(lst.id, n)
+            # replace, rather than add to, what lst is within
+            object.__setattr__(page, 'within', layer)
+            page.startIndex = start
+            if n > 1:
+                page.prev = page_ident(lst.id, n - 1)
+            if not last:
+                page.next = page_ident(lst.id, n + 1)
+        page.resources = annotations
+        try:
+            self._write(page)
+        finally:
+            if layer is None:
+                page.resources = saved
+
+    def _write(self, resource):
+        """Write resource to its file."""
+        nbytes = [0]
+
+        def chunks():
+            for chunk in resource.iterString(self.compact):
+                nbytes[0] += len(chunk.encode('utf-8'))
+                yield chunk
+        pre = self.factory.get_precompressor()
+        if pre is not None:
+            pre.write(resource.file_path(), chunks())
+        else:
+            _write_chunks(resource.file_path(), chunks())
+        self.stats.bytes += nbytes[0]
@@ -0,0 +1,137 @@
+"""Rewrite the base URIs in published JSON files, as text.
+
+    iiif-prezi-rebase published/ mirror/ --map http://example.org/iiif/=https://mirror.example.org/iiif/
+
+Every string in each .json file that starts with a base URI being mapped
+is rewritten with the new base, without parsing the JSON: the same
+rewriting that ManifestFactory.set_base_map() does while serializing.
+Files are done in a pool of processes, and each is replaced in one step,
+so the source and destination directories can be the same. The
+compressed copies and ETag sidecar of each file written are removed, as
+they would be out of date; precompress_tree() makes them again.
+"""
+
+from __future__ import unicode_literals
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+from .compress import remove_copies
+from .factory import BaseMap, _write_chunks
+
+
+def rebase_file(src, dst, bmap):
+    """Write JSON file src to dst with its URIs rewritten by BaseMap bmap.
+
+    Returns the number of URIs rewritten. dst is only written if it is a
+    different file or something was rewritten, and then any compressed
+    copies of it are removed.
+    """
+    with io.open(src, encoding='utf-8') as fh:
+        text = fh.read()
+    (text, count) = bmap.text_count(text)
+    if count or os.path.abspath(src) != os.path.abspath(dst):
+        _write_chunks(dst, [text])
+        remove_copies(dst)
+    return count
+
+
+def _rebase_job(args):
+    """Rebase a file in a pool worker, returning (src, URIs rewritten, bytes, error)."""
+    (src, dst, mapping) = args
+    try:
+        dr = os.path.dirname(dst)
+        if dr and not os.path.isdir(dr):
+            try:
+                os.makedirs(dr)
+            except OSError:
+                # made by another worker
+                pass
+        return (src, rebase_file(src, dst, BaseMap(mapping)), os.path.getsize(src), None)
+    except (IOError, OSError, ValueError) as e:
+        return (src, 0, 0, "%s: %s" % (type(e).__name__, e))
+
+
+class RebaseStats(object):
+    """Counts of a rebase_tree() run."""
+
+    def __init__(self):
+        """Initialize RebaseStats."""
+        self.files = 0
+        self.changed = 0
+        self.uris = 0
+        self.bytes = 0
+        self.failed = []
+        self.seconds = 0.0
+
+    def __str__(self):
+        """Summary line."""
+        return "%d files (%d changed, %d URIs), %.1f MB in %.1fs, %d failed" % (
+            self.files, self.changed, self.uris, self.bytes / 1e6, self.seconds, len(self.failed))
+
+
+def rebase_tree(src_dir, dst_dir, mapping, processes=None):
+    """Rebase every .json file in src_dir into the same place in dst_dir.
+
+    mapping is a dict of base URI to new base URI. processes is None for
+    one per CPU, or 0 to do them in this process. Returns RebaseStats.
+    """
+    stats = RebaseStats()
+    start = time.time()
+    jobs = []
+    for (dr, dirs, files) in os.walk(src_dir):
+        dirs.sort()
+        rel = os.path.relpath(dr, src_dir)
+        for fn in sorted(files):
+            if fn.endswith('.json'):
+                jobs.append((os.path.join(dr, fn), os.path.normpath(os.path.join(dst_dir, rel, fn)), mapping))
+    if processes == 0:
+        results = [_rebase_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = list(pool.imap_unordered(_rebase_job, jobs, 16))
+        finally:
+            pool.close()
+            pool.join()
+    for (src, count, size, error) in results:
+        if error:
+            stats.failed.append((src, error))
+            continue
+        stats.files += 1
+        stats.bytes += size
+        stats.uris += count
+        if count:
+            stats.changed += 1
+    stats.seconds = time.time() - start
+    return stats
+
+
+def main(argv=None):
+    """Command line entry point for iiif-prezi-rebase."""
+    p = argparse.ArgumentParser(description="Rewrite the base URIs in a directory of JSON files")
+    p.add_argument('src', help="directory of JSON files")
+    p.add_argument('dst', help="directory to write to, which may be src")
+    p.add_argument('--map', '-m', action='append', required=True, metavar="OLD=NEW",
+                   help="base URI OLD to write as NEW; may be repeated")
+    p.add_argument('--processes', '-p', type=int, default=None,
+                   help="worker processes (default: CPUs, 0 for none)")
+    args = p.parse_args(argv)
+    mapping = {}
+    for m in args.map:
+        (old, sep, new) = m.partition('=')
+        if not (old and sep and new):
+            p.error("--map must be OLD=NEW, got %s" % m)
+        mapping[old] = new
+    stats = rebase_tree(args.src, args.dst, mapping, args.processes)
+    print(stats)
+    for (src, error) in stats.failed:
+        sys.stderr.write("%s: %s\n" % (src, error))
+    return 1 if stats.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
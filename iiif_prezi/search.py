@@ -0,0 +1,470 @@
+"""Full text search of the text Annotations of Manifests, in IIIF Content Search form.
+
+    builder = SearchIndexBuilder()
+    builder.add_manifest(manifest)
+    builder.write("book.idx")
+
+    with SearchIndex("book.idx") as index:
+        response = index.content_search("orange pekoe", "http://example.org/search/book")
+
+The index is an inverted index in one file: a sorted table of the
+tokens, each with the positions it is at in the text of all of the
+Annotations in reading order, and for each position the Annotation it
+is in, with the Annotation's @id, text, Canvas and xywh box. It is read
+through mmap, so opening it is immediate and only what a query looks at
+is read. Phrases are found by checking that their tokens are at
+consecutive positions, starting from the rarest token, and the last
+token of a query can be a prefix. A position is skipped at the start of
+each Canvas and list, so phrases don't run from one page to the next.
+
+Text is lowercased and split into tokens of word characters.
+"""
+
+from __future__ import unicode_literals
+import io
+import json
+import mmap
+import sys
+import os
+import re
+import struct
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from heapq import merge
+
+try:
+    from urllib.parse import quote
+except ImportError:  # Py2
+    from urllib import quote
+
+from .factory import (AnnotationList, Canvas, RawResource, SpecificResource, Text, DataError,
+                      _replace_file)
+from .util import STR_TYPES
+
+MAGIC = b'IIIFsrch1'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+XYWH_RE = re.compile(r'xywh=(?:pixel:)?(\d+),(\d+),(\d+),(\d+)')
+
+SEARCH_CONTEXT = "http://iiif.io/api/search/1/context.json"
+PRESENTATION_CONTEXT = "http://iiif.io/api/presentation/2/context.json"
+
+# Offsets and counts of the sections of the file
+HEADER = struct.Struct('<10Q')
+# term: offset and length of its text, offset and count of its positions
+TERM = struct.Struct('<QIQI')
+# annotation: @id offset and length, text offset and length, canvas, x, y, w, h
+ANNO = struct.Struct('<QIQIIiiii')
+# canvas: @id offset and length
+CANVAS = struct.Struct('<QI')
+UINT = struct.Struct('<I')
+
+
+def _uint_bytes(values):
+    """Little-endian 4 byte unsigned ints of array('I') values."""
+    if sys.byteorder != 'little':
+        values = array('I', values)
+        values.byteswap()
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+
+def tokenize(text):
+    """List of the lowercased word tokens of text."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def _ident(value):
+    """@id of value: a string, dict or resource."""
+    if type(value) in STR_TYPES:
+        return value
+    elif isinstance(value, dict):
+        return value.get('@id', '')
+    return getattr(value, 'id', '') or ''
+
+
+def _target(on):
+    """(Canvas @id, (x, y, w, h) or None) of an Annotation's on."""
+    if type(on) == list:
+        on = on[0] if on else ''
+    if isinstance(on, SpecificResource) or (isinstance(on, dict) and 'full' in on):
+        if isinstance(on, dict):
+            (full, selector) = (on.get('full'), on.get('selector'))
+        else:
+            (full, selector) = (on.full, on.selector)
+        value = selector.get('value', '') if isinstance(selector, dict) else ''
+        on = _ident(full) + '#' + value
+    else:
+        on = _ident(on)
+    (canvas, frag) = (on.split('#', 1) + [''])[:2]
+    m = XYWH_RE.search(frag)
+    return (canvas, tuple([int(v) for v in m.groups()]) if m else None)
+
+
+def _chars(body):
+    """Text of an Annotation body, or None if it isn't text."""
+    if type(body) == list:
+        texts = [_chars(b) for b in body]
+        texts = [t for t in texts if t is not None]
+        return " ".join(texts) if texts else None
+    if isinstance(body, Text):
+        return body.chars
+    elif isinstance(body, dict) and 'chars' in body:
+        return body['chars']
+    return None
+
+
+class SearchIndexBuilder(object):
+    """Collect the text Annotations of Manifests and lists, and write the index."""
+
+    def __init__(self):
+        """Initialize SearchIndexBuilder."""
+        self.terms = {}
+        self.position_annos = array('I')
+        self.annotations = []
+        self.canvases = []
+        self._canvas_idx = {}
+        self._split = False
+
+    def _break(self):
+        """Keep phrases from running across the text before and after this point."""
+        self._split = True
+
+    def add_annotation(self, ident, text, on):
+        """Add text Annotation with @id ident on on (@id or fragment, or resource)."""
+        (canvas, xywh) = _target(on)
+        cidx = self._canvas_idx.get(canvas)
+        if cidx is None:
+            cidx = self._canvas_idx[canvas] = len(self.canvases)
+            self.canvases.append(canvas)
+        if self.annotations and self.annotations[-1][2] != cidx:
+            self._break()
+        n = len(self.annotations)
+        self.annotations.append((ident, text, cidx, xywh or (-1, -1, -1, -1)))
+        tokens = tokenize(text)
+        if tokens and self._split:
+            # skip a position, which no token is at, so phrases can't span it
+            if self.position_annos:
+                self.position_annos.append(self.position_annos[-1])
+            self._split = False
+        for token in tokens:
+            postings = self.terms.get(token)
+            if postings is None:
+                postings = self.terms[token] = array('I')
+            postings.append(len(self.position_annos))
+            self.position_annos.append(n)
+
+    def add_list(self, lst):
+        """Add the text Annotations of AnnotationList lst, or of its JSON (a dict)."""
+        if isinstance(lst, RawResource):
+            lst = lst.toJSON()
+        if isinstance(lst, dict):
+            annos = lst.get('resources', [])
+        elif isinstance(lst, AnnotationList):
+            annos = lst.resources
+        else:
+            raise DataError("Expected an AnnotationList or its JSON, got %r" % lst)
+        self._break()
+        for anno in annos:
+            if isinstance(anno, RawResource):
+                anno = anno.toJSON()
+            if isinstance(anno, dict):
+                (ident, body, on) = (anno.get('@id', ''), anno.get('resource'), anno.get('on', ''))
+            else:
+                (ident, body, on) = (anno.id, anno.resource, anno.on)
+            text = _chars(body)
+            if text:
+                self.add_annotation(ident, text, on)
+
+    def add_list_file(self, fn):
+        """Add the text Annotations of the Annotation List JSON in file fn.
+
+        Such as one written by OcrWriter.write_page().
+        """
+        with io.open(fn, encoding='utf-8') as fh:
+            self.add_list(json.load(fh))
+
+    def add_manifest(self, manifest):
+        """Add the Annotation Lists of the Canvases of manifest, in order.
+
+        Lists that are only referred to, rather than held, are skipped;
+        add them with add_list() or add_list_file().
+        """
+        for seq in manifest.sequences[:1]:
+            for cvs in getattr(seq, 'canvases', []):
+                if not isinstance(cvs, Canvas):
+                    continue
+                for lst in cvs.otherContent:
+                    if isinstance(lst, AnnotationList) or \
+                            (isinstance(lst, RawResource) and 'resources' in lst.toJSON()):
+                        self.add_list(lst)
+
+    def write(self, path):
+        """Write the index to file path."""
+        strings = []
+        size = [0]
+
+        def add_string(value):
+            data = value.encode('utf-8')
+            strings.append(data)
+            size[0] += len(data)
+            return (size[0] - len(data), len(data))
+
+        terms = sorted([(t.encode('utf-8'), t) for t in self.terms])
+        term_rows = []
+        postings = array('I')
+        for (data, term) in terms:
+            (off, n) = add_string(term)
+            term_rows.append(TERM.pack(off, n, len(postings), len(self.terms[term])))
+            postings.extend(self.terms[term])
+        anno_rows = []
+        for (ident, text, cidx, xywh) in self.annotations:
+            anno_rows.append(ANNO.pack(*(add_string(ident) + add_string(text) + (cidx,) + tuple(xywh))))
+        canvas_rows = [CANVAS.pack(*add_string(c)) for c in self.canvases]
+        sections = [b"".join(term_rows), _uint_bytes(postings), _uint_bytes(self.position_annos),
+                    b"".join(anno_rows), b"".join(canvas_rows), b"".join(strings)]
+        offsets = []
+        at = len(MAGIC) + HEADER.size
+        for section in sections:
+            offsets.append(at)
+            at += len(section)
+        header = HEADER.pack(len(terms), offsets[0], len(self.position_annos), offsets[1], offsets[2],
+                             len(self.annotations), offsets[3], len(self.canvases), offsets[4],
+                             offsets[5])
+        tmp = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        try:
+            with io.open(tmp, 'wb') as fh:
+                fh.write(MAGIC + header)
+                for section in sections:
+                    fh.write(section)
+            _replace_file(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+class _Column(object):
+    """Sequence of the unsigned ints in a section of the index, for bisect."""
+
+    def __init__(self, mm, offset, length):
+        """Initialize _Column of length ints at offset in mm."""
+        self.mm = mm
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        """Number of ints."""
+        return self.length
+
+    def __getitem__(self, i):
+        """int i."""
+        if i < 0 or i >= self.length:
+            raise IndexError(i)
+        return UINT.unpack_from(self.mm, self.offset + 4 * i)[0]
+
+    def __iter__(self):
+        """Iterate over the ints."""
+        for i in range(self.length):
+            yield UINT.unpack_from(self.mm, self.offset + 4 * i)[0]
+
+
+def _contains(column, value):
+    """True if sorted column has value."""
+    i = bisect_left(column, value)
+    return i < len(column) and column[i] == value
+
+
+class SearchIndex(object):
+    """Search an index file written by SearchIndexBuilder."""
+
+    def __init__(self, path):
+        """Initialize SearchIndex, mapping file path."""
+        self._fh = io.open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fh.close()
+            raise DataError("Not a search index: %s" % path)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise DataError("Not a search index: %s" % path)
+        (self.n_terms, self._terms, self.n_positions, self._postings, self._position_annos,
+         self.n_annotations, self._annos, self.n_canvases, self._canvases,
+         self._strings) = HEADER.unpack_from(self.mm, len(MAGIC))
+        self.position_annos = _Column(self.mm, self._position_annos, self.n_positions)
+
+    def close(self):
+        """Unmap and close the file."""
+        self.mm.close()
+        self._fh.close()
+
+    def __enter__(self):
+        """Use in with."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close at end of with."""
+        self.close()
+
+    def _string(self, off, n):
+        """Text in the strings section."""
+        start = self._strings + off
+        return self.mm[start:start + n].decode('utf-8')
+
+    def _term(self, i):
+        """(text as bytes, postings offset, count) of term i."""
+        (off, n, poff, count) = TERM.unpack_from(self.mm, self._terms + TERM.size * i)
+        start = self._strings + off
+        return (self.mm[start:start + n], poff, count)
+
+    def _term_search(self, data):
+        """Index of the first term not less than bytes data."""
+        (lo, hi) = (0, self.n_terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid)[0] < data:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _column(self, poff, count):
+        """Positions of a term."""
+        return _Column(self.mm, self._postings + 4 * poff, count)
+
+    def postings(self, token, prefix=False):
+        """Sorted positions of token, or of every token starting with it if prefix."""
+        data = token.lower().encode('utf-8')
+        i = self._term_search(data)
+        if not prefix:
+            if i < self.n_terms:
+                (term, poff, count) = self._term(i)
+                if term == data:
+                    return self._column(poff, count)
+            return []
+        columns = []
+        while i < self.n_terms:
+            (term, poff, count) = self._term(i)
+            if not term.startswith(data):
+                break
+            columns.append(self._column(poff, count))
+            i += 1
+        if len(columns) == 1:
+            return columns[0]
+        return list(merge(*columns))
+
+    def terms(self, prefix=""):
+        """Generate the tokens starting with prefix, in order."""
+        data = prefix.lower().encode('utf-8')
+        i = self._term_search(data)
+        while i < self.n_terms:
+            term = self._term(i)[0]
+            if not term.startswith(data):
+                break
+            yield term.decode('utf-8')
+            i += 1
+
+    def search(self, q, prefix=False):
+        """Return the sorted start positions of phrase q.
+
+        With prefix, the last token of q matches tokens that start with it.
+        """
+        tokens = tokenize(q)
+        if not tokens:
+            return []
+        lists = [self.postings(t, prefix and i == len(tokens) - 1) for (i, t) in enumerate(tokens)]
+        rarest = min(range(len(lists)), key=lambda i: len(lists[i]))
+        found = []
+        for pos in lists[rarest]:
+            start = pos - rarest
+            if start < 0:
+                continue
+            for (i, column) in enumerate(lists):
+                if i != rarest and not _contains(column, start + i):
+                    break
+            else:
+                found.append(start)
+        return found
+
+    def annotation(self, n):
+        """(@id, text, Canvas @id, (x, y, w, h) or None) of annotation n."""
+        (ioff, ilen, toff, tlen, cidx, x, y, w, h) = ANNO.unpack_from(self.mm, self._annos + ANNO.size * n)
+        (coff, clen) = CANVAS.unpack_from(self.mm, self._canvases + CANVAS.size * cidx)
+        return (self._string(ioff, ilen), self._string(toff, tlen), self._string(coff, clen),
+                (x, y, w, h) if w >= 0 else None)
+
+    def hits(self, q, prefix=False):
+        """Return a list of the annotation numbers of each match of q."""
+        length = len(tokenize(q))
+        result = []
+        for start in self.search(q, prefix):
+            annos = []
+            for pos in range(start, start + length):
+                n = self.position_annos[pos]
+                if not annos or annos[-1] != n:
+                    annos.append(n)
+            result.append(annos)
+        return result
+
+    def _annotation_json(self, n):
+        """Annotation n as in a search response."""
+        (ident, text, canvas, xywh) = self.annotation(n)
+        on = canvas if xywh is None else "%s#xywh=%d,%d,%d,%d" % ((canvas,) + xywh)
+        return OrderedDict([("@id", ident), ("@type", "oa:Annotation"), ("motivation", "sc:painting"),
+                            ("resource", OrderedDict([("@type", "cnt:ContentAsText"), ("chars", text)])),
+                            ("on", on)])
+
+    def content_search(self, q, service_id, prefix=False, page=0, per_page=None):
+        """IIIF Content Search response for q, as an OrderedDict.
+
+        service_id is the search service's @id. The Annotations of the
+        matches are the resources, in order, and each match is a hit.
+        With per_page, the response is page number page (from 0) of the
+        matches, with a Layer that has the total.
+        """
+        matches = self.hits(q, prefix)
+        base = "%s?q=%s" % (service_id, quote(q.encode('utf-8')))
+        total = len(matches)
+        if per_page:
+            start = page * per_page
+            shown = matches[start:start + per_page]
+            last = max(0, (total - 1) // per_page)
+            ident = base + ("&page=%d" % page if page else "")
+        else:
+            shown = matches
+            ident = base
+        resources = []
+        hits = []
+        seen = set()
+        for annos in shown:
+            ids = []
+            for n in annos:
+                anno = self._annotation_json(n)
+                if n not in seen:
+                    seen.add(n)
+                    resources.append(anno)
+                ids.append(anno['@id'])
+            hits.append(OrderedDict([("@type", "search:Hit"), ("annotations", ids)]))
+        response = OrderedDict([("@context", [PRESENTATION_CONTEXT, SEARCH_CONTEXT]),
+                                ("@id", ident), ("@type", "sc:AnnotationList")])
+        if per_page:
+            within = OrderedDict([("@type", "sc:Layer"), ("total", total),
+                                  ("first", base), ("last", base + ("&page=%d" % last if last else ""))])
+            response['within'] = within
+            response['startIndex'] = page * per_page
+            if page < last:
+                response['next'] = base + "&page=%d" % (page + 1)
+            if page > 0:
+                response['prev'] = base + ("&page=%d" % (page - 1) if page > 1 else "")
+        response['resources'] = resources
+        response['hits'] = hits
+        return response
+
+
+def build_index(manifest, path):
+    """Write the search index of the text Annotations of manifest to path."""
+    builder = SearchIndexBuilder()
+    builder.add_manifest(manifest)
+    builder.write(path)
+    return builder
@@ -0,0 +1,223 @@
+"""Binary snapshots of resource trees, for caching between pipeline stages.
+
+A snapshot records the factory configuration and every resource in the
+tree as a row of values. The attribute names, which attributes are empty
+and which refer to other resources are stored once per class and shape
+of resource, rather than once per resource. It is encoded with
+msgpack if that is installed, otherwise with marshal, which is only
+readable by the same version of Python.
+
+    data = snapshot.dumps(manifest)
+    manifest = snapshot.loads(data)
+"""
+
+from __future__ import unicode_literals
+import marshal
+
+from . import factory as _factory
+from .factory import BaseMetadataObject, RawResource, DataError, factory_from_config
+from .store import StoredResource, _Proxy
+from .util import optional_import, STR_TYPES
+
+MAGIC = b'IIIFsnap1'
+
+# Markers in encoded values, as keys that can't be IIIF properties
+REF = '\x00ref'
+RAW = '\x00raw'
+
+# Kinds of attribute in a schema
+VALUE = 0  # value in the row
+RESOURCE = 1  # index of a resource in the row
+RESOURCES = 2  # list of indexes of resources in the row
+EMPTY_STRING = 3  # "", not in the row
+EMPTY_LIST = 4  # [], not in the row
+
+
+def _slots(cls):
+    """Attribute names of a resource class that holds them in slots, or None."""
+    return cls.__dict__.get('__slots__')
+
+
+def _encoder(codec):
+    """Return (codec byte, dumps function) for codec name, None for the best available."""
+    msgpack = optional_import('msgpack') if codec in (None, 'msgpack') else None
+    if msgpack is not None:
+        return (b'm', lambda d: msgpack.packb(d, use_bin_type=True))
+    elif codec in (None, 'marshal'):
+        return (b'r', lambda d: marshal.dumps(d, marshal.version))
+    raise DataError("Snapshot codec '%s' is not available" % codec)
+
+
+def _decoder(code):
+    """Return loads function for codec byte code."""
+    if code == b'm':
+        msgpack = optional_import('msgpack')
+        if msgpack is None:
+            raise DataError("Snapshot was written with msgpack, which is not installed")
+        return lambda d: msgpack.unpackb(d, raw=False)
+    elif code == b'r':
+        return marshal.loads
+    raise DataError("Not a snapshot, or an unknown snapshot codec")
+
+
+class _Encoder(object):
+    """Flatten a resource tree into a table of rows."""
+
+    def __init__(self):
+        self.schemas = []
+        self.schema_idx = {}
+        self.rows = []
+        self.obj_idx = {}
+        # Resources loaded from a ResourceStore, kept so their ids (and
+        # those of their parts) aren't reused while obj_idx refers to them
+        self.loaded = []
+        self.factory = None
+
+    def resource(self, obj):
+        """Index of obj in rows, adding it (and what it refers to) if new."""
+        if isinstance(obj, _Proxy):
+            if type(obj) is StoredResource:
+                memo = (id(obj._store), obj._key)
+                idx = self.obj_idx.get(memo)
+                if idx is not None:
+                    return idx
+                obj = obj._resolve()
+                self.loaded.append(obj)
+                self.obj_idx[memo] = len(self.rows)
+            else:
+                obj = obj._resolve()
+        idx = self.obj_idx.get(id(obj))
+        if idx is not None:
+            return idx
+        idx = len(self.rows)
+        self.obj_idx[id(obj)] = idx
+        row = []
+        self.rows.append(row)
+        slots = _slots(type(obj))
+        if slots is None:
+            items = obj.__dict__.items()
+        else:
+            items = [(k, getattr(obj, k)) for k in slots]
+        fac = getattr(obj, '_factory', None)
+        if fac is not None and self.factory is None:
+            self.factory = fac
+        shape = []
+        for (k, v) in items:
+            if k == '_factory':
+                continue
+            elif isinstance(v, BaseMetadataObject):
+                shape.append((k, RESOURCE))
+                row.append(self.resource(v))
+            elif type(v) is list and v and all([isinstance(x, BaseMetadataObject) for x in v]):
+                shape.append((k, RESOURCES))
+                row.append([self.resource(x) for x in v])
+            elif type(v) in STR_TYPES and not v:
+                shape.append((k, EMPTY_STRING))
+            elif type(v) is list and not v:
+                shape.append((k, EMPTY_LIST))
+            else:
+                shape.append((k, VALUE))
+                row.append(self.value(v))
+        skey = (type(obj).__name__, tuple(shape))
+        sidx = self.schema_idx.get(skey)
+        if sidx is None:
+            sidx = self.schema_idx[skey] = len(self.schemas)
+            self.schemas.append([skey[0]] + [list(x) for x in shape])
+        row.insert(0, sidx)
+        return idx
+
+    def value(self, v):
+        """Encode v, with resources as references to their rows."""
+        if isinstance(v, BaseMetadataObject):
+            return {REF: self.resource(v)}
+        elif isinstance(v, RawResource):
+            return {RAW: v.toJSON() if v._data is not None else v._text}
+        elif isinstance(v, (list, tuple)):
+            return [self.value(x) for x in v]
+        elif isinstance(v, dict):
+            return dict([(k, self.value(x)) for (k, x) in v.items()])
+        return v
+
+
+def dumps(resource, codec=None):
+    """Return a snapshot (bytes) of resource and everything it contains.
+
+    codec is 'msgpack' or 'marshal', by default msgpack if available.
+    """
+    enc = _Encoder()
+    root = enc.resource(resource)
+    config = enc.factory.get_config() if enc.factory is not None else None
+    (code, dump) = _encoder(codec)
+    return MAGIC + code + dump([config, enc.schemas, enc.rows, root])
+
+
+def loads(data, factory=None):
+    """Return the resource tree from snapshot data.
+
+    The resources are given factory, or one made from the configuration
+    in the snapshot with factory_from_config().
+    """
+    if not data.startswith(MAGIC):
+        raise DataError("Not a snapshot, or an unknown snapshot codec")
+    load = _decoder(data[len(MAGIC):len(MAGIC) + 1])
+    (config, schemas, rows, root) = load(data[len(MAGIC) + 1:])
+    if factory is None and config is not None:
+        factory = factory_from_config(config)
+    classes = []
+    for schema in schemas:
+        cls = getattr(_factory, schema[0], None)
+        if not (isinstance(cls, type) and issubclass(cls, BaseMetadataObject)):
+            raise DataError("Unknown resource class in snapshot: %s" % schema[0])
+        classes.append(cls)
+    # Make all of the objects first, so references can be resolved
+    objs = [object.__new__(classes[row[0]]) for row in rows]
+
+    def value(v):
+        if isinstance(v, list):
+            return [value(x) for x in v]
+        elif isinstance(v, dict):
+            if REF in v:
+                return objs[v[REF]]
+            elif RAW in v:
+                return RawResource(v[RAW])
+            return dict([(k, value(x)) for (k, x) in v.items()])
+        return v
+
+    for (obj, row) in zip(objs, rows):
+        slotted = _slots(type(obj)) is not None
+        if slotted:
+            # the factory is the selected resource's
+            d = {}
+        else:
+            d = obj.__dict__
+            d['_factory'] = factory
+        x = 1
+        for (k, kind) in schemas[row[0]][1:]:
+            if kind == EMPTY_STRING:
+                d[k] = ""
+                continue
+            elif kind == EMPTY_LIST:
+                d[k] = []
+                continue
+            elif kind == RESOURCE:
+                d[k] = objs[row[x]]
+            elif kind == RESOURCES:
+                d[k] = [objs[i] for i in row[x]]
+            else:
+                v = row[x]
+                d[k] = value(v) if isinstance(v, (list, dict)) else v
+            x += 1
+        if slotted:
+            for (k, v) in d.items():
+                object.__setattr__(obj, k, v)
+    return objs[root]
+
+
+def dump(resource, fh, codec=None):
+    """Write a snapshot of resource to binary file fh."""
+    fh.write(dumps(resource, codec))
+
+
+def load(fh, factory=None):
+    """Read a snapshot from binary file fh, return the resource tree."""
+    return loads(fh.read(), factory)
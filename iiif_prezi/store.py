@@ -0,0 +1,431 @@
+"""Disk backed store for building resource trees larger than memory.
+
+With a ResourceStore set on the factory (ManifestFactory.set_resource_store),
+the factory returns Manifests and Canvases as StoredResource proxies.
+These behave like the resources themselves, but only a bounded working
+set of resources is kept in memory: the least recently used are pickled
+into a sqlite database, and are read back in when they are next used,
+for example while they are streamed out by toFile().
+
+The parts of a stored resource, such as its Sequences or its list of
+otherContent, are proxies too, which find the part in the resource each
+time they are used, so they can be held on to and changed as usual:
+
+    seq = mfst.sequence()
+    for (ident, label) in pages:
+        seq.canvas(ident=ident, label=label)
+
+Pinning a resource, with pin() or pinned(), keeps it in memory rather
+than reading it back for each use.
+"""
+
+from __future__ import unicode_literals
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import weakref
+
+try:
+    # python2
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from . import factory as _factory
+from .factory import ConfigurationError, DataError, OrderedDict
+
+# Reading these doesn't change the resource, so it needn't be written back
+READ_ONLY = frozenset(['id', 'type', '_type', 'label', '_factory', 'toJSON', 'toString',
+                       'iterString', 'toFile', 'file_path', '_iter_chunks', '_flatten',
+                       'index', 'count', 'get', 'keys', 'values', 'items', 'copy'])
+
+
+def _is_part(value):
+    """True if value is a part of a resource that should be reached through its owner."""
+    return type(value) not in (StoredResource, _Part) and \
+        isinstance(value, (list, dict, _factory.BaseMetadataObject))
+
+
+def _unwrap(value):
+    """The object a _Part proxy stands for, or value itself."""
+    return value._resolve() if type(value) is _Part else value
+
+
+class _Proxy(object):
+    """Attribute access and method calls passed on to an object in a ResourceStore.
+
+    _resolve() finds the object, loading its owner, the resource with
+    _key, from disk if needed. Lists, dicts and resources within it are
+    returned as _Part proxies, so that they are found again in the owner
+    after it has been spilled and read back, and methods are called with
+    the owner kept in memory.
+    """
+
+    __slots__ = ()
+
+    @property
+    def __class__(self):
+        """Class of the object."""
+        return self._cls
+
+    def __getattr__(self, name):
+        """Get attribute of the object."""
+        value = getattr(self._resolve(), name)
+        if name not in READ_ONLY:
+            # could be a list, or a method, that changes it
+            self._store.dirty.add(self._key)
+        if _is_part(value):
+            return self._store.part(self._key, self._path + (('attr', name),), type(value))
+        elif callable(value) and type(value) is not StoredResource:
+            return self._method(name)
+        return value
+
+    def __setattr__(self, name, value):
+        """Set attribute of the object."""
+        obj = self._resolve()
+        self._store.dirty.add(self._key)
+        setattr(obj, name, _unwrap(value))
+
+    def _method(self, name):
+        """Method name of the object, called with its owner held in memory."""
+        def call(*args, **kw):
+            store = self._store
+            store.hold(self._key)
+            try:
+                obj = self._resolve()
+                result = getattr(obj, name)(*[_unwrap(a) for a in args],
+                                            **dict([(k, _unwrap(v)) for (k, v) in kw.items()]))
+                return self._result(obj, result)
+            finally:
+                store.release(self._key)
+        return call
+
+    def _result(self, obj, result):
+        """Return result, of a method of obj, as a _Part if it is part of obj."""
+        if not _is_part(result):
+            return result
+        for (name, v) in getattr(obj, '__dict__', {}).items():
+            if v is result:
+                return self._store.part(self._key, self._path + (('attr', name),), type(result))
+            elif type(v) is list:
+                for (n, x) in enumerate(v):
+                    if x is result:
+                        return self._store.part(self._key, self._path + (('attr', name), ('item', n)),
+                                                type(result))
+        return result
+
+    def __reduce_ex__(self, protocol):
+        """Pickle as the object itself."""
+        return self._resolve().__reduce_ex__(protocol)
+
+
+class StoredResource(_Proxy):
+    """Proxy for a resource held in a ResourceStore.
+
+    Attribute access and method calls are passed on to the resource,
+    which is read back from disk first if needed. isinstance() sees the
+    class of the resource, and the identity is kept in the proxy so
+    duplicate checks don't need to load it. Its parts, such as its
+    Sequences, are proxies too, so they stay a part of it however often
+    it is spilled.
+    """
+
+    __slots__ = ('_store', '_key', '_cls', 'id', '__weakref__')
+    _path = ()
+
+    def __init__(self, store, key, cls, ident):
+        """Initialize StoredResource."""
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_key', key)
+        object.__setattr__(self, '_cls', cls)
+        object.__setattr__(self, 'id', ident)
+
+    def _resolve(self):
+        """The resource."""
+        return self._store.load(self._key)
+
+    def __setattr__(self, name, value):
+        """Set attribute of the resource."""
+        _Proxy.__setattr__(self, name, value)
+        if name == 'id':
+            object.__setattr__(self, 'id', self._resolve().id)
+
+    def __repr__(self):
+        """Show the resource type and identity."""
+        return "<StoredResource %s %s>" % (self._cls.__name__, self.id)
+
+
+class _Part(_Proxy):
+    """Proxy for a list, dict or resource within a stored resource.
+
+    It is found from the owner by _path, a tuple of ('attr', name) and
+    ('item', index or key) steps, each time it is used.
+    """
+
+    __slots__ = ('_store', '_key', '_path', '_cls', '__weakref__')
+
+    def __init__(self, store, key, path, cls):
+        """Initialize _Part."""
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_key', key)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_cls', cls)
+
+    def _resolve(self):
+        """The object, found from its owner."""
+        obj = self._store.load(self._key)
+        try:
+            for (kind, k) in self._path:
+                obj = getattr(obj, k) if kind == 'attr' else obj[k]
+        except (AttributeError, IndexError, KeyError):
+            obj = None
+        if type(obj) is not self._cls:
+            raise DataError("Part of a stored resource has been moved or removed: %s" % (
+                ".".join([str(k) for (kind, k) in self._path])))
+        return obj
+
+    def _item(self, k, value):
+        """Return value, item k of the object, as a _Part if it is one."""
+        if not _is_part(value):
+            return value
+        if type(k) is int and k < 0:
+            k += len(self._resolve())
+        return self._store.part(self._key, self._path + (('item', k),), type(value))
+
+    def __getitem__(self, k):
+        """Get item k."""
+        value = self._resolve()[k]
+        return value if type(k) is slice else self._item(k, value)
+
+    def __setitem__(self, k, value):
+        """Set item k."""
+        obj = self._resolve()
+        self._store.dirty.add(self._key)
+        obj[k] = _unwrap(value)
+
+    def __delitem__(self, k):
+        """Delete item k."""
+        obj = self._resolve()
+        self._store.dirty.add(self._key)
+        del obj[k]
+
+    def __iadd__(self, other):
+        """Extend the list."""
+        obj = self._resolve()
+        self._store.dirty.add(self._key)
+        obj += other
+        return self
+
+    def __iter__(self):
+        """Iterate over the items, or the keys of a dict."""
+        obj = self._resolve()
+        if isinstance(obj, dict):
+            return iter(list(obj))
+        return iter([self._item(n, v) for (n, v) in enumerate(obj)])
+
+    def __len__(self):
+        """Number of items."""
+        return len(self._resolve())
+
+    def __contains__(self, value):
+        """True if value is an item, or a key of a dict."""
+        return _unwrap(value) in self._resolve()
+
+    def __eq__(self, other):
+        """Compare the object to other."""
+        return self._resolve() == _unwrap(other)
+
+    def __ne__(self, other):
+        """Compare the object to other."""
+        return self._resolve() != _unwrap(other)
+
+    def __hash__(self):
+        """Hash of the object, for resources."""
+        return hash(self._resolve())
+
+    def __bool__(self):
+        """Truth of the object."""
+        return bool(self._resolve())
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        """String of the object."""
+        return str(self._resolve())
+
+    def __repr__(self):
+        """Show the object."""
+        return repr(self._resolve())
+
+
+class _Pickler(pickle.Pickler):
+    """Pickle resources, with the factory and other stored resources by reference."""
+
+    def __init__(self, fh, store):
+        pickle.Pickler.__init__(self, fh, pickle.HIGHEST_PROTOCOL)
+        self.store = store
+
+    def persistent_id(self, obj):
+        if obj is self.store.factory:
+            return 'factory'
+        elif type(obj) is StoredResource:
+            return (obj._key, obj._cls.__name__, obj.id)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """Unpickle resources pickled by _Pickler."""
+
+    def __init__(self, fh, store):
+        pickle.Unpickler.__init__(self, fh)
+        self.store = store
+
+    def persistent_load(self, pid):
+        if pid == 'factory':
+            return self.store.factory
+        (key, clsname, ident) = pid
+        return self.store.proxy(key, getattr(_factory, clsname), ident)
+
+
+class ResourceStore(object):
+    """Keep at most max_resident resources in memory, the rest in sqlite.
+
+    path is the database file, by default a temporary file removed by
+    close(). The contents are only meaningful to the ResourceStore that
+    wrote them.
+
+    A pinned resource (pin() or pinned()) is never spilled to disk, nor
+    is one while a method of it or of one of its parts is running.
+
+    Not thread-safe: use a ResourceStore, and its factory, from one thread.
+    """
+
+    def __init__(self, path=None, max_resident=1000):
+        """Initialize ResourceStore."""
+        self.max_resident = max(1, max_resident)
+        self.factory = None
+        self.remove = path is None
+        if path is None:
+            (fd, path) = tempfile.mkstemp(suffix='.db', prefix='iiif-prezi-')
+            os.close(fd)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS resources (key INTEGER PRIMARY KEY, data BLOB)")
+        row = self.db.execute("SELECT MAX(key) FROM resources").fetchone()
+        self.next_key = (row[0] or 0) + 1
+        self.resident = OrderedDict()
+        self.dirty = set()
+        self.pins = {}
+        self.proxies = weakref.WeakValueDictionary()
+        self.parts = weakref.WeakValueDictionary()
+        self.loads = 0
+        self.spills = 0
+
+    def close(self):
+        """Close the database, and remove it if it was temporary."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            self.resident.clear()
+            if self.remove:
+                os.remove(self.path)
+
+    def add(self, obj):
+        """Store resource obj, return the StoredResource for it."""
+        if self.factory is None:
+            raise ConfigurationError("ResourceStore must be set on a ManifestFactory")
+        key = self.next_key
+        self.next_key += 1
+        proxy = self.proxy(key, type(obj), obj.id)
+        self.dirty.add(key)
+        self._resident(key, obj)
+        return proxy
+
+    def proxy(self, key, cls, ident):
+        """Return the StoredResource for key, the same one each time while it's in use."""
+        proxy = self.proxies.get(key)
+        if proxy is None:
+            proxy = StoredResource(self, key, cls, ident)
+            self.proxies[key] = proxy
+        return proxy
+
+    def part(self, key, path, cls):
+        """Return the _Part for path in the resource key, the same one each time while it's in use."""
+        proxy = self.parts.get((key, path))
+        if proxy is None or proxy._cls is not cls:
+            proxy = _Part(self, key, path, cls)
+            self.parts[(key, path)] = proxy
+        return proxy
+
+    def hold(self, key):
+        """Keep the resource key in memory until release(key)."""
+        self.load(key)
+        self.pins[key] = self.pins.get(key, 0) + 1
+
+    def release(self, key):
+        """Undo hold(key)."""
+        count = self.pins.pop(key, 0) - 1
+        if count > 0:
+            self.pins[key] = count
+
+    def pin(self, resource):
+        """Keep resource, a StoredResource, in memory until it is unpinned."""
+        self.hold(resource._key)
+
+    def unpin(self, resource):
+        """Undo pin(), after which resource may be spilled again."""
+        self.release(resource._key)
+
+    @contextlib.contextmanager
+    def pinned(self, *resources):
+        """Keep resources in memory for the duration of a with block."""
+        for resource in resources:
+            self.pin(resource)
+        try:
+            yield resources
+        finally:
+            for resource in resources:
+                self.unpin(resource)
+
+    def load(self, key):
+        """Return the resource for key, reading it from disk if necessary."""
+        obj = self.resident.get(key)
+        if obj is None:
+            row = self.db.execute("SELECT data FROM resources WHERE key=?", (key,)).fetchone()
+            obj = _Unpickler(io.BytesIO(row[0]), self).load()
+            self.loads += 1
+        self._resident(key, obj)
+        return obj
+
+    def _resident(self, key, obj):
+        """Make obj the most recently used resource."""
+        self.resident.pop(key, None)
+        self.resident[key] = obj
+        if len(self.resident) > self.max_resident:
+            self.spill(self.max_resident * 3 // 4)
+
+    def spill(self, keep=0):
+        """Write least recently used resources to disk until only keep are in memory."""
+        rows = []
+        for key in list(self.resident):
+            if len(self.resident) <= keep:
+                break
+            if key in self.pins:
+                continue
+            if key in self.dirty:
+                fh = io.BytesIO()
+                _Pickler(fh, self).dump(self.resident[key])
+                rows.append((key, sqlite3.Binary(fh.getvalue())))
+                self.dirty.discard(key)
+            del self.resident[key]
+        if rows:
+            self.db.executemany("INSERT OR REPLACE INTO resources VALUES (?, ?)", rows)
+            self.spills += len(rows)
+
+    def __len__(self):
+        """Number of resources stored."""
+        return self.next_key - 1
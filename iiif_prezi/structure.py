@@ -0,0 +1,283 @@
+"""Index of which Canvases are in which Ranges of a Manifest.
+
+    index = StructureIndex(manifest)
+    index.ranges_for(canvas)      # Ranges with canvas, outermost first
+    index.canvases(rng)           # @ids of rng's Canvases, in order
+    index.contains(rng, canvas)
+    index.depth(rng)
+    for (depth, rng) in index.toc():
+        ...
+
+Canvases are numbered by their position in the Manifest's first
+Sequence, and each Range's Canvases are held as sorted intervals of
+positions rather than as a list of @ids. The positions are cut at every
+interval's start and end into segments that are each in the same Ranges,
+so finding the Ranges that have a Canvas is a binary search. Fragments
+of a Canvas (canvas.json#xywh=...) count as the whole Canvas.
+
+The index is not updated when the Manifest changes; make a new one.
+ranges_from_toc() makes the Ranges for a table of contents.
+"""
+
+from __future__ import unicode_literals
+from bisect import bisect_right
+
+from .factory import RawResource, DataError, StructuralError
+from .util import STR_TYPES
+
+
+def _canvas_id(cvs):
+    """@id of the Canvas that cvs (@id, fragment, dict or Canvas) is or is part of."""
+    if type(cvs) in STR_TYPES:
+        ident = cvs
+    elif isinstance(cvs, dict):
+        ident = cvs.get('@id', '')
+    else:
+        ident = cvs.id
+    return ident.split('#', 1)[0]
+
+
+def _members(rng):
+    """(canvases, ranges, within) of Range or RawResource rng."""
+    if isinstance(rng, RawResource):
+        js = rng.toJSON()
+        (canvases, ranges, within) = (js.get('canvases', []), js.get('ranges', []), js.get('within', ''))
+    else:
+        (canvases, ranges, within) = (rng.canvases, rng.ranges, rng.within)
+    if isinstance(within, list):
+        within = within[0] if within else ''
+    if isinstance(within, dict):
+        within = within.get('@id', '')
+    elif type(within) not in STR_TYPES:
+        within = getattr(within, 'id', '')
+    return (canvases, ranges, within)
+
+
+def _intervals(positions):
+    """Sorted, merged [start, end) intervals covering positions."""
+    intervals = []
+    for pos in sorted(set(positions)):
+        if intervals and intervals[-1][1] == pos:
+            intervals[-1][1] = pos + 1
+        else:
+            intervals.append([pos, pos + 1])
+    return [tuple(i) for i in intervals]
+
+
+class StructureIndex(object):
+    """Canvas to Range and Range to Canvas index of manifest's structures.
+
+    unknown lists (Range @id, Canvas @id) for Canvases in a Range that
+    aren't in the first Sequence, and so aren't in the index.
+    """
+
+    def __init__(self, manifest):
+        """Initialize StructureIndex for manifest."""
+        self.manifest = manifest
+        seq = manifest.sequences[0] if manifest.sequences else None
+        self.ids = [c.id for c in seq.canvases] if seq is not None else []
+        self.positions = dict([(c, i) for (i, c) in enumerate(self.ids)])
+        self.ranges = list(manifest.structures)
+        self._by_id = {}
+        for (i, rng) in enumerate(self.ranges):
+            if rng.id:
+                self._by_id[rng.id] = i
+        self.unknown = []
+        self.intervals = []
+        self.children = [[] for r in self.ranges]
+        self.parents = [None] * len(self.ranges)
+        for (i, rng) in enumerate(self.ranges):
+            (canvases, ranges, within) = _members(rng)
+            positions = []
+            for cvs in canvases:
+                cid = _canvas_id(cvs)
+                pos = self.positions.get(cid)
+                if pos is None:
+                    self.unknown.append((rng.id, cid))
+                else:
+                    positions.append(pos)
+            self.intervals.append(_intervals(positions))
+            for sub in ranges:
+                j = self._by_id.get(sub if type(sub) in STR_TYPES else sub.id)
+                if j is not None and self.parents[j] is None and j != i:
+                    self.parents[j] = i
+                    self.children[i].append(j)
+            if within in self._by_id and self.parents[i] is None:
+                j = self._by_id[within]
+                if j != i:
+                    self.parents[i] = j
+                    self.children[j].append(i)
+        self._depths = self._find_depths()
+        self._make_segments()
+
+    def _find_depths(self):
+        """Nesting depth of each Range, 0 for those in no other Range."""
+        depths = [None] * len(self.ranges)
+        for i in range(len(self.ranges)):
+            chain = []
+            j = i
+            while j is not None and depths[j] is None:
+                if j in chain:
+                    raise StructuralError("Ranges are within each other: %s" % self.ranges[j].id)
+                chain.append(j)
+                j = self.parents[j]
+            depth = -1 if j is None else depths[j]
+            for j in reversed(chain):
+                depth += 1
+                depths[j] = depth
+        return depths
+
+    def _make_segments(self):
+        """Cut the positions into segments, each in the same Ranges."""
+        starts = {}
+        ends = {}
+        for (i, intervals) in enumerate(self.intervals):
+            for (start, end) in intervals:
+                starts.setdefault(start, []).append(i)
+                ends.setdefault(end, []).append(i)
+        self._bounds = sorted(set(starts) | set(ends))
+        self._segments = []
+        shared = {}
+        active = set()
+        for pos in self._bounds:
+            active.difference_update(ends.get(pos, []))
+            active.update(starts.get(pos, []))
+            key = tuple(sorted(active, key=lambda i: (self._depths[i], i)))
+            self._segments.append(shared.setdefault(key, key))
+
+    def _index(self, rng):
+        """Position in structures of Range, RawResource or @id rng."""
+        ident = rng if type(rng) in STR_TYPES else rng.id
+        i = self._by_id.get(ident)
+        if i is None:
+            for (i, r) in enumerate(self.ranges):
+                if r is rng:
+                    return i
+            raise DataError("Range is not in the Manifest's structures: %s" % ident)
+        return i
+
+    def position(self, cvs):
+        """Position in the Sequence of Canvas cvs (@id, fragment or Canvas), or None."""
+        return self.positions.get(_canvas_id(cvs))
+
+    def ranges_for(self, cvs, inherited=False):
+        """Ranges that have Canvas cvs, outermost first.
+
+        With inherited, also the Ranges that have it through one of their
+        sub-Ranges, such as a top Range that only lists Ranges.
+        """
+        pos = self.position(cvs)
+        if pos is None:
+            return []
+        k = bisect_right(self._bounds, pos) - 1
+        if k < 0:
+            return []
+        found = self._segments[k]
+        if inherited:
+            found = set(found)
+            for i in list(found):
+                i = self.parents[i]
+                while i is not None and i not in found:
+                    found.add(i)
+                    i = self.parents[i]
+            found = sorted(found, key=lambda i: (self._depths[i], i))
+        return [self.ranges[i] for i in found]
+
+    def contains(self, rng, cvs):
+        """True if Range rng has Canvas cvs."""
+        pos = self.position(cvs)
+        if pos is None:
+            return False
+        intervals = self.intervals[self._index(rng)]
+        k = bisect_right(intervals, (pos, float('inf'))) - 1
+        return k >= 0 and intervals[k][0] <= pos < intervals[k][1]
+
+    def canvases(self, rng):
+        """@ids of the Canvases in Range rng, in Sequence order."""
+        ids = []
+        for (start, end) in self.intervals[self._index(rng)]:
+            ids.extend(self.ids[start:end])
+        return ids
+
+    def spans(self, rng):
+        """(first, last) @ids of each contiguous run of Canvases in Range rng."""
+        return [(self.ids[start], self.ids[end - 1])
+                for (start, end) in self.intervals[self._index(rng)]]
+
+    def depth(self, rng):
+        """Nesting depth of Range rng, 0 if it is in no other Range."""
+        return self._depths[self._index(rng)]
+
+    def parent(self, rng):
+        """Range that Range rng is in, or None."""
+        i = self.parents[self._index(rng)]
+        return None if i is None else self.ranges[i]
+
+    def toc(self):
+        """Generate (depth, Range) for the table of contents, depth first.
+
+        Ranges that aren't in another are in the order of their first
+        Canvas, and the rest in the order their parent lists them.
+        """
+        def first(i):
+            intervals = self.intervals[i]
+            return (intervals[0][0] if intervals else len(self.ids), i)
+        stack = [i for i in sorted([i for (i, p) in enumerate(self.parents) if p is None],
+                                   key=first, reverse=True)]
+        while stack:
+            i = stack.pop()
+            yield (self._depths[i], self.ranges[i])
+            stack.extend(reversed(self.children[i]))
+
+
+def ranges_from_toc(manifest, entries, ident="toc"):
+    """Add Ranges to manifest for the table of contents entries.
+
+    entries is a list of (depth, label, Canvas or @id) in order, from
+    depth 0. Each entry's Range has the Canvases from its own up to the
+    next entry at the same or a lesser depth, or to the end of the
+    Sequence, and is in the Range of the entry before it with a lesser
+    depth. Ranges get @ids from ident and their number. Returns the list
+    of new Ranges.
+    """
+    seq = manifest.sequences[0]
+    ids = [c.id for c in seq.canvases]
+    positions = dict([(c, i) for (i, c) in enumerate(ids)])
+    starts = []
+    for (depth, label, cvs) in entries:
+        pos = positions.get(_canvas_id(cvs))
+        if pos is None:
+            raise StructuralError("Table of contents entry '%s' is not on a Canvas in the Sequence: %s" % (
+                label, _canvas_id(cvs)))
+        if depth > (starts[-1][0] + 1 if starts else 0):
+            raise DataError("Table of contents entry '%s' is more than one level deeper than the last" % label)
+        starts.append((depth, pos))
+    # Where each entry's Range ends: the start of the next entry that
+    # isn't deeper, found from the end with a stack of deeper entries
+    ends = [len(ids)] * len(starts)
+    pending = []
+    for n in range(len(starts) - 1, -1, -1):
+        (depth, pos) = starts[n]
+        while pending and starts[pending[-1]][0] > depth:
+            pending.pop()
+        if pending:
+            ends[n] = starts[pending[-1]][1]
+        pending.append(n)
+    factory = manifest._factory
+    made = [factory.range(ident="%s-%d" % (ident, n + 1), label=entries[n][1])
+            for n in range(len(entries))]
+    existing = set([r.id for r in manifest.structures])
+    for rng in made:
+        if rng.id in existing:
+            raise DataError("Cannot have two Ranges with the same identity", manifest)
+    open_ranges = []
+    for (n, rng) in enumerate(made):
+        (depth, pos) = starts[n]
+        rng.canvases = ids[pos:max(ends[n], pos + 1)]
+        del open_ranges[depth:]
+        if open_ranges:
+            open_ranges[-1].add_range(rng)
+        rng._parent = manifest
+        manifest.structures.append(rng)
+        open_ranges.append(rng)
+    return made
@@ -0,0 +1,94 @@
+"""Set the thumbnails of every Manifest and Canvas in a Collection.
+
+    engine = ThumbnailEngine(width=200, height=200)
+    engine.populate(collection)
+
+Thumbnails are made as by BaseMetadataObject.get_thumbnail(), from the
+IIIF Image service of each Canvas's first image: one of the sizes the
+service lists, which level 0 servers have ready, or else a size worked
+out from the image's width and height. No requests are made to the
+image servers. The request for each service and image size is
+memoized, so Canvases that share an image, and a Manifest and its first
+Canvas, are only worked out once.
+"""
+
+from __future__ import unicode_literals
+
+from .factory import (Canvas, Collection, Manifest, THUMBNAIL_SIZE,
+                      _image_request, _service_info, _thumbnail_image, _thumbnail_source)
+
+
+class ThumbnailEngine(object):
+    """Make thumbnails of width and height, or squares, from Image services.
+
+    replace: replace thumbnails that are already set, rather than leave them
+    """
+
+    def __init__(self, width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE, square=False, replace=False):
+        """Initialize ThumbnailEngine."""
+        self.width = width
+        self.height = height
+        self.square = square
+        self.replace = replace
+        self.cache = {}
+        self.hits = 0
+        self.set = 0
+
+    def request(self, image):
+        """Return (URL, width, height) for a thumbnail of Image image, or None."""
+        info = _service_info(image.service, image._factory)
+        if info is None:
+            return None
+        key = (info, image.width, image.height)
+        found = self.cache.get(key)
+        if found is None:
+            found = self.cache[key] = _image_request(
+                info, self.width, self.height, self.square, image.width, image.height)
+        else:
+            self.hits += 1
+        return found
+
+    def thumbnail(self, resource):
+        """Return a thumbnail Image for resource, or None if it has no IIIF image."""
+        image = _thumbnail_source(resource)
+        if image is None:
+            return None
+        found = self.request(image)
+        if found is None:
+            return None
+        (url, w, h) = found
+        return _thumbnail_image(image._factory, url, w, h, image.service)
+
+    def populate(self, resource):
+        """Set the thumbnails of resource and the Manifests and Canvases in it.
+
+        resource is a Collection, Manifest or Canvas. Returns the number
+        of thumbnails set.
+        """
+        before = self.set
+        if isinstance(resource, Collection):
+            for coll in resource.collections:
+                if isinstance(coll, Collection):
+                    self.populate(coll)
+            for mfst in resource.manifests:
+                if isinstance(mfst, Manifest):
+                    self.populate(mfst)
+        elif isinstance(resource, Manifest):
+            for seq in resource.sequences:
+                for cvs in getattr(seq, 'canvases', []):
+                    if isinstance(cvs, Canvas):
+                        self._set(cvs)
+            self._set(resource)
+        elif isinstance(resource, Canvas):
+            self._set(resource)
+        return self.set - before
+
+    def _set(self, resource):
+        """Set the thumbnail of resource, if it has none or replace is set."""
+        if resource.thumbnail and not self.replace:
+            return
+        thumb = self.thumbnail(resource)
+        if thumb is not None:
+            # Replace rather than add to the thumbnail, as setting would
+            object.__setattr__(resource, 'thumbnail', thumb)
+            self.set += 1
@@ -0,0 +1,219 @@
+"""Write static IIIF Image API level 0 tiles and info.json for local image files.
+
+    fac.set_iiif_image_info("2.0", "0")
+    fac.set_image_api_dir("/var/www/iiif")
+    tiler = TileGenerator(fac, tile_size=512, processes=4)
+    img = canvas.annotation().image("page1", iiif=True)
+    tiler.add(img, "page1.tif")
+    tiler.run()
+
+For each image, the tiles of every scale factor, the full image at each
+of the sizes and info.json are written under the image's identifier in
+the image API directory, as a static web server needs them. Images are
+done in parallel in a pool of processes. Each tile is written as soon as
+it is cut, and each scale's image is made by halving the one before, so
+only the full image and one reduced copy are held at once. Once done,
+each Image is given the height and width, and its ImageService the
+sizes and tiles, so viewers needn't request info.json. Needs Pillow.
+"""
+
+from __future__ import unicode_literals
+import json
+import multiprocessing
+import os
+
+from .factory import ConfigurationError, DataError, get_pil_image, _write_chunks
+
+TILE_SIZE = 512
+JPEG_QUALITY = 90
+
+
+def scale_factors(width, height, tile_size=TILE_SIZE):
+    """Scale factors, 1, 2, 4..., down to the one at which the image fits in a tile."""
+    factors = [1]
+    while (width + factors[-1] - 1) // factors[-1] > tile_size or \
+            (height + factors[-1] - 1) // factors[-1] > tile_size:
+        factors.append(factors[-1] * 2)
+    return factors
+
+
+def _scaled(n, factor):
+    """Return the size of n pixels at scale factor, rounded up."""
+    return (n + factor - 1) // factor
+
+
+def tile_layout(width, height, tile_size=TILE_SIZE):
+    """Generate (factor, region, size, box) of each tile, from the largest factor.
+
+    region and size are as in the Image API request for the tile, and
+    box is (left, upper, right, lower) of the tile in the image at that
+    scale factor.
+    """
+    for factor in reversed(scale_factors(width, height, tile_size)):
+        span = tile_size * factor
+        for y in range(0, height, span):
+            for x in range(0, width, span):
+                (rw, rh) = (min(span, width - x), min(span, height - y))
+                (sw, sh) = (_scaled(rw, factor), _scaled(rh, factor))
+                if rw == width and rh == height:
+                    region = "full"
+                else:
+                    region = "%d,%d,%d,%d" % (x, y, rw, rh)
+                box = (x // factor, y // factor, x // factor + sw, y // factor + sh)
+                yield (factor, region, "%d," % sw, box)
+
+
+def level0_info(service_id, width, height, tile_size=TILE_SIZE, profile="", context=""):
+    """info.json dict for a level 0 service of an image width by height."""
+    factors = scale_factors(width, height, tile_size)
+    info = {
+        "@context": context or "http://iiif.io/api/image/2/context.json",
+        "@id": service_id,
+        "protocol": "http://iiif.io/api/image",
+        "profile": profile or "http://iiif.io/api/image/2/level0.json",
+        "width": width,
+        "height": height,
+        "sizes": [{"width": _scaled(width, f), "height": _scaled(height, f)}
+                  for f in reversed(factors)],
+        "tiles": [{"width": tile_size, "scaleFactors": factors}]
+    }
+    return info
+
+
+def _halve(img, pil_image):
+    """Return img at half the size, rounded up."""
+    if hasattr(img, 'reduce'):
+        return img.reduce(2)
+    return img.resize((_scaled(img.size[0], 2), _scaled(img.size[1], 2)), pil_image.BILINEAR)
+
+
+def _save(img, path, quality):
+    """Save img as JPEG at path, making its directory."""
+    dr = os.path.dirname(path)
+    if not os.path.isdir(dr):
+        os.makedirs(dr)
+    img.save(path, 'JPEG', quality=quality)
+
+
+def make_tiles(fn, base, service_id, tile_size=TILE_SIZE, quality=JPEG_QUALITY,
+               profile="", context=""):
+    """Write the tiles, sizes and info.json of image file fn in directory base.
+
+    base is where service_id is served from. Returns the info.json dict.
+    """
+    pil_image = get_pil_image()
+    if pil_image is None:
+        raise ConfigurationError("Making tiles needs Pillow (PIL)")
+    src = pil_image.open(fn)
+    try:
+        img = src.convert('RGB') if src.mode != 'RGB' else src
+        (width, height) = img.size
+        info = level0_info(service_id, width, height, tile_size, profile, context)
+        _save(img, os.path.join(base, "full", "full", "0", "default.jpg"), quality)
+        tiles = {}
+        for (f, region, size, box) in tile_layout(width, height, tile_size):
+            tiles.setdefault(f, []).append((region, size, box))
+        level = img
+        factor = 1
+        for f in sorted(tiles):
+            while factor < f:
+                level = _halve(level, pil_image)
+                factor *= 2
+            for (region, size, box) in tiles[f]:
+                _save(level.crop(box), os.path.join(base, region, size, "0", "default.jpg"), quality)
+            if tiles[f][0][0] != "full":
+                # the image at this size, unless that was the only tile
+                _save(level, os.path.join(base, "full", "%d," % level.size[0], "0", "default.jpg"), quality)
+        img = level = None
+    finally:
+        src.close()
+    _write_chunks(os.path.join(base, "info.json"), [json.dumps(info, indent=2)])
+    return info
+
+
+def _make_tiles(args):
+    """make_tiles() for a pool worker, returning (key, info, error)."""
+    (key, fn, base, service_id, tile_size, quality, profile, context) = args
+    try:
+        return (key, make_tiles(fn, base, service_id, tile_size, quality, profile, context), None)
+    except Exception as e:
+        return (key, None, "%s: %s" % (fn, e))
+
+
+class TileGenerator(object):
+    """Make level 0 tiles for Images with IIIF services, from local files.
+
+    out_dir: directory to write to, by default the factory's image API
+        directory (set_image_api_dir()); the factory's base image URI
+        should be where that is served
+    tile_size: width and height of tiles
+    quality: JPEG quality
+    processes: number of worker processes, None for one per CPU and 0
+        to make the tiles in this process
+    """
+
+    def __init__(self, factory, out_dir=None, tile_size=TILE_SIZE, quality=JPEG_QUALITY, processes=None):
+        """Initialize TileGenerator."""
+        if str(factory.default_image_api_level) != "0":
+            raise ConfigurationError(
+                "Static tiles are level 0: use set_iiif_image_info(version, 0) on the factory")
+        if not factory.default_image_api_version.startswith('2'):
+            raise ConfigurationError("Static tiles are made for Image API 2.x")
+        self.factory = factory
+        self.out_dir = out_dir or factory.default_image_api_dir
+        if not self.out_dir:
+            raise ConfigurationError("Image API directory on Factory must be set to write tiles")
+        self.tile_size = tile_size
+        self.quality = quality
+        self.processes = processes
+        self.images = []
+        self.failed = []
+
+    def add(self, image, fn=None):
+        """Make tiles for Image image from file fn, by default its identifier.
+
+        A relative fn is looked for in the factory's base image directory,
+        as Image.set_hw_from_file() does.
+        """
+        if not image._identifier:
+            raise ConfigurationError("Image is not configured with IIIF support")
+        fn = fn or image._identifier
+        if not os.path.exists(fn):
+            fn2 = os.path.join(self.factory.default_base_image_dir, fn)
+            if not os.path.exists(fn2):
+                raise DataError("Could not find image file: %s" % fn)
+            fn = fn2
+        self.images.append((image, fn))
+
+    def run(self):
+        """Make the tiles of the Images added, and set their sizes and tiles.
+
+        Returns the number of Images done. Files that couldn't be read are
+        in failed, with the reason, and their Images are left as they were.
+        """
+        jobs = []
+        for (i, (image, fn)) in enumerate(self.images):
+            svc = image.service
+            jobs.append((i, fn, os.path.join(self.out_dir, image._identifier), svc.id,
+                         self.tile_size, self.quality, svc.profile, svc.context))
+        if self.processes == 0:
+            results = [_make_tiles(job) for job in jobs]
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                results = pool.imap_unordered(_make_tiles, jobs)
+                results = list(results)
+            finally:
+                pool.close()
+                pool.join()
+        done = 0
+        for (i, info, error) in results:
+            if info is None:
+                self.failed.append(error)
+                continue
+            (image, fn) = self.images[i]
+            image.set_hw(info['height'], info['width'])
+            image.service.set_info(info)
+            done += 1
+        self.images = []
+        return done
@@ -0,0 +1,451 @@
+"""Upgrade Presentation API JSON to a later version, without building resources.
+
+    upgrader = Upgrader("3.0")
+    js = upgrader.upgrade(json.load(fh))
+
+    pipeline = UpgradePipeline("2.1", processes=8, sample=0.01)
+    stats = pipeline.run("corpus/", "upgraded/")
+
+Documents are upgraded as JSON: each object is rewritten by the steps
+from its version to the target, from the leaves up, in one walk, and the
+top level object is then finished (its @context and, for 3.0, its
+structures). The steps are:
+
+ * 0.9/1.0 to 2.1: the 2 context, cnt:chars as chars, and the 0.9
+   agent, date and location properties as metadata pairs
+ * 2.0/2.1 to 3.0, as in 3.0/example.json: id and type, unprefixed
+   types, body and target, language maps, rights, the members of
+   Sequences and Ranges, and Ranges nested within the Ranges that list
+   them
+
+UpgradePipeline upgrades every .json file in a directory tree in a pool
+of processes, and checks a sample of the 2.1 Manifests and Collections
+by reading them with ManifestReader. Compressed copies of the files written are removed
+as out of date; precompress_tree() in iiif_prezi.compress makes them
+again.
+"""
+
+from __future__ import unicode_literals
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from collections import OrderedDict
+
+from .compress import remove_copies
+from .factory import DataError, KEY_ORDER_HASH, _write_chunks
+from .loader import ManifestReader
+from .util import STR_TYPES
+
+CONTEXT_1 = "http://www.shared-canvas.org/ns/context.json"
+CONTEXT_2 = "http://iiif.io/api/presentation/2/context.json"
+CONTEXT_3 = "http://iiif.io/api/presentation/3/context.json"
+ANNO_CONTEXT = "http://w3.org/ns/anno.jsonld"
+
+VERSIONS = ["1.0", "2.1", "3.0"]
+# Versions that are upgraded as another
+VERSION_ALIASES = {"0.9": "1.0", "2": "2.1", "2.0": "2.1", "3": "3.0"}
+
+TYPES_3 = {
+    'sc:Collection': 'Collection', 'sc:Manifest': 'Manifest', 'sc:Sequence': 'Sequence',
+    'sc:Canvas': 'Canvas', 'sc:Range': 'Range', 'sc:AnnotationList': 'AnnotationPage',
+    'sc:Layer': 'AnnotationCollection', 'oa:Annotation': 'Annotation',
+    'oa:SpecificResource': 'SpecificResource', 'oa:Choice': 'Choice',
+    'oa:FragmentSelector': 'FragmentSelector', 'oa:SvgSelector': 'SvgSelector',
+    'cnt:ContentAsText': 'TextualBody', 'dctypes:Image': 'Image', 'dctypes:Sound': 'Sound',
+    'dctypes:Audio': 'Sound', 'dctypes:Video': 'Video', 'dctypes:Text': 'Text',
+    'dctypes:Dataset': 'Dataset'
+}
+RENAME_3 = {'@id': 'id', '@type': 'type', 'resource': 'body', 'on': 'target', 'license': 'rights'}
+LANGUAGE_PROPERTIES = ('label', 'description', 'attribution')
+# Properties of 2.x Ranges that list the Canvases and Ranges in them
+RANGE_MEMBERS = (('canvases', 'Canvas'), ('ranges', 'Range'))
+# Where the 3.0 keys go in KEY_ORDER
+KEY_ORDER_3 = dict([(new, old) for (old, new) in RENAME_3.items()] + [('members', 'canvases')])
+
+OLD_PROPERTIES = ('agent', 'date', 'location')
+# Top level types whose results can be checked with ManifestReader
+VALIDATED_TYPES = ('sc:Manifest', 'sc:Collection')
+
+
+def detect_version(js):
+    """Version of the top level JSON object js from its @context: 1.0, 2.1 or 3.0."""
+    ctx = js.get('@context') if isinstance(js, dict) else None
+    if ctx is None:
+        raise DataError("Top level resource has no @context")
+    if type(ctx) != list:
+        ctx = [ctx]
+    for c in ctx:
+        if c == CONTEXT_3:
+            return "3.0"
+        elif c == CONTEXT_2:
+            return "2.1"
+        elif c == CONTEXT_1:
+            return "1.0"
+    raise DataError("Top level @context is not known: %r" % js['@context'])
+
+
+def _version(version):
+    """Version as in VERSIONS."""
+    version = VERSION_ALIASES.get(version, version)
+    if version not in VERSIONS:
+        raise DataError("Can't upgrade to or from version %s" % version)
+    return version
+
+
+def _node_1_to_2(d, key):
+    """Upgrade a 0.9 or 1.0 object to 2.1."""
+    if 'cnt:chars' in d and 'chars' not in d:
+        d['chars'] = d.pop('cnt:chars')
+    if '@type' in d:
+        for prop in OLD_PROPERTIES:
+            if prop in d:
+                md = d.setdefault('metadata', [])
+                if isinstance(md, list):
+                    md.append(OrderedDict([('label', prop.title()), ('value', d.pop(prop))]))
+    return d
+
+
+def _top_1_to_2(js):
+    """Upgrade the top level object from 1.0."""
+    js['@context'] = CONTEXT_2
+    return js
+
+
+def _language_map(value):
+    """A 2.x string property as a 3.0 language map, or as it is if it has no languages."""
+    values = value if type(value) == list else [value]
+    if not any(isinstance(v, dict) and '@language' in v for v in values):
+        return value
+    found = OrderedDict()
+    for v in values:
+        if isinstance(v, dict):
+            (lang, v) = (v.get('@language') or '@none', v.get('@value', ''))
+        else:
+            lang = '@none'
+        found.setdefault(lang, []).append(v)
+    return OrderedDict([(k, v[0] if len(v) == 1 else v) for (k, v) in found.items()])
+
+
+def _reference(ident, typ):
+    """3.0 reference to ident, of type typ."""
+    if isinstance(ident, dict):
+        return ident
+    return OrderedDict([('id', ident), ('type', typ)])
+
+
+def _ordered_3(d):
+    """Return d in KEY_ORDER, with the 3.0 keys where the keys they replace go."""
+    return OrderedDict(sorted(d.items(), key=lambda kv: KEY_ORDER_HASH.get(
+        KEY_ORDER_3.get(kv[0], kv[0]), 1000)))
+
+
+def _node_2_to_3(d, key):
+    """Upgrade a 2.x object to 3.0."""
+    if '@value' in d:
+        # in a language property, done by its parent
+        return d
+    service = key == 'service'
+    types = d.get('@type')
+    if type(types) != list:
+        types = [types]
+    # the IIIF type, of possibly several
+    typ = ([t for t in types if type(t) in STR_TYPES and t in TYPES_3] or types)[0]
+    for prop in LANGUAGE_PROPERTIES:
+        if prop in d:
+            d[prop] = _language_map(d[prop])
+    for pair in d.get('metadata', []) if isinstance(d.get('metadata'), list) else []:
+        if isinstance(pair, dict):
+            for prop in ('label', 'value'):
+                if prop in pair:
+                    pair[prop] = _language_map(pair[prop])
+    if typ == 'sc:Sequence' and 'canvases' in d:
+        d['members'] = d.pop('canvases')
+    elif typ == 'sc:Range':
+        members = d.get('members') or []
+        if not members:
+            for (prop, mtyp) in RANGE_MEMBERS:
+                members.extend([_reference(m, mtyp) for m in d.pop(prop, [])])
+        for (prop, mtyp) in RANGE_MEMBERS:
+            d.pop(prop, None)
+        if members:
+            d['members'] = members
+    elif typ == 'sc:Collection':
+        members = d.get('members') or []
+        if not members:
+            for prop in ('collections', 'manifests'):
+                members.extend([_reference(m, 'Collection' if prop == 'collections' else 'Manifest')
+                                for m in d.pop(prop, [])])
+        if members:
+            d['members'] = members
+    elif typ == 'oa:Annotation' and type(d.get('motivation')) in STR_TYPES:
+        d['motivation'] = d['motivation'].split(':', 1)[-1]
+    if type(d.get('@type')) == list:
+        d['@type'] = [TYPES_3.get(t, t) if type(t) in STR_TYPES else t for t in d['@type']]
+    elif typ in TYPES_3:
+        d['@type'] = TYPES_3[typ]
+    if 'otherContent' in d:
+        d['otherContent'] = [_reference(o, 'AnnotationPage') for o in d['otherContent']]
+    new = OrderedDict()
+    for (k, v) in d.items():
+        if service and k == '@type':
+            # Image API services keep their 2.x form, but for id
+            new[k] = v
+        else:
+            new[RENAME_3.get(k, k)] = v
+    return _ordered_3(new)
+
+
+def _nest_ranges(ranges):
+    """Ranges with those that other Ranges list nested within them, in order."""
+    by_id = OrderedDict()
+    for rng in ranges:
+        if isinstance(rng, dict) and rng.get('id'):
+            by_id[rng['id']] = rng
+    nested = set()
+    for rng in by_id.values():
+        for (i, member) in enumerate(rng.get('members', [])):
+            mid = member.get('id') if isinstance(member, dict) else None
+            if mid in by_id and mid != rng['id'] and mid not in nested and \
+                    member.get('type') == 'Range' and len(member) == 2:
+                rng['members'][i] = by_id[mid]
+                nested.add(mid)
+    return [r for r in ranges if not (isinstance(r, dict) and r.get('id') in nested)]
+
+
+def _top_2_to_3(js):
+    """Upgrade the top level object from 2.x."""
+    js['@context'] = [CONTEXT_3, ANNO_CONTEXT]
+    if isinstance(js.get('structures'), list):
+        js['structures'] = _nest_ranges(js['structures'])
+    return _ordered_3(js)
+
+
+# version: (next version, object step, top level step)
+STEPS = {
+    "1.0": ("2.1", _node_1_to_2, _top_1_to_2),
+    "2.1": ("3.0", _node_2_to_3, _top_2_to_3)
+}
+
+
+class Upgrader(object):
+    """Upgrade the JSON of resources to version target."""
+
+    def __init__(self, target="2.1"):
+        """Initialize Upgrader."""
+        self.target = _version(target)
+
+    def steps(self, version):
+        """List of the (next version, object step, top level step) from version."""
+        version = _version(version)
+        if VERSIONS.index(version) > VERSIONS.index(self.target):
+            raise DataError("Can't downgrade from %s to %s" % (version, self.target))
+        steps = []
+        while version != self.target:
+            steps.append(STEPS[version])
+            version = STEPS[version][0]
+        return steps
+
+    def upgrade(self, js, version=None):
+        """Return the upgraded JSON of top level resource js.
+
+        js is changed in place where it can be. version is detected from
+        the @context if not given.
+        """
+        steps = self.steps(version or detect_version(js))
+        if not steps:
+            return js
+        node_steps = [s[1] for s in steps]
+        js = self._walk(js, node_steps, None)
+        for s in steps:
+            js = s[2](js)
+        return js
+
+    def _walk(self, value, steps, key):
+        """Upgrade value, the value of key, from the leaves up."""
+        if isinstance(value, dict):
+            for (k, v) in value.items():
+                if isinstance(v, (dict, list)):
+                    value[k] = self._walk(v, steps, k)
+            for step in steps:
+                value = step(value, key)
+            return value
+        elif isinstance(value, list):
+            return [self._walk(v, steps, key) if isinstance(v, (dict, list)) else v for v in value]
+        return value
+
+    def upgrade_file(self, src, dst, compact=False):
+        """Upgrade the JSON in file src, writing it to dst.
+
+        Returns (version it was, JSON written). Any compressed copies of
+        dst are removed.
+        """
+        with io.open(src, 'rb') as fh:
+            data = fh.read().decode('utf-8-sig')
+        try:
+            js = json.loads(data, object_pairs_hook=OrderedDict)
+        except ValueError as e:
+            raise DataError("Invalid JSON: %s" % e)
+        version = detect_version(js)
+        js = self.upgrade(js, version)
+        if compact:
+            out = json.dumps(js, ensure_ascii=False, separators=(',', ':'))
+        else:
+            out = json.dumps(js, ensure_ascii=False, indent=2, separators=(',', ': '))
+        _write_chunks(dst, [out])
+        remove_copies(dst)
+        return (version, out)
+
+
+def validate_upgraded(data):
+    """Read data, an upgraded 2.1 Manifest or Collection, with ManifestReader; return any error."""
+    try:
+        ManifestReader(data, version="2.1").read()
+    except Exception as e:
+        # not only PresentationError: the reader can fail on unexpected structures
+        return "%s: %s" % (type(e).__name__, e)
+    return None
+
+
+def _sampled(path, sample):
+    """True if path is in the sample, a fraction of all paths, chosen by its name."""
+    return sample > 0 and (zlib.crc32(path.encode('utf-8')) & 0xffffffff) < sample * 0x100000000
+
+
+def _upgrade_job(args):
+    """Upgrade a file in a pool worker, returning (src, version, bytes, error, checked, invalid)."""
+    (src, dst, target, compact, check) = args
+    try:
+        dr = os.path.dirname(dst)
+        if dr and not os.path.isdir(dr):
+            try:
+                os.makedirs(dr)
+            except OSError:
+                # made by another worker
+                pass
+        (version, out) = Upgrader(target).upgrade_file(src, dst, compact)
+        if check:
+            # the reader only reads whole Manifests and Collections
+            js = json.loads(out)
+            check = isinstance(js, dict) and js.get('@type') in VALIDATED_TYPES
+        invalid = validate_upgraded(js) if check else None
+        return (src, version, os.path.getsize(src), None, check, invalid)
+    except Exception as e:
+        # one bad file mustn't stop the run
+        return (src, None, 0, "%s: %s" % (type(e).__name__, e), False, None)
+
+
+class UpgradeStats(object):
+    """Counts and throughput of an UpgradePipeline run."""
+
+    def __init__(self):
+        """Initialize UpgradeStats."""
+        self.files = 0
+        self.bytes = 0
+        self.versions = {}
+        self.failed = []
+        self.validated = 0
+        self.invalid = []
+        self.seconds = 0.0
+
+    def __str__(self):
+        """Summary lines."""
+        secs = self.seconds or 1e-9
+        lines = ["%d files, %.1f MB in %.1fs: %.0f files/s, %.1f MB/s" % (
+            self.files, self.bytes / 1e6, self.seconds, self.files / secs, self.bytes / 1e6 / secs)]
+        lines.append("from " + ", ".join(["%s: %d" % kv for kv in sorted(self.versions.items())]))
+        lines.append("%d failed, %d of %d validated were invalid" % (
+            len(self.failed), len(self.invalid), self.validated))
+        return "\n".join(lines)
+
+
+class UpgradePipeline(object):
+    """Upgrade every JSON file in a directory tree to version target.
+
+    processes: number of worker processes, None for one per CPU, 0 for
+        none
+    sample: fraction of the files whose results are also read with
+        ManifestReader, to check them; the loader only reads Manifests
+        and Collections up to 2.1, so other resources and 3.0 results
+        aren't checked
+    compact: write compact rather than indented JSON
+    """
+
+    def __init__(self, target="2.1", processes=None, sample=0.01, compact=False):
+        """Initialize UpgradePipeline."""
+        self.target = _version(target)
+        self.processes = processes
+        self.sample = sample
+        self.compact = compact
+
+    def jobs(self, src_dir, dst_dir):
+        """Generate the worker arguments for each .json file in src_dir."""
+        for (dr, dirs, files) in os.walk(src_dir):
+            dirs.sort()
+            rel = os.path.relpath(dr, src_dir)
+            for fn in sorted(files):
+                if fn.endswith('.json'):
+                    path = os.path.normpath(os.path.join(rel, fn))
+                    yield (os.path.join(dr, fn), os.path.join(dst_dir, path), self.target,
+                           self.compact, self.target != "3.0" and _sampled(path, self.sample))
+
+    def run(self, src_dir, dst_dir):
+        """Upgrade the files in src_dir into the same places in dst_dir; return UpgradeStats."""
+        if os.path.abspath(src_dir) == os.path.abspath(dst_dir):
+            raise DataError("Upgrade into a different directory")
+        stats = UpgradeStats()
+        start = time.time()
+        jobs = self.jobs(src_dir, dst_dir)
+        if self.processes == 0:
+            results = (_upgrade_job(job) for job in jobs)
+            self._count(results, stats)
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                self._count(pool.imap_unordered(_upgrade_job, jobs, 16), stats)
+            finally:
+                pool.close()
+                pool.join()
+        stats.seconds = time.time() - start
+        return stats
+
+    def _count(self, results, stats):
+        """Add the results of _upgrade_job() to stats."""
+        for (src, version, size, error, checked, invalid) in results:
+            if error:
+                stats.failed.append((src, error))
+                continue
+            stats.files += 1
+            stats.bytes += size
+            stats.versions[version] = stats.versions.get(version, 0) + 1
+            if checked:
+                stats.validated += 1
+                if invalid:
+                    stats.invalid.append((src, invalid))
+
+
+def main(argv=None):
+    """Command line entry point for iiif-prezi-upgrade."""
+    p = argparse.ArgumentParser(description="Upgrade a directory of Presentation API JSON")
+    p.add_argument('src', help="directory of JSON files")
+    p.add_argument('dst', help="directory to write the upgraded files to")
+    p.add_argument('--to', default="2.1", choices=["2.1", "3.0"], help="version to upgrade to (default 2.1)")
+    p.add_argument('--processes', '-p', type=int, default=None,
+                   help="worker processes (default: CPUs, 0 for none)")
+    p.add_argument('--sample', type=float, default=0.01,
+                   help="fraction of results to check with the loader (default 0.01)")
+    p.add_argument('--compact', action='store_true', help="write compact JSON")
+    args = p.parse_args(argv)
+    stats = UpgradePipeline(args.to, args.processes, args.sample, args.compact).run(args.src, args.dst)
+    print(stats)
+    for (src, error) in stats.failed + stats.invalid:
+        sys.stderr.write("%s: %s\n" % (src, error))
+    return 1 if stats.failed or stats.invalid else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,7 @@
 """IIIF Presentation API - Utility Functions."""
 
+import importlib
+
 try:  # python 3
     from urllib.parse import urlparse
 except:  # python 2
@@ -17,3 +19,27 @@ def is_http_uri(uri):
         return(False)
     up = urlparse(uri)
     return(up.scheme == 'http' or up.scheme == 'https')
+
+
+_optional_modules = {}
+
+
+def optional_import(*names):
+    """Import and return the first importable module of names, else None.
+
+    Used to defer loading optional dependencies (PIL, lxml, pyld) until
+    they are first needed. The result is cached, so repeat calls are cheap.
+    """
+    try:
+        return _optional_modules[names]
+    except KeyError:
+        pass
+    module = None
+    for name in names:
+        try:
+            module = importlib.import_module(name)
+            break
+        except Exception:
+            pass
+    _optional_modules[names] = module
+    return module
@@ -0,0 +1,426 @@
+"""Validation service for IIIF Presentation API resources.
+
+ValidatorApp is a WSGI application that reads resources with
+ManifestReader in a pool of worker processes, which are warmed up
+(reader imported, JSON-LD contexts loaded, a resource read) when the
+pool starts rather than on each request.
+
+    POST /validate       body is the JSON of the resource
+    POST /validate       form field url=... to fetch the resource from (*)
+    GET /validate?url=...                                            (*)
+    GET /metrics         request counts and latencies, Prometheus text format
+    GET /health          {"okay": true, ...} while the pool is running
+
+Validation results are JSON: okay, version, type, error (null, or the
+type and message of the error) and a list of warnings. Requests that are
+too large (413), malformed (400), can't be fetched (502), take too long
+(504) or fail unexpectedly (500) get the same form of response with okay
+false.
+
+(*) Only with allow_urls (--urls), as the service then makes requests to
+any address it is given, including ones on its own network.
+
+The iiif-prezi-validate command serves it with the standard library
+wsgiref server; for production, give ValidatorApp to any WSGI server.
+"""
+
+from __future__ import unicode_literals
+import argparse
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from collections import OrderedDict
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+try:
+    # python3
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    # fall back to python2
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+from ._version import __version__
+from .factory import ManifestFactory, PresentationError, get_urllib
+from .loader import ManifestReader, get_jsonld, load_document_local
+from .util import is_http_uri
+
+MAX_BYTES = 10 * 1024 * 1024
+TIMEOUT = 10.0
+FETCH_TIMEOUT = 10.0
+# Upper bounds of the latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STATUS = {
+    200: "200 OK",
+    400: "400 Bad Request",
+    404: "404 Not Found",
+    405: "405 Method Not Allowed",
+    413: "413 Request Entity Too Large",
+    500: "500 Internal Server Error",
+    502: "502 Bad Gateway",
+    504: "504 Gateway Timeout",
+}
+
+
+class RequestError(Exception):
+    """Request that can't be validated, with the HTTP status to respond with."""
+
+    def __init__(self, status, msg):
+        """Initialize RequestError."""
+        super(RequestError, self).__init__(msg)
+        self.status = status
+
+
+def error_record(e):
+    """JSON form of exception e."""
+    return OrderedDict([("type", e.__class__.__name__), ("message", "%s" % e.args[0] if e.args else "")])
+
+
+def warning_record(w):
+    """JSON form of PresentationWarning w."""
+    return OrderedDict([("code", w.code), ("type", w.resource_type), ("id", w.ident),
+                        ("message", w.message)])
+
+
+def validate(data, version=None):
+    """Read data (JSON text or parsed) with ManifestReader, return the result as a dict."""
+    result = OrderedDict([("okay", False), ("version", None), ("type", None),
+                          ("error", None), ("warnings", [])])
+    reader = ManifestReader(data, version=version)
+    try:
+        resource = reader.read()
+        result['okay'] = True
+        result['type'] = resource._type
+    except PresentationError as e:
+        result['error'] = error_record(e)
+    except Exception as e:
+        # Not the structure the reader expects at all
+        result['error'] = error_record(e)
+    if reader.factory is not None:
+        result['version'] = reader.factory.presentation_api_version
+        result['warnings'] = [warning_record(w) for w in reader.get_warning_records()]
+    return result
+
+
+def warm_up():
+    """Load everything validate() needs, so the first request isn't slow."""
+    get_jsonld()
+    for url in set(ManifestReader.contexts.values()):
+        load_document_local(url)
+    fac = ManifestFactory()
+    fac.set_debug("error")
+    fac.set_base_prezi_uri("http://example.org/")
+    mfst = fac.manifest(label="warm up")
+    cvs = mfst.sequence().canvas(ident="c1", label="c1")
+    cvs.set_hw(10, 10)
+    cvs.annotation().image("http://example.org/image.jpg")
+    validate(mfst.toString())
+
+
+class Metrics(object):
+    """Request counts and latencies, shared between request threads."""
+
+    def __init__(self):
+        """Initialize Metrics."""
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.results = {'valid': 0, 'invalid': 0}
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.bytes = 0
+        self.in_flight = 0
+        self.pool_restarts = 0
+
+    def start(self):
+        """Count a request starting."""
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, path, status, seconds, size=0, result=None):
+        """Count a request that finished with status after seconds."""
+        with self.lock:
+            self.in_flight -= 1
+            key = (path, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if result is not None:
+                self.results['valid' if result['okay'] else 'invalid'] += 1
+            self.bytes += size
+            if path == '/validate':
+                self.latency_count += 1
+                self.latency_sum += seconds
+                for (i, bound) in enumerate(LATENCY_BUCKETS):
+                    if seconds <= bound:
+                        self.buckets[i] += 1
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format."""
+        with self.lock:
+            lines = [
+                "# TYPE iiif_prezi_validator_requests_total counter",
+            ]
+            for ((path, status), n) in sorted(self.requests.items()):
+                lines.append('iiif_prezi_validator_requests_total{path="%s",status="%d"} %d' % (path, status, n))
+            lines.append("# TYPE iiif_prezi_validator_results_total counter")
+            for (result, n) in sorted(self.results.items()):
+                lines.append('iiif_prezi_validator_results_total{result="%s"} %d' % (result, n))
+            lines.append("# TYPE iiif_prezi_validator_latency_seconds histogram")
+            for (bound, n) in zip(LATENCY_BUCKETS, self.buckets):
+                lines.append('iiif_prezi_validator_latency_seconds_bucket{le="%s"} %d' % (bound, n))
+            lines.append('iiif_prezi_validator_latency_seconds_bucket{le="+Inf"} %d' % self.latency_count)
+            lines.append("iiif_prezi_validator_latency_seconds_sum %f" % self.latency_sum)
+            lines.append("iiif_prezi_validator_latency_seconds_count %d" % self.latency_count)
+            lines.append("# TYPE iiif_prezi_validator_received_bytes_total counter")
+            lines.append("iiif_prezi_validator_received_bytes_total %d" % self.bytes)
+            lines.append("# TYPE iiif_prezi_validator_in_flight gauge")
+            lines.append("iiif_prezi_validator_in_flight %d" % self.in_flight)
+            lines.append("# TYPE iiif_prezi_validator_pool_restarts_total counter")
+            lines.append("iiif_prezi_validator_pool_restarts_total %d" % self.pool_restarts)
+            lines.append("# TYPE iiif_prezi_validator_uptime_seconds gauge")
+            lines.append("iiif_prezi_validator_uptime_seconds %f" % (time.time() - self.started))
+        return "\n".join(lines) + "\n"
+
+
+class ValidatorApp(object):
+    """WSGI application validating IIIF resources in a pool of worker processes.
+
+    processes: number of workers (default: CPUs), 0 to validate in the
+        request thread, in which case timeout is not enforced
+    max_bytes: largest request body or fetched resource
+    timeout: seconds to wait for a validation; after a timeout new
+        requests go to a new pool, and the old one is stopped once the
+        requests still waiting on it are done, as the worker can't be
+        interrupted
+    allow_urls: fetch resources from url parameters, off by default
+    fetch_timeout: seconds to wait when fetching a url
+    """
+
+    def __init__(self, processes=None, max_bytes=MAX_BYTES, timeout=TIMEOUT,
+                 allow_urls=False, fetch_timeout=FETCH_TIMEOUT):
+        """Initialize ValidatorApp and start its pool."""
+        self.processes = processes
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.allow_urls = allow_urls
+        self.fetch_timeout = fetch_timeout
+        self.metrics = Metrics()
+        self.lock = threading.Lock()
+        self.pool = None
+        # Requests waiting on each pool
+        self.waiting = {}
+        if processes != 0:
+            self.pool = self._start_pool()
+        else:
+            warm_up()
+
+    def _start_pool(self):
+        """Start a pool of warmed up workers."""
+        return multiprocessing.Pool(self.processes, initializer=warm_up)
+
+    def close(self):
+        """Stop the worker pool."""
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+
+    def _acquire_pool(self):
+        """Return the current pool, counting a request waiting on it."""
+        with self.lock:
+            pool = self.pool
+            if pool is not None:
+                self.waiting[pool] = self.waiting.get(pool, 0) + 1
+            return pool
+
+    def _release_pool(self, pool):
+        """Count a request done with pool, and stop it if it was replaced and is now unused."""
+        with self.lock:
+            count = self.waiting.pop(pool) - 1
+            if count > 0:
+                self.waiting[pool] = count
+                return
+            if pool is self.pool:
+                return
+        pool.terminate()
+        pool.join()
+
+    def _restart_pool(self, pool):
+        """Send new requests to a new pool, as pool has a worker stuck on a validation."""
+        with self.lock:
+            if self.pool is pool:
+                self.pool = self._start_pool()
+                self.metrics.pool_restarts += 1
+
+    def validate(self, data):
+        """Validate data in the pool, return the result."""
+        if self.processes == 0:
+            return validate(data)
+        pool = self._acquire_pool()
+        if pool is None:
+            raise RequestError(500, "Validator is closed")
+        try:
+            return pool.apply_async(validate, (data,)).get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self._restart_pool(pool)
+            raise RequestError(504, "Validation took more than %s seconds" % self.timeout)
+        finally:
+            self._release_pool(pool)
+
+    def read_body(self, environ):
+        """Return the request body, up to max_bytes."""
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            raise RequestError(400, "Bad Content-Length")
+        if length > self.max_bytes:
+            raise RequestError(413, "Request body is larger than %d bytes" % self.max_bytes)
+        if length == -1:
+            data = environ['wsgi.input'].read(self.max_bytes + 1)
+            if len(data) > self.max_bytes:
+                raise RequestError(413, "Request body is larger than %d bytes" % self.max_bytes)
+            return data
+        return environ['wsgi.input'].read(length)
+
+    def fetch(self, url):
+        """Return the resource at url, up to max_bytes."""
+        if not self.allow_urls:
+            raise RequestError(400, "Validating urls is not allowed")
+        if not is_http_uri(url):
+            raise RequestError(400, "url must be http or https")
+        urllib = get_urllib()
+        try:
+            req = urllib.Request(url, headers={'Accept': 'application/ld+json, application/json',
+                                               'User-Agent': 'iiif-prezi-validator/' + __version__})
+            fh = urllib.urlopen(req, timeout=self.fetch_timeout)
+            try:
+                data = fh.read(self.max_bytes + 1)
+            finally:
+                fh.close()
+        except Exception as e:
+            raise RequestError(502, "Could not fetch %s: %s" % (url, e))
+        if len(data) > self.max_bytes:
+            raise RequestError(413, "Resource is larger than %d bytes" % self.max_bytes)
+        return data
+
+    def request_data(self, environ):
+        """Return the resource to validate from the request."""
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method == 'GET':
+            url = parse_qs(environ.get('QUERY_STRING', '')).get('url')
+            if not url:
+                raise RequestError(400, "GET needs a url parameter")
+            return self.fetch(url[0])
+        elif method != 'POST':
+            raise RequestError(405, "Use GET or POST")
+        body = self.read_body(environ)
+        if environ.get('CONTENT_TYPE', '').startswith('application/x-www-form-urlencoded'):
+            try:
+                url = parse_qs(body.decode('utf-8')).get('url')
+            except ValueError as e:
+                # including UnicodeDecodeError
+                raise RequestError(400, "Bad form data: %s" % e)
+            if not url:
+                raise RequestError(400, "Form needs a url field")
+            return self.fetch(url[0])
+        if not body:
+            raise RequestError(400, "No resource in request body")
+        return body
+
+    def __call__(self, environ, start_response):
+        """Handle a WSGI request."""
+        start = time.time()
+        path = environ.get('PATH_INFO', '/')
+        self.metrics.start()
+        status = 200
+        size = 0
+        result = None
+        content_type = 'application/json'
+        try:
+            try:
+                if path == '/validate':
+                    data = self.request_data(environ)
+                    size = len(data)
+                    result = self.validate(data)
+                    body = result
+                elif path == '/metrics':
+                    body = self.metrics.render()
+                    content_type = 'text/plain; version=0.0.4'
+                elif path in ('/', '/health'):
+                    body = OrderedDict([("okay", self.pool is not None or self.processes == 0),
+                                        ("version", __version__),
+                                        ("processes", self.processes)])
+                else:
+                    raise RequestError(404, "Not found: %s" % path)
+                if content_type == 'application/json':
+                    body = json.dumps(body)
+            except Exception as e:
+                # RequestError, or a bug to report rather than drop the connection
+                status = e.status if isinstance(e, RequestError) else 500
+                (result, content_type) = (None, 'application/json')
+                body = json.dumps(OrderedDict([("okay", False), ("version", None), ("type", None),
+                                               ("error", error_record(e)), ("warnings", [])]))
+        finally:
+            self.metrics.finish(path if status != 404 else 'other', status, time.time() - start, size, result)
+        body = body.encode('utf-8')
+        start_response(STATUS[status], [('Content-Type', content_type),
+                                        ('Content-Length', str(len(body))),
+                                        ('Access-Control-Allow-Origin', '*')])
+        return [body]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """wsgiref server handling each request in a thread."""
+
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Request handler that doesn't log each request."""
+
+    def log_message(self, *args):
+        """Don't log."""
+        pass
+
+
+def main(argv=None):
+    """Command line entry point for iiif-prezi-validate."""
+    p = argparse.ArgumentParser(description="Serve IIIF Presentation API validation over HTTP")
+    p.add_argument('--host', default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    p.add_argument('--port', type=int, default=8080, help="port to listen on (default 8080)")
+    p.add_argument('--processes', '-p', type=int, default=None,
+                   help="validation processes (default: CPUs, 0 for none)")
+    p.add_argument('--max-bytes', type=int, default=MAX_BYTES,
+                   help="largest resource accepted (default %d)" % MAX_BYTES)
+    p.add_argument('--timeout', type=float, default=TIMEOUT,
+                   help="seconds allowed for a validation (default %s)" % TIMEOUT)
+    p.add_argument('--fetch-timeout', type=float, default=FETCH_TIMEOUT,
+                   help="seconds allowed for fetching a url (default %s)" % FETCH_TIMEOUT)
+    p.add_argument('--urls', action='store_true',
+                   help="also validate resources fetched from url parameters (lets clients make "
+                        "the service send requests to any address)")
+    p.add_argument('--quiet', '-q', action='store_true', help="don't log requests")
+    args = p.parse_args(argv)
+
+    app = ValidatorApp(processes=args.processes, max_bytes=args.max_bytes, timeout=args.timeout,
+                       allow_urls=args.urls, fetch_timeout=args.fetch_timeout)
+    server = make_server(args.host, args.port, app, server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler if args.quiet else WSGIRequestHandler)
+    sys.stderr.write("Validating on http://%s:%d/validate\n" % (args.host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        app.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
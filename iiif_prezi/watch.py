@@ -0,0 +1,310 @@
+"""Watch a directory of images and keep its Manifests and Collections up to date.
+
+Filesystem events, from inotify on Linux or by polling elsewhere, are
+reduced to the set of directories that changed. Events are debounced
+until the tree has been quiet for a moment, so a scan being copied in is
+handled once, and then passed as a batch to DirectoryBuilder.update()
+through a bounded queue. If updates can't keep up, the queue fills, the
+watching thread blocks and events are coalesced into the next batch.
+"""
+
+from __future__ import unicode_literals
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+try:
+    # python3
+    import queue
+except ImportError:
+    # fall back to python2
+    import Queue as queue
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _reldir(root, path):
+    """Directory path relative to root, '' for root itself."""
+    rel = os.path.relpath(path, root)
+    return "" if rel == os.curdir else rel.replace(os.sep, '/')
+
+
+class InotifySource(object):
+    """Changed directories under root, from Linux inotify.
+
+    Raises OSError if inotify isn't available.
+    """
+
+    def __init__(self, root):
+        """Initialize InotifySource watching every directory under root."""
+        self.root = root
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name or 'libc.so.6', use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.wds = {}
+        self.paths = {}
+        self.add_tree(root)
+
+    def add_tree(self, path):
+        """Watch path and every directory below it."""
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            fsname = dirpath.encode(sys.getfilesystemencoding()) if not isinstance(dirpath, bytes) else dirpath
+            wd = self.libc.inotify_add_watch(self.fd, fsname, WATCH_MASK)
+            if wd < 0:
+                # gone already, or out of watches
+                continue
+            reldir = _reldir(self.root, dirpath)
+            self.wds[wd] = reldir
+            self.paths[reldir] = wd
+
+    def remove_tree(self, reldir):
+        """Stop watching reldir and every directory below it."""
+        for d in [d for d in self.paths if d == reldir or d.startswith(reldir + '/')]:
+            wd = self.paths.pop(d)
+            self.wds.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds, return a list of changed reldirs.
+
+        Returns None if events were lost and everything must be rescanned.
+        """
+        (readable, w, x) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        changed = []
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            pos = 0
+            while pos < len(data):
+                (wd, mask, cookie, namelen) = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = data[pos:pos + namelen].rstrip(b'\0').decode(sys.getfilesystemencoding())
+                pos += namelen
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                reldir = self.wds.get(wd)
+                if reldir is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self.wds.pop(wd, None)
+                    if self.paths.get(reldir) == wd:
+                        del self.paths[reldir]
+                    continue
+                if mask & IN_DELETE_SELF:
+                    changed.append(reldir)
+                    continue
+                child = reldir + '/' + name if reldir else name
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.add_tree(os.path.join(self.root, child))
+                    elif mask & IN_MOVED_FROM:
+                        self.remove_tree(child)
+                elif mask & IN_CREATE:
+                    # wait for the file to be closed
+                    continue
+                changed.append(reldir)
+        return None if overflow else changed
+
+    def close(self):
+        """Stop watching."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class PollingSource(object):
+    """Changed directories under root, by comparing directory listings."""
+
+    def __init__(self, root):
+        """Initialize PollingSource with the current state of root."""
+        self.root = root
+        self.state = self.snapshot()
+
+    def snapshot(self):
+        """Return {reldir: listing} with the names, sizes and times of entries."""
+        state = {}
+        for (dirpath, dirnames, filenames) in os.walk(self.root):
+            entries = []
+            for name in dirnames:
+                entries.append((name, -1, 0))
+            for name in filenames:
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                entries.append((name, st.st_size, st.st_mtime))
+            entries.sort()
+            state[_reldir(self.root, dirpath)] = hash(tuple(entries))
+        return state
+
+    def poll(self, timeout):
+        """Wait timeout seconds, return a list of changed reldirs."""
+        time.sleep(timeout)
+        state = self.snapshot()
+        changed = [d for d in state if self.state.get(d) != state[d]]
+        changed.extend([d for d in self.state if d not in state])
+        self.state = state
+        return changed
+
+    def close(self):
+        """Stop watching."""
+        pass
+
+
+class Watcher(object):
+    """Rebuild with a DirectoryBuilder as the image directory changes.
+
+    debounce: seconds without events before a batch of changes is queued
+    max_delay: seconds after which a batch is queued even if events continue
+    max_pending: number of changed directories after which a batch is queued
+    max_batches: size of the queue of batches waiting to be built
+    interval: polling interval when inotify is not available
+    callback: callable(stats, reldirs) called after each update, reldirs
+        is None after a full rebuild
+    """
+
+    def __init__(self, builder, debounce=1.0, max_delay=30.0, max_pending=10000,
+                 max_batches=4, interval=5.0, use_inotify=True, callback=None):
+        """Initialize Watcher."""
+        self.builder = builder
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.interval = interval
+        self.callback = callback
+        self.queue = queue.Queue(max_batches)
+        self.source = None
+        if use_inotify:
+            try:
+                self.source = InotifySource(builder.image_dir)
+            except (OSError, AttributeError):
+                self.source = None
+        if self.source is None:
+            self.source = PollingSource(builder.image_dir)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start watching in a background thread."""
+        self.thread = threading.Thread(target=self._watch, name="iiif-prezi-watch")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop watching and building."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.source.close()
+
+    def _watch(self):
+        """Collect changes from the source into batches on the queue."""
+        pending = set()
+        full = False
+        first = last = None
+        while not self.stopped.is_set():
+            if pending or full:
+                wait = self.debounce
+            elif isinstance(self.source, PollingSource):
+                wait = self.interval
+            else:
+                # just often enough to notice stop()
+                wait = 0.5
+            changed = self.source.poll(wait)
+            now = time.time()
+            if changed is None:
+                full = True
+                pending = set()
+            elif changed and not full:
+                pending.update(changed)
+            if changed is None or changed:
+                last = now
+                if first is None:
+                    first = now
+            if not (pending or full):
+                continue
+            if (now - last >= self.debounce or now - first >= self.max_delay or
+                    len(pending) >= self.max_pending):
+                self._put(None if full else pending)
+                pending = set()
+                full = False
+                first = last = None
+
+    def _put(self, batch):
+        """Queue batch, blocking while the queue is full."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def process(self, timeout=None):
+        """Wait up to timeout for queued changes and build them.
+
+        All batches waiting are merged into one update. Returns the
+        BuildStats, or None if nothing was queued.
+        """
+        try:
+            batch = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        while batch is not None:
+            try:
+                more = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch = None if more is None else batch | more
+        if batch is None:
+            stats = self.builder.build()
+        else:
+            stats = self.builder.update(batch)
+        if self.callback:
+            self.callback(stats, batch)
+        return stats
+
+    def run(self):
+        """Build everything, then watch and rebuild until stop() or interrupted."""
+        self.builder.build()
+        self.start()
+        try:
+            while not self.stopped.is_set():
+                self.process(timeout=0.5)
+        finally:
+            self.stop()
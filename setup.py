@@ -84,4 +84,13 @@ setup(
     cmdclass={
         'coverage': Coverage,
     },
+    entry_points={
+        'console_scripts': [
+            'iiif-prezi-build=iiif_prezi.builder:main',
+            'iiif-prezi-validate=iiif_prezi.validator:main',
+            'iiif-prezi-upgrade=iiif_prezi.upgrade:main',
+            'iiif-prezi-rebase=iiif_prezi.rebase:main',
+            'iiif-prezi-diff=iiif_prezi.diff:main',
+        ],
+    },
 )
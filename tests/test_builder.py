@@ -0,0 +1,170 @@
+"""Test code for iiif_prezi.builder."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.cache import BuildCache
+from iiif_prezi.builder import DirectoryBuilder, natural_sort_key, image_header_dimensions, main
+from iiif_prezi.factory import ManifestFactory, ConfigurationError
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.img_dir = os.path.join(self.tmpdir, 'img')
+        self.out_dir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(os.path.join(self.img_dir, 'vol_1'))
+        os.makedirs(os.path.join(self.img_dir, 'vol_2', 'part_a'))
+        os.makedirs(self.out_dir)
+        src = 'testimages/nci-vol-2303-72.jpg'
+        for name in ['p10.jpg', 'p9.jpg', 'p1.jpg', 'notes.txt']:
+            shutil.copy(src, os.path.join(self.img_dir, 'vol_1', name))
+        shutil.copy(src, os.path.join(self.img_dir, 'vol_2', 'part_a', 'p1.jpg'))
+        with open(os.path.join(self.img_dir, 'vol_2', 'broken.jpg'), 'w') as fh:
+            fh.write('not an image')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def factory(self, out_dir=None):
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_prezi_dir(out_dir or self.out_dir)
+        fac.set_base_image_uri("http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "1")
+        return fac
+
+    def read(self, path):
+        with open(os.path.join(self.out_dir, path)) as fh:
+            return json.load(fh)
+
+    def test01_natural_sort_key(self):
+        self.assertEqual(sorted(['p10', 'P2', 'p1'], key=natural_sort_key), ['p1', 'P2', 'p10'])
+
+    def test02_image_header_dimensions(self):
+        self.assertEqual(image_header_dimensions('testimages/nci-vol-2303-72.jpg'), (432, 648))
+        self.assertEqual(image_header_dimensions('tests/test_builder.py'), None)
+
+    def test03_build(self):
+        self.assertRaises(ConfigurationError, DirectoryBuilder, ManifestFactory(), self.img_dir)
+        progress = []
+        builder = DirectoryBuilder(self.factory(), self.img_dir, processes=2,
+                                   label_template="Image {index}: {stem}",
+                                   progress=lambda done, total: progress.append((done, total)))
+        stats = builder.build()
+        self.assertEqual(stats.images, 5)
+        self.assertEqual(len(stats.failed), 1)
+        self.assertEqual(stats.manifests, 2)
+        self.assertEqual(stats.collections, 2)
+        self.assertEqual(progress[-1], (5, 5))
+        mfst = self.read('vol_1/manifest.json')
+        self.assertEqual(mfst['label'], 'Vol 1')
+        cvs = mfst['sequences'][0]['canvases']
+        self.assertEqual([c['label'] for c in cvs], ['Image 1: p1', 'Image 2: p9', 'Image 3: p10'])
+        self.assertEqual(cvs[0]['@id'], 'http://example.org/prezi/canvas/vol_1/p1.json')
+        self.assertEqual((cvs[0]['height'], cvs[0]['width']), (432, 648))
+        self.assertEqual(cvs[0]['images'][0]['resource']['service']['@id'],
+                         'http://example.org/iiif/vol_1%2Fp1')
+        top = self.read('collection.json')
+        self.assertEqual([c['@id'] for c in top['collections']],
+                         ['http://example.org/prezi/vol_2/collection.json'])
+        self.assertEqual([m['@id'] for m in top['manifests']],
+                         ['http://example.org/prezi/vol_1/manifest.json'])
+        vol2 = self.read('vol_2/collection.json')
+        self.assertEqual([m['@id'] for m in vol2['manifests']],
+                         ['http://example.org/prezi/vol_2/part_a/manifest.json'])
+
+    def test04_static_images(self):
+        builder = DirectoryBuilder(self.factory(), os.path.join(self.img_dir, 'vol_1'),
+                                   processes=1, iiif=False)
+        builder.build()
+        img = self.read('manifest.json')['sequences'][0]['canvases'][0]['images'][0]['resource']
+        self.assertEqual(img['@id'], 'http://example.org/iiif/p1')
+        self.assertEqual(img['format'], 'image/jpeg')
+        self.assertFalse('service' in img)
+
+    def test05_main(self):
+        ret = main([self.img_dir, '--prezi-dir', self.out_dir, '--prezi-base', 'http://example.org/p',
+                    '--image-base', 'http://example.org/i', '-p', '1', '-q'])
+        self.assertEqual(ret, 1)  # broken.jpg
+        self.assertEqual(self.read('collection.json')['@id'], 'http://example.org/p/collection.json')
+        # a new output directory is made
+        out = os.path.join(self.tmpdir, 'new', 'out')
+        main([self.img_dir, '--prezi-dir', out, '--prezi-base', 'http://example.org/p',
+              '--image-base', 'http://example.org/i', '-p', '1', '-q'])
+        self.assertTrue(os.path.exists(os.path.join(out, 'collection.json')))
+
+    def test06_cache(self):
+        cache = BuildCache(os.path.join(self.tmpdir, 'cache.db'))
+        for compact in [True, False]:
+            stats = DirectoryBuilder(self.factory(), self.img_dir, processes=1,
+                                     compact=compact, cache=cache).build()
+            self.assertEqual((stats.cached, stats.unchanged), (0, 0) if compact else (4, 0))
+        files = ['collection.json', 'vol_1/manifest.json', 'vol_2/collection.json',
+                 'vol_2/part_a/manifest.json']
+        mtimes = [os.stat(os.path.join(self.out_dir, f)).st_mtime for f in files]
+        # Nothing changed, nothing written
+        stats = DirectoryBuilder(self.factory(), self.img_dir, processes=1,
+                                 compact=False, cache=cache).build()
+        self.assertEqual((stats.cached, stats.unchanged), (4, 4))
+        self.assertEqual(mtimes, [os.stat(os.path.join(self.out_dir, f)).st_mtime for f in files])
+        # New image is probed, only its manifest is rewritten
+        shutil.copy('testimages/nci-vol-2303-72.jpg', os.path.join(self.img_dir, 'vol_1', 'p2.jpg'))
+        stats = DirectoryBuilder(self.factory(), self.img_dir, processes=1,
+                                 compact=False, cache=cache).build()
+        self.assertEqual((stats.cached, stats.unchanged), (4, 3))
+        self.assertEqual(len(cache), 5)
+        # Same result as building from scratch
+        fresh = os.path.join(self.tmpdir, 'fresh')
+        os.makedirs(fresh)
+        DirectoryBuilder(self.factory(fresh), self.img_dir, processes=1, compact=False).build()
+        for f in files:
+            with open(os.path.join(self.out_dir, f)) as fh:
+                with open(os.path.join(fresh, f)) as fh2:
+                    self.assertEqual(fh.read(), fh2.read())
+        # Removed files are forgotten
+        os.remove(os.path.join(self.img_dir, 'vol_1', 'p2.jpg'))
+        DirectoryBuilder(self.factory(), self.img_dir, processes=1, cache=cache).build()
+        self.assertEqual(len(cache), 4)
+        cache.close()
+
+    def test07_update(self):
+        builder = DirectoryBuilder(self.factory(), self.img_dir, processes=1)
+        builder.update([])  # builds everything first time
+        coll = os.path.join(self.out_dir, 'collection.json')
+        mfst = os.path.join(self.out_dir, 'vol_1', 'manifest.json')
+        os.utime(coll, (0, 0))
+        os.utime(mfst, (0, 0))
+        # Changed images in vol_1 only rewrite its Manifest
+        shutil.copy('testimages/nci-vol-2303-72.jpg', os.path.join(self.img_dir, 'vol_1', 'p2.jpg'))
+        stats = builder.update(['vol_1'])
+        self.assertEqual((stats.manifests, stats.collections, stats.unchanged), (1, 0, 0))
+        self.assertNotEqual(os.stat(mfst).st_mtime, 0)
+        self.assertEqual(os.stat(coll).st_mtime, 0)
+        self.assertEqual(len(self.read('vol_1/manifest.json')['sequences'][0]['canvases']), 4)
+        # A new directory changes the membership of the top Collection
+        os.makedirs(os.path.join(self.img_dir, 'vol_3', 'x'))
+        shutil.copy('testimages/nci-vol-2303-72.jpg', os.path.join(self.img_dir, 'vol_3', 'x', 'p1.jpg'))
+        builder.update([''])
+        self.assertNotEqual(os.stat(coll).st_mtime, 0)
+        self.assertEqual([c['@id'] for c in self.read('collection.json')['collections']],
+                         ['http://example.org/prezi/vol_2/collection.json',
+                          'http://example.org/prezi/vol_3/collection.json'])
+        self.assertEqual(self.read('vol_3/collection.json')['manifests'][0]['@id'],
+                         'http://example.org/prezi/vol_3/x/manifest.json')
+        # As does removing the only image of a directory
+        os.remove(os.path.join(self.img_dir, 'vol_3', 'x', 'p1.jpg'))
+        builder.update(['vol_3/x'])
+        self.assertEqual([c['@id'] for c in self.read('collection.json')['collections']],
+                         ['http://example.org/prezi/vol_2/collection.json'])
+        # or removing a directory
+        shutil.rmtree(os.path.join(self.img_dir, 'vol_1'))
+        builder.update(['', 'vol_1'])
+        self.assertFalse('manifests' in self.read('collection.json'))
+        # a full build after updates counts from nothing
+        stats = builder.build()
+        self.assertEqual((stats.manifests, stats.unchanged), (1, 3))
@@ -0,0 +1,58 @@
+"""Test code for iiif_prezi.cache."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.cache import BuildCache, fingerprint
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'a.jpg')
+        with open(self.fn, 'wb') as fh:
+            fh.write(b'image')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test01_images(self):
+        cache = BuildCache(os.path.join(self.tmpdir, 'cache.db'))
+        (hw, info) = cache.lookup('a.jpg', self.fn)
+        self.assertEqual(hw, None)
+        cache.store('a.jpg', info, (10, 20))
+        self.assertEqual(cache.lookup('a.jpg', self.fn)[0], (10, 20))
+        self.assertEqual(cache.canvas('a.jpg', 'k1'), None)
+        cache.set_canvas('a.jpg', 'k1', '{"@id":"c1"}')
+        self.assertEqual(cache.canvas('a.jpg', 'k1'), '{"@id":"c1"}')
+        self.assertEqual(cache.canvas('a.jpg', 'k2'), None)
+        # Changed time is a change without hash_contents
+        st = os.stat(self.fn)
+        os.utime(self.fn, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(cache.lookup('a.jpg', self.fn)[0], None)
+        cache.close()
+        # Persisted
+        cache = BuildCache(os.path.join(self.tmpdir, 'cache.db'), hash_contents=True)
+        self.assertEqual(len(cache), 1)
+        (hw, info) = cache.lookup('a.jpg', self.fn)
+        cache.store('a.jpg', info, (10, 20))
+        os.utime(self.fn, (st.st_atime, st.st_mtime + 20))
+        self.assertEqual(cache.lookup('a.jpg', self.fn)[0], (10, 20))
+        with open(self.fn, 'wb') as fh:
+            fh.write(b'other')
+        os.utime(self.fn, (st.st_atime, st.st_mtime + 30))
+        self.assertEqual(cache.lookup('a.jpg', self.fn)[0], None)
+        self.assertEqual(cache.prune(['b.jpg']), 1)
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    def test02_outputs(self):
+        with BuildCache(':memory:') as cache:
+            self.assertEqual(cache.output('manifest'), (None, None))
+            fp = fingerprint('manifest', [1, 2])
+            self.assertEqual(fp, fingerprint('manifest', [1, 2]))
+            self.assertNotEqual(fp, fingerprint('manifest', [2, 1]))
+            cache.set_output('manifest', fp, {'@id': 'http://example.org/manifest.json'})
+            self.assertEqual(cache.output('manifest'), (fp, {'@id': 'http://example.org/manifest.json'}))
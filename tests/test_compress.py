@@ -0,0 +1,157 @@
+"""Test code for iiif_prezi.compress."""
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.compress import Precompressor, available_formats, precompress_tree, read_sidecar
+from iiif_prezi.diff import Publisher
+from iiif_prezi.edit import ManifestEditor
+from iiif_prezi.factory import ConfigurationError, ManifestFactory
+from iiif_prezi.ocr import OcrPage, OcrWriter
+from iiif_prezi.paging import AnnotationListWriter
+from iiif_prezi.rebase import rebase_tree
+from iiif_prezi.upgrade import UpgradePipeline
+
+
+def read(path):
+    with io.open(path, 'rb') as fh:
+        return fh.read()
+
+
+def gunzip(path):
+    with gzip.open(path, 'rb') as fh:
+        return fh.read()
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fac = ManifestFactory()
+        self.fac.set_debug("error")
+        self.fac.set_base_prezi_uri("http://example.org/iiif/")
+        self.fac.set_base_prezi_dir(self.tmp)
+        self.fac.set_base_image_uri("http://example.org/images/")
+        self.fac.set_iiif_image_info("2.0", "1")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def manifest(self, n, label="Book"):
+        mf = self.fac.manifest(ident="m%d/manifest" % n, label="%s %d" % (label, n))
+        seq = mf.sequence()
+        for i in range(20):
+            cvs = seq.canvas(ident="m%d/p%d" % (n, i), label="p. %d" % i)
+            cvs.set_hw(100, 100)
+            cvs.annotation(ident="m%d/a%d" % (n, i)).image("m%d-%d" % (n, i), iiif=True)
+        return mf
+
+    def test01_to_file(self):
+        self.fac.set_precompress(formats=['gz'], levels={'gz': 6})
+        mf = self.manifest(1)
+        text = mf.toFile(compact=False)
+        path = mf.file_path()
+        data = read(path)
+        self.assertEqual(data, text.encode('utf-8'))
+        self.assertEqual(gunzip(path + ".gz"), data)
+        side = read_sidecar(path)
+        sha = hashlib.sha256(data).hexdigest()
+        self.assertEqual(side['etag'], '"%s"' % sha[:32])
+        self.assertEqual(side['length'], len(data))
+        self.assertEqual(side['encodings'], {"gzip": {"etag": '"%s-gz6"' % sha[:32],
+                                                      "length": os.path.getsize(path + ".gz")}})
+        # the same bytes every time, with or without threads
+        gz = read(path + ".gz")
+        self.fac.set_precompress(formats=['gz'], levels={'gz': 6}, threads=2)
+        mf.toFile(compact=False)
+        self.assertEqual(read(path + ".gz"), gz)
+        self.assertEqual(read_sidecar(path), side)
+        self.assertTrue(Precompressor(['gz'], {'gz': 6}).is_current(path))
+        self.assertFalse(Precompressor(['gz'], {'gz': 9}).is_current(path))
+        # configuration
+        self.assertRaises(ConfigurationError, self.fac.set_precompress, ['zip'])
+        if 'br' not in available_formats():
+            self.assertRaises(ConfigurationError, self.fac.set_precompress, ['br'])
+        self.fac.set_precompress([])
+        self.assertEqual(self.fac.get_precompressor(), None)
+
+    def test02_publish(self):
+        pre = Precompressor(['gz'], threads=2)
+        pub = Publisher(precompressor=pre)
+        mfs = [self.manifest(n) for n in range(5)]
+        for mf in mfs:
+            pub.publish(mf)
+        pub.close()
+        for mf in mfs:
+            self.assertEqual(gunzip(mf.file_path() + ".gz"), read(mf.file_path()))
+            self.assertTrue(pre.is_current(mf.file_path()))
+        # unchanged, but without its copy
+        os.remove(mfs[0].file_path() + ".gz")
+        self.assertFalse(pub.publish(self.manifest(0)))
+        self.assertTrue(pre.is_current(mfs[0].file_path()))
+        pub.publish(self.manifest(1, label="Revised"))
+        pub.close()
+        self.assertTrue(b"Revised" in gunzip(mfs[1].file_path() + ".gz"))
+        pre.close()
+        # edited in place
+        path = mfs[2].file_path()
+        ManifestEditor(path, Precompressor(['gz'])).update({"label": "Edited"})
+        self.assertTrue(b"Edited" in gunzip(path + ".gz"))
+        ManifestEditor(path).update({"label": "Edited again"})
+        self.assertFalse(os.path.exists(path + ".gz"))
+        self.assertEqual(read_sidecar(path), None)
+
+    def test03_tree(self):
+        for n in range(3):
+            self.manifest(n).toFile()
+        stats = precompress_tree(self.tmp, formats=['gz'], threads=2)
+        self.assertEqual((stats.files, stats.current, len(stats.failed)), (3, 0, 0))
+        self.assertTrue("3 files compressed (gz " in str(stats))
+        stats = precompress_tree(self.tmp, formats=['gz'], threads=2)
+        self.assertEqual((stats.files, stats.current), (0, 3))
+        # changed without its copies
+        self.manifest(1, label="Revised").toFile()
+        stats = precompress_tree(self.tmp, formats=['gz'])
+        self.assertEqual((stats.files, stats.current), (1, 2))
+        path = self.manifest(1).file_path()
+        self.assertEqual(gunzip(path + ".gz"), read(path))
+        stats = precompress_tree(self.tmp, formats=['gz'], levels={'gz': 1}, force=True)
+        self.assertEqual(stats.files, 3)
+        self.assertTrue(read_sidecar(path)['encodings']['gzip']['etag'].endswith('-gz1"'))
+        self.assertEqual(json.loads(read(path).decode('utf-8'))['label'], "Revised 1")
+
+    def test04_other_writers(self):
+        self.fac.set_precompress(formats=['gz'])
+        mf = self.manifest(1)
+        cvs = mf.sequences[0].canvases[0]
+        al = cvs.annotationList(ident="m1-text.json", label="Text")
+        anno = al.annotation(ident="m1/t0")
+        anno.text("word")
+        anno.on = cvs.id + "#xywh=0,0,10,10"
+        AnnotationListWriter(self.fac).write_manifest(mf)
+        page = OcrPage(1, 100, 100)
+        page.add("word", 0, 0, 10, 10)
+        OcrWriter(self.fac).write_page(page, cvs, "m1-ocr.json")
+        for fn in ("m1-text.json", "m1-ocr.json"):
+            path = os.path.join(self.tmp, "list", fn)
+            self.assertEqual(gunzip(path + ".gz"), read(path))
+            self.assertTrue(Precompressor(['gz']).is_current(path))
+        # Files rewritten in place lose their copies, which are out of date
+        mf.toFile()
+        path = mf.file_path()
+        rebase_tree(self.tmp, self.tmp, {"http://example.org/iiif/": "https://example.org/iiif/"}, processes=0)
+        self.assertFalse(os.path.exists(path + ".gz"))
+        self.assertEqual(read_sidecar(path), None)
+        dst = os.path.join(self.tmp, "upgraded")
+        UpgradePipeline("3.0", processes=0).run(os.path.dirname(path), dst)
+        precompress_tree(dst, formats=['gz'])
+        upgraded = os.path.join(dst, os.path.basename(path))
+        self.assertTrue(os.path.exists(upgraded + ".gz"))
+        UpgradePipeline("3.0", processes=0).run(os.path.dirname(path), dst)
+        self.assertFalse(os.path.exists(upgraded + ".gz"))
+        self.assertEqual(read_sidecar(upgraded), None)
@@ -0,0 +1,103 @@
+"""Test code for iiif_prezi.diff."""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.diff import Publisher, apply_patch, diff, main
+from iiif_prezi.factory import DataError, ManifestFactory
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fac = ManifestFactory()
+        self.fac.set_debug("error")
+        self.fac.set_base_prezi_uri("http://example.org/iiif/book1/")
+        self.fac.set_base_prezi_dir(self.tmp)
+        self.fac.set_base_image_uri("http://example.org/images/")
+        self.fac.set_iiif_image_info("2.0", "1")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def manifest(self, label="Book 1", pages=(1, 2, 3)):
+        mf = self.fac.manifest(label=label)
+        mf.set_metadata({"Author": "Ann"})
+        seq = mf.sequence(ident="normal")
+        for n in pages:
+            cvs = seq.canvas(ident="p%d" % n, label="p. %d" % n)
+            cvs.set_hw(100, 100)
+            cvs.annotation(ident="a%d" % n).image("page%d" % n, iiif=True)
+        return mf
+
+    def test01_diff(self):
+        old = self.manifest().toJSON(top=True)
+        self.assertFalse(diff(old, self.manifest()))
+        new = self.manifest(label="Book One", pages=(3, 1, 4, 2)).toJSON(top=True)
+        new['sequences'][0]['canvases'][1]['label'] = "page 1"
+        changes = diff(json.dumps(old), new)
+        self.assertEqual(apply_patch(old, changes.patch()), new)
+        # the Canvases are matched by @id
+        ops = [(c.op, c.kind) for c in changes]
+        self.assertEqual(sorted(ops), [("add", "structural"), ("move", "structural"),
+                                       ("replace", "descriptive"), ("replace", "descriptive")])
+        base = "http://example.org/iiif/book1/"
+        self.assertEqual(changes.added, set([base + "canvas/p4.json", base + "annotation/a4.json",
+                                             "http://example.org/images/page4/full/full/0/default.jpg",
+                                             "http://example.org/images/page4"]))
+        self.assertEqual(changes.removed, set())
+        self.assertEqual(changes.changed, set([base + "manifest.json", base + "sequence/normal.json",
+                                               base + "canvas/p1.json"]))
+        self.assertEqual(changes.kinds(), {"descriptive": 2, "structural": 2})
+        self.assertTrue("4 changes" in str(changes))
+        # removing, and lists without @ids by position
+        newer = json.loads(json.dumps(new))
+        del newer['sequences'][0]['canvases'][0]
+        newer['metadata'].append({"label": "Date", "value": "1850"})
+        del newer['label']
+        changes = diff(new, newer)
+        self.assertEqual(apply_patch(new, changes.patch()), newer)
+        self.assertEqual(changes.patch()[0], {"op": "remove", "path": "/label"})
+        self.assertTrue(base + "canvas/p3.json" in changes.removed)
+        self.assertEqual(diff(None, new).patch(), [{"op": "add", "path": "", "value": new}])
+        self.assertRaises(DataError, diff, "{", new)
+        self.assertRaises(DataError, apply_patch, new, [{"op": "remove", "path": "/nothing"}])
+
+    def test02_publish(self):
+        pub = Publisher()
+        mf = self.manifest()
+        path = mf.file_path()
+        self.assertTrue(pub.publish(mf))
+        mtime = os.path.getmtime(path)
+        os.utime(path, (mtime - 100, mtime - 100))
+        # the same again
+        self.assertFalse(pub.publish(self.manifest()))
+        self.assertEqual(os.path.getmtime(path), mtime - 100)
+        # changed
+        changes = pub.publish(self.manifest(pages=(1, 2)))
+        self.assertEqual(changes.removed, set([
+            "http://example.org/iiif/book1/canvas/p3.json", "http://example.org/iiif/book1/annotation/a3.json",
+            "http://example.org/images/page3/full/full/0/default.jpg", "http://example.org/images/page3"]))
+        with io.open(path) as fh:
+            self.assertEqual(fh.read(), self.manifest(pages=(1, 2)).toString())
+        self.assertEqual(pub.unchanged, 1)
+        self.assertEqual(pub.written(), [path])
+        self.assertTrue(str(pub).startswith("1 files written"))
+        # same size, different text; and broken files are replaced
+        self.assertEqual(len(pub.publish_text(path, self.manifest(label="Book 2", pages=(1, 2)).toString())), 1)
+        with io.open(path, 'w') as fh:
+            fh.write('{')
+        self.assertEqual(len(Publisher().publish(mf)), 1)
+
+    def test03_main(self):
+        (old, new) = (os.path.join(self.tmp, "old.json"), os.path.join(self.tmp, "new.json"))
+        for (fn, mf) in [(old, self.manifest()), (new, self.manifest(label="Book One"))]:
+            with io.open(fn, 'w') as fh:
+                fh.write(mf.toString())
+        self.assertEqual(main([old, old]), 0)
+        self.assertEqual(main([old, new]), 1)
+        self.assertEqual(main([old, new, "--summary"]), 1)
@@ -0,0 +1,126 @@
+"""Test code for iiif_prezi.edit."""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.edit import ManifestEditor
+from iiif_prezi.factory import DataError, ManifestFactory, RawResource
+
+RAW = ('{"@id": "http://example.org/iiif/book1/canvas/p5.json", "@type": "sc:Canvas",'
+       ' "label": "fünf", "height": 10, "width": 10}')
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fac = ManifestFactory()
+        self.fac.set_debug("error")
+        self.fac.set_base_prezi_uri("http://example.org/iiif/book1/")
+        self.fac.set_base_prezi_dir(self.tmp)
+        self.fac.set_base_image_uri("http://example.org/images/")
+        self.fac.set_iiif_image_info("2.0", "1")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def canvas(self, n):
+        cvs = self.fac.canvas(ident="p%d" % n, label="p. %d" % n)
+        cvs.set_hw(100, 100)
+        cvs.annotation(ident="a%d" % n).image("page%d" % n, iiif=True)
+        return cvs
+
+    def manifest(self):
+        mf = self.fac.manifest(label="Book")
+        mf.description = "A book"
+        seq = mf.sequence()
+        for n in (1, 2, 3):
+            seq.add_canvas(self.canvas(n))
+        mf.range(ident="r1", label="Part 1").add_canvas(seq.canvases[0])
+        return mf
+
+    def assertLayout(self, editor):
+        """The layout kept up to date is the same as reading the file again."""
+        (kept, fresh) = (editor.layout(), ManifestEditor(editor.path).layout())
+        self.assertEqual((kept.keys, kept.canvases, kept.canvas_ids, kept.close),
+                         (fresh.keys, fresh.canvases, fresh.canvas_ids, fresh.close))
+
+    def assertFile(self, mf, compact):
+        with io.open(mf.file_path(), encoding='utf-8') as fh:
+            self.assertEqual(fh.read(), "".join(mf.iterString(compact)))
+
+    def test01_edit(self):
+        for compact in (True, False):
+            mf = self.manifest()
+            mf.toFile(compact=compact)
+            editor = ManifestEditor(mf.file_path())
+            self.assertEqual(len(editor.canvas_ids()), 3)
+            # append
+            (cvs4, raw) = (self.canvas(4), RawResource(RAW))
+            editor.append_canvases([cvs4, raw])
+            mf.sequences[0].add_canvas(cvs4)
+            mf.sequences[0].add_canvas(raw)
+            self.assertFile(mf, compact)
+            self.assertEqual(editor.canvas(raw.id)['label'], "fünf")
+            # replace
+            cvs2 = mf.sequences[0].canvases[1]
+            cvs2.label = "page two"
+            editor.replace_canvas(cvs2)
+            self.assertFile(mf, compact)
+            # top level properties, replaced, removed and added before and after the Sequences
+            editor.update({"label": "Book, revised", "description": None, "attribution": "Library",
+                           "related": "http://example.org/book1.html"})
+            (mf.label, mf.description, mf.attribution) = ("Book, revised", "", "Library")
+            mf.related = "http://example.org/book1.html"
+            self.assertFile(mf, compact)
+            self.assertLayout(editor)
+            self.assertEqual(editor.full_rewrites, 0)
+            self.assertRaises(DataError, editor.append_canvases, [self.canvas(1)])
+            self.assertRaises(DataError, editor.append_canvases, [{"@type": "sc:Range", "@id": "x"}])
+            self.assertRaises(DataError, editor.replace_canvas, self.canvas(9))
+            self.assertRaises(DataError, editor.update, {"sequences": []})
+
+    def test02_first_canvas(self):
+        for (compact, kw) in [(True, {"separators": (',', ':')}),
+                              (False, {"indent": 2, "separators": (',', ': ')})]:
+            mf = self.manifest()
+            js = mf.toJSON(top=True)
+            js['sequences'][0]['canvases'] = []
+            with io.open(mf.file_path(), 'w') as fh:
+                fh.write(json.dumps(js, **kw))
+            editor = ManifestEditor(mf.file_path())
+            self.assertEqual(editor.canvas_ids(), [])
+            cvs = self.canvas(1)
+            editor.append_canvases([cvs])
+            js['sequences'][0]['canvases'] = [cvs.toJSON()]
+            with io.open(mf.file_path()) as fh:
+                self.assertEqual(fh.read(), json.dumps(js, **kw))
+            self.assertLayout(editor)
+
+    def test03_full_rewrite(self):
+        mf = self.manifest()
+        path = mf.file_path()
+        with io.open(path, 'w') as fh:
+            fh.write(json.dumps(mf.toJSON(top=True), indent=4))
+        editor = ManifestEditor(path)
+        self.assertEqual(editor.layout(), None)
+        self.assertEqual(editor.canvas(mf.sequences[0].canvases[0].id)['label'], "p. 1")
+        cvs = self.canvas(4)
+        editor.append_canvases([cvs])
+        editor.update({"label": "Book, revised"})
+        self.assertEqual(editor.full_rewrites, 1)
+        mf.sequences[0].add_canvas(cvs)
+        mf.label = "Book, revised"
+        self.assertFile(mf, False)
+        # no Sequence to add to
+        path = os.path.join(self.tmp, "other.json")
+        with io.open(path, 'w') as fh:
+            fh.write(json.dumps({"@context": self.fac.context_uri, "@id": "http://example.org/iiif/book1/other.json",
+                                 "@type": "sc:Manifest", "label": "No sequence"}))
+        editor = ManifestEditor(path)
+        editor.append_canvases([self.canvas(1)])
+        self.assertEqual(editor.full_rewrites, 1)
+        self.assertEqual(editor.canvas_ids(), [self.canvas(1).id])
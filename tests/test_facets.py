@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Test code for iiif_prezi.facets."""
+from __future__ import unicode_literals
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.factory import DataError, ManifestFactory
+from iiif_prezi.facets import FacetIndex, nav_date_seconds, read_fields
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fac = ManifestFactory()
+        self.fac.set_debug("error")
+        self.fac.set_base_prezi_uri("http://example.org/prezi/")
+        self.fac.set_base_prezi_dir(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, n, author, lang="en", nav="", hint="", canvases=1):
+        mf = self.fac.manifest(ident="m%d" % n, label={lang: "Book %d" % n})
+        mf.set_metadata({"label": "Author", "value": author})
+        mf.set_metadata({"label": {"en": "Subject"}, "value": {lang: "Subject %d" % (n % 2)}})
+        if nav:
+            mf.navDate = nav
+        if hint:
+            mf.viewingHint = hint
+        seq = mf.sequence()
+        for i in range(canvases):
+            cvs = seq.canvas(ident="m%d-c%d" % (n, i), label="p%d" % i)
+            cvs.set_hw(100, 100)
+        mf.toFile(compact=False)
+        return os.path.join(self.tmp, "m%d.json" % n)
+
+    def test01_read_fields(self):
+        fn = self.write(1, "Ann", nav="1901-02-03T00:00:00Z", canvases=2000)
+        # only the start of the file is read
+        with io.open(fn, 'rb') as fh:
+            fields = read_fields(fh, chunk_size=1024)
+            self.assertTrue(fh.tell() < os.path.getsize(fn) / 10)
+        with io.open(fn, encoding='utf-8') as fh:
+            js = json.load(fh)
+        for key in ('@id', 'label', 'metadata', 'navDate'):
+            self.assertEqual(fields[key], js[key])
+        self.assertFalse('sequences' in fields)
+        # keys after the sequences, values split across chunks, a BOM
+        text = '\ufeff{"sequences": [{"a": "}\\""}], "@id": "x", "navDate": 12345678901, "label": "Caf\xe9"}'
+        data = text.encode('utf-8')
+        self.assertEqual(read_fields(io.BytesIO(data), chunk_size=3), {})
+        self.assertEqual(read_fields(io.BytesIO(data), stop_at=(), chunk_size=3),
+                         {"@id": "x", "navDate": 12345678901, "label": "Caf\xe9"})
+        # reads that end part way through a character
+        data = '{"label": "\xdcn\xefcode"}'.encode('utf-8')
+        self.assertEqual(read_fields(io.BytesIO(data), chunk_size=1), {"label": "\xdcn\xefcode"})
+        self.assertRaises(DataError, read_fields, io.BytesIO(data[:12]), chunk_size=1)
+        self.assertEqual(read_fields(io.StringIO("{ }")), {})
+        self.assertRaises(DataError, read_fields, io.BytesIO(b"[1]"))
+        self.assertRaises(DataError, read_fields, io.BytesIO(b'{"@id" "x"}'))
+        self.assertRaises(DataError, read_fields, io.BytesIO(b'{"@id": "x"'), stop_at=())
+
+    def test02_nav_dates(self):
+        self.assertEqual(nav_date_seconds("1970-01-01T00:00:00Z"), 0)
+        self.assertEqual(nav_date_seconds("1970-01-02"), 86400)
+        self.assertEqual(nav_date_seconds("1970-01-01T01:00:00+01:00"), 0)
+        self.assertEqual(nav_date_seconds(datetime.date(1970, 1, 2)), 86400)
+        self.assertEqual(nav_date_seconds(datetime.datetime(1970, 1, 1, 0, 1)), 60)
+        self.assertEqual(nav_date_seconds("1970-13-01"), None)
+        self.assertEqual(nav_date_seconds("last year"), None)
+
+    def test03_facets(self):
+        fns = [self.write(0, "Ann", nav="1901-01-01T00:00:00Z", hint="paged"),
+               self.write(1, "Bob", lang="fr", nav="1950-06-01T00:00:00Z"),
+               self.write(2, "Ann", lang="fr", nav="1925-01-01T00:00:00Z", hint="individuals"),
+               self.write(3, "Cat")]
+        with io.open(os.path.join(self.tmp, "bad.json"), 'w') as fh:
+            fh.write('{"@id": "c", "@type": "sc:Collection"}')
+        idx = FacetIndex()
+        self.assertEqual(idx.add_files(fns + [os.path.join(self.tmp, "bad.json"),
+                                              os.path.join(self.tmp, "none.json")]), 4)
+        self.assertEqual(len(idx.failed), 2)
+        self.assertEqual(idx.fields(), ["language", "metadata:Author", "metadata:Subject", "viewingHint"])
+        self.assertEqual(idx.counts("metadata:Author"), [("Ann", 2), ("Bob", 1), ("Cat", 1)])
+        self.assertEqual(idx.counts("metadata:Author", limit=1), [("Ann", 2)])
+        self.assertEqual(idx.counts("language"), [("en", 4), ("fr", 2)])
+        self.assertEqual(idx.counts("nothing"), [])
+        french = idx.select({"language": "fr"})
+        self.assertEqual(french, [1, 2])
+        self.assertEqual(idx.counts("metadata:Author", french), [("Ann", 1), ("Bob", 1)])
+        self.assertEqual(idx.counts("metadata:Subject", [0, 1, 2, 3]),
+                         [("Subject 0", 2), ("Subject 1", 2)])
+        self.assertEqual(idx.select({"metadata:Author": ["Ann", "Cat"], "viewingHint": "paged"}), [0])
+        self.assertEqual(idx.select({"metadata:Author": "Nobody"}), [])
+        self.assertEqual(idx.select(), [0, 1, 2, 3])
+        # navDate ranges
+        self.assertEqual(idx.nav_range("1901-01-01", "1925-01-01T00:00:00Z"), [0, 2])
+        self.assertEqual(idx.nav_range(start=datetime.date(1920, 1, 1)), [1, 2])
+        self.assertEqual(idx.select({"language": "fr"}, nav_to="1930-01-01"), [2])
+        self.assertRaises(DataError, idx.nav_range, "soon")
+        # sub-collections
+        coll = idx.collection(self.fac, french, ident="french", label="French")
+        js = coll.toJSON(top=True)
+        self.assertEqual([m['@id'] for m in js['manifests']],
+                         ["http://example.org/prezi/m1.json", "http://example.org/prezi/m2.json"])
+        self.assertEqual(js['manifests'][0]['label'], {"@value": "Book 1", "@language": "fr"})
+        # saved and loaded
+        path = os.path.join(self.tmp, "facets.idx")
+        idx.save(path)
+        idx2 = FacetIndex.load(path)
+        self.assertEqual(idx2.counts("language"), idx.counts("language"))
+        self.assertEqual(idx2.nav_range("1901-01-01", "1925-01-01"), [0, 2])
+        self.assertRaises(DataError, FacetIndex.load, fns[0])
+        # read in worker processes, in the same order
+        idx3 = FacetIndex()
+        self.assertEqual(idx3.add_files(fns, processes=2), 4)
+        self.assertEqual(idx3.ids, idx.ids)
@@ -1,9 +1,25 @@
 """Test code for iiif_prezi.factory"""
 
 from __future__ import unicode_literals
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
-from iiif_prezi.factory import ManifestFactory, ConfigurationError, OrderedDict
+from iiif_prezi.factory import ManifestFactory, ConfigurationError, MetadataError, OrderedDict, \
+    PresentationWarning, WarningCollector, DataError, RequirementError, StructuralError, \
+    factory_from_config, FragmentSelection
+from iiif_prezi.loader import ManifestReader
+
+
+def _relabel(cvs):
+    """Pool task for test21."""
+    cvs.set_label("Changed " + cvs.label)
+    return cvs
 
 
 class TestAll(unittest.TestCase):
@@ -84,3 +100,259 @@ class TestAll(unittest.TestCase):
         child._embed = False
         js = parent.toJSON()
         self.assertFalse(js['collections'][0].get('collections', False))
+
+    def test13_warning_collection(self):
+        mf = ManifestFactory(mdbase="http://example.org/")
+        out = io.StringIO()
+        mf.set_debug_stream(out)
+        m = mf.manifest(label="m")
+        m.sequence().canvas(ident="c1", label="c1").set_hw(10, 10)
+        m.toJSON()
+        # Nothing written until a top level serialization
+        self.assertEqual(out.getvalue(), "")
+        recs = mf.warnings.records(code="missing-recommended")
+        self.assertEqual(len(recs), 2)
+        self.assertEqual(recs[0].resource_type, "sc:Manifest")
+        self.assertEqual(recs[0].ident, "http://example.org/manifest.json")
+        # Serializing again does not repeat warnings
+        m.toJSON()
+        self.assertEqual(len(mf.warnings), 2)
+        m.toJSON(top=True)
+        self.assertEqual(out.getvalue(),
+                         "WARNING: Resource type 'sc:Manifest' should have 'description' set\n"
+                         "WARNING: Resource type 'sc:Canvas' should have 'images' set\n")
+        self.assertEqual(len(mf.warnings), 0)
+        # and again for each serialization
+        m.toJSON(top=True)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+    def test14_warning_limits(self):
+        wc = WarningCollector(max_records=5, max_per_code=2)
+        for n in range(3):
+            self.assertEqual(wc.add(PresentationWarning("a", "t", "i%d" % n, "%s", (n,))), n < 2)
+        self.assertFalse(wc.add(PresentationWarning("a", "t", "i0", "%s", (0,))))
+        self.assertEqual(wc.suppressed, 1)
+        for n in range(5):
+            wc.add(PresentationWarning("b%d" % n, "t", "", "x"))
+        self.assertEqual(len(wc), 5)
+        self.assertEqual(wc.suppressed, 3)
+        self.assertEqual(wc.messages()[0], "WARNING: 0")
+        # limits and duplicates are of the pending warnings
+        self.assertEqual(len(wc.drain()), 5)
+        self.assertTrue(wc.add(PresentationWarning("a", "t", "i0", "%s", (0,))))
+        self.assertFalse(wc.add(PresentationWarning("a", "t", "i0", "%s", (0,))))
+        self.assertTrue(wc.add(PresentationWarning("a", "t", "i2", "%s", (2,))))
+        for n in range(1000):
+            wc.add(PresentationWarning("c", "t", "", "%s", (n,)))
+            wc.drain()
+        self.assertTrue(wc.add(PresentationWarning("c", "t", "", "new")))
+        self.assertEqual(len(wc._seen), 1)
+        wc.clear()
+        self.assertEqual(len(wc), 0)
+        self.assertTrue(wc.add(PresentationWarning("a", "t", "i0", "%s", (0,))))
+
+    def test15_warning_formatting_is_lazy(self):
+        class Boom(object):
+            def __str__(self):
+                raise AssertionError("formatted")
+        mf = ManifestFactory()
+        mf.maybe_warn("%s", (Boom(),))
+        self.assertEqual(len(mf.warnings), 1)
+        mf.set_base_prezi_uri("http://example.org/")
+        mf.manifest(label="m").thing = "x"
+        (w,) = mf.warnings.records("non-standard-field")
+        self.assertEqual(w.message, "Setting non-standard field 'thing' on resource of type 'sc:Manifest'")
+        mf.set_debug("error_on_warning")
+        self.assertRaises(MetadataError, mf.maybe_warn, "bad %s", ("thing",))
+
+    def test16_bulk_canvases(self):
+        def build(bulk, iiif=True):
+            mf = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/img/")
+            mf.set_iiif_image_info("2.0", "1")
+            seq = mf.manifest(label="m").sequence()
+            ids = ["p%d" % n for n in range(4)]
+            labels = ["Page %d" % n for n in range(4)]
+            hs = [100, 200, 300, 400]
+            ws = (10, 20, 30, 40)
+            fmts = ["image/png"] * 4
+            if bulk:
+                out = seq.bulk_canvases(ids, iter(labels), hs, ws, formats=fmts, iiif=iiif)
+                self.assertEqual(len(out), 4)
+            else:
+                for x in range(4):
+                    cvs = seq.canvas(ident=ids[x], label=labels[x])
+                    cvs.set_hw(hs[x], ws[x])
+                    img = cvs.annotation().image(ids[x], iiif=iiif)
+                    img.set_hw(hs[x], ws[x])
+                    img.format = fmts[x]
+            return seq
+        for iiif in (True, False):
+            seq = build(True, iiif)
+            self.assertEqual(json.dumps(seq.toJSON()), json.dumps(build(False, iiif).toJSON()))
+            # New objects still behave like normal ones
+            seq.canvases[2].label = "changed"
+            self.assertEqual(seq.canvases[2].label, "changed")
+            self.assertEqual(seq.canvases[1].images[0].resource.height, 200)
+
+    def test17_bulk_canvases_errors(self):
+        class Column(object):
+            def __init__(self, vals):
+                self.vals = vals
+
+            def tolist(self):
+                return list(self.vals)
+        mf = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/img/")
+        seq = mf.sequence()
+        self.assertEqual(seq.bulk_canvases([], [], [], []), [])
+        self.assertRaises(DataError, seq.bulk_canvases, ["a"], ["a", "b"], [1], [1])
+        self.assertRaises(DataError, seq.bulk_canvases, ["a"], ["a"], [1.5], [1])
+        self.assertRaises(RequirementError, seq.bulk_canvases, [""], ["a"], [1], [1])
+        self.assertRaises(DataError, seq.bulk_canvases, ["a", "a"], ["a", "b"], [1, 1], [1, 1])
+        self.assertEqual(seq.canvases, [])
+        out = seq.bulk_canvases(Column(["a", "b"]), Column(["A", "B"]), Column([1, 2]), Column([3, 4]))
+        self.assertEqual([c.id for c in out], ["http://example.org/prezi/canvas/a.json",
+                                               "http://example.org/prezi/canvas/b.json"])
+        self.assertRaises(DataError, seq.bulk_canvases, ["a"], ["a"], [1], [1])
+
+    def test18_iter_string_matches_to_string(self):
+        for n in (1, 5, 10, 19):
+            fn = 'tests/testdata/2.0/example/fixtures/%d/manifest.json' % n
+            with open(fn) as fh:
+                mfst = ManifestReader(fh.read()).read()
+            for compact in (True, False):
+                self.assertEqual("".join(mfst.iterString(compact)), mfst.toString(compact))
+
+    def test19_raw_resources(self):
+        mf = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/img/")
+        mf.set_debug("error")
+        mfst = mf.manifest(label="m")
+        seq = mfst.sequence()
+        seq.canvas(ident="c1", label="one").set_hw(10, 10)
+        raw_dict = OrderedDict([("@id", "http://example.org/prezi/canvas/c2.json"),
+                                ("@type", "sc:Canvas"), ("label", "two"),
+                                ("height", 20), ("width", 20)])
+        raw_text = b'{"@id":"http://example.org/prezi/canvas/c3.json","@type":"sc:Canvas",' \
+                   b'"label":"three", "width":30,"height":30}'
+        seq.add_canvas(mf.rawResource(raw_dict))
+        seq.add_canvas(mf.rawResource(raw_text))
+        self.assertEqual(seq.canvases[2].id, "http://example.org/prezi/canvas/c3.json")
+        self.assertRaises(DataError, seq.add_canvas, mf.rawResource(raw_text))
+        seq.set_start_canvas(seq.canvases[2])
+        js = mfst.toJSON(top=True)
+        cvs = js['sequences'][0]['canvases']
+        self.assertTrue(cvs[1] is raw_dict)
+        self.assertEqual(cvs[2]['label'], 'three')
+        # streaming output has the bytes verbatim
+        out = "".join(mfst.iterString(compact=False))
+        self.assertIn(raw_text.decode('utf-8'), out)
+        self.assertEqual(json.loads(out), json.loads(mfst.toString()))
+        # in collections they are minimal
+        coll = mf.collection(label="c")
+        coll.add_manifest(mf.rawResource({"@id": "http://example.org/m2.json",
+                                          "@type": "sc:Manifest", "label": "m2",
+                                          "sequences": []}))
+        self.assertEqual(coll.toJSON()['manifests'],
+                         [{"@id": "http://example.org/m2.json", "@type": "sc:Manifest", "label": "m2"}])
+        # checks
+        self.assertRaises(StructuralError, mf.rawResource, {"@id": "http://example.org/x"})
+        self.assertRaises(StructuralError, mf.rawResource, b'{"label": "x"}')
+        self.assertRaises(StructuralError, mf.rawResource, b'not json')
+        self.assertRaises(StructuralError, seq.add_canvas,
+                          mf.rawResource({"@id": "http://example.org/x", "@type": "sc:Manifest"}))
+        other = mf.rawResource(b'{"@type": "sc:Canvas", "@id": "http://example.org/c\\/4"}')
+        self.assertEqual(other.id, "http://example.org/c/4")
+
+    def test20_to_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            mf = ManifestFactory(mdbase="http://example.org/prezi/", mddir=tmpdir)
+            mf.set_debug("error")
+            mfst = mf.manifest(ident="book1/manifest", label="m")
+            seq = mfst.sequence()
+            seq.canvas(ident="c1", label="one").set_hw(10, 10)
+            out = mfst.toFile(compact=False)
+            self.assertEqual(out, mfst.toString(compact=False))
+            with open(os.path.join(tmpdir, "book1", "manifest.json")) as fh:
+                self.assertEqual(fh.read(), out)
+            # Failure part way through leaves the existing file alone
+            seq.canvases[0].height = 0
+            self.assertRaises(RequirementError, mfst.toFile)
+            self.assertEqual(os.listdir(os.path.join(tmpdir, "book1")), ["manifest.json"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test21_pickle(self):
+        mf = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/iiif/")
+        mf.set_iiif_image_info("2.0", "1")
+        mf.set_debug_stream(io.StringIO())
+        mfst = mf.manifest(label="Book")
+        seq = mfst.sequence()
+        seq.bulk_canvases(["c%d" % i for i in range(20)], ["p%d" % i for i in range(20)],
+                          [100] * 20, [50] * 20)
+        data = pickle.dumps(mfst, pickle.HIGHEST_PROTOCOL)
+        copy = pickle.loads(data)
+        self.assertEqual(copy.toString(compact=False), mfst.toString(compact=False))
+        # The factory is pickled once, as its configuration, and unpickled
+        # as the one factory for that configuration in this process
+        self.assertTrue(copy._factory is not mf)
+        self.assertTrue(copy.sequences[0].canvases[5]._factory is copy._factory)
+        self.assertTrue(pickle.loads(data)._factory is copy._factory)
+        self.assertTrue(len(data) < len(mfst.toString()))
+        config = mf.get_config()
+        self.assertEqual(config['log_stream'], None)
+        other = factory_from_config(config)
+        self.assertEqual(other.prezi_base, "http://example.org/prezi/")
+        self.assertEqual(other.default_image_api_version, "2.0")
+        self.assertTrue(other is copy._factory)
+        self.assertTrue(factory_from_config(config) is other)
+        # Empty lists aren't shared after unpickling
+        cvs = pickle.loads(pickle.dumps(seq.canvases[0]))
+        cvs.otherContent.append("x")
+        self.assertEqual(seq.canvases[1].otherContent, [])
+        # and resources can go through a process pool
+        pool = multiprocessing.Pool(2)
+        try:
+            done = pool.map(_relabel, seq.canvases[:4])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual([c.label for c in done], ["Changed p0", "Changed p1", "Changed p2", "Changed p3"])
+        self.assertTrue(done[0]._factory is other)
+
+    def test22_compact_selection(self):
+        mf = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/iiif/")
+        mf.set_iiif_image_info("2.0", "1")
+        mf.set_debug("error")
+        cvs = mf.canvas(ident="c1", label="p1")
+        cvs.set_hw(100, 200)
+        al = mf.annotationList(ident="l1.json")
+        for compact in (False, True):
+            for summarize in (False, True):
+                anno = al.annotation()
+                anno.text("word")
+                anno.on = cvs.make_selection("xywh=1,2,3,4", summarize=summarize, compact=compact)
+            img = mf.image("i1", iiif=True)
+            img.set_hw(100, 200)
+            cvs.annotation().resource = img.make_selection("xywh=1,2,3,4", compact=compact)
+        sel = al.resources[3].on
+        self.assertTrue(isinstance(sel, FragmentSelection))
+        for compact in (True, False):
+            text = al.toString(compact)
+            self.assertEqual(text, "".join(al.iterString(compact)))
+            res = json.loads(text)['resources']
+            self.assertEqual(res[0]['on'], res[2]['on'])
+            self.assertEqual(res[1]['on'], res[3]['on'])
+        self.assertEqual(res[3]['on']['full'],
+                         {"@id": cvs.id, "@type": "sc:Canvas", "label": "p1"})
+        res = json.loads(cvs.toString())['images']
+        self.assertEqual(res[0]['resource'], res[1]['resource'])
+        self.assertEqual(res[1]['resource']['selector']['value'], "xywh=1,2,3,4")
+        # Immutable, small, and pickles as the resource and value
+        self.assertRaises(DataError, setattr, sel, 'style', 'x')
+        self.assertFalse(hasattr(sel, '__dict__') and sel.__dict__)
+        copy = pickle.loads(pickle.dumps(al, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.toString(), al.toString())
+        self.assertTrue(isinstance(copy.resources[3].on, FragmentSelection))
+        # Non-string selectors still make SpecificResources
+        sr = cvs.make_selection({"@type": "oa:SvgSelector", "value": "<svg/>"}, compact=True)
+        self.assertFalse(isinstance(sr, FragmentSelection))
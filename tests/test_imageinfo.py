@@ -0,0 +1,115 @@
+"""Test code for iiif_prezi.imageinfo."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:  # Py2
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+from iiif_prezi.factory import ManifestFactory, DataError
+from iiif_prezi.imageinfo import InfoEnricher, image_services
+
+INFO = {
+    "@context": "http://iiif.io/api/image/2/context.json",
+    "@id": "http://example.org/iiif/img0",
+    "profile": "http://iiif.io/api/image/2/level0.json",
+    "width": 2000,
+    "height": 3000,
+    "sizes": [{"width": 100, "height": 150}, {"width": 500, "height": 750}],
+    "tiles": [{"width": 512, "scaleFactors": [1, 2, 4]}]
+}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files from the current directory without logging."""
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def manifest(self, imgbase):
+        fac = ManifestFactory(mdbase="http://example.org/prezi/", imgbase=imgbase)
+        fac.set_iiif_image_info("2.0", "0")
+        fac.set_debug("error")
+        mfst = fac.manifest(label="Book")
+        seq = mfst.sequence()
+        for i in range(4):
+            cvs = seq.canvas(ident="c%d" % i, label="p%d" % i)
+            cvs.set_hw(3000, 2000)
+            # two Canvases for each image
+            cvs.annotation().image("img%d" % (i // 2), iiif=True)
+        return mfst
+
+    def write_info(self, ident, info):
+        os.makedirs(os.path.join(self.tmp, "iiif", ident))
+        with open(os.path.join(self.tmp, "iiif", ident, "info.json"), "w") as fh:
+            json.dump(info, fh)
+
+    def test01_set_info(self):
+        mfst = self.manifest("http://example.org/iiif/")
+        svc = mfst.sequences[0].canvases[0].images[0].resource.service
+        self.assertEqual(svc.info_url(), "http://example.org/iiif/img0/info.json")
+        svc.set_info(INFO)
+        js = json.loads(svc.toString())
+        self.assertEqual(list(js.keys()), ["@context", "@id", "height", "width", "profile", "tiles", "sizes"])
+        self.assertEqual(list(js['tiles'][0].keys()), ["width", "scaleFactors"])
+        self.assertEqual(list(js['sizes'][0].keys()), ["height", "width"])
+        self.assertRaises(DataError, svc.set_info, {"sizes": []})
+        self.assertEqual(len(list(image_services(mfst))), 4)
+
+    def serve(self):
+        """Serve self.tmp over HTTP, return the base URI."""
+        os.chdir(self.tmp)
+        self.server = HTTPServer(('127.0.0.1', 0), QuietHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return "http://127.0.0.1:%d/iiif" % self.server.server_address[1]
+
+    def test02_enrich(self):
+        base = self.serve()
+        self.write_info("img0", INFO)
+        self.write_info("img1", dict(INFO, width=1000, height=800, sizes=[]))
+        mfst = self.manifest(base)
+        cache = os.path.join(self.tmp, "cache")
+        enricher = InfoEnricher(mfst._factory, cache_dir=cache, workers=2)
+        stats = enricher.enrich(mfst)
+        self.assertEqual((stats.services, stats.fetched, stats.cached, stats.failed), (4, 2, 0, []))
+        canvases = json.loads(mfst.toString())['sequences'][0]['canvases']
+        self.assertEqual(canvases[1]['images'][0]['resource']['service']['sizes'][1], {"height": 750, "width": 500})
+        self.assertEqual(canvases[2]['images'][0]['resource']['service']['width'], 1000)
+        self.assertEqual(canvases[2]['images'][0]['resource']['height'], 800)
+        self.assertEqual(len(os.listdir(cache)), 2)
+        # Again from the cache, without the info.json files
+        shutil.rmtree(os.path.join(self.tmp, "iiif"))
+        again = self.manifest(base)
+        stats = InfoEnricher(again._factory, cache_dir=cache).enrich(again)
+        self.assertEqual((stats.fetched, stats.cached), (0, 2))
+        self.assertEqual(again.toString(), mfst.toString())
+        # Failures are reported, and harvested infos used
+        other = self.manifest(base)
+        enricher = InfoEnricher(other._factory, infos={base + "/img1": INFO})
+        stats = enricher.enrich(other)
+        self.assertEqual(stats.services, 2)
+        self.assertEqual([f[0] for f in stats.failed], [base + "/img0"])
+        self.assertEqual(InfoEnricher(other._factory, fetch=False).enrich(other).failed, [])
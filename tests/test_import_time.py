@@ -0,0 +1,43 @@
+"""Import time benchmark for iiif_prezi, based on python -X importtime."""
+import os
+import subprocess
+import sys
+import unittest
+
+# Generous default so that a slow CI box doesn't fail, override with
+# IIIF_PREZI_IMPORT_BUDGET_MS to tighten the check
+BUDGET_MS = float(os.environ.get('IIIF_PREZI_IMPORT_BUDGET_MS', '1000'))
+LAZY_MODULES = ['PIL', 'Image', 'lxml', 'pyld', 'urllib.request', 'urllib2']
+
+
+def import_times(module):
+    """Run python -X importtime for module, return {name: cumulative_us}."""
+    out = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (selft, cumulative, name) = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime needs python 3.7+")
+class TestAll(unittest.TestCase):
+
+    def check_module(self, module):
+        times = import_times(module)
+        self.assertIn(module, times)
+        for name in times:
+            for lazy in LAZY_MODULES:
+                self.assertFalse(name == lazy or name.startswith(lazy + '.'),
+                                 "importing %s imported %s" % (module, name))
+        self.assertLess(times[module] / 1000.0, BUDGET_MS)
+
+    def test01_factory(self):
+        self.check_module('iiif_prezi.factory')
+
+    def test02_loader(self):
+        self.check_module('iiif_prezi.loader')
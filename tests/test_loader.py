@@ -90,3 +90,25 @@ class TestAll(unittest.TestCase):
         lv = mr.labels_and_values({'label': 'l',
                                    'value': ['val1', 'val2']})
         self.assertEqual(lv, {'l': ['val1', 'val2']})
+
+    def test07_get_warnings(self):
+        mr = ManifestReader('{}')
+        self.assertEqual(mr.get_warnings(), [])
+        js = {'@context': 'http://iiif.io/api/presentation/2/context.json',
+              '@id': 'http://example.org/m.json', '@type': 'sc:Manifest',
+              'label': 'm',
+              'sequences': [{'@type': 'sc:Sequence', 'canvases': [
+                  {'@id': 'http://example.org/c1.json', '@type': 'sc:Canvas',
+                   'label': 'c1', 'height': 10, 'width': 10,
+                   'images': [{'@type': 'oa:Annotation', 'motivation': 'sc:painting',
+                               'on': 'http://example.org/c1.json',
+                               'resource': {'@id': 'http://example.org/i.jpg',
+                                            '@type': 'dctypes:Image', 'format': 'image/jpeg',
+                                            'height': 10, 'width': 10}}]}]}]}
+        mr = ManifestReader(js)
+        mr.read().toJSON(top=True)
+        recs = mr.get_warning_records()
+        self.assertEqual([r.code for r in recs], ['missing-recommended'] * 2)
+        self.assertEqual(mr.get_warnings(), [
+            "WARNING: Resource type 'sc:Manifest' should have 'description' set\n",
+            "WARNING: Resource type 'oa:Annotation' should have '@id' set\n"])
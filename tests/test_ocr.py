@@ -0,0 +1,131 @@
+"""Test code for iiif_prezi.ocr."""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.factory import ManifestFactory
+from iiif_prezi.ocr import OcrPage, OcrWriter, iter_alto, iter_hocr, iter_pages, _scale_columns
+from iiif_prezi.util import optional_import
+
+HOCR = b"""<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title></title></head>
+<body>
+<div class="ocr_page" id="page_1" title='image "p1.tif"; bbox 0 0 2000 3000; ppageno 0'>
+ <span class="ocr_line" title="bbox 100 200 700 260">
+  <span class="ocrx_word" title="bbox 100 200 300 260; x_wconf 91">Caf\xc3\xa9</span>
+  <span class="ocrx_word" title="bbox 320 200 700 260; x_wconf 85"><strong>"100%"</strong></span>
+  <span class="ocrx_word" title="bbox 720 200 800 260; x_wconf 85"> </span>
+ </span>
+</div>
+<div class="ocr_page" id="page_2" title='image "p2.tif"; bbox 0 0 1000 1500; ppageno 1'>
+ <span class="ocrx_word" title="bbox 10 20 30 40">two</span>
+</div>
+</body>
+</html>
+"""
+
+ALTO = b"""<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#">
+<Description><MeasurementUnit>pixel</MeasurementUnit>
+<sourceImageInformation><fileName>scan.tif</fileName></sourceImageInformation></Description>
+<Layout>
+<Page ID="P1" PHYSICAL_IMG_NR="7" WIDTH="2000" HEIGHT="3000">
+<PrintSpace><TextBlock><TextLine>
+<String CONTENT="Caf\xc3\xa9" HPOS="100" VPOS="200" WIDTH="200" HEIGHT="60"/><SP/>
+<String CONTENT='"100%"' HPOS="320.5" VPOS="200" WIDTH="380" HEIGHT="60"/>
+</TextLine></TextBlock></PrintSpace>
+</Page>
+</Layout>
+</alto>
+"""
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def factory(self):
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_prezi_dir(self.tmp)
+        return fac
+
+    def expected(self, fac, page, canvas, ident, compact, language=""):
+        """Serialization of the same list built from objects."""
+        al = fac.annotationList(ident=ident)
+        (xs, ys, ws, hs) = page.scaled(canvas.width, canvas.height)
+        for (i, text) in enumerate(page.text):
+            anno = al.annotation(ident="%s#w%d" % (al.id, i))
+            anno.text(text, language=language)
+            anno.on = canvas.make_fragment("xywh=%d,%d,%d,%d" % (xs[i], ys[i], ws[i], hs[i]))
+        return al.toString(compact)
+
+    def test01_hocr(self):
+        pages = list(iter_hocr(io.BytesIO(HOCR)))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[0].number, 0)
+        self.assertEqual((pages[0].width, pages[0].height, pages[0].image), (2000, 3000, "p1.tif"))
+        self.assertEqual(pages[0].text, [u"Caf\xe9", u'"100%"'])
+        self.assertEqual(list(pages[0].x), [100, 320])
+        self.assertEqual(list(pages[0].w), [200, 380])
+        self.assertEqual(pages[1].text, ["two"])
+        self.assertEqual(pages[0].scaled(1000, 1500), [[50, 160], [100, 100], [100, 190], [30, 30]])
+        # unknown page size, no scaling
+        self.assertEqual(OcrPage(1).scaled(10, 10), [[], [], [], []])
+
+    def test02_alto(self):
+        (page,) = list(iter_alto(io.BytesIO(ALTO)))
+        self.assertEqual(page.number, 7)
+        self.assertEqual(page.image, "scan.tif")
+        self.assertEqual(page.text, [u"Caf\xe9", u'"100%"'])
+        self.assertEqual(list(page.x), [100, 320.5])
+        self.assertEqual(page.scaled(4000, 6000)[0], [200, 641])
+
+    def test03_write(self):
+        fac = self.factory()
+        page = list(iter_hocr(io.BytesIO(HOCR)))[0]
+        # %-encoded identity, to check it isn't taken as formatting
+        cvs = fac.canvas(ident="c%201", label="p1")
+        cvs.set_hw(1500, 1000)
+        for compact in (True, False):
+            for language in ("", "fr"):
+                writer = OcrWriter(fac, compact=compact, language=language)
+                ref = writer.write_page(page, cvs, "ocr-1.json", add=False)
+                with io.open(os.path.join(self.tmp, "list", "ocr-1.json"), encoding='utf-8') as fh:
+                    self.assertEqual(fh.read(), self.expected(fac, page, cvs, "ocr-1.json", compact, language))
+                self.assertEqual(writer.words, 2)
+        self.assertEqual(ref.id, "http://example.org/prezi/list/ocr-1.json")
+        self.assertEqual(cvs.otherContent, [])
+        writer.write_page(OcrPage(2), cvs, "ocr-2.json")
+        self.assertEqual(cvs.toJSON()['otherContent'][0]['@id'], "http://example.org/prezi/list/ocr-2.json")
+        with open(os.path.join(self.tmp, "list", "ocr-2.json")) as fh:
+            self.assertEqual(json.load(fh)['resources'], [])
+
+    def test04_iter_pages(self):
+        for (name, data, n) in (("a.hocr", HOCR, 2), ("a.xml", ALTO, 1)):
+            fn = os.path.join(self.tmp, name)
+            with open(fn, 'wb') as fh:
+                fh.write(data)
+            self.assertEqual(len(list(iter_pages(fn))), n)
+
+    def test05_rounding(self):
+        page = OcrPage(1, 100, 100)
+        page.add("a", 5, 15, 25, 1)
+        page.add("b", -5, 0.5, 3, 7)
+        # halves round up, with or without numpy
+        expected = [[3, -2], [8, 0], [13, 2], [1, 4]]
+        self.assertEqual(page.scaled(50, 50), expected)
+        columns = [(page.x, 0.5), (page.y, 0.5), (page.w, 0.5), (page.h, 0.5)]
+        self.assertEqual(_scale_columns(columns), expected)
+        np = optional_import('numpy')
+        if np is not None:
+            self.assertEqual(_scale_columns(columns, np), expected)
@@ -0,0 +1,126 @@
+"""Test code for iiif_prezi.paging."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.factory import ManifestFactory, ConfigurationError
+from iiif_prezi.loader import ManifestReader
+from iiif_prezi.paging import AnnotationListWriter, page_ident, layer_ident
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def factory(self):
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_prezi_dir(self.tmp)
+        fac.set_base_image_uri("http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "1")
+        return fac
+
+    def build(self, fac, counts):
+        mfst = fac.manifest(label="OCR")
+        seq = mfst.sequence()
+        for (i, n) in enumerate(counts):
+            cvs = seq.canvas(ident="c%d" % i, label="p%d" % i)
+            cvs.set_hw(100, 200)
+            al = cvs.annotationList(ident="ocr-%d.json" % i, label="OCR %d" % i)
+            for j in range(n):
+                anno = al.annotation(ident="a%d-%d" % (i, j))
+                anno.text("word %d" % j)
+                anno.on = cvs.id + "#xywh=%d,0,10,10" % j
+        return mfst
+
+    def read(self, ident):
+        path = os.path.join(self.tmp, ident[len("http://example.org/prezi/"):])
+        with open(path) as fh:
+            return json.load(fh)
+
+    def test01_idents(self):
+        self.assertEqual(page_ident("http://x/l.json", 1), "http://x/l.json")
+        self.assertEqual(page_ident("http://x/l.json", 3), "http://x/l-3.json")
+        self.assertEqual(page_ident("http://x/l", 2), "http://x/l-2")
+        self.assertEqual(layer_ident("http://x/l.json"), "http://x/l-layer.json")
+        fac = ManifestFactory()
+        self.assertRaises(ConfigurationError, AnnotationListWriter, fac)
+
+    def test02_unpaged(self):
+        fac = self.factory()
+        mfst = self.build(fac, [3, 0])
+        expected = mfst.sequences[0].canvases[0].otherContent[0].toString(compact=False)
+        mtext = mfst.toString(compact=False)
+        writer = AnnotationListWriter(fac, max_annotations=3, compact=False)
+        stats = writer.write_manifest(mfst)
+        self.assertEqual((stats.lists, stats.pages, stats.layers, stats.annotations), (2, 2, 0, 3))
+        with open(os.path.join(self.tmp, "list", "ocr-0.json")) as fh:
+            self.assertEqual(fh.read(), expected)
+        # Released lists are still referred to in the same way
+        self.assertEqual(mfst.toString(compact=False), mtext)
+        self.assertEqual(self.read("http://example.org/prezi/list/ocr-1.json")['@id'],
+                         "http://example.org/prezi/list/ocr-1.json")
+
+    def test03_paged(self):
+        fac = self.factory()
+        mfst = self.build(fac, [25])
+        al = mfst.sequences[0].canvases[0].otherContent[0]
+        annos = [a.toJSON() for a in al.resources]
+        writer = AnnotationListWriter(fac, max_annotations=10, release=False)
+        self.assertEqual(writer.write_list(al), 3)
+        self.assertEqual(len(al.resources), 25)
+        ident = "http://example.org/prezi/list/ocr-0.json"
+        layer = self.read("http://example.org/prezi/list/ocr-0-layer.json")
+        self.assertEqual(layer['@type'], 'sc:Layer')
+        self.assertEqual(layer['total'], 25)
+        self.assertEqual(layer['first'], ident)
+        self.assertEqual(layer['last'], "http://example.org/prezi/list/ocr-0-3.json")
+        found = []
+        page = layer['first']
+        prev = None
+        while page:
+            js = self.read(page)
+            self.assertEqual(js['@id'], page)
+            self.assertEqual(js['within']['@id'], layer['@id'])
+            # startIndex 0 on the first page is left out, as are other empty values
+            self.assertEqual(js.get('startIndex', 0), len(found))
+            self.assertEqual(js.get('prev'), prev)
+            found.extend(js['resources'])
+            prev = page
+            page = js.get('next')
+        self.assertEqual(found, json.loads(json.dumps(annos)))
+        # pages can be read back
+        with open(os.path.join(self.tmp, "list", "ocr-0-2.json")) as fh:
+            js = json.load(fh)
+        js['@context'] = "http://iiif.io/api/presentation/2/context.json"
+        page = ManifestReader(js).read()
+        self.assertEqual(page.startIndex, 10)
+        self.assertEqual(len(page.resources), 10)
+
+    def test04_bytes(self):
+        fac = self.factory()
+        mfst = self.build(fac, [40])
+        cvs = mfst.sequences[0].canvases[0]
+        al = cvs.otherContent[0]
+        lyr = al.layer(ident="http://example.org/prezi/layer/ocr.json", label="OCR")
+        size = len(json.dumps(al.resources[0].toJSON(), separators=(',', ':')))
+        writer = AnnotationListWriter(fac, max_annotations=None, max_bytes=size * 5)
+        writer.write_canvas(cvs)
+        self.assertTrue(writer.stats.pages >= 8)
+        self.assertEqual(lyr.total, 40)
+        layer = self.read(lyr.id)
+        self.assertEqual(layer['total'], 40)
+        for n in range(1, writer.stats.pages + 1):
+            js = self.read(page_ident(al.id, n))
+            self.assertTrue(len(js['resources']) <= 5)
+            self.assertEqual(js['within'], {'@id': lyr.id, '@type': 'sc:Layer', 'label': 'OCR'})
+        # The Canvas now refers to the first page only
+        self.assertEqual(cvs.toJSON()['otherContent'],
+                         [{'@id': al.id, '@type': 'sc:AnnotationList', 'label': 'OCR 0'}])
@@ -0,0 +1,141 @@
+"""Test code for base URI rebasing: ManifestFactory.set_base_map() and iiif_prezi.rebase."""
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from iiif_prezi.factory import BaseMap, ManifestFactory, RawResource
+from iiif_prezi.ocr import OcrPage, OcrWriter
+from iiif_prezi.rebase import main, rebase_file, rebase_tree
+
+PREZI = "http://example.org/prezi/"
+IMAGES = "http://example.org/iiif"
+STAGING = {PREZI: "https://staging.example.org/p/", IMAGES: "https://img.staging.example.org/iiif"}
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fac = ManifestFactory()
+        self.fac.set_debug("error")
+        self.fac.set_base_prezi_uri(PREZI)
+        self.fac.set_base_prezi_dir(self.tmp)
+        self.fac.set_base_image_uri(IMAGES)
+        self.fac.set_iiif_image_info("2.0", "1")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def manifest(self):
+        mf = self.fac.manifest(label="Book")
+        mf.seeAlso = PREZI + "book.xml"
+        mf.description = "See http://example.org/prezi/ for more"
+        cvs = mf.sequence().canvas(ident="p1", label="p. 1")
+        cvs.set_hw(100, 100)
+        img = cvs.annotation(ident="a1").image("p1", iiif=True)
+        img.set_hw(100, 100)
+        cvs.thumbnail = cvs.make_selection("xywh=0,0,10,10", summarize=True, compact=True)
+        # written out verbatim, with escaped slashes
+        cvs.add_annotation(RawResource(
+            '{"@id": "http:\\/\\/example.org\\/prezi\\/annotation\\/a2.json", "@type": "oa:Annotation",'
+            ' "on": "http://example.org/prezi/canvas/p1.json"}'))
+        return mf
+
+    def test01_base_map(self):
+        bmap = BaseMap({"http://a/": "http://b/", "http://a/x/": "http://c/"})
+        self.assertEqual(bmap.uri("http://a/1"), "http://b/1")
+        self.assertEqual(bmap.uri("http://a/x/1"), "http://c/1")
+        self.assertEqual(bmap.uri("see http://a/1"), "see http://a/1")
+        self.assertEqual(bmap.text('{"@id": "http://a/x/1", "s": "http:\\/\\/a\\/2", "t": "see http://a/"}'),
+                         '{"@id": "http://c/1", "s": "http:\\/\\/b\\/2", "t": "see http://a/"}')
+        self.assertEqual(bmap.text_count('["http://a/", "http://a/x/"]'), ('["http://b/", "http://c/"]', 2))
+        self.assertEqual(BaseMap({}).text('"x"'), '"x"')
+        self.assertRaises(ValueError, self.fac.set_base_map, {"": "http://b/"})
+
+    def test02_serialize(self):
+        mf = self.manifest()
+        plain = mf.toJSON(top=True)
+        self.fac.set_base_map(STAGING)
+        js = mf.toJSON(top=True)
+        self.assertEqual(js['@id'], "https://staging.example.org/p/manifest.json")
+        self.assertEqual(mf.id, PREZI + "manifest.json")
+        self.assertEqual(js['seeAlso'], "https://staging.example.org/p/book.xml")
+        self.assertEqual(js['description'], plain['description'])
+        cvs = js['sequences'][0]['canvases'][0]
+        self.assertEqual(cvs['images'][0]['resource']['service']['@id'],
+                         "https://img.staging.example.org/iiif/p1")
+        self.assertEqual(cvs['thumbnail']['full']['@id'], "https://staging.example.org/p/canvas/p1.json")
+        self.assertEqual(cvs['images'][1]['@id'], "https://staging.example.org/p/annotation/a2.json")
+        self.assertEqual(cvs['images'][1]['on'], "https://staging.example.org/p/canvas/p1.json")
+        # streamed the same, raw resources included
+        text = "".join(mf.iterString(compact=False))
+        self.assertEqual(json.loads(text), js)
+        self.assertEqual(json.loads(mf.toString()), js)
+        self.assertFalse('example.org/prezi' in text.replace("See http://example.org/prezi/", ""))
+        self.assertEqual(json.loads(mf.toFile()), js)
+        with io.open(os.path.join(self.tmp, "manifest.json")) as fh:
+            self.assertEqual(json.load(fh), js)
+        # and the same as mapping the plain JSON
+        self.assertEqual(BaseMap(STAGING).json(plain), js)
+
+    def test03_rebased(self):
+        mf = self.manifest()
+        self.fac.set_base_map(STAGING)
+        mirror = {PREZI: "http://mirror.example.org/"}
+        found = []
+
+        def other():
+            found.append(mf.toJSON(top=True)['@id'])
+        with self.fac.rebased(mirror):
+            self.assertEqual(mf.toJSON(top=True)['@id'], "http://mirror.example.org/manifest.json")
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join()
+            with self.fac.rebased({}):
+                self.assertEqual(mf.toJSON(top=True)['@id'], mf.id)
+        self.assertEqual(found, ["https://staging.example.org/p/manifest.json"])
+        self.assertEqual(mf.toJSON(top=True)['@id'], "https://staging.example.org/p/manifest.json")
+        # only top level serializations are mapped
+        self.assertEqual(mf.toJSON()['@id'], mf.id)
+        # OCR lists
+        page = OcrPage(1, 100, 100)
+        page.add("word", 1, 2, 3, 4)
+        cvs = mf.sequences[0].canvases[0]
+        for compact in (True, False):
+            with self.fac.rebased(mirror):
+                ref = OcrWriter(self.fac, compact=compact).write_page(page, cvs, "ocr1", add=False)
+            with io.open(os.path.join(self.tmp, "list", "ocr1.json")) as fh:
+                js = json.load(fh)
+            self.assertEqual(js['@id'], "http://mirror.example.org/list/ocr1.json")
+            self.assertEqual(js['resources'][0]['@id'], "http://mirror.example.org/list/ocr1.json#w0")
+            self.assertEqual(js['resources'][0]['on'], "http://mirror.example.org/canvas/p1.json#xywh=1,2,3,4")
+            self.assertEqual(ref.id, PREZI + "list/ocr1.json")
+
+    def test04_rebase_files(self):
+        mf = self.manifest()
+        mf.toFile(compact=False)
+        self.fac.annotationList(ident="sub/l1").toFile()
+        with io.open(os.path.join(self.tmp, "broken.json"), 'wb') as fh:
+            fh.write(b'\xff')
+        expected = BaseMap(STAGING).json(mf.toJSON(top=True))
+        dst = os.path.join(self.tmp, "out")
+        path = os.path.join(self.tmp, "manifest.json")
+        with io.open(path) as fh:
+            text = fh.read()
+        uris = text.count('"http://example.org/') + text.count('"http:\\/\\/example.org')
+        self.assertEqual(rebase_file(path, os.path.join(self.tmp, "m2.json"), BaseMap(STAGING)), uris)
+        stats = rebase_tree(self.tmp, dst, STAGING, processes=0)
+        self.assertEqual((stats.files, stats.changed, len(stats.failed)), (3, 2, 1))
+        with io.open(os.path.join(dst, "manifest.json")) as fh:
+            self.assertEqual(json.load(fh), expected)
+        with io.open(os.path.join(dst, "list", "sub", "l1.json")) as fh:
+            self.assertEqual(json.load(fh)['@id'], "https://staging.example.org/p/list/sub/l1.json")
+        # in place, from the command line
+        os.remove(os.path.join(self.tmp, "broken.json"))
+        self.assertEqual(main([dst, dst, "-p", "2", "--map", "https://staging.example.org/p/=http://x.org/"]), 0)
+        with io.open(os.path.join(dst, "manifest.json")) as fh:
+            self.assertEqual(json.load(fh)['@id'], "http://x.org/manifest.json")
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Test code for iiif_prezi.search."""
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.factory import DataError, ManifestFactory
+from iiif_prezi.ocr import OcrPage, OcrWriter
+from iiif_prezi.search import SearchIndex, SearchIndexBuilder, build_index, tokenize
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "book.idx")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def manifest(self):
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_prezi_dir(self.tmp)
+        mf = fac.manifest(label="Book")
+        seq = mf.sequence()
+        pages = [["The", "quick", "brown", "fox"], ["jumps", "over", "the", "lazy", "dog."],
+                 ["Quick", "brown", "dogs", "and", "quicker", "foxes"]]
+        for (n, words) in enumerate(pages):
+            cvs = seq.canvas(ident="c%d" % n, label="p%d" % n)
+            cvs.set_hw(1000, 800)
+            lst = cvs.annotationList(ident="l%d" % n)
+            for (i, word) in enumerate(words):
+                anno = lst.annotation(ident="l%d-w%d" % (n, i))
+                anno.text(word)
+                anno.on = "%s#xywh=%d,10,50,20" % (cvs.id, i * 60)
+        return (fac, mf)
+
+    def test01_phrases(self):
+        (fac, mf) = self.manifest()
+        self.assertEqual(tokenize("Caf\xe9, 100%!"), ["caf\xe9", "100"])
+        build_index(mf, self.path)
+        with SearchIndex(self.path) as idx:
+            self.assertEqual(idx.n_annotations, 15)
+            self.assertEqual(list(idx.terms("qu")), ["quick", "quicker"])
+            self.assertEqual(len(idx.search("quick brown")), 2)
+            self.assertEqual(len(idx.search("brown quick")), 0)
+            self.assertEqual(idx.search("nothing"), [])
+            self.assertEqual(idx.search("  "), [])
+            # phrases continue across annotations, but not across canvases
+            hits = idx.hits("brown fox")
+            self.assertEqual(len(hits), 1)
+            self.assertEqual([idx.annotation(n)[0] for n in hits[0]],
+                             ["http://example.org/prezi/annotation/l0-w2.json",
+                              "http://example.org/prezi/annotation/l0-w3.json"])
+            self.assertEqual(idx.annotation(hits[0][1]),
+                             ("http://example.org/prezi/annotation/l0-w3.json", "fox",
+                              "http://example.org/prezi/canvas/c0.json", (180, 10, 50, 20)))
+            self.assertEqual(idx.hits("fox jumps"), [])
+            self.assertEqual(idx.hits("dog quick"), [])
+            self.assertEqual(len(idx.hits("jumps")), 1)
+            self.assertEqual(len(idx.search("fox")), 1)
+            self.assertEqual(len(idx.search("fox", prefix=True)), 2)
+            self.assertEqual(len(idx.search("brown fox", prefix=True)), 1)
+            self.assertEqual(len(idx.search("quick brown do", prefix=True)), 1)
+            self.assertEqual(len(idx.search("QUICK", prefix=True)), 3)
+        self.assertRaises(DataError, SearchIndex, __file__)
+
+    def test02_content_search(self):
+        (fac, mf) = self.manifest()
+        build_index(mf, self.path)
+        with SearchIndex(self.path) as idx:
+            res = idx.content_search("lazy dog", "http://example.org/search")
+            self.assertEqual(res['@id'], "http://example.org/search?q=lazy%20dog")
+            self.assertEqual(res['@type'], "sc:AnnotationList")
+            self.assertEqual(res['@context'][1], "http://iiif.io/api/search/1/context.json")
+            self.assertEqual([a['@id'] for a in res['resources']],
+                             ["http://example.org/prezi/annotation/l1-w3.json",
+                              "http://example.org/prezi/annotation/l1-w4.json"])
+            self.assertEqual(res['resources'][1]['on'], "http://example.org/prezi/canvas/c1.json#xywh=240,10,50,20")
+            self.assertEqual(res['resources'][1]['resource']['chars'], "dog.")
+            self.assertEqual(res['hits'], [{"@type": "search:Hit", "annotations": [
+                "http://example.org/prezi/annotation/l1-w3.json",
+                "http://example.org/prezi/annotation/l1-w4.json"]}])
+            self.assertFalse('within' in res)
+            # paged
+            res = idx.content_search("quick", "http://example.org/search", prefix=True, per_page=2)
+            self.assertEqual(res['within']['total'], 3)
+            self.assertEqual(len(res['hits']), 2)
+            self.assertEqual(res['next'], "http://example.org/search?q=quick&page=1")
+            self.assertEqual(res['within']['last'], "http://example.org/search?q=quick&page=1")
+            res = idx.content_search("quick", "http://example.org/search", prefix=True, page=1, per_page=2)
+            self.assertEqual(res['@id'], "http://example.org/search?q=quick&page=1")
+            self.assertEqual(res['startIndex'], 2)
+            self.assertEqual(res['prev'], "http://example.org/search?q=quick")
+            self.assertFalse('next' in res)
+            self.assertEqual(res['resources'][0]['resource']['chars'], "quicker")
+
+    def test03_lists(self):
+        (fac, mf) = self.manifest()
+        builder = SearchIndexBuilder()
+        # JSON of a list, and a list written by OcrWriter
+        builder.add_list(mf.sequences[0].canvases[2].otherContent[0].toJSON(top=True))
+        page = OcrPage(1, 2000, 2000)
+        page.add("Caf\xe9 brown", 100, 200, 300, 60)
+        page.add("quick", 500, 200, 100, 60)
+        cvs = fac.canvas(ident="ocr")
+        cvs.set_hw(1000, 1000)
+        ref = OcrWriter(fac).write_page(page, cvs, "ocr1")
+        builder.add_list_file(os.path.join(self.tmp, "list", "ocr1.json"))
+        # other bodies and targets are skipped or kept without a box
+        builder.add_list({"resources": [{"@id": "a", "resource": {"@id": "img.jpg"}, "on": "c"},
+                                        {"@id": "b", "resource": {"chars": "Brown Fox"},
+                                         "on": {"@type": "oa:SpecificResource", "full": "c",
+                                                "selector": {"value": "t=1,2"}}}]})
+        self.assertRaises(DataError, builder.add_list, "list")
+        builder.write(self.path)
+        with SearchIndex(self.path) as idx:
+            self.assertEqual(idx.n_annotations, 9)
+            self.assertEqual(idx.n_canvases, 3)
+            matches = [[idx.annotation(n) for n in hit] for hit in idx.hits("brown quick")]
+            self.assertEqual(matches, [[
+                ("%s#w0" % ref.id, "Caf\xe9 brown", cvs.id, (50, 100, 150, 30)),
+                ("%s#w1" % ref.id, "quick", cvs.id, (250, 100, 50, 30))]])
+            self.assertEqual(idx.annotation(idx.hits("brown fox")[0][0]), ("b", "Brown Fox", "c", None))
+            self.assertEqual(idx.content_search("fox", "s")['resources'][0]['on'], "c")
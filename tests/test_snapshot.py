@@ -0,0 +1,86 @@
+"""Test code for iiif_prezi.snapshot."""
+import io
+import unittest
+
+from iiif_prezi import snapshot
+from iiif_prezi.factory import ManifestFactory, DataError, Canvas
+from iiif_prezi.loader import ManifestReader
+from iiif_prezi.store import ResourceStore
+from iiif_prezi.util import optional_import
+
+
+class TestAll(unittest.TestCase):
+
+    def test01_fixtures(self):
+        for n in [1, 5, 10, 19]:
+            fn = 'tests/testdata/2.0/example/fixtures/%d/manifest.json' % n
+            with io.open(fn, 'r', encoding='utf-8') as fh:
+                mfst = ManifestReader(fh.read()).read()
+            data = snapshot.dumps(mfst, 'marshal')
+            copy = snapshot.loads(data)
+            self.assertEqual(copy.toString(compact=False), mfst.toString(compact=False))
+
+    def test02_shared(self):
+        fac = ManifestFactory(mdbase="http://example.org/prezi/")
+        mfst = fac.manifest(label="Book")
+        seq = mfst.sequence()
+        cvs = seq.canvas(ident="c1", label="p1")
+        cvs.set_hw(10, 20)
+        rng = mfst.range(ident="r1", label="Range")
+        rng.add_canvas(cvs)
+        seq.add_canvas(fac.rawResource(b'{"@id":"http://example.org/c2","@type":"sc:Canvas"}'))
+        fh = io.BytesIO()
+        snapshot.dump(mfst, fh)
+        fh.seek(0)
+        copy = snapshot.load(fh, factory=fac)
+        self.assertTrue(isinstance(copy.sequences[0].canvases[0], Canvas))
+        self.assertTrue(copy.structures[0]._parent is copy)
+        self.assertTrue(copy._factory is fac)
+        self.assertEqual(copy.toString(), mfst.toString())
+        self.assertRaises(DataError, snapshot.loads, b'{}')
+
+    def test03_selections(self):
+        fac = ManifestFactory(mdbase="http://example.org/prezi/")
+        fac.set_debug("error")
+        cvs = fac.canvas(ident="c1", label="p1")
+        cvs.set_hw(10, 20)
+        al = fac.annotationList(ident="l1.json")
+        for summarize in (False, True):
+            anno = al.annotation()
+            anno.text("word")
+            anno.on = cvs.make_selection("xywh=1,2,3,4", summarize=summarize, compact=True)
+        copy = snapshot.loads(snapshot.dumps(al, 'marshal'), factory=fac)
+        self.assertEqual(copy.toString(), al.toString())
+        self.assertTrue(copy.resources[0].on.full is copy.resources[1].on._full)
+        self.assertTrue(copy.resources[1].on._factory is fac)
+
+    @unittest.skipIf(optional_import('msgpack') is None, "needs msgpack")
+    def test04_msgpack(self):
+        with io.open('tests/testdata/2.0/example/fixtures/1/manifest.json', 'r', encoding='utf-8') as fh:
+            mfst = ManifestReader(fh.read()).read()
+        data = snapshot.dumps(mfst, 'msgpack')
+        self.assertEqual(data, snapshot.dumps(mfst))
+        copy = snapshot.loads(data)
+        self.assertEqual(copy.toString(compact=False), mfst.toString(compact=False))
+
+    def test05_stored(self):
+        fac = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/iiif/")
+        fac.set_debug("error")
+        fac.set_iiif_image_info("2.0", "1")
+        store = ResourceStore(max_resident=10)
+        fac.set_resource_store(store)
+        mfst = fac.manifest(label="Book")
+        seq = mfst.sequence()
+        for i in range(200):
+            cvs = seq.canvas(ident="c%d" % i, label="p%d" % i)
+            cvs.set_hw(10, 20)
+            cvs.annotation().image("i%d" % i, iiif=True).set_hw(10, 20)
+        store.spill()
+        data = snapshot.dumps(mfst, 'marshal')
+        copy = snapshot.loads(data)
+        canvases = copy.sequences[0].canvases
+        self.assertEqual(len(set([c.id for c in canvases])), 200)
+        self.assertEqual(copy.toString(), mfst.toString())
+        # parts of stored resources are their own snapshots
+        self.assertEqual(snapshot.loads(snapshot.dumps(seq, 'marshal')).toString(), seq.toString())
+        store.close()
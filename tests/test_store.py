@@ -0,0 +1,143 @@
+"""Test code for iiif_prezi.store."""
+import unittest
+
+from iiif_prezi.factory import ManifestFactory, Canvas, Manifest, Sequence, ConfigurationError, DataError
+from iiif_prezi.store import ResourceStore, StoredResource
+
+
+class TestAll(unittest.TestCase):
+
+    def factory(self, store=None):
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/")
+        fac.set_base_image_uri("http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "1")
+        if store is not None:
+            fac.set_resource_store(store)
+        return fac
+
+    def build(self, fac, n=30):
+        coll = fac.collection(label="All")
+        for m in range(3):
+            mfst = coll.manifest(ident="m%d" % m, label="Manifest %d" % m)
+            seq = mfst.sequence()
+            for i in range(n):
+                cvs = seq.canvas(ident="m%d/c%d" % (m, i), label="p%d" % i)
+                cvs.set_hw(100, 200)
+                img = cvs.annotation().image("m%d/i%d" % (m, i), iiif=True)
+                img.set_hw(100, 200)
+            seq.bulk_canvases(["m%d/b%d" % (m, i) for i in range(n)], ["b"] * n, [1] * n, [2] * n)
+        return coll
+
+    def test01_same_output(self):
+        store = ResourceStore(max_resident=10)
+        fac = self.factory(store)
+        coll = self.build(fac)
+        mfst = coll.manifests[1]
+        self.assertEqual(type(mfst), StoredResource)
+        self.assertTrue(isinstance(mfst, Manifest))
+        self.assertTrue(isinstance(mfst.sequences[0].canvases[0], Canvas))
+        self.assertTrue(store.spills > 100)
+        self.assertTrue(len(store.resident) <= 10)
+        plain = self.build(self.factory())
+        self.assertEqual(coll.toString(), plain.toString())
+        for (a, b) in zip(coll.manifests, plain.manifests):
+            self.assertEqual(a.toString(compact=False), b.toString(compact=False))
+            self.assertEqual(''.join(a.iterString()), b.toString())
+        # Serializing doesn't need the resources to be written again
+        store.spill()
+        spills = store.spills
+        coll.manifests[0].toString()
+        store.spill()
+        self.assertEqual(store.spills, spills)
+        store.close()
+
+    def test02_changes_kept(self):
+        store = ResourceStore(max_resident=4)
+        fac = self.factory(store)
+        mfst = fac.manifest(label="M")
+        with store.pinned(mfst):
+            seq = mfst.sequence()
+            for i in range(20):
+                seq.canvas(ident="c%d" % i, label="p%d" % i).set_hw(1, 2)
+            # pinned while seq is added to, so its Manifest stays in memory
+            self.assertTrue(mfst._key in store.resident)
+            store.spill()
+            self.assertTrue(mfst._key in store.resident)
+        store.spill()
+        self.assertFalse(mfst._key in store.resident)
+        cvs = mfst.sequences[0].canvases[0]
+        self.assertEqual(cvs.label, "p0")
+        cvs.label = "changed"
+        cvs.set_hw(10, 20)
+        self.assertRaises(DataError, mfst.sequences[0].add_canvas, cvs)
+        store.spill()
+        js = mfst.toJSON(top=True)
+        self.assertEqual(len(js['sequences'][0]['canvases']), 20)
+        self.assertEqual(js['sequences'][0]['canvases'][0]['label'], "changed")
+        self.assertEqual(js['sequences'][0]['canvases'][0]['width'], 20)
+        self.assertTrue(mfst.sequences[0].canvases[0] is cvs)
+        self.assertRaises(ConfigurationError, self.factory, store)
+        store.close()
+
+    def test03_held_parts(self):
+        store = ResourceStore(max_resident=2)
+        fac = self.factory(store)
+        c0 = fac.canvas(ident="c0", label="p0")
+        lst = c0.otherContent
+        self.assertTrue(isinstance(lst, list))
+        for i in range(1, 10):
+            fac.canvas(ident="c%d" % i, label="p%d" % i)
+        self.assertFalse(c0._key in store.resident)
+        lst.append("http://example.org/list/0")
+        store.spill()
+        self.assertEqual(c0.otherContent, ["http://example.org/list/0"])
+        self.assertEqual(len(lst), 1)
+        with store.pinned(c0):
+            lst = c0.otherContent
+            for i in range(10, 20):
+                fac.canvas(ident="c%d" % i, label="p%d" % i)
+            self.assertTrue(c0._key in store.resident)
+            lst.append("http://example.org/list/1")
+        store.spill()
+        self.assertFalse(c0._key in store.resident)
+        self.assertEqual(list(c0.otherContent), ["http://example.org/list/0", "http://example.org/list/1"])
+        # pins nest
+        store.pin(c0)
+        with store.pinned(c0):
+            pass
+        store.spill()
+        self.assertTrue(c0._key in store.resident)
+        store.unpin(c0)
+        store.spill()
+        self.assertEqual(store.pins, {})
+        self.assertFalse(c0._key in store.resident)
+        store.close()
+
+    def test04_unpinned_sequence(self):
+        store = ResourceStore(max_resident=10)
+        fac = self.factory(store)
+        mfst = fac.manifest(label="M")
+        seq = mfst.sequence()
+        self.assertTrue(isinstance(seq, Sequence))
+        for i in range(50):
+            seq.canvas(ident="c%d" % i, label="p%d" % i).set_hw(1, 2)
+            anno = seq.canvases[i].annotation()
+            img = anno.image("i%d" % i, iiif=True)
+            if i % 10 == 0:
+                store.spill()
+            img.set_hw(1, 2)
+        # the Manifest and Canvases were spilled and read back
+        self.assertTrue(store.loads >= 10)
+        store.spill()
+        self.assertFalse(mfst._key in store.resident)
+        self.assertEqual(len(seq.canvases), 50)
+        js = mfst.toJSON(top=True)
+        self.assertEqual(len(js['sequences'][0]['canvases']), 50)
+        self.assertEqual(js['sequences'][0]['canvases'][49]['images'][0]['resource']['width'], 2)
+        self.assertTrue(mfst.sequences[0] is seq)
+        # parts that are moved can't be found again
+        mfst.sequences = []
+        self.assertRaises(DataError, getattr, seq, 'canvases')
+        store.close()
@@ -0,0 +1,90 @@
+"""Test code for iiif_prezi.structure."""
+import io
+import unittest
+
+from iiif_prezi.factory import ManifestFactory, DataError, StructuralError
+from iiif_prezi.loader import ManifestReader
+from iiif_prezi.structure import StructureIndex, ranges_from_toc
+
+BASE = "http://example.org/prezi/"
+
+
+class TestAll(unittest.TestCase):
+
+    def manifest(self, n=10):
+        fac = ManifestFactory(mdbase=BASE)
+        fac.set_debug("error")
+        mfst = fac.manifest(label="Book")
+        seq = mfst.sequence()
+        for i in range(n):
+            seq.canvas(ident="c%d" % i, label="p%d" % i).set_hw(10, 10)
+        return mfst
+
+    def cid(self, n):
+        return BASE + "canvas/c%d.json" % n
+
+    def labels(self, ranges):
+        return [r.label for r in ranges]
+
+    def test01_index(self):
+        mfst = self.manifest()
+        top = mfst.range(ident="top", label="Top")
+        top.viewingHint = "top"
+        one = top.range(ident="one", label="One")
+        mfst.add_range(one)
+        for n in (1, 2, 3, 7):
+            one.add_canvas(self.cid(n))
+        two = top.range(ident="two", label="Two")
+        mfst.add_range(two)
+        two.add_canvas(mfst.sequences[0].canvases[2], frag="#xywh=0,0,5,5")
+        two.add_canvas(self.cid(3))
+        self.assertEqual(len(mfst.structures), 3)
+        self.assertRaises(StructuralError, two.add_canvas, BASE + "canvas/missing.json")
+        ix = StructureIndex(mfst)
+        self.assertEqual(ix.intervals[1], [(1, 4), (7, 8)])
+        self.assertEqual(self.labels(ix.ranges_for(self.cid(2))), ["One", "Two"])
+        self.assertEqual(self.labels(ix.ranges_for(self.cid(7))), ["One"])
+        self.assertEqual(self.labels(ix.ranges_for(self.cid(7), inherited=True)), ["Top", "One"])
+        self.assertEqual(ix.ranges_for(self.cid(5)), [])
+        self.assertEqual(ix.ranges_for(self.cid(0)), [])
+        self.assertEqual(ix.ranges_for("http://example.org/other"), [])
+        self.assertTrue(ix.contains(one, self.cid(7) + "#xywh=0,0,1,1"))
+        self.assertFalse(ix.contains(one, self.cid(4)))
+        self.assertTrue(ix.contains(two.id, self.cid(2)))
+        self.assertEqual(ix.canvases(one), [self.cid(1), self.cid(2), self.cid(3), self.cid(7)])
+        self.assertEqual(ix.spans(one), [(self.cid(1), self.cid(3)), (self.cid(7), self.cid(7))])
+        self.assertEqual((ix.depth(top), ix.depth(one), ix.depth(two)), (0, 1, 1))
+        self.assertTrue(ix.parent(two) is top)
+        self.assertEqual([(d, r.label) for (d, r) in ix.toc()], [(0, "Top"), (1, "One"), (1, "Two")])
+        self.assertRaises(DataError, ix.depth, BASE + "range/missing.json")
+
+    def test02_toc(self):
+        mfst = self.manifest()
+        seq = mfst.sequences[0]
+        toc = [(0, "Front", self.cid(0)), (0, "Chapter 1", seq.canvases[2]),
+               (1, "Section 1.1", seq.canvases[2]), (1, "Section 1.2", self.cid(4)),
+               (0, "Chapter 2", self.cid(6) + "#xywh=0,0,5,5"), (1, "Section 2.1", self.cid(7))]
+        made = ranges_from_toc(mfst, toc)
+        self.assertEqual(made[0].id, BASE + "range/toc-1.json")
+        self.assertEqual(made[0].canvases, [self.cid(0), self.cid(1)])
+        self.assertEqual(made[1].ranges, [made[2].id, made[3].id])
+        ix = StructureIndex(mfst)
+        self.assertEqual([(d, r.label) for (d, r) in ix.toc()], [(d, l) for (d, l, c) in toc])
+        self.assertEqual(ix.spans(made[4]), [(self.cid(6), self.cid(9))])
+        self.assertEqual(self.labels(ix.ranges_for(self.cid(5))), ["Chapter 1", "Section 1.2"])
+        self.assertRaises(DataError, ranges_from_toc, self.manifest(), [(1, "Deep", self.cid(0))])
+        self.assertRaises(StructuralError, ranges_from_toc, self.manifest(), [(0, "X", BASE + "x")])
+
+    def test03_read(self):
+        with io.open('tests/range_range_fixture.json', encoding='utf-8') as fh:
+            mfst = ManifestReader(fh.read()).read()
+        ix = StructureIndex(mfst)
+        self.assertEqual(ix.unknown, [])
+        toc = list(ix.toc())
+        self.assertEqual([d for (d, r) in toc[:3]], [0, 1, 1])
+        top = toc[0][1]
+        for cid in ix.ids:
+            found = ix.ranges_for(cid, inherited=True)
+            if found:
+                self.assertTrue(found[0] is top)
+                self.assertEqual(len(found), 2)
@@ -0,0 +1,152 @@
+"""Test concurrent use of iiif_prezi from many threads."""
+import io
+import json
+import threading
+import unittest
+
+from iiif_prezi.factory import ManifestFactory, AnnotationList, Range, WarningCollector
+from iiif_prezi.loader import ManifestReader
+
+THREADS = 16
+ROUNDS = 5
+
+
+def factory():
+    fac = ManifestFactory()
+    fac.set_base_prezi_uri("http://example.org/prezi/")
+    fac.set_base_image_uri("http://example.org/iiif/")
+    fac.set_iiif_image_info("2.0", "1")
+    fac.set_debug("warn")
+    fac.set_debug_stream(io.StringIO())
+    return fac
+
+
+def build(fac, n):
+    """Manifest n, with ranges, annotation lists and resources that warn."""
+    mfst = fac.manifest(ident="m%d/manifest" % n, label="Manifest %d" % n)
+    seq = mfst.sequence(ident="m%d/normal" % n)
+    for i in range(n % 4 + 2):
+        cvs = seq.canvas(ident="m%d/c%d" % (n, i), label="p. %d" % i)
+        cvs.set_hw(1000 + n, 800 + i)
+        img = cvs.annotation(ident="m%d/a%d" % (n, i)).image("m%d-%d" % (n, i), iiif=True)
+        img.set_hw(1000 + n, 800 + i)
+        al = cvs.annotationList(ident="m%d/l%d" % (n, i))
+        al.annotation(ident="m%d/t%d" % (n, i)).text("Page %d of %d" % (i, n))
+    top = mfst.range(ident="m%d/r" % n, label="Top")
+    top.viewingHint = "top"
+    rng = mfst.range(ident="m%d/r0" % n, label="Chapter")
+    rng.add_canvas(seq.canvases[0])
+    if n % 2:
+        rng.viewingHint = "individuals"
+    return mfst
+
+
+class TestAll(unittest.TestCase):
+
+    def run_threads(self, target):
+        errors = []
+
+        def run(t):
+            try:
+                target(t)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(t,)) for t in range(THREADS)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        if errors:
+            raise errors[0]
+
+    def test01_shared_factory(self):
+        """Build, serialize and read back in many threads with one factory."""
+        expected = {}
+        for n in range(THREADS * ROUNDS):
+            expected[n] = build(factory(), n).toString(compact=False)
+        range_warn = Range._warn[:]
+        fac = factory()
+        results = {}
+
+        def work(t):
+            for r in range(ROUNDS):
+                n = t * ROUNDS + r
+                with fac.collect_warnings():
+                    text = build(fac, n).toString(compact=False)
+                results[n] = text
+                reader = ManifestReader(text)
+                results[n, 'read'] = reader.read().toString(compact=False)
+        self.run_threads(work)
+        for n in expected:
+            self.assertEqual(results[n], expected[n])
+            self.assertEqual(json.loads(results[n, 'read']), json.loads(expected[n]))
+        self.assertEqual(Range._warn, range_warn)
+        self.assertEqual(AnnotationList.resources, [])
+        self.assertEqual(fac.warnings.records(), [])
+
+    def test02_factory_per_thread(self):
+        """Factories in different threads don't affect each other."""
+        expected = build(factory(), 3).toString(compact=False)
+        results = []
+
+        def work(t):
+            fac = factory()
+            if t % 2:
+                fac.set_base_prezi_uri("http://example.com/other/")
+            for r in range(ROUNDS):
+                results.append((t, build(fac, 3).toString(compact=False)))
+        self.run_threads(work)
+        self.assertEqual(len(results), THREADS * ROUNDS)
+        for (t, text) in results:
+            if t % 2:
+                self.assertEqual(text, expected.replace("http://example.org/prezi/",
+                                                        "http://example.com/other/"))
+            else:
+                self.assertEqual(text, expected)
+
+    def test03_collect_warnings(self):
+        """Each thread sees only its own warnings."""
+        fac = factory()
+        seen = {}
+
+        def work(t):
+            with fac.collect_warnings() as collector:
+                for r in range(ROUNDS):
+                    coll = fac.collection(ident="w%d-%d" % (t, r), label="no description")
+                    coll.toJSON(top=True)
+            seen[t] = collector.records()
+        self.run_threads(work)
+        for t in range(THREADS):
+            idents = sorted(set([w.ident for w in seen[t]]))
+            self.assertEqual(idents, sorted(["http://example.org/prezi/w%d-%d.json" % (t, r)
+                                             for r in range(ROUNDS)]))
+        self.assertEqual(fac.warnings.records(), [])
+        self.assertEqual(fac.log_stream.getvalue(), "")
+        # Outside collect_warnings() the factory's collector is used again
+        fac.collection(ident="after", label="no description").toJSON(top=True)
+        self.assertTrue("description" in fac.log_stream.getvalue())
+
+    def test04_collector_lock(self):
+        """Concurrent adds to one WarningCollector respect its limits."""
+        fac = factory()
+        collector = WarningCollector(max_records=50, max_per_code=1000)
+        mfst = fac.manifest(ident="x", label="x")
+
+        def work(t):
+            with fac.collect_warnings(collector):
+                for r in range(100):
+                    fac.maybe_warn("warning %s %s", (t, r), code="w%d" % r, resource=mfst)
+        self.run_threads(work)
+        self.assertEqual(len(collector.records()), 50)
+        self.assertEqual(collector.suppressed, THREADS * 100 - 50)
+
+    def test05_range_warn(self):
+        """viewingHint changes the Range's own warnings only."""
+        fac = factory()
+        mfst = fac.manifest(ident="m", label="m")
+        top = mfst.range(ident="r1", label="Top")
+        top.viewingHint = "top"
+        other = mfst.range(ident="r2", label="Other")
+        self.assertEqual(Range._warn, ['canvases'])
+        self.assertFalse('canvases' in top._warn)
+        self.assertTrue('canvases' in other._warn)
@@ -0,0 +1,99 @@
+"""Test code for thumbnails and iiif_prezi.thumbnail."""
+import io
+import json
+import unittest
+
+from iiif_prezi.factory import ManifestFactory, Image, _image_request
+from iiif_prezi.loader import ManifestReader
+from iiif_prezi.thumbnail import ThumbnailEngine
+
+
+class TestAll(unittest.TestCase):
+
+    def factory(self):
+        fac = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "1")
+        fac.set_debug("error")
+        return fac
+
+    def manifest(self, fac, n=3, ident="m1"):
+        mfst = fac.manifest(ident=ident, label="Book")
+        seq = mfst.sequence()
+        for i in range(n):
+            cvs = seq.canvas(ident="%s-c%d" % (ident, i), label="p%d" % i)
+            cvs.set_hw(3000, 2000)
+            img = cvs.annotation().image("img%d" % (i % 2), iiif=True)
+            img.set_hw(3000, 2000)
+        return mfst
+
+    def test01_requests(self):
+        sizes = ((100, 150), (200, 300), (1000, 1500))
+        level0 = ("http://example.org/iiif/x", 2, 0, sizes, 0, 0)
+        self.assertEqual(_image_request(level0, 150, 150),
+                         ("http://example.org/iiif/x/full/100,/0/default.jpg", 100, 150))
+        self.assertEqual(_image_request(level0, 5000)[0], "http://example.org/iiif/x/full/1000,/0/default.jpg")
+        # Square can't be made by level 0, so a listed size is used
+        self.assertEqual(_image_request(level0, 150, square=True, image_width=1000, image_height=1500)[1:],
+                         (200, 300))
+        self.assertEqual(_image_request(level0[:3] + ((), 0, 0), 100)[0],
+                         "http://example.org/iiif/x/full/full/0/default.jpg")
+        level1 = ("http://example.org/iiif/x", 2, 1, (), 0, 0)
+        self.assertEqual(_image_request(level1, 300, square=True, image_width=2000, image_height=3000),
+                         ("http://example.org/iiif/x/0,500,2000,2000/300,/0/default.jpg", 300, 300))
+        self.assertEqual(_image_request(level1, 100, 80)[0], "http://example.org/iiif/x/full/!100,80/0/default.jpg")
+        self.assertEqual(_image_request(level1, 0, 80)[0], "http://example.org/iiif/x/full/,80/0/default.jpg")
+        self.assertEqual(_image_request(level1, 5000, image_width=2000, image_height=3000)[0],
+                         "http://example.org/iiif/x/full/full/0/default.jpg")
+        v1 = ("http://example.org/iiif/x", 1, 1, (), 0, 0)
+        self.assertEqual(_image_request(v1, 100, image_width=200, image_height=100)[0],
+                         "http://example.org/iiif/x/full/100,/0/native.jpg")
+        v3 = ("http://example.org/iiif/x", 3, 1, (), 0, 0)
+        self.assertEqual(_image_request(v3, 100, image_width=200, image_height=100)[0],
+                         "http://example.org/iiif/x/full/100,50/0/default.jpg")
+
+    def test02_get_thumbnail(self):
+        fac = self.factory()
+        mfst = self.manifest(fac)
+        cvs = mfst.sequences[0].canvases[0]
+        thumb = mfst.get_thumbnail()
+        self.assertTrue(isinstance(thumb, Image))
+        self.assertEqual(thumb.id, "http://example.org/iiif/img0/full/67,/0/default.jpg")
+        self.assertEqual((thumb.width, thumb.height), (67, 100))
+        self.assertTrue(thumb.service is cvs.images[0].resource.service)
+        self.assertEqual(cvs.get_thumbnail(height=150).id, "http://example.org/iiif/img0/full/100,/0/default.jpg")
+        # A thumbnail that is set is returned, or used for other sizes
+        cvs.thumbnail = thumb
+        self.assertTrue(cvs.get_thumbnail() is thumb)
+        self.assertEqual(cvs.get_thumbnail(width=30).id, "http://example.org/iiif/img0/full/30,/0/default.jpg")
+        other = fac.canvas(ident="c9", label="none")
+        self.assertEqual(other.get_thumbnail(), None)
+        other.thumbnail = "http://example.org/thumb.jpg"
+        self.assertEqual(other.get_thumbnail(width=10), "http://example.org/thumb.jpg")
+        # From a read manifest's thumbnail service
+        with io.open('tests/thumbnail_manifest.json', encoding='utf-8') as fh:
+            read = ManifestReader(fh.read()).read()
+        cvs = read.sequences[0].canvases[0]
+        url = cvs.get_thumbnail(width=120).id
+        self.assertTrue(url.endswith("_FL2292639_thumb/full/120,/0/default.jpg"))
+
+    def test03_engine(self):
+        fac = self.factory()
+        coll = fac.collection(ident="top", label="All")
+        for n in range(2):
+            coll.add_manifest(self.manifest(fac, 3, ident="m%d" % n))
+        engine = ThumbnailEngine(width=200, height=200)
+        self.assertEqual(engine.populate(coll), 8)
+        # Two images, each worked out once
+        self.assertEqual(len(engine.cache), 2)
+        self.assertEqual(engine.hits, 6)
+        mfst = coll.manifests[1]
+        js = json.loads(mfst.toString())
+        self.assertEqual(js['thumbnail']['@id'], "http://example.org/iiif/img0/full/133,/0/default.jpg")
+        self.assertEqual(js['sequences'][0]['canvases'][1]['thumbnail']['@id'],
+                         "http://example.org/iiif/img1/full/133,/0/default.jpg")
+        # Thumbnails already set are kept, unless replacing
+        self.assertEqual(engine.populate(mfst), 0)
+        square = ThumbnailEngine(width=64, square=True, replace=True)
+        self.assertEqual(square.populate(mfst.sequences[0].canvases[0]), 1)
+        self.assertEqual(mfst.sequences[0].canvases[0].thumbnail.id,
+                         "http://example.org/iiif/img0/0,500,2000,2000/64,/0/default.jpg")
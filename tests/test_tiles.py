@@ -0,0 +1,79 @@
+"""Test code for iiif_prezi.tiles."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.factory import ManifestFactory, ConfigurationError, DataError, get_pil_image
+from iiif_prezi.tiles import TileGenerator, level0_info, scale_factors, tile_layout
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def factory(self):
+        fac = ManifestFactory(mdbase="http://example.org/prezi/", imgbase="http://example.org/iiif/")
+        fac.set_debug("error")
+        fac.set_iiif_image_info("2.0", "0")
+        fac.set_image_api_dir(os.path.join(self.tmp, "iiif"))
+        fac.set_base_image_dir(self.tmp)
+        return fac
+
+    def test01_layout(self):
+        self.assertEqual(scale_factors(512, 100, 512), [1])
+        self.assertEqual(scale_factors(1200, 700, 256), [1, 2, 4, 8])
+        tiles = list(tile_layout(1200, 700, 512))
+        self.assertEqual(tiles[0], (4, "full", "300,", (0, 0, 300, 175)))
+        # 2 by 1 tiles at factor 2, 3 by 2 at factor 1
+        self.assertEqual([t[0] for t in tiles], [4, 2, 2, 1, 1, 1, 1, 1, 1])
+        self.assertEqual(tiles[2], (2, "1024,0,176,700", "88,", (512, 0, 600, 350)))
+        self.assertEqual(tiles[-1], (1, "1024,512,176,188", "176,", (1024, 512, 1200, 700)))
+        info = level0_info("http://example.org/iiif/x", 1200, 700, 512)
+        self.assertEqual(info['sizes'], [{"width": 300, "height": 175}, {"width": 600, "height": 350},
+                                         {"width": 1200, "height": 700}])
+        self.assertEqual(info['tiles'], [{"width": 512, "scaleFactors": [1, 2, 4]}])
+        self.assertEqual(info['profile'], "http://iiif.io/api/image/2/level0.json")
+
+    def test02_config(self):
+        fac = ManifestFactory(imgbase="http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "1")
+        self.assertRaises(ConfigurationError, TileGenerator, fac, self.tmp)
+        fac.set_iiif_image_info("2.0", "0")
+        self.assertRaises(ConfigurationError, TileGenerator, fac)
+        tiler = TileGenerator(self.factory())
+        img = tiler.factory.image("missing.tif", iiif=True)
+        self.assertRaises(DataError, tiler.add, img)
+        self.assertRaises(ConfigurationError, tiler.add, tiler.factory.image("http://example.org/x.jpg"))
+
+    @unittest.skipIf(get_pil_image() is None, "needs Pillow")
+    def test03_tiles(self):
+        pil_image = get_pil_image()
+        pil_image.new('RGB', (1200, 700), (200, 100, 50)).save(os.path.join(self.tmp, "page.tif"))
+        fac = self.factory()
+        cvs = fac.canvas(ident="c1", label="p1")
+        cvs.set_hw(700, 1200)
+        img = cvs.annotation().image("page.tif", iiif=True)
+        tiler = TileGenerator(fac, tile_size=512, processes=0)
+        tiler.add(img)
+        self.assertEqual(tiler.run(), 1)
+        base = os.path.join(self.tmp, "iiif", "page.tif")
+        with open(os.path.join(base, "info.json")) as fh:
+            info = json.load(fh)
+        self.assertEqual(info['@id'], "http://example.org/iiif/page.tif")
+        for (factor, region, size, box) in tile_layout(1200, 700, 512):
+            path = os.path.join(base, region, size, "0", "default.jpg")
+            self.assertEqual(pil_image.open(path).size, (box[2] - box[0], box[3] - box[1]))
+        for size in info['sizes']:
+            path = os.path.join(base, "full", "%d," % size['width'], "0", "default.jpg")
+            self.assertEqual(pil_image.open(path).size, (size['width'], size['height']))
+        self.assertTrue(os.path.exists(os.path.join(base, "full", "full", "0", "default.jpg")))
+        self.assertEqual((img.width, img.height), (1200, 700))
+        svc = json.loads(img.service.toString())
+        self.assertEqual(svc['sizes'][0], {"height": 175, "width": 300})
+        self.assertEqual(svc['profile'], "http://iiif.io/api/image/2/level0.json")
@@ -0,0 +1,166 @@
+"""Test code for iiif_prezi.upgrade."""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.factory import DataError, ManifestFactory
+from iiif_prezi.loader import ManifestReader
+from iiif_prezi.upgrade import (UpgradePipeline, Upgrader, detect_version, main,
+                                validate_upgraded)
+
+OLD = {
+    "@context": "http://www.shared-canvas.org/ns/context.json",
+    "@id": "http://example.org/iiif/old/manifest.json",
+    "@type": "sc:Manifest",
+    "label": "Old book",
+    "agent": "Ann",
+    "date": "1850",
+    "sequences": [{
+        "@type": "sc:Sequence",
+        "canvases": [{
+            "@id": "http://example.org/iiif/old/canvas/1.json",
+            "@type": "sc:Canvas",
+            "label": "p. 1",
+            "height": 100,
+            "width": 80,
+            "images": [{
+                "@type": "oa:Annotation",
+                "motivation": "sc:painting",
+                "resource": {"@id": "http://example.org/old/1.jpg", "@type": "dctypes:Image"},
+                "on": "http://example.org/iiif/old/canvas/1.json"
+            }]
+        }]
+    }]
+}
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def manifest(self):
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/iiif/book1/")
+        fac.set_base_image_uri("http://example.org/images/")
+        fac.set_iiif_image_info("2.0", "2")
+        mf = fac.manifest(label={"en": "Book 1", "fr": "Livre 1"})
+        mf.license = "http://creativecommons.org/licenses/by/4.0/"
+        mf.set_metadata({"label": "Author", "value": {"en": "Ann", "fr": "Anne"}})
+        cvs = mf.sequence().canvas(ident="p1", label="Page 1")
+        cvs.set_hw(4000, 4000)
+        cvs.annotation(ident="1").image("book1-page1", iiif=True)
+        cvs.annotationList(ident="p1")
+        r0 = mf.range(ident="r0", label="Table of Contents")
+        r0.viewingHint = "top"
+        r1 = r0.range(ident="r0-1", label={"en": "Introduction"})
+        mf.add_range(r1)
+        r1.add_canvas(cvs)
+        return mf.toJSON(top=True)
+
+    def test01_to_3(self):
+        js = Upgrader("3.0").upgrade(self.manifest())
+        with io.open(os.path.join(os.path.dirname(__file__), '..', '3.0', 'example.json')) as fh:
+            example = json.load(fh)
+        self.assertEqual(js['@context'], example['@context'])
+        self.assertEqual(list(js)[:5], ["@context", "id", "type", "label", "metadata"])
+        self.assertEqual(js['label'], example['label'])
+        self.assertEqual(js['metadata'], [{"label": "Author", "value": {"en": "Ann", "fr": "Anne"}}])
+        self.assertEqual(js['rights'], "http://creativecommons.org/licenses/by/4.0/")
+        seq = js['sequences'][0]
+        self.assertEqual(seq['type'], "Sequence")
+        cvs = seq['members'][0]
+        self.assertEqual(cvs['type'], "Canvas")
+        anno = cvs['images'][0]
+        self.assertEqual(sorted(anno), ["body", "id", "motivation", "target", "type"])
+        self.assertEqual((anno['type'], anno['motivation'], anno['body']['type']),
+                         ("Annotation", "painting", "Image"))
+        svc = anno['body']['service']
+        self.assertEqual(sorted(svc), ["@context", "id", "profile"])
+        self.assertEqual(cvs['otherContent'][0]['type'], "AnnotationPage")
+        # the Ranges are nested
+        self.assertEqual(len(js['structures']), 1)
+        top = js['structures'][0]
+        self.assertEqual(top['viewingHint'], "top")
+        self.assertEqual(top['members'][0]['label'], {"en": "Introduction"})
+        self.assertEqual(top['members'][0]['members'], [{"id": cvs['id'], "type": "Canvas"}])
+        # already 3.0
+        self.assertEqual(Upgrader("3.0").upgrade(js), js)
+        self.assertRaises(DataError, Upgrader("2.1").upgrade, js)
+        self.assertRaises(DataError, Upgrader, "4.0")
+
+    def test02_from_1(self):
+        self.assertEqual(detect_version(OLD), "1.0")
+        self.assertRaises(DataError, detect_version, {"@context": "http://example.org/"})
+        self.assertRaises(DataError, detect_version, {})
+        js = Upgrader("2.1").upgrade(json.loads(json.dumps(OLD)))
+        self.assertEqual(js['@context'], "http://iiif.io/api/presentation/2/context.json")
+        self.assertEqual(js['metadata'], [{"label": "Agent", "value": "Ann"}, {"label": "Date", "value": "1850"}])
+        self.assertFalse('agent' in js)
+        self.assertEqual(validate_upgraded(json.dumps(js)), None)
+        mf = ManifestReader(json.dumps(js), version="2.1").read()
+        self.assertEqual(mf.label, "Old book")
+        self.assertTrue(validate_upgraded(json.dumps(OLD)))
+        # through 2.1 to 3.0
+        js = Upgrader("3.0").upgrade(json.loads(json.dumps(OLD)))
+        self.assertEqual(js['sequences'][0]['members'][0]['images'][0]['body']['type'], "Image")
+        self.assertEqual(js['metadata'][1], {"label": "Date", "value": "1850"})
+
+    def test03_pipeline(self):
+        src = os.path.join(self.tmp, "src")
+        os.makedirs(os.path.join(src, "a", "b"))
+        for (fn, js) in [("old.json", OLD), ("a/new.json", self.manifest()), ("a/b/old2.json", OLD)]:
+            with io.open(os.path.join(src, fn), 'w') as fh:
+                fh.write(json.dumps(js))
+        with io.open(os.path.join(src, "a", "broken.json"), 'w') as fh:
+            fh.write('{"@context": ')
+        with io.open(os.path.join(src, "a", "notes.txt"), 'w') as fh:
+            fh.write('not json')
+        dst = os.path.join(self.tmp, "dst")
+        stats = UpgradePipeline("2.1", processes=0, sample=1.0).run(src, dst)
+        self.assertEqual(stats.files, 3)
+        self.assertEqual(stats.versions, {"1.0": 2, "2.1": 1})
+        self.assertEqual(len(stats.failed), 1)
+        self.assertTrue(stats.failed[0][0].endswith("broken.json"))
+        self.assertEqual((stats.validated, stats.invalid), (3, []))
+        self.assertTrue("3 files" in str(stats))
+        with io.open(os.path.join(dst, "a", "b", "old2.json")) as fh:
+            self.assertEqual(detect_version(json.load(fh)), "2.1")
+        self.assertFalse(os.path.exists(os.path.join(dst, "a", "notes.txt")))
+        # in processes, to 3.0, which isn't validated
+        dst3 = os.path.join(self.tmp, "dst3")
+        stats = UpgradePipeline("3.0", processes=2, sample=1.0, compact=True).run(src, dst3)
+        self.assertEqual((stats.files, stats.validated), (3, 0))
+        with io.open(os.path.join(dst3, "old.json")) as fh:
+            self.assertEqual(json.load(fh)['type'], "Manifest")
+        self.assertRaises(DataError, UpgradePipeline().run, src, src)
+        # from the command line
+        self.assertEqual(main([src, os.path.join(self.tmp, "dst4"), "--processes", "0"]), 1)
+        self.assertEqual(main([os.path.join(src, "a", "b"), os.path.join(self.tmp, "dst5"), "-p", "0"]), 0)
+
+    def test04_testdata(self):
+        testdata = os.path.join(os.path.dirname(__file__), "testdata")
+        total = sum(len([f for f in files if f.endswith('.json')]) for (dr, dirs, files) in os.walk(testdata))
+        stats = UpgradePipeline("2.1", processes=0, sample=1.0).run(testdata, os.path.join(self.tmp, "2"))
+        # bad documents fail or are invalid, each recorded rather than ending the run
+        self.assertEqual(stats.files + len(stats.failed), total)
+        # only Manifests and Collections are read back
+        self.assertTrue(0 < stats.validated < stats.files)
+        invalid = dict([(os.path.relpath(src, testdata).replace(os.sep, '/'), err) for (src, err) in stats.invalid])
+        self.assertFalse("2.0/example/fixtures/list/65/list1.json" in invalid)
+        self.assertFalse("2.0/example/fixtures/sequence/20/s1.json" in invalid)
+        # the invalid ones are the examples of errors, and image information
+        for src in list(invalid) + [os.path.relpath(src, testdata).replace(os.sep, '/') for (src, err) in stats.failed]:
+            self.assertTrue(src.startswith("2.0/example/errors/") or src.endswith("/info.json"), src)
+        stats = UpgradePipeline("3.0", processes=0).run(testdata, os.path.join(self.tmp, "3"))
+        self.assertEqual(stats.files + len(stats.failed), total)
+        with io.open(os.path.join(self.tmp, "3", "2.0/example/fixtures/39/manifest.json")) as fh:
+            anno = json.load(fh)['sequences'][0]['members'][0]['images'][0]
+        self.assertEqual(anno['stylesheet']['type'], ["oa:CssStyle", "TextualBody"])
@@ -1,7 +1,7 @@
 """Test code for iiif_prezi.util."""
 import unittest
 
-from iiif_prezi.util import is_http_uri
+from iiif_prezi.util import is_http_uri, optional_import
 
 
 class TestAll(unittest.TestCase):
@@ -14,3 +14,10 @@ class TestAll(unittest.TestCase):
         self.assertTrue(is_http_uri('http://example.org'))
         self.assertTrue(is_http_uri('https://example.org:646/some/path'))
         self.assertTrue(is_http_uri('https://example.org:646/some/path#frag'))
+
+    def test02_optional_import(self):
+        self.assertEqual(optional_import('no_such_module_xyz'), None)
+        json_mod = optional_import('no_such_module_xyz', 'json')
+        self.assertEqual(json_mod.__name__, 'json')
+        # cached
+        self.assertTrue(optional_import('no_such_module_xyz', 'json') is json_mod)
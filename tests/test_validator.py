@@ -0,0 +1,148 @@
+"""Test code for iiif_prezi.validator."""
+import io
+import json
+import os
+import threading
+import unittest
+from wsgiref.simple_server import make_server
+from wsgiref.util import setup_testing_defaults
+
+from iiif_prezi.factory import ManifestFactory
+from iiif_prezi.validator import ValidatorApp, QuietHandler, validate
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'thumbnail_manifest.json')
+
+
+def big_manifest(n):
+    fac = ManifestFactory()
+    fac.set_debug("error")
+    fac.set_base_prezi_uri("http://example.org/")
+    fac.set_base_image_uri("http://example.org/iiif/")
+    fac.set_iiif_image_info("2.0", "1")
+    mfst = fac.manifest(label="Big")
+    mfst.sequence().bulk_canvases(["c%d" % i for i in range(n)], ["p%d" % i for i in range(n)],
+                                  [100] * n, [200] * n, ["i%d" % i for i in range(n)])
+    return mfst.toString().encode('utf-8')
+
+
+class TestAll(unittest.TestCase):
+
+    def call(self, app, path, body=None, method=None, query="", content_type="application/json"):
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query,
+                   'REQUEST_METHOD': method or ('GET' if body is None else 'POST')}
+        if body is not None:
+            environ['CONTENT_LENGTH'] = str(len(body))
+            environ['CONTENT_TYPE'] = content_type
+            environ['wsgi.input'] = io.BytesIO(body)
+        setup_testing_defaults(environ)
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(headers)
+        data = b''.join(app(environ, start_response))
+        if response['headers']['Content-Type'] == 'application/json':
+            return (response['status'], json.loads(data.decode('utf-8')))
+        return (response['status'], data.decode('utf-8'))
+
+    def test01_validate(self):
+        with open(FIXTURE, 'rb') as fh:
+            data = fh.read()
+        result = validate(data)
+        self.assertTrue(result['okay'])
+        self.assertEqual(result['type'], 'sc:Manifest')
+        self.assertEqual(result['version'], '2.1')
+        self.assertEqual(result['error'], None)
+        result = validate('{"@context": "http://example.org/context.json"}')
+        self.assertFalse(result['okay'])
+        self.assertEqual(result['error']['type'], 'SerializationError')
+        result = validate('not json')
+        self.assertEqual(result['error'], {'type': 'SerializationError', 'message': 'Data is not valid JSON'})
+
+    def test02_in_process(self):
+        app = ValidatorApp(processes=0, max_bytes=100000)
+        with open(FIXTURE, 'rb') as fh:
+            data = fh.read()
+        (status, result) = self.call(app, '/validate', data)
+        self.assertEqual(status, 200)
+        self.assertTrue(result['okay'])
+        (status, result) = self.call(app, '/validate', b'{"@context": 1}')
+        self.assertEqual(status, 200)
+        self.assertFalse(result['okay'])
+        (status, result) = self.call(app, '/validate', b' ' * 100001)
+        self.assertEqual(status, 413)
+        self.assertEqual(result['error']['type'], 'RequestError')
+        (status, result) = self.call(app, '/validate', b'')
+        self.assertEqual(status, 400)
+        (status, result) = self.call(app, '/validate', query="url=file:///etc/passwd")
+        self.assertEqual(status, 400)
+        (status, result) = self.call(app, '/validate', b'url=http://127.0.0.1:1/x',
+                                     content_type='application/x-www-form-urlencoded')
+        self.assertEqual(status, 400)
+        self.assertEqual(result['error']['message'], "Validating urls is not allowed")
+        (status, result) = self.call(app, '/validate', b'\xff\xfe',
+                                     content_type='application/x-www-form-urlencoded')
+        self.assertEqual(status, 400)
+        (status, result) = self.call(app, '/nowhere')
+        self.assertEqual(status, 404)
+        (status, result) = self.call(app, '/health')
+        self.assertTrue(result['okay'])
+        (status, text) = self.call(app, '/metrics')
+        self.assertTrue('iiif_prezi_validator_requests_total{path="/validate",status="200"} 2' in text)
+        self.assertTrue('iiif_prezi_validator_requests_total{path="/validate",status="413"} 1' in text)
+        self.assertTrue('iiif_prezi_validator_results_total{result="invalid"} 1' in text)
+        self.assertTrue('iiif_prezi_validator_latency_seconds_count 7' in text)
+        # counting the /metrics request itself
+        self.assertTrue('iiif_prezi_validator_in_flight 1' in text)
+        # Unexpected errors are reported, and counted
+        app.validate = lambda data: 1 / 0
+        (status, result) = self.call(app, '/validate', b'{}')
+        self.assertEqual(status, 500)
+        self.assertEqual(result['error']['type'], 'ZeroDivisionError')
+        self.assertEqual(app.metrics.in_flight, 0)
+
+    def test03_pool(self):
+        app = ValidatorApp(processes=1, timeout=0.01, max_bytes=100000000)
+        try:
+            # a big manifest takes longer than the timeout
+            (status, result) = self.call(app, '/validate', big_manifest(5000))
+            self.assertEqual(status, 504)
+            self.assertEqual(app.metrics.pool_restarts, 1)
+            app.timeout = 30
+            with open(FIXTURE, 'rb') as fh:
+                data = fh.read()
+            (status, result) = self.call(app, '/validate', data)
+            self.assertEqual(status, 200)
+            self.assertTrue(result['okay'])
+            # A replaced pool is kept for the requests still waiting on it
+            old = app._acquire_pool()
+            app._restart_pool(old)
+            self.assertTrue(app.pool is not old)
+            self.assertTrue(old.apply_async(validate, (data,)).get(30)['okay'])
+            app._release_pool(old)
+            self.assertEqual(app.waiting, {})
+            self.assertRaises(ValueError, old.apply_async, validate, (data,))
+        finally:
+            app.close()
+        (status, result) = self.call(app, '/validate', data)
+        self.assertEqual(status, 500)
+
+    def test04_url(self):
+        app = ValidatorApp(processes=0, allow_urls=True)
+        server = make_server('127.0.0.1', 0, app, handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            # validate the service's own health response, which is JSON but not IIIF
+            url = "http://127.0.0.1:%d/health" % server.server_port
+            (status, result) = self.call(app, '/validate', query="url=" + url)
+            self.assertEqual(status, 200)
+            self.assertFalse(result['okay'])
+            self.assertEqual(result['error']['message'], 'Top level resource MUST have @context')
+        finally:
+            server.shutdown()
+            server.server_close()
+        app = ValidatorApp(processes=0)
+        (status, result) = self.call(app, '/validate', query="url=" + url)
+        self.assertEqual(status, 400)
@@ -0,0 +1,87 @@
+"""Test code for iiif_prezi.watch."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iiif_prezi.builder import DirectoryBuilder
+from iiif_prezi.factory import ManifestFactory
+from iiif_prezi.watch import Watcher, InotifySource, PollingSource
+
+try:
+    InotifySource(tempfile.gettempdir()).close()
+    have_inotify = True
+except (OSError, AttributeError):
+    have_inotify = False
+
+
+class TestAll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.img_dir = os.path.join(self.tmpdir, 'img')
+        self.out_dir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(os.path.join(self.img_dir, 'vol_1'))
+        os.makedirs(self.out_dir)
+        self.add_image('vol_1/p1.jpg')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def add_image(self, path):
+        shutil.copy('testimages/nci-vol-2303-72.jpg', os.path.join(self.img_dir, path))
+
+    def builder(self):
+        fac = ManifestFactory()
+        fac.set_debug("error")
+        fac.set_base_prezi_uri("http://example.org/prezi/")
+        fac.set_base_prezi_dir(self.out_dir)
+        fac.set_base_image_uri("http://example.org/iiif/")
+        fac.set_iiif_image_info("2.0", "1")
+        builder = DirectoryBuilder(fac, self.img_dir, processes=1)
+        builder.build()
+        return builder
+
+    def canvases(self, path):
+        with open(os.path.join(self.out_dir, path)) as fh:
+            return len(json.load(fh)['sequences'][0]['canvases'])
+
+    def watch(self, **kw):
+        batches = []
+        watcher = Watcher(self.builder(), debounce=0.2, interval=0.2,
+                          callback=lambda stats, reldirs: batches.append(reldirs), **kw)
+        watcher.start()
+        try:
+            # Several changes are debounced into one batch
+            self.add_image('vol_1/p2.jpg')
+            self.add_image('vol_1/p3.jpg')
+            self.assertTrue(watcher.process(timeout=10) is not None)
+            self.assertEqual(self.canvases('vol_1/manifest.json'), 3)
+            self.assertEqual(batches, [set(['vol_1'])])
+            os.makedirs(os.path.join(self.img_dir, 'vol_2'))
+            self.add_image('vol_2/p1.jpg')
+            for x in range(3):
+                if watcher.process(timeout=10) is None:
+                    break
+                if os.path.exists(os.path.join(self.out_dir, 'collection.json')):
+                    break
+            self.assertEqual(self.canvases('vol_2/manifest.json'), 1)
+        finally:
+            watcher.stop()
+
+    def test01_polling(self):
+        self.watch(use_inotify=False)
+
+    @unittest.skipUnless(have_inotify, "inotify not available")
+    def test02_inotify(self):
+        self.watch()
+
+    def test03_polling_source(self):
+        source = PollingSource(self.img_dir)
+        self.assertEqual(source.poll(0), [])
+        self.add_image('vol_1/p2.jpg')
+        os.makedirs(os.path.join(self.img_dir, 'vol_2'))
+        self.assertEqual(sorted(source.poll(0)), ['', 'vol_1', 'vol_2'])
+        shutil.rmtree(os.path.join(self.img_dir, 'vol_2'))
+        self.assertEqual(sorted(source.poll(0)), ['', 'vol_2'])